@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backenddd.settings')
 
 application = get_asgi_application()
+
+# Build the autocomplete index now rather than in the first /suggest request
+from products import suggest  # noqa: E402
+
+suggest.warm_up()
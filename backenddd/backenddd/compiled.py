@@ -0,0 +1,318 @@
+# This file compiles read-only DRF serializers into a faster path for large
+# list responses. A ModelSerializer builds and walks field objects for every
+# row; a compiled serializer plans the columns once, reads them with
+# values() and turns each row into the same dict with precomputed accessors.
+# Related rows (seller usernames, nested items and products) are fetched
+# with one extra query per relation, on whichever database holds them.
+#
+# Only reads use it: writes, and serializers with fields it doesn't know,
+# keep going through DRF. The output must match DRF exactly, so every field
+# either has an exact fast path or calls the DRF field's to_representation().
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import fields as drf_fields
+from rest_framework import serializers
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.response import Response
+from products import shards
+
+# Fields whose to_representation() needs nothing but the value
+PLAIN_FIELDS = (
+    drf_fields.BooleanField, drf_fields.CharField, drf_fields.ChoiceField, drf_fields.DateField,
+    drf_fields.DateTimeField, drf_fields.DecimalField, drf_fields.FloatField, drf_fields.IntegerField,
+    drf_fields.ReadOnlyField, drf_fields.TimeField, drf_fields.UUIDField,
+)
+
+
+class NotCompilable(Exception):
+    """The serializer uses something the compiled path can't reproduce exactly"""
+
+
+class RowView:
+    """A values() row seen as an object, for model methods and SerializerMethodFields"""
+
+    def __init__(self, row):
+        self.__dict__ = row
+
+
+def enabled():
+    return getattr(settings, 'COMPILED_SERIALIZERS', True)
+
+
+def representer(field):
+    """The fastest function that gives the same result as field.to_representation()"""
+    if type(field) is drf_fields.IntegerField:
+        return int
+    if type(field) is drf_fields.CharField or type(field) is drf_fields.URLField:
+        return str
+    if isinstance(field, (PrimaryKeyRelatedField, drf_fields.ReadOnlyField)):
+        # values() already gives the primary key / the raw value
+        return None
+    if isinstance(field, drf_fields.DecimalField):
+        slow = field.to_representation
+        coerce = getattr(field, 'coerce_to_string', None)
+        if coerce is None:
+            coerce = drf_fields.api_settings.COERCE_DECIMAL_TO_STRING
+        if not coerce or field.localize or field.decimal_places is None:
+            return slow
+        exponent = -field.decimal_places
+        max_digits = field.max_digits or float('inf')
+
+        def decimal_string(value):
+            # Database values already have the field's decimal places: quantize() would change nothing
+            if type(value) is Decimal:
+                parts = value.as_tuple()
+                if parts.exponent == exponent and len(parts.digits) <= max_digits:
+                    return f'{value:f}'
+            return slow(value)
+        return decimal_string
+    return field.to_representation
+
+
+class CompiledSerializer:
+    """
+    A read-only plan for one serializer class. Use values() to select the
+    planned columns of a queryset and serialize() to turn those rows into
+    the serializer's output.
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        serializer = serializer_class()
+        self.model = serializer.Meta.model
+        opts = self.model._meta
+        self.pk = opts.pk.attname
+        self.columns = [self.pk]
+        # (output name, kind, key, representer, extra) in output order
+        self.plan = []
+        # {fk attname: (related model, [(row key, remote attname)])} for one-hop dotted sources
+        self.lookups = {}
+        # {name: (fk attname, CompiledSerializer)} for nested forward relations
+        self.nested = {}
+        # {name: (fk attname on the child, CompiledSerializer)} for nested reverse relations
+        self.children = {}
+        self.needs_view = False
+
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.ListSerializer):
+                self.add_children(name, field)
+            elif isinstance(field, serializers.BaseSerializer):
+                self.add_nested(name, field)
+            elif isinstance(field, serializers.SerializerMethodField):
+                self.needs_view = True
+                # The method's result is the output as is
+                self.plan.append((name, 'call', getattr(serializer, field.method_name), None, None))
+            elif not isinstance(field, PLAIN_FIELDS + (PrimaryKeyRelatedField,)) or field.source == '*':
+                raise NotCompilable(f'{serializer_class.__name__}.{name}: {type(field).__name__}')
+            elif len(field.source_attrs) == 1:
+                self.add_attribute(name, field)
+            elif len(field.source_attrs) == 2:
+                self.add_lookup(name, field)
+            else:
+                raise NotCompilable(f'{serializer_class.__name__}.{name}: source {field.source!r}')
+        if self.needs_view:
+            # Methods may read any column of the row
+            self.columns = list(dict.fromkeys(
+                [self.pk] + [model_field.attname for model_field in opts.concrete_fields] + self.columns
+            ))
+
+    # Planning ------------------------------------------------------------------
+
+    def add_attribute(self, name, field):
+        source = field.source_attrs[0]
+        try:
+            model_field = self.model._meta.get_field(source)
+        except FieldDoesNotExist:
+            model_field = None
+        if model_field is not None and model_field.concrete and not model_field.is_relation:
+            self.columns.append(model_field.attname)
+            self.plan.append((name, 'column', model_field.attname, representer(field), None))
+        elif model_field is not None and model_field.many_to_one and isinstance(field, PrimaryKeyRelatedField):
+            if field.pk_field is not None:
+                raise NotCompilable(f'{self.serializer_class.__name__}.{name}: pk_field')
+            self.columns.append(model_field.attname)
+            self.plan.append((name, 'column', model_field.attname, None, None))
+        elif model_field is None and callable(getattr(self.model, source, None)):
+            # A model method (source='get_discounted_price'), called with the row as self
+            self.needs_view = True
+            self.plan.append((name, 'call', getattr(self.model, source), representer(field), None))
+        else:
+            raise NotCompilable(f'{self.serializer_class.__name__}.{name}: source {field.source!r}')
+
+    def add_lookup(self, name, field):
+        relation, remote = field.source_attrs
+        try:
+            model_field = self.model._meta.get_field(relation)
+            remote_field = model_field.related_model._meta.get_field(remote) if model_field.many_to_one else None
+        except FieldDoesNotExist:
+            remote_field = None
+        if remote_field is None or not remote_field.concrete or remote_field.is_relation:
+            raise NotCompilable(f'{self.serializer_class.__name__}.{name}: source {field.source!r}')
+        self.columns.append(model_field.attname)
+        key = f'{relation}__{remote}'
+        self.lookups.setdefault(model_field.attname, (model_field.related_model, []))[1].append(
+            (key, remote_field.attname)
+        )
+        # DRF skips the field when the relation is empty, unless it has a default or allows null
+        if field.default is not drf_fields.empty:
+            raise NotCompilable(f'{self.serializer_class.__name__}.{name}: default')
+        self.plan.append((name, 'lookup', key, representer(field), (model_field.attname, field.allow_null)))
+
+    def add_nested(self, name, field):
+        try:
+            model_field = self.model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            model_field = None
+        if model_field is None or not model_field.many_to_one:
+            raise NotCompilable(f'{self.serializer_class.__name__}.{name}: nested {field.source!r}')
+        self.columns.append(model_field.attname)
+        self.nested[name] = (model_field.attname, get_compiled(type(field), strict=True))
+        self.plan.append((name, 'nested', name, None, model_field.attname))
+
+    def add_children(self, name, field):
+        try:
+            relation = self.model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            relation = None
+        if relation is None or not relation.one_to_many:
+            raise NotCompilable(f'{self.serializer_class.__name__}.{name}: nested {field.source!r}')
+        self.children[name] = (relation.field.attname, get_compiled(type(field.child), strict=True))
+        self.plan.append((name, 'children', name, None, None))
+
+    # Reading -------------------------------------------------------------------
+
+    def joins(self):
+        """True if dotted sources can be joined in the query (the related rows are on the same database)"""
+        return not (shards.enabled() and shards.is_sharded(self.model))
+
+    def values(self, queryset, *extra):
+        """queryset.values() with the planned columns, the joined lookups and `extra`"""
+        columns = list(dict.fromkeys([*self.columns, *extra]))
+        if self.joins():
+            columns += [key for _, keys in self.lookups.values() for key, _ in keys]
+        return queryset.select_related(None).prefetch_related(None).values(*columns)
+
+    def related_rows(self, extra=(), **filters):
+        """values() rows matching `filters`, from every database that may hold them"""
+        queryset = self.model._default_manager.filter(**filters)
+        if shards.is_sharded(self.model):
+            return [row for alias_queryset in shards.each(queryset) for row in self.values(alias_queryset, *extra)]
+        return list(self.values(queryset, *extra))
+
+    def serialize(self, rows):
+        """The serializer's output for rows read with values()"""
+        rows = list(rows)
+        if not rows:
+            return []
+        if not self.joins():
+            self.attach_lookups(rows)
+        nested = {}
+        for name, (attname, plan) in self.nested.items():
+            ids = {row[attname] for row in rows if row[attname] is not None}
+            found = plan.related_rows(pk__in=ids) if ids else []
+            nested[name] = dict(zip((row[plan.pk] for row in found), plan.serialize(found)))
+        children = {}
+        for name, (attname, plan) in self.children.items():
+            grouped = {row[self.pk]: [] for row in rows}
+            found = plan.related_rows([attname], **{f'{attname}__in': list(grouped)})
+            found.sort(key=lambda row: row[plan.pk])
+            for row, data in zip(found, plan.serialize(found)):
+                grouped[row[attname]].append(data)
+            children[name] = grouped
+
+        plan = self.plan
+        needs_view = self.needs_view
+        output = []
+        for row in rows:
+            view = RowView(row) if needs_view else None
+            data = {}
+            for name, kind, key, represent, extra in plan:
+                if kind == 'column':
+                    value = row[key]
+                elif kind == 'call':
+                    value = key(view)
+                elif kind == 'lookup':
+                    if row[extra[0]] is None:
+                        if not extra[1]:
+                            continue
+                        value = None
+                    else:
+                        value = row.get(key)
+                elif kind == 'nested':
+                    data[name] = nested[name].get(row[extra])
+                    continue
+                else:
+                    data[name] = children[name][row[self.pk]]
+                    continue
+                data[name] = value if value is None or represent is None else represent(value)
+            output.append(data)
+        return output
+
+    def attach_lookups(self, rows):
+        """Fill in dotted sources with one query per relation (used when they can't be joined)"""
+        for attname, (model, keys) in self.lookups.items():
+            ids = {row[attname] for row in rows if row[attname] is not None}
+            remote = [remote for _, remote in keys]
+            found = {
+                values[0]: values[1:]
+                for values in model._default_manager.filter(pk__in=ids).values_list('pk', *remote)
+            } if ids else {}
+            for row in rows:
+                values = found.get(row[attname])
+                for position, (key, _) in enumerate(keys):
+                    # A missing related row reads as None, as in DRF
+                    row[key] = None if values is None else values[position]
+
+    def serialize_queryset(self, queryset):
+        return self.serialize(self.values(queryset))
+
+
+_compiled = {}
+
+
+def get_compiled(serializer_class, strict=False):
+    """
+    The CompiledSerializer of a serializer class (planned once), or None if
+    it can't be compiled. strict=True raises NotCompilable instead.
+    """
+    if serializer_class not in _compiled:
+        try:
+            _compiled[serializer_class] = CompiledSerializer(serializer_class)
+        except NotCompilable:
+            _compiled[serializer_class] = None
+            if strict:
+                raise
+    plan = _compiled[serializer_class]
+    if plan is None and strict:
+        raise NotCompilable(serializer_class.__name__)
+    return plan
+
+
+def read_plan(serializer_class):
+    """get_compiled() for the read paths: None when COMPILED_SERIALIZERS is off"""
+    return get_compiled(serializer_class) if enabled() else None
+
+
+class CompiledListMixin:
+    """
+    Viewset mixin: list() reads through the compiled serializer (falling
+    back to DRF when it can't be compiled or COMPILED_SERIALIZERS is off).
+    Other actions, writes included, use the regular serializer.
+    """
+
+    def get_compiled_serializer(self):
+        return read_plan(self.get_serializer_class())
+
+    def list(self, request, *args, **kwargs):
+        compiled = self.get_compiled_serializer()
+        if compiled is None:
+            return super().list(request, *args, **kwargs)
+        queryset = compiled.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(compiled.serialize(page))
+        return Response(compiled.serialize(queryset))
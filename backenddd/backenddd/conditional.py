@@ -0,0 +1,111 @@
+# This file adds conditional GET support (ETag / Last-Modified / Cache-Control)
+# to API views. Validators come from a cheap aggregate query, so a client
+# that already has the current data gets a 304 without us serializing anything.
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+
+def queryset_validator(queryset, field):
+    """
+    Return (last_modified, row_count) for a queryset with one aggregate query.
+
+    The count catches deletes, which would not move the newest timestamp.
+    """
+    row = queryset.order_by().aggregate(last=Max(field), count=Count('pk'))
+    return row['last'], row['count']
+
+
+def build_validators(request, validators, private=False):
+    """
+    Turn a list of (last_modified, count) pairs into an (etag, last_modified) pair.
+
+    The request path (with its query string) is part of the ETag so different
+    searches, orderings and pages never share one. Private responses also mix
+    in the user id.
+    """
+    parts = [request.get_full_path()]
+    if private:
+        parts.append(str(getattr(request.user, 'pk', '')))
+    last_modified = None
+    for last, count in validators:
+        parts.append(f"{last.isoformat() if last else '-'}:{count}")
+        if last is not None and (last_modified is None or last > last_modified):
+            last_modified = last
+    etag = '"%s"' % hashlib.sha1('|'.join(parts).encode()).hexdigest()
+    return etag, last_modified
+
+
+def apply_cache_headers(response, etag, last_modified, cache_control, private=False):
+    """Set ETag, Last-Modified and Cache-Control on a response"""
+    if etag and not response.has_header('ETag'):
+        response['ETag'] = etag
+    if last_modified is not None and not response.has_header('Last-Modified'):
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    if cache_control:
+        patch_cache_control(response, **cache_control)
+    if private:
+        patch_vary_headers(response, ['Authorization'])
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    Viewset mixin that answers repeat GETs with 304 Not Modified.
+
+    `cache_control` holds keyword arguments for patch_cache_control and
+    `last_modified_field` names the timestamp column used as the validator.
+    Views with extra dependencies can override get_list_validators().
+    """
+    cache_control = None
+    last_modified_field = 'updated_at'
+
+    def is_private_cache(self):
+        return bool(self.cache_control and self.cache_control.get('private'))
+
+    def get_list_validators(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        return [queryset_validator(queryset, self.last_modified_field)]
+
+    def get_detail_validators(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.get_queryset().filter(
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        )
+        return [queryset_validator(queryset, self.last_modified_field)]
+
+    def conditional_response(self, request, validators, build_response):
+        """
+        Return 304 if the client's validators still match, otherwise call
+        build_response() and decorate it with caching headers.
+        """
+        private = self.is_private_cache()
+        etag, last_modified = build_validators(request, validators, private=private)
+        not_modified = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=int(last_modified.timestamp()) if last_modified else None,
+        )
+        if not_modified is not None:
+            return apply_cache_headers(not_modified, etag, last_modified, self.cache_control, private)
+
+        response = build_response()
+        if response.status_code == 200:
+            apply_cache_headers(response, etag, last_modified, self.cache_control, private)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request,
+            self.get_list_validators(),
+            lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request,
+            self.get_detail_validators(),
+            lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs),
+        )
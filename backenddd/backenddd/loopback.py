@@ -0,0 +1,58 @@
+# This file lets the load-test commands (throttle_harness, replay_workload)
+# pose as many different clients against a local server. Throttling is keyed
+# on the connection's address (REMOTE_ADDR), not on headers the client can
+# forge, so each simulated client connects from its own loopback address:
+# the whole 127.0.0.0/8 range reaches the local machine on Linux.
+import functools
+import http.client
+import ipaddress
+import socket
+import urllib.parse
+import urllib.request
+
+
+class SourceAddressHandler(urllib.request.HTTPHandler):
+    """urllib handler whose connections come from a given local address"""
+
+    def __init__(self, address):
+        super().__init__()
+        self.address = address
+
+    def http_open(self, request):
+        return self.do_open(functools.partial(http.client.HTTPConnection, source_address=(self.address, 0)), request)
+
+
+def is_loopback(url):
+    host = urllib.parse.urlsplit(url).hostname or ''
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+def can_bind(address):
+    """True if this machine can open connections from `address` (macOS only has 127.0.0.1)"""
+    try:
+        with socket.socket() as probe:
+            probe.bind((address, 0))
+    except OSError:
+        return False
+    return True
+
+
+def client_address(number):
+    """A loopback address for simulated client `number` (127.0.0.1 is left to the real ones)"""
+    number = number % (256 ** 3 - 2) + 2
+    return f'127.{number >> 16 & 255}.{number >> 8 & 255}.{number & 255}'
+
+
+def opener_for(address):
+    """A urllib opener connecting from `address` (the default opener when it is None)"""
+    if address is None:
+        return urllib.request.build_opener()
+    return urllib.request.build_opener(SourceAddressHandler(address))
+
+
+def simulated_clients(url):
+    """True if requests to `url` can come from per-client loopback addresses"""
+    return is_loopback(url) and can_bind(client_address(1))
@@ -0,0 +1,183 @@
+# This file holds project-wide middleware
+import secrets
+import threading
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+from django.utils.text import compress_sequence, compress_string
+
+# brotli is optional: without it only gzip is offered
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+re_accepts_gzip = _lazy_re_compile(r"\bgzip\b")
+re_accepts_br = _lazy_re_compile(r"\bbr\b")
+
+
+def _brotli_padding(max_random_bytes):
+    """
+    A brotli metadata block of 0 to `max_random_bytes` (at most 256) bytes.
+
+    Decoders skip metadata, so this only changes the length of the stream,
+    like the random file name Django's gzip functions add. It must go where
+    the compressed data ends on a byte boundary, i.e. right after flush().
+    """
+    length = secrets.randbelow(min(max_random_bytes, 256) + 1)
+    if not length:
+        return b''
+    # Bits from the lowest: ISLAST=0, MNIBBLES=11 (metadata), reserved 0,
+    # MSKIPBYTES=1, then the 8 bits of length - 1 and 2 bits of padding
+    skip = length - 1
+    return bytes([0b00010110 | (skip & 3) << 6, skip >> 2]) + bytes(length)
+
+
+def _brotli_compress(content, quality, max_random_bytes):
+    """Compress a body with brotli, padded with _brotli_padding()"""
+    compressor = brotli.Compressor(quality=quality)
+    data = compressor.process(content) + compressor.flush()
+    return data + _brotli_padding(max_random_bytes) + compressor.finish()
+
+
+def _brotli_sequence(sequence, quality, max_random_bytes):
+    """Compress an iterable of byte chunks with one brotli stream (padded once)"""
+    compressor = brotli.Compressor(quality=quality)
+    padding = _brotli_padding(max_random_bytes)
+    for chunk in sequence:
+        data = compressor.process(chunk)
+        if data:
+            yield data
+        # Flush each chunk so clients see streamed data straight away
+        data = compressor.flush() + padding
+        padding = b''
+        if data:
+            yield data
+    yield compressor.flush() + padding + compressor.finish()
+
+
+class CompressionMiddleware:
+    """
+    Compress responses with brotli (when installed and accepted) or gzip.
+
+    Responses smaller than COMPRESSION_MIN_SIZE bytes are left alone, and
+    streaming responses are compressed chunk by chunk. Like Django's
+    GZipMiddleware, every compressed body gets up to
+    COMPRESSION_MAX_RANDOM_BYTES of random padding against BREACH, and
+    strong ETags are made weak once the body is re-encoded.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', 1024)
+        self.brotli_quality = getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 4)
+        self.max_random_bytes = getattr(settings, 'COMPRESSION_MAX_RANDOM_BYTES', 100)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        return self.process_response(request, response)
+
+    def choose_encoding(self, request, response):
+        accept = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        # Async streams are only supported by the gzip path
+        if brotli is not None and re_accepts_br.search(accept) and not (
+            response.streaming and response.is_async
+        ):
+            return 'br'
+        if re_accepts_gzip.search(accept):
+            return 'gzip'
+        return None
+
+    def process_response(self, request, response):
+        if not response.streaming and len(response.content) < self.min_size:
+            return response
+        if response.has_header('Content-Encoding'):
+            return response
+        # Event streams must reach the client one event at a time
+        if response.get('Content-Type', '').startswith('text/event-stream'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = self.choose_encoding(request, response)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if encoding == 'br':
+                response.streaming_content = _brotli_sequence(
+                    response.streaming_content, self.brotli_quality, self.max_random_bytes
+                )
+            elif response.is_async:
+                original_iterator = response.streaming_content
+                max_random_bytes = self.max_random_bytes
+
+                async def gzip_wrapper():
+                    async for chunk in original_iterator:
+                        yield compress_string(chunk, max_random_bytes=max_random_bytes)
+
+                response.streaming_content = gzip_wrapper()
+            else:
+                response.streaming_content = compress_sequence(
+                    response.streaming_content, max_random_bytes=self.max_random_bytes
+                )
+            # The compressed size is unknown until the stream is consumed
+            del response.headers['Content-Length']
+        else:
+            if encoding == 'br':
+                compressed = _brotli_compress(response.content, self.brotli_quality, self.max_random_bytes)
+            else:
+                compressed = compress_string(response.content, max_random_bytes=self.max_random_bytes)
+            # Only keep the compressed body if it is actually smaller
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(response.content))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+class ConcurrencyLimitMiddleware:
+    """
+    Shed load when too many requests are in flight in this process.
+
+    Once MAX_IN_FLIGHT_REQUESTS requests are being handled, new ones get an
+    immediate 503 with Retry-After instead of queueing behind the busy
+    workers. Paths starting with one of CONCURRENCY_LIMIT_EXEMPT_PATHS
+    (e.g. the admin) are never shed.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.limit = getattr(settings, 'MAX_IN_FLIGHT_REQUESTS', None)
+        self.retry_after = getattr(settings, 'LOAD_SHED_RETRY_AFTER', 1)
+        self.exempt_paths = tuple(getattr(settings, 'CONCURRENCY_LIMIT_EXEMPT_PATHS', ()))
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, request):
+        if not self.limit or request.path.startswith(self.exempt_paths):
+            return self.get_response(request)
+
+        with self._lock:
+            if self.in_flight >= self.limit:
+                shed = True
+            else:
+                shed = False
+                self.in_flight += 1
+        if shed:
+            response = JsonResponse(
+                {'detail': 'Server is busy, please retry shortly.'}, status=503
+            )
+            response['Retry-After'] = str(self.retry_after)
+            return response
+
+        try:
+            return self.get_response(request)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
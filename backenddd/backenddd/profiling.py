@@ -0,0 +1,223 @@
+# This file adds on-demand profiling of single requests. An admin sends the
+# X-Profile: 1 header (or ?_profile=1) with a slow request; it then runs
+# under a sampling profiler with every SQL query recorded, and the result is
+# stored in PROFILING_DIR. The response carries X-Profile-Id, and the
+# /api/profiles/ endpoints list the recent profiles and download them.
+#
+# The stacks are written in the "folded" format (one "frame;frame;frame
+# count" line per stack), which flamegraph.pl, speedscope and most flame
+# graph viewers read. Requests without the header or flag only pay for one
+# dictionary lookup and one substring test.
+import json
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse, Http404
+from django.utils import timezone
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from backenddd.queries import SITE_PACKAGES, QueryLog
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_FLAG = '_profile'
+# Profile ids are generated here; anything else in a URL is rejected
+PROFILE_ID = re.compile(r'^\d{8}-\d{6}-[0-9a-f]{6}$')
+# Queries listed in one profile (the totals still count all of them)
+MAX_RECORDED_QUERIES = 2000
+# Query parameters that hold credentials, blanked in saved profiles
+SECRET_PARAMS = re.compile(r'(?<=[?&])(ticket|token)=[^&]*')
+
+
+def profile_directory():
+    return Path(getattr(settings, 'PROFILING_DIR', Path(settings.BASE_DIR) / 'var' / 'profiles'))
+
+
+def frame_name(code):
+    """'function (file:line)' with the file relative to the project or to site-packages"""
+    filename = code.co_filename
+    base = str(settings.BASE_DIR)
+    if filename.startswith(base):
+        filename = filename[len(base):].lstrip('/\\')
+    else:
+        filename = SITE_PACKAGES.sub('', filename)
+    # ';' separates frames in the folded format
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'.replace(';', ':')
+
+
+class Sampler:
+    """Samples one thread's Python stack every `interval` seconds from a background thread"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='request-profiler', daemon=True)
+
+    def run(self):
+        names = {}
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                if code not in names:
+                    names[code] = frame_name(code)
+                stack.append(names[code])
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+
+def profile_requested(request):
+    """True if the request asks to be profiled (who asked is checked later)"""
+    if PROFILE_HEADER in request.META:
+        return request.META[PROFILE_HEADER] not in ('', '0')
+    if PROFILE_FLAG in request.META.get('QUERY_STRING', ''):
+        return request.GET.get(PROFILE_FLAG) not in (None, '', '0')
+    return False
+
+
+def is_admin(request):
+    """Staff user from the session (admin login) or from the JWT access token"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.is_staff, user
+    try:
+        result = JWTAuthentication().authenticate(request)
+    except (InvalidToken, AuthenticationFailed):
+        return False, None
+    if result is None:
+        return False, None
+    return result[0].is_staff, result[0]
+
+
+def save_profile(summary, stacks):
+    """Write a profile's folded stacks and summary, then drop the oldest beyond PROFILING_KEEP"""
+    directory = profile_directory()
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / f'{summary["id"]}.folded', 'w') as handle:
+        for stack, count in stacks.most_common():
+            handle.write(f'{stack} {count}\n')
+    with open(directory / f'{summary["id"]}.json', 'w') as handle:
+        json.dump(summary, handle, indent=1)
+    keep = getattr(settings, 'PROFILING_KEEP', 50)
+    for old in sorted(directory.glob('*.json'), reverse=True)[keep:]:
+        old.unlink(missing_ok=True)
+        old.with_suffix('.folded').unlink(missing_ok=True)
+
+
+class ProfilingMiddleware:
+    """
+    Profile requests that carry X-Profile: 1 or ?_profile=1, when they come
+    from a staff user. Everyone else's flag is ignored.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not profile_requested(request):
+            return self.get_response(request)
+        allowed, user = is_admin(request)
+        if not allowed:
+            return self.get_response(request)
+        return self.profile(request, user)
+
+    def profile(self, request, user):
+        profile_id = f'{time.strftime("%Y%m%d-%H%M%S")}-{secrets.token_hex(3)}'
+        started_at = timezone.now()
+        interval = getattr(settings, 'PROFILING_SAMPLE_INTERVAL', 0.001)
+        started = time.perf_counter()
+        with QueryLog(MAX_RECORDED_QUERIES) as log, Sampler(threading.get_ident(), interval) as sampler:
+            response = self.get_response(request)
+        duration = (time.perf_counter() - started) * 1000
+
+        save_profile({
+            'id': profile_id,
+            'method': request.method,
+            'path': SECRET_PARAMS.sub(r'\1=***', request.get_full_path()),
+            'user': user.get_username(),
+            'status': response.status_code,
+            'started_at': started_at.isoformat(),
+            'ms': round(duration, 3),
+            'samples': sampler.samples,
+            'sample_interval_ms': interval * 1000,
+            'sql_count': log.count,
+            'sql_ms': round(log.total, 3),
+            'sql': log.queries,
+            # Shapes run more than once on a database (possible N+1 loops)
+            'repeated': log.repeated(),
+        }, sampler.stacks)
+        response['X-Profile-Id'] = profile_id
+        return response
+
+
+# Admin endpoints -----------------------------------------------------------------
+
+def load_summary(profile_id):
+    path = profile_directory() / f'{profile_id}.json'
+    if not PROFILE_ID.match(profile_id) or not path.exists():
+        raise Http404('No such profile')
+    with open(path) as handle:
+        return json.load(handle)
+
+
+@api_view(['GET'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAdminUser])
+def profile_list(request):
+    """The stored profiles, newest first, without their queries"""
+    profiles = []
+    for path in sorted(profile_directory().glob('*.json'), reverse=True):
+        summary = load_summary(path.stem)
+        summary.pop('sql')
+        summary.pop('repeated', None)
+        profiles.append(summary)
+    return Response(profiles)
+
+
+@api_view(['GET'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAdminUser])
+def profile_detail(request, profile_id):
+    """One profile with its queries, slowest first"""
+    summary = load_summary(profile_id)
+    summary['sql'].sort(key=lambda query: query['ms'], reverse=True)
+    return Response(summary)
+
+
+@api_view(['GET'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAdminUser])
+def profile_flamegraph(request, profile_id):
+    """The folded stacks, for flamegraph.pl or speedscope"""
+    load_summary(profile_id)
+    return FileResponse(
+        open(profile_directory() / f'{profile_id}.folded', 'rb'),
+        as_attachment=True,
+        filename=f'profile-{profile_id}.folded',
+        content_type='text/plain; charset=utf-8',
+    )
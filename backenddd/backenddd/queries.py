@@ -0,0 +1,194 @@
+# This file finds repeated queries (N+1 patterns). Every query is reduced to
+# its shape: literals, placeholders and IN lists are replaced, so
+# "WHERE id = 4" and "WHERE id = 7" are the same shape. A shape that runs
+# many times on one database in a single request or test usually means a
+# loop that queries once per row, and the report shows which lines ran it.
+#
+# query_budget() turns this into a test assertion:
+#
+#     with query_budget(total=4, repeats=1):
+#         client.get('/api/orders/')
+#
+# fails when the block runs more than 4 queries, or the same shape twice.
+# It also works as a decorator. With DEBUG on, RepeatedQueryMiddleware
+# warns about requests that repeat a shape QUERY_REPEAT_WARNING times.
+import logging
+import os
+import re
+import sys
+import time
+from collections import Counter
+from contextlib import ContextDecorator, ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+SITE_PACKAGES = re.compile(r'.*[/\\](site|dist)-packages[/\\]')
+# This file and the profiler wrap the queries: their frames are never the call site
+WRAPPER_FILES = {__file__, os.path.join(os.path.dirname(__file__), 'profiling.py')}
+
+# Shape normalization, applied in order
+SHAPE_RULES = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'(?<![\w."])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b'), '?'),
+    (re.compile(r'%s|%\(\w+\)s'), '?'),
+    # Savepoint names are unique per transaction
+    (re.compile(r'(SAVEPOINT\s+)"[^"]*"', re.IGNORECASE), r'\1"?"'),
+    # IN lists and multi-row VALUES of any length
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+]
+# Nested atomic() blocks, not a loop: left out of repeated()
+TRANSACTION_SHAPE = re.compile(r'^(RELEASE |ROLLBACK TO )?SAVEPOINT ', re.IGNORECASE)
+
+
+def fingerprint(sql):
+    """The shape of a query: the SQL with its values replaced"""
+    for pattern, replacement in SHAPE_RULES:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def project_frames(limit=6):
+    """'file:line in function' for the innermost frames of project code, outermost first"""
+    base = str(settings.BASE_DIR)
+    frames = []
+    frame = sys._getframe(1)
+    while frame is not None and len(frames) < limit:
+        filename = frame.f_code.co_filename
+        if filename.startswith(base) and filename not in WRAPPER_FILES and SITE_PACKAGES.match(filename) is None:
+            frames.append(f'{filename[len(base):].lstrip("/")}:{frame.f_lineno} in {frame.f_code.co_name}')
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+class QueryLog:
+    """
+    Records every query run on any database while it is active (use it as a
+    context manager), grouped by database and shape with the call sites of
+    each. The first `max_recorded` queries are also kept one by one.
+    """
+
+    def __init__(self, max_recorded=0):
+        self.max_recorded = max_recorded
+        self.queries = []
+        self.count = 0
+        self.total = 0.0
+        # {(database, shape): Counter({call site frames: count})}
+        self.shapes = {}
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - started) * 1000
+            alias = context['connection'].alias
+            origin = project_frames()
+            self.count += 1
+            self.total += duration
+            self.shapes.setdefault((alias, fingerprint(sql)), Counter())[tuple(origin)] += 1
+            if len(self.queries) < self.max_recorded:
+                self.queries.append({
+                    'database': alias,
+                    # Placeholders only: parameters may hold personal data
+                    'sql': sql,
+                    'many': many,
+                    'ms': round(duration, 3),
+                    'origin': origin,
+                })
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for alias in connections:
+            self._stack.enter_context(connections[alias].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+        self._stack = None
+
+    def repeated(self, threshold=2):
+        """Shapes run at least `threshold` times on one database, most repeated first"""
+        found = [
+            {
+                'database': alias,
+                'shape': shape,
+                'count': sum(sites.values()),
+                'sites': [{'count': count, 'stack': list(stack)} for stack, count in sites.most_common()],
+            }
+            for (alias, shape), sites in self.shapes.items()
+            if sum(sites.values()) >= threshold and not TRANSACTION_SHAPE.match(shape)
+        ]
+        found.sort(key=lambda entry: entry['count'], reverse=True)
+        return found
+
+    def report(self, threshold=2):
+        """repeated() as text, with the innermost call site of each stack"""
+        lines = []
+        for entry in self.repeated(threshold):
+            lines.append(f"{entry['count']}x on {entry['database']}: {entry['shape']}")
+            for site in entry['sites'][:3]:
+                lines.append(f"    {site['count']}x from {' > '.join(site['stack'][-3:]) or 'outside the project'}")
+        return '\n'.join(lines)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A query_budget() block ran more queries than it allows"""
+
+
+class query_budget(ContextDecorator):
+    """
+    Fail when the block (or decorated test) runs more than `total` queries,
+    or the same shape more than `repeats` times on one database. None leaves
+    that limit out.
+    """
+
+    def __init__(self, total=None, repeats=None, label=''):
+        self.total = total
+        self.repeats = repeats
+        self.label = label
+
+    def __enter__(self):
+        self.log = QueryLog().__enter__()
+        return self.log
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.log.__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return False
+        problems = []
+        if self.total is not None and self.log.count > self.total:
+            problems.append(f'{self.log.count} queries, budget {self.total}')
+        if self.repeats is not None and self.log.repeated(self.repeats + 1):
+            problems.append(f'a query shape ran more than {self.repeats} times')
+        if problems:
+            label = f'{self.label}: ' if self.label else ''
+            raise QueryBudgetExceeded(
+                f"{label}{'; '.join(problems)}\n{self.log.report(2 if self.repeats is None else self.repeats + 1)}"
+            )
+        return False
+
+
+class RepeatedQueryMiddleware:
+    """With DEBUG on, log a warning for requests that repeat a query shape QUERY_REPEAT_WARNING times"""
+
+    def __init__(self, get_response):
+        self.threshold = getattr(settings, 'QUERY_REPEAT_WARNING', None)
+        if not settings.DEBUG or self.threshold is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryLog() as log:
+            response = self.get_response(request)
+        report = log.report(self.threshold)
+        if report:
+            logger.warning('%s %s repeats queries:\n%s', request.method, request.path, report)
+        return response
@@ -0,0 +1,41 @@
+# This file defines a faster JSON renderer for API responses
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# orjson is optional: without it we fall back to DRF's stdlib renderer
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when it is installed.
+
+    Output matches DRF's compact, unicode JSON: datetimes are written with a
+    trailing "Z" for UTC, and anything orjson does not know natively (Decimal,
+    lazy strings, UUIDs...) goes through DRF's own JSONEncoder.default.
+    Pretty-printed requests (?indent / browsable API) use the stdlib path.
+    """
+    _fallback = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(
+            data,
+            default=self._fallback.default,
+            option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS,
+        )
+        # Keep DRF's escaping of U+2028/U+2029 so output stays a JavaScript subset
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
@@ -0,0 +1,60 @@
+# This file routes queries between 'default' and the seller shards.
+# Products and order items live on their seller's shard (see products/shards.py);
+# everything else, including users and orders, lives on 'default'.
+from django.db import DEFAULT_DB_ALIAS
+
+
+class SellerShardRouter:
+    """
+    Database router for SELLER_SHARDS (does nothing while it is empty).
+
+    Writes and related lookups of a product or order item go to its seller's
+    shard. Queries without an instance to go by return None (so 'default'):
+    code reading sharded models across sellers asks products.shards for the
+    right database instead. Every model is migrated on every database.
+    """
+
+    def db_for_model(self, model, instance, for_write=False):
+        from products import shards
+
+        if not shards.enabled():
+            return None
+        if not shards.is_sharded(model):
+            return DEFAULT_DB_ALIAS
+        if instance is None:
+            return None
+        seller_id = getattr(instance, 'seller_id', None)
+        if for_write and shards.is_sharded(type(instance)) and seller_id is not None:
+            # Writes go where the map says now (refused while the seller is
+            # being moved), even for a row read before a move
+            return shards.shard_for_seller(seller_id, for_write=True)
+        if shards.is_sharded(type(instance)) and not instance._state.adding and instance._state.db is not None:
+            # Loaded from a shard (or a related row of one): stay there
+            return instance._state.db
+        # The rest are hints for related rows (e.g. product.seller = user):
+        # the cached placement is enough, the row's own save checks the map
+        if isinstance(instance, model._meta.get_field('seller').related_model):
+            # user.products / user.sold_items
+            return shards.shard_for_seller(instance.pk)
+        if seller_id is not None:
+            return shards.shard_for_seller(seller_id)
+        product_id = getattr(instance, 'product_id', None)
+        if product_id is not None:
+            # review.product / cart_item.product
+            return shards.shard_for_product(product_id)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self.db_for_model(model, hints.get('instance'))
+
+    def db_for_write(self, model, **hints):
+        return self.db_for_model(model, hints.get('instance'), for_write=True)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        from products import shards
+
+        # Rows on a shard point at users and orders on 'default'
+        return True if shards.enabled() else None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
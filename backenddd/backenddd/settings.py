@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,7 +49,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backenddd.middleware.ConcurrencyLimitMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'backenddd.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,9 +59,16 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'backenddd.queries.RepeatedQueryMiddleware',
+    'backenddd.profiling.ProfilingMiddleware',
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True
+# Let the frontend read the pagination Link header on cross-origin responses
+CORS_EXPOSE_HEADERS = ["Link", "Idempotent-Replayed"]
+# The frontend sends an Idempotency-Key header when placing orders
+from corsheaders.defaults import default_headers
+CORS_ALLOW_HEADERS = (*default_headers, "idempotency-key")
 
 ROOT_URLCONF = 'backenddd.urls'
 
@@ -90,6 +100,33 @@ DATABASES = {
     }
 }
 
+# Seller shards: each seller's products and order items can live on one of
+# several databases (users, orders, carts and reviews stay on 'default').
+# Turn it on by listing the shard aliases in the SELLER_SHARDS environment
+# variable (e.g. SELLER_SHARDS=shard_0,shard_1,shard_2). Each alias gets a
+# local SQLite file db_<alias>.sqlite3 (point them at real servers in your
+# own settings). Run `manage.py migrate --database=<alias>` for each of
+# them, then `manage.py rebalance_shards --bootstrap` moves the existing
+# catalog out of 'default'. Unset: everything stays on 'default' and no
+# shard database is defined.
+SELLER_SHARDS = [alias.strip() for alias in os.environ.get('SELLER_SHARDS', '').split(',') if alias.strip()]
+for alias in SELLER_SHARDS:
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'db_{alias}.sqlite3',
+    }
+DATABASE_ROUTERS = ['backenddd.routers.SellerShardRouter']
+# Seconds a seller's shard is kept in the shared cache (moves clear it)
+SELLER_SHARD_CACHE_SECONDS = 300
+# Seconds rebalance_shards waits after locking a seller, so writes that
+# checked the map before the lock finish first (writes always read the lock
+# from the map, never from the cache)
+SELLER_SHARD_MOVE_GRACE = 2
+# Seconds rebalance_shards waits before deleting a moved seller's old rows,
+# so processes reading through a cached placement still find them.
+# None: SELLER_SHARD_CACHE_SECONDS
+SELLER_SHARD_PURGE_DELAY = None
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -110,6 +147,42 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing ("auth performance mode")
+# Hasher for new passwords: 'pbkdf2' (Django's default), 'scrypt' or 'argon2'
+# (needs the argon2-cffi package). Passwords stored with another hasher or
+# another cost still work and are rehashed on the user's next login.
+AUTH_PASSWORD_HASHER = 'pbkdf2'
+# Cost settings; raising one upgrades each password at its next login
+AUTH_PBKDF2_ITERATIONS = None  # None: Django's default
+AUTH_SCRYPT_WORK_FACTOR = 2 ** 14
+AUTH_SCRYPT_BLOCK_SIZE = 8
+AUTH_SCRYPT_PARALLELISM = 1
+AUTH_ARGON2_TIME_COST = 2
+AUTH_ARGON2_MEMORY_COST = 64 * 1024  # KiB
+AUTH_ARGON2_PARALLELISM = 1
+# Hashing runs on this many dedicated workers per process, so a burst of
+# logins can't use every request thread (0: hash on the request thread)
+AUTH_HASHING_WORKERS = 2
+# 'thread' (hashlib and argon2 release the GIL) or 'process'
+AUTH_HASHING_POOL = 'thread'
+# Logins allowed to wait for a worker; more than that get 503 with Retry-After
+AUTH_HASHING_QUEUE = 32
+
+AUTH_HASHER_CLASSES = {
+    'pbkdf2': 'users.hashers.TunedPBKDF2PasswordHasher',
+    'scrypt': 'users.hashers.TunedScryptPasswordHasher',
+    'argon2': 'users.hashers.TunedArgon2PasswordHasher',
+}
+# The first hasher is used for new hashes; the others only verify old ones.
+# (A settings module that changes AUTH_PASSWORD_HASHER must rebuild this list.)
+PASSWORD_HASHERS = [AUTH_HASHER_CLASSES[AUTH_PASSWORD_HASHER]] + [
+    path for name, path in AUTH_HASHER_CLASSES.items() if name != AUTH_PASSWORD_HASHER
+] + [
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/6.0/topics/i18n/
 
@@ -127,8 +200,192 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Default primary key type (matches the existing migrations)
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'backenddd.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    # Token buckets: "N/period" allows bursts of N, refilled at N per period
+    'DEFAULT_THROTTLE_CLASSES': (
+        'backenddd.throttling.AnonBucketThrottle',
+        'backenddd.throttling.UserBucketThrottle',
+    ),
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': '120/min',
+        'user': '300/min',
+        # Login and registration hash passwords, so they get a much smaller budget
+        'auth': '10/min',
+    },
+    # Reverse proxies in front of the app that append the client address to
+    # X-Forwarded-For. 0: clients are told apart by the connection address
+    # (REMOTE_ADDR) only, so a forged X-Forwarded-For can't pick a fresh
+    # rate-limit bucket. Behind a load balancer set the real proxy count.
+    'NUM_PROXIES': 0,
+}
+
+# Caches
+# The throttle cache must be shared by all workers in production (Redis or
+# memcached). The local-memory default keeps one set of buckets per process:
+# with N worker processes every rate limit (login included) is N times higher.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'throttle',
+    },
 }
+
+# Load shedding (backenddd.middleware.ConcurrencyLimitMiddleware)
+# Requests in flight per process before new ones get 503 + Retry-After
+MAX_IN_FLIGHT_REQUESTS = 64
+# Seconds clients are asked to wait when shed
+LOAD_SHED_RETRY_AFTER = 1
+# Long-lived or operator paths that are never shed
+CONCURRENCY_LIMIT_EXEMPT_PATHS = ['/admin/', '/api/products/seller/sales-stream/']
+
+# Response compression (backenddd.middleware.CompressionMiddleware)
+# Responses smaller than this many bytes are sent uncompressed
+COMPRESSION_MIN_SIZE = 1024
+# Brotli quality 0-11; 4 is a good speed/size balance for dynamic responses
+COMPRESSION_BROTLI_QUALITY = 4
+# Up to this many random bytes are added to each compressed response, so its
+# length can't be used to guess secrets in it (the BREACH attack; same as
+# Django's GZipMiddleware). 0 turns the padding off; brotli allows at most 256
+COMPRESSION_MAX_RANDOM_BYTES = 100
+
+# Product autocomplete (/api/products/suggest/)
+# Default number of suggestions returned (capped at 20 per request)
+PRODUCT_SUGGEST_LIMIT = 10
+# Optional snapshot written by `manage.py build_suggest_index`, loaded when the index is built
+PRODUCT_SUGGEST_SNAPSHOT = None
+# Build the index when a web worker starts (wsgi.py/asgi.py), so no request waits for it
+PRODUCT_SUGGEST_WARM_UP = True
+# Seconds between reads of the product change log that keep each process's index current
+PRODUCT_SUGGEST_REFRESH_SECONDS = 5
+
+# Order history (/api/orders/, /api/products/seller/sales-orders/)
+# Orders per page (newest first) and the most a client may ask for with ?limit=
+ORDER_HISTORY_PAGE_SIZE = 50
+ORDER_HISTORY_MAX_PAGE_SIZE = 200
+
+# Idempotent order creation (Idempotency-Key header on POST /api/orders/ and cart checkout)
+# Seconds a key and its stored response are kept (purge with `manage.py purge_idempotency_keys`)
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+# Seconds a duplicate request waits for the first one before getting 409
+IDEMPOTENCY_WAIT_SECONDS = 10
+# An unfinished key older than this is treated as abandoned (its worker died)
+IDEMPOTENCY_LOCK_SECONDS = 60
+
+# Product cache and batch lookups (/api/products/?ids=1,2,3, /api/products/batch/)
+# Seconds a serialized product stays in the shared cache (writes also clear it)
+PRODUCT_CACHE_TIMEOUT = 300
+# Cache alias for the shared level; use a Redis/memcached cache with several workers
+PRODUCT_CACHE_ALIAS = 'default'
+# Bump when the serialized product format changes so old entries are ignored
+PRODUCT_CACHE_VERSION = 1
+# In-process LRU size, and how long a process may keep a copy another one changed
+PRODUCT_CACHE_LOCAL_MAX_ENTRIES = 2000
+PRODUCT_CACHE_LOCAL_TTL = 5
+# Seconds other workers wait for the one loading a missing product
+PRODUCT_CACHE_LOCK_TIMEOUT = 5
+# Most ids accepted by one batch request
+PRODUCT_BATCH_MAX_IDS = 100
+
+# Product change feed (/api/products/changes/?since=<token>)
+# Default and largest number of changes per response
+PRODUCT_CHANGES_PAGE_SIZE = 500
+PRODUCT_CHANGES_MAX_PAGE_SIZE = 1000
+# Changes younger than this are held back, so one committed a little late
+# by a slower transaction is not skipped. Changes whose transaction commits
+# later than this are recorded again when it commits (products/changes.py)
+PRODUCT_CHANGES_SETTLE_SECONDS = 2
+# `manage.py compact_product_changes` drops deletes older than this; clients
+# that haven't synced for longer must download the catalog again
+PRODUCT_CHANGES_RETENTION_DAYS = 30
+
+# Seller bulk price/discount changes (/api/products/seller/bulk-pricing/)
+# Most product ids accepted in one request (filters have no limit)
+SELLER_BULK_MAX_IDS = 5000
+
+# Product admin changelist
+# Performance mode: estimated counts, price range buckets, title prefix search
+PRODUCT_ADMIN_PERFORMANCE_MODE = True
+# Filtered/searched lists count (and page through) at most this many rows
+PRODUCT_ADMIN_COUNT_LIMIT = 10000
+# Edges of the price filter buckets (the last bucket is "and up")
+PRODUCT_ADMIN_PRICE_BUCKETS = [0, 10, 25, 50, 100, 250, 500, 1000]
+
+# Home page storefront (/api/products/storefront/)
+# Products per section and number of per-category sections
+STOREFRONT_SECTION_SIZE = 8
+STOREFRONT_CATEGORIES = 6
+# Reviews a product needs before it can appear under "Top rated"
+STOREFRONT_MIN_REVIEWS = 3
+# Seconds the built storefront is cached (product edits also clear it)
+STOREFRONT_CACHE_SECONDS = 60
+
+# Related products (/api/products/{id}/related/)
+# Index files written by `manage.py build_related_index` and memory-mapped by the API
+RELATED_INDEX_DIR = BASE_DIR / 'var' / 'related'
+# Size of the hashed text vectors and neighbours stored per product
+RELATED_INDEX_DIMS = 128
+RELATED_INDEX_NEIGHBOURS = 12
+# Products compared exactly with each other per similarity bucket
+RELATED_INDEX_BUCKET_SIZE = 512
+# Seconds between checks for a newly published index version
+RELATED_INDEX_RELOAD_SECONDS = 30
+# Default number of related products returned
+RELATED_PRODUCTS_LIMIT = 8
+
+# Catalog snapshot for read-only nodes (written by `manage.py export_catalog_snapshot`)
+# 'database' reads products from the ORM; 'snapshot' serves the public list,
+# product pages and batch lookups from the memory-mapped snapshot instead
+PRODUCT_READ_BACKEND = 'database'
+CATALOG_SNAPSHOT_DIR = BASE_DIR / 'var' / 'catalog'
+# Seconds between checks for a newly published snapshot version
+CATALOG_SNAPSHOT_RELOAD_SECONDS = 30
+
+# Compiled read serializers (backenddd/compiled.py): the product list, product
+# pages, batch lookups and order history read values() rows and build the
+# same JSON as the DRF serializers without per-row field objects.
+# False: always serialize model instances with DRF
+COMPILED_SERIALIZERS = True
+
+# On-demand request profiling (backenddd/profiling.py): a staff user sends
+# "X-Profile: 1" or ?_profile=1 and the request is sampled, its SQL recorded
+# and the result stored as a folded flame graph under PROFILING_DIR.
+# The admin endpoints under /api/profiles/ list and download them.
+# False: the middleware is removed at startup
+PROFILING_ENABLED = True
+PROFILING_DIR = BASE_DIR / 'var' / 'profiles'
+# Seconds between stack samples
+PROFILING_SAMPLE_INTERVAL = 0.001
+# Newest profiles kept on disk
+PROFILING_KEEP = 50
+
+# Repeated query detection (backenddd/queries.py): with DEBUG on, a request
+# that runs the same query shape this many times on one database logs a
+# warning with the lines that ran it (usually a loop querying once per row).
+# Tests use queries.query_budget() instead. None: don't check requests
+QUERY_REPEAT_WARNING = 10
+
+# Live seller sales feed (/api/products/seller/sales-stream/, served under ASGI)
+# Pub/sub implementation; swap for a shared broker when running several workers
+SALES_EVENT_BROKER = 'orders.events.InProcessBroker'
+# Seconds between keep-alive comments on an idle stream
+SALES_STREAM_HEARTBEAT = 15
+# Seconds a stream ticket (POST /api/products/seller/sales-stream-ticket/) can open the stream
+SALES_STREAM_TICKET_SECONDS = 30
+# On reconnect, sales this many seconds older than the client's last event
+# are sent again (checkouts can commit out of order); the client skips duplicates
+SALES_STREAM_REPLAY_OVERLAP = 5
+# Most missed sales sent on one reconnect (beyond that the client reloads its page)
+SALES_STREAM_REPLAY_LIMIT = 500
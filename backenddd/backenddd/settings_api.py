@@ -0,0 +1,56 @@
+"""
+Lean settings for API-only workers.
+
+The API authenticates with JWT on every request, so the admin, sessions,
+messages and the browsable API are never used by these processes. Leaving
+them out means fewer modules to import when a worker boots and fewer
+middleware calls per request.
+
+Run a worker with it like this:
+    DJANGO_SETTINGS_MODULE=backenddd.settings_api gunicorn backenddd.wsgi
+
+Migrations must still be run with the full settings (backenddd.settings),
+because they cover the tables of the apps removed here too.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+# Apps only needed by the admin site or by browser logins
+LEAN_SKIPPED_APPS = [
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'rest_framework.authtoken',
+]
+
+# Middleware that only matters for session (cookie) logins. DRF views
+# authenticate with JWT themselves and are exempt from CSRF checks.
+LEAN_SKIPPED_MIDDLEWARE = [
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+]
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in LEAN_SKIPPED_APPS]  # noqa: F405
+
+MIDDLEWARE = [name for name in MIDDLEWARE if name not in LEAN_SKIPPED_MIDDLEWARE]  # noqa: F405
+
+TEMPLATES = [{
+    **TEMPLATES[0],  # noqa: F405
+    'OPTIONS': {
+        'context_processors': [
+            'django.template.context_processors.request',
+            'django.contrib.auth.context_processors.auth',
+        ],
+    },
+}]
+
+# JSON only: the browsable API needs templates, static files and sessions
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,  # noqa: F405
+    'DEFAULT_RENDERER_CLASSES': (
+        'backenddd.renderers.FastJSONRenderer',
+    ),
+}
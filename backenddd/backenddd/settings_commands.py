@@ -0,0 +1,16 @@
+"""
+Lean settings for short-lived management commands (backfill_ratings,
+archive_orders, build_related_index, ...).
+
+Same as the API worker profile without CORS, since commands never answer
+browser requests. manage.py picks this profile by itself for the commands
+listed in LEAN_COMMANDS; set DJANGO_SETTINGS_MODULE to override it.
+"""
+
+from .settings_api import *  # noqa: F401,F403
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app != 'corsheaders']  # noqa: F405
+
+MIDDLEWARE = [  # noqa: F405
+    name for name in MIDDLEWARE if name != 'corsheaders.middleware.CorsMiddleware'  # noqa: F405
+]
@@ -0,0 +1,20 @@
+"""
+Settings for the test suite.
+
+The full settings plus three seller shard databases. The sharded tests turn
+shards on per test class (override_settings(SELLER_SHARDS=...)), so these
+databases must exist whether or not SELLER_SHARDS is set. The test runner
+creates them as temporary test databases.
+
+manage.py test picks this module by itself. Other runners need it set:
+    DJANGO_SETTINGS_MODULE=backenddd.settings_test
+"""
+
+from .settings import *  # noqa: F401,F403
+
+SELLER_SHARD_TEST_DATABASES = ['shard_0', 'shard_1', 'shard_2']
+for alias in SELLER_SHARD_TEST_DATABASES:
+    DATABASES.setdefault(alias, {  # noqa: F405
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'db_{alias}.sqlite3',  # noqa: F405
+    })
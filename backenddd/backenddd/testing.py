@@ -0,0 +1,40 @@
+# This file holds what the apps' tests share. SellerShardsMixin runs a test
+# class again with seller shards on:
+#
+#     class ShardedCartTests(SellerShardsMixin, CartTests):
+#         """The same with each seller's rows on one of three shards"""
+#
+# The shard databases are defined by backenddd.settings_test.
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.test import override_settings
+
+SHARDS = list(settings.SELLER_SHARD_TEST_DATABASES)
+
+
+class SellerShardsMixin:
+    """Test class mixin (put it first) that turns on the SHARDS seller shards, without move delays"""
+    databases = {'default', *SHARDS}
+
+    @classmethod
+    def setUpClass(cls):
+        shard_settings = override_settings(
+            SELLER_SHARDS=SHARDS, SELLER_SHARD_MOVE_GRACE=0, SELLER_SHARD_PURGE_DELAY=0,
+        )
+        shard_settings.enable()
+        cls.addClassCleanup(shard_settings.disable)
+        super().setUpClass()
+
+    @classmethod
+    @contextmanager
+    def captureOnCommitCallbacks(cls, *, using=DEFAULT_DB_ALIAS, execute=False):
+        # Hooks of writes to the shards wait for each shard's commit in turn,
+        # then for 'default' (shards.on_commit()): capture them on every
+        # database, released in that order
+        with ExitStack() as stack:
+            callbacks = stack.enter_context(super().captureOnCommitCallbacks(using=using, execute=execute))
+            for alias in reversed(SHARDS):
+                stack.enter_context(super().captureOnCommitCallbacks(using=alias, execute=execute))
+            yield callbacks
@@ -0,0 +1,119 @@
+# This file implements token-bucket rate limiting for the API
+from django.core.cache import caches
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    Token bucket throttle stored in a shared cache.
+
+    A rate of "N/period" means a bucket of N tokens that refills at N tokens
+    per period, so clients may burst up to N requests and then continue at
+    the average rate. The bucket state is two cache keys: a counter of tokens
+    taken and an anchor time; tokens refilled since the anchor are added back.
+    The counter only changes through atomic cache.add()/incr()/decr(), so
+    concurrent requests never lose a count. When the bucket is full the anchor
+    moves forward instead of the counter being reset, so unused tokens don't
+    pile up. Limits are only global if every worker uses the same cache
+    (Redis, memcached): with the local-memory cache they are per process.
+    """
+    cache = caches['throttle']
+    # Keep idle buckets around for this many periods before the cache drops them
+    key_lifetime_periods = 10
+
+    def __init__(self):
+        super().__init__()
+        if self.rate is not None:
+            self.refill_rate = self.num_requests / self.duration
+        self.retry_after = None
+
+    def take_token(self, count_key, timeout):
+        try:
+            return self.cache.incr(count_key)
+        except ValueError:
+            # First request for this bucket
+            self.cache.add(count_key, 0, timeout)
+            return self.cache.incr(count_key)
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        now = self.timer()
+        timeout = int(self.duration * self.key_lifetime_periods)
+        anchor_key = f"{self.key}:anchor"
+        count_key = f"{self.key}:taken"
+
+        taken = self.take_token(count_key, timeout)
+        # The anchor at which `taken - 1` tokens have been refilled: the
+        # bucket was full just before this request
+        full_anchor = now - (taken - 1) / self.refill_rate
+        anchor = self.cache.get(anchor_key)
+        if anchor is None:
+            self.cache.add(anchor_key, full_anchor, timeout * 2)
+            anchor = self.cache.get(anchor_key, full_anchor)
+
+        refilled = (now - anchor) * self.refill_rate
+        if refilled >= taken - 1:
+            # The bucket refilled completely before this request: drop the
+            # unused tokens by moving the anchor (a concurrent request doing
+            # the same writes an anchor at most a token or two apart)
+            self.cache.set(anchor_key, full_anchor, timeout * 2)
+            self.cache.touch(count_key, timeout)
+            return True
+
+        if taken <= self.num_requests + refilled:
+            return True
+
+        # Denied requests do not use up tokens
+        try:
+            self.cache.decr(count_key)
+        except ValueError:
+            pass
+        # A client kept at the limit must not see its counter expire (a free full bucket)
+        self.cache.touch(count_key, timeout)
+        self.retry_after = (taken - self.num_requests - refilled) / self.refill_rate
+        return False
+
+    def wait(self):
+        return self.retry_after
+
+
+class AnonBucketThrottle(TokenBucketThrottle):
+    """Per-IP bucket for anonymous requests (e.g. the public catalog)"""
+    scope = 'anon'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return None
+        return self.cache_format % {
+            'scope': self.scope,
+            'ident': self.get_ident(request),
+        }
+
+
+class UserBucketThrottle(TokenBucketThrottle):
+    """Per-user bucket for authenticated requests"""
+    scope = 'user'
+
+    def get_cache_key(self, request, view):
+        if not (request.user and request.user.is_authenticated):
+            return None
+        return self.cache_format % {
+            'scope': self.scope,
+            'ident': request.user.pk,
+        }
+
+
+class AuthBucketThrottle(TokenBucketThrottle):
+    """Stricter per-IP bucket for login and registration (password hashing is expensive)"""
+    scope = 'auth'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {
+            'scope': self.scope,
+            'ident': self.get_ident(request),
+        }
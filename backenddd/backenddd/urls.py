@@ -14,16 +14,25 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.apps import apps
 from django.urls import path, include
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from backenddd import profiling
+from backenddd.throttling import AuthBucketThrottle
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('api/users/', include('users.urls')),
     path('api/products/', include('products.urls')),
     path("api/orders/", include("orders.urls")),
-    path('api/token/', TokenObtainPairView.as_view()),
+    path('api/token/', TokenObtainPairView.as_view(throttle_classes=[AuthBucketThrottle])),
     path('api/token/refresh/', TokenRefreshView.as_view()),
+    path('api/profiles/', profiling.profile_list),
+    path('api/profiles/<str:profile_id>/', profiling.profile_detail),
+    path('api/profiles/<str:profile_id>/flamegraph/', profiling.profile_flamegraph),
 ]
 
+# The lean settings profiles (settings_api, settings_commands) leave the admin out
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+
+    urlpatterns.insert(0, path('admin/', admin.site.urls))
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backenddd.settings')
 
 application = get_wsgi_application()
+
+# Build the autocomplete index now rather than in the first /suggest request
+from products import suggest  # noqa: E402
+
+suggest.warm_up()
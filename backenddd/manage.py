@@ -3,9 +3,34 @@
 import os
 import sys
 
+# Short-lived commands that run with the lean settings profile by default
+# (no admin, sessions, messages or CORS to import). Setting
+# DJANGO_SETTINGS_MODULE yourself always wins.
+LEAN_COMMANDS = {
+    'archive_orders',
+    'backfill_ratings',
+    'bench_related_index',
+    'build_related_index',
+    'build_suggest_index',
+    'compact_product_changes',
+    'export_catalog_snapshot',
+    'generate_workload',
+    'purge_idempotency_keys',
+    'rebalance_shards',
+    'reconcile_ratings',
+    'replay_workload',
+}
+# The tests run with their own settings (the seller shard test databases)
+TEST_SETTINGS = 'backenddd.settings_test'
+
 
 def main():
     """Run administrative tasks."""
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command in LEAN_COMMANDS:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backenddd.settings_commands')
+    elif command == 'test':
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', TEST_SETTINGS)
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backenddd.settings')
     try:
         from django.core.management import execute_from_command_line
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class OrdersConfig(AppConfig):
     name = 'orders'
+
+    def ready(self):
+        # Register signal handlers that publish live sales events
+        from . import signals  # noqa: F401
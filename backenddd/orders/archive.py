@@ -0,0 +1,347 @@
+# This file moves old orders into the archive tables and reads order history
+# across both. Reads always start with the small hot tables and only look in
+# the archive when the requested date range reaches back before the cutoff.
+from datetime import datetime, time as day_start
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from products import shards
+from .models import ArchivedOrder, ArchivedOrderItem, ArchiveRun, Order, OrderItem
+
+# Archive state ---------------------------------------------------------------
+
+def archive_state():
+    """
+    The newest archive cutoff and run: {"cutoff", "run_id", "finished_at"}
+    (cutoff None = empty archive). Read from the small ArchiveRun table on
+    every call, not cached: a per-process cache would keep other workers on
+    the old cutoff while a run moves orders out of the hot table. Views read
+    it once per request and pass it to the functions below as `state`.
+    """
+    run = ArchiveRun.objects.order_by("-cutoff", "-id").values("cutoff", "id", "finished_at").first()
+    return {
+        "cutoff": run["cutoff"] if run else None,
+        "run_id": run["id"] if run else None,
+        "finished_at": run["finished_at"] if run else None,
+    }
+
+
+def archive_validator(state=None):
+    """(last_modified, count)-style validator that changes with every archive run"""
+    if state is None:
+        state = archive_state()
+    return state["finished_at"], state["run_id"] or 0
+
+
+def needs_archive(created_after, state=None):
+    """True if a range starting at `created_after` (None = forever) reaches archived orders"""
+    if state is None:
+        state = archive_state()
+    cutoff = state["cutoff"]
+    return cutoff is not None and (created_after is None or created_after < cutoff)
+
+
+# Moving orders ---------------------------------------------------------------
+
+def archive_orders(cutoff, chunk_size=1000, log=None):
+    """
+    Move orders created before `cutoff` (and their items) into the archive.
+
+    Each chunk is copied and deleted in one transaction over 'default' and
+    the shards, so a reader finds every order in exactly one of the two
+    tables and the run can be stopped and restarted at any time. The cutoff
+    is published before the first chunk moves, so readers start looking in
+    the archive straight away.
+    """
+    run = ArchiveRun.objects.create(cutoff=cutoff)
+
+    while True:
+        # 'default' commits first: a crash before the shards commit leaves
+        # hot items of archived orders behind, never archived items missing
+        with shards.atomic(*shards.databases()):
+            orders = list(
+                Order.objects.filter(created_at__lt=cutoff).order_by("id")[:chunk_size]
+            )
+            if not orders:
+                break
+            order_ids = [order.id for order in orders]
+            created = {order.id: order.created_at for order in orders}
+            # Items live with their products, on 'default' or the seller shards
+            items = [
+                item
+                for items_here in shards.each(OrderItem.objects.filter(order_id__in=order_ids).select_related("product"))
+                for item in items_here
+            ]
+            ArchivedOrder.objects.bulk_create([
+                ArchivedOrder(
+                    id=order.id,
+                    user_id=order.user_id,
+                    created_at=order.created_at,
+                    total_items=order.total_items,
+                    total_price=order.total_price,
+                )
+                for order in orders
+            ])
+            ArchivedOrderItem.objects.bulk_create([
+                ArchivedOrderItem(
+                    id=item.id,
+                    order_id=item.order_id,
+                    product_id=item.product_id,
+                    seller_id=item.seller_id,
+                    order_created_at=created[item.order_id],
+                    quantity=item.quantity,
+                    product_title=item.product_title,
+                    product_image_url=item.product.image_url,
+                    unit_price=item.unit_price,
+                    discount=item.discount,
+                    line_total=item.line_total,
+                )
+                for item in items
+            ])
+            for alias in shards.databases():
+                OrderItem.objects.using(alias).filter(order_id__in=order_ids).delete()
+            Order.objects.filter(pk__in=order_ids).delete()
+
+        run.orders_archived += len(orders)
+        run.items_archived += len(items)
+        run.save(update_fields=["orders_archived", "items_archived"])
+        if log:
+            log(f"Archived {run.orders_archived} orders ({run.items_archived} items)")
+
+    run.finished_at = timezone.now()
+    run.save(update_fields=["finished_at"])
+    return run
+
+
+# Request parameters ------------------------------------------------------------
+
+def parse_moment(value, name):
+    """Parse an ISO date or datetime query parameter into an aware datetime"""
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValidationError({name: ["Use an ISO date (2024-01-31) or datetime."]})
+        moment = datetime.combine(day, day_start())
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def history_range(request):
+    """
+    (created_after, before, limit) from ?created_after=&created_before=&limit=.
+    before is None, (created_before, None) or, on pages after the first,
+    the (created_at, id) of the last order seen (&before_id= is set then).
+    """
+    params = request.query_params
+    page_size = getattr(settings, "ORDER_HISTORY_PAGE_SIZE", 50)
+    try:
+        limit = int(params.get("limit", page_size))
+    except ValueError:
+        raise ValidationError({"limit": ["Must be a whole number."]})
+    limit = max(1, min(limit, getattr(settings, "ORDER_HISTORY_MAX_PAGE_SIZE", 200)))
+    created_before = parse_moment(params.get("created_before"), "created_before")
+    before_id = params.get("before_id")
+    if before_id is not None:
+        if created_before is None:
+            raise ValidationError({"before_id": ["Only valid together with created_before."]})
+        try:
+            before_id = int(before_id)
+        except ValueError:
+            raise ValidationError({"before_id": ["Must be a whole number."]})
+    before = (created_before, before_id) if created_before is not None else None
+    return parse_moment(params.get("created_after"), "created_after"), before, limit
+
+
+def next_page_link(request, created_at, order_id):
+    """
+    URL of the next (older) page: the same request continuing after the
+    order (created_at, order_id). The id breaks ties between orders placed
+    at the same moment, so none of them is skipped or repeated.
+    """
+    params = request.query_params.copy()
+    params["created_before"] = created_at.isoformat()
+    params["before_id"] = str(order_id)
+    return request.build_absolute_uri(f"{request.path}?{urlencode(list(params.lists()), doseq=True)}")
+
+
+def _in_range(queryset, field, created_after, before, id_field="id"):
+    """Rows with `field` >= created_after and (field, id_field) before `before` (newest-first keyset)"""
+    if created_after is not None:
+        queryset = queryset.filter(**{f"{field}__gte": created_after})
+    if before is not None:
+        created_before, before_id = before
+        if before_id is None:
+            queryset = queryset.filter(**{f"{field}__lt": created_before})
+        else:
+            queryset = queryset.filter(
+                Q(**{f"{field}__lt": created_before}) | Q(**{field: created_before, f"{id_field}__lt": before_id})
+            )
+    return queryset
+
+
+# Customer order history ----------------------------------------------------------
+
+def order_history(user, created_after=None, before=None, limit=50, compiled=None, state=None):
+    """
+    Newest-first page of a user's orders from created_after up to `before`
+    (see history_range()).
+
+    Returns (hot orders, archived orders), together at most `limit`. The
+    archive is only queried when the hot table can't fill the page and the
+    range goes back past the archive cutoff. With a compiled serializer
+    the hot orders are its values() rows instead of model instances.
+    """
+    hot = _in_range(Order.objects.filter(user=user), "created_at", created_after, before).order_by(
+        "-created_at", "-id"
+    )
+    if compiled is not None:
+        hot = list(compiled.values(hot)[:limit])
+    else:
+        hot = shards.prefetch_order_items(hot[:limit])
+    archived = []
+    if len(hot) < limit and needs_archive(created_after, state):
+        archived = list(
+            _in_range(ArchivedOrder.objects.filter(user=user), "created_at", created_after, before)
+            .order_by("-created_at", "-id")
+            .prefetch_related("items")[:limit - len(hot)]
+        )
+    return hot, archived
+
+
+def archived_totals(cache_prefix, queryset, state=None, **aggregates):
+    """
+    Aggregate over archive rows, cached until the next archive run (the
+    archive only changes when orders are moved into it).
+    """
+    if state is None:
+        state = archive_state()
+    if state["cutoff"] is None:
+        return {name: None for name in aggregates}
+    key = f"{cache_prefix}:run{state['run_id']}"
+    totals = cache.get(key)
+    if totals is None:
+        totals = queryset.aggregate(**aggregates)
+        # A run still in progress keeps adding rows, so only cache finished runs
+        if state["finished_at"] is not None:
+            cache.set(key, totals, None)
+    return totals
+
+
+def order_totals(user, state=None):
+    """Number of orders and amount spent over the user's whole history"""
+    hot = Order.objects.filter(user=user).aggregate(orders=Count("id"), spent=Sum("total_price"))
+    archived = archived_totals(
+        f"orders:archived-user-totals:{user.pk}",
+        ArchivedOrder.objects.filter(user=user),
+        state,
+        orders=Count("id"),
+        spent=Sum("total_price"),
+    )
+    return {
+        "total_orders": hot["orders"] + (archived["orders"] or 0),
+        "total_spent": (hot["spent"] or 0) + (archived["spent"] or 0),
+    }
+
+
+# Seller sales --------------------------------------------------------------------
+
+def _sales_orders(items):
+    """Group hot or archived item rows (newest order first) into the sales-orders format"""
+    orders = {}
+    for item in items:
+        order_id = item.order_id
+        if order_id not in orders:
+            orders[order_id] = {
+                "order_id": order_id,
+                "customer": item.order.user.username,
+                # Archived items carry their own copy of the order date
+                "created_at": getattr(item, "order_created_at", None) or item.order.created_at,
+                "items": [],
+                "total": 0,
+            }
+        item_total = float(item.line_total)
+        orders[order_id]["items"].append({
+            # Archived items keep their id, so live events can be matched to it
+            "id": item.id,
+            "product_id": item.product_id,
+            "product_title": item.product_title,
+            "quantity": item.quantity,
+            "price": float(item.paid_unit_price()),
+            "total": item_total,
+        })
+        orders[order_id]["total"] += item_total
+    return list(orders.values())
+
+
+def seller_sales_orders(seller, created_after=None, before=None, limit=50, state=None):
+    """
+    Newest-first page of orders containing the seller's products, as dicts.
+
+    One query picks the page of order ids, one reads their items and one
+    their orders and customers (on 'default', the items may be on a seller
+    shard); the archive gets two queries only if the page isn't full and
+    the range reaches back before the cutoff.
+    """
+    sold_items = OrderItem.objects.using(shards.shard_for_seller(seller.pk)).filter(seller=seller)
+    order_ids = [
+        order_id
+        for order_id, _ in _in_range(sold_items, "order_created_at", created_after, before, "order_id")
+        .values_list("order_id", "order_created_at")
+        .order_by("-order_created_at", "-order_id")
+        .distinct()[:limit]
+    ]
+    items = list(sold_items.filter(order_id__in=order_ids).order_by("-order_created_at", "-order_id", "id"))
+    orders = Order.objects.select_related("user").in_bulk(order_ids)
+    # An order archived between the two queries is gone from 'default': leave
+    # its items out (the archive read below finds it when the range reaches it)
+    items = [item for item in items if item.order_id in orders]
+    for item in items:
+        item.order = orders[item.order_id]
+    result = _sales_orders(items)
+
+    if len(result) < limit and needs_archive(created_after, state):
+        archived_ids = [
+            order_id
+            for order_id, _ in _in_range(
+                ArchivedOrderItem.objects.filter(seller=seller), "order_created_at", created_after, before, "order_id"
+            )
+            .values_list("order_id", "order_created_at")
+            .order_by("-order_created_at", "-order_id")
+            .distinct()[:limit - len(result)]
+        ]
+        archived_items = (
+            ArchivedOrderItem.objects.filter(seller=seller, order_id__in=archived_ids)
+            .select_related("order__user")
+            .order_by("-order_created_at", "-order_id", "id")
+        )
+        result.extend(_sales_orders(archived_items))
+    return result
+
+
+def seller_totals(seller, state=None):
+    """Orders, items sold and revenue for a seller over hot and archived sales"""
+    aggregates = dict(
+        total_orders=Count("order", distinct=True),
+        total_items_sold=Sum("quantity"),
+        total_revenue=Sum("line_total"),
+    )
+    hot = OrderItem.objects.using(shards.shard_for_seller(seller.pk)).filter(seller=seller).aggregate(**aggregates)
+    archived = archived_totals(
+        f"orders:archived-seller-totals:{seller.pk}",
+        ArchivedOrderItem.objects.filter(seller=seller),
+        state,
+        **aggregates,
+    )
+    return {
+        name: (hot[name] or 0) + (archived[name] or 0)
+        for name in aggregates
+    }
@@ -0,0 +1,166 @@
+# This file turns carts into orders with a constant number of queries
+from decimal import Decimal
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, Value, When
+from rest_framework import serializers
+from products.models import Product
+from products import cache as product_cache
+from products import changes as product_changes
+from products import shards
+from .events import get_broker, sale_event
+from .models import Order, OrderItem, discounted_price, line_total
+
+# Output type for money expressions computed in the database
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+
+def discounted_price_expression(prefix=""):
+    """SQL version of Product.get_discounted_price() (prefix e.g. "product__")"""
+    price = F(f"{prefix}price")
+    return ExpressionWrapper(
+        price - price * F(f"{prefix}discount") / Value(Decimal("100")),
+        output_field=MONEY,
+    )
+
+
+def priced_cart_items(cart):
+    """
+    Cart lines with today's price, discount and stock in a single query.
+
+    Line totals and the in-stock flag are computed by the database through
+    annotations, so rendering or checking a cart never loops over products.
+    With seller shards the products are on other databases than the cart, so
+    they are read with one query per shard and the same values are set in Python.
+    """
+    if shards.enabled():
+        return sharded_cart_items(cart)
+    return (
+        cart.items.annotate(
+            title=F("product__title"),
+            image_url=F("product__image_url"),
+            price=F("product__price"),
+            discount=F("product__discount"),
+            stock=F("product__stock"),
+            unit_price=discounted_price_expression("product__"),
+        )
+        .annotate(
+            line_total=ExpressionWrapper(F("unit_price") * F("quantity"), output_field=MONEY),
+            in_stock=Case(When(quantity__lte=F("product__stock"), then=Value(True)), default=Value(False)),
+        )
+        .order_by("added_at", "id")
+    )
+
+
+def sharded_cart_items(cart):
+    """priced_cart_items() for carts whose products are on the seller shards"""
+    lines = list(cart.items.order_by("added_at", "id"))
+    products = shards.in_bulk(Product.objects.all(), [line.product_id for line in lines])
+    priced = []
+    for line in lines:
+        product = products.get(line.product_id)
+        if product is None:
+            # Like the join above, lines of deleted products are left out
+            continue
+        line.title = product.title
+        line.image_url = product.image_url
+        line.price = product.price
+        line.discount = product.discount
+        line.stock = product.stock
+        line.unit_price = discounted_price(product.price, product.discount)
+        line.line_total = line_total(product.price, product.discount, line.quantity)
+        line.in_stock = line.quantity <= product.stock
+        priced.append(line)
+    return priced
+
+
+def place_order(user, quantities):
+    """
+    Create an order for `user` from a {product_id: quantity} mapping.
+
+    Prices and stock are read from the database in one query (the client's
+    prices are never used), order items are inserted with one bulk_create
+    together with their price snapshots, the order totals are stored on
+    the order and stock is decremented with one conditional UPDATE. Unknown product
+    ids are skipped; if nothing valid is left a ValidationError is raised.
+    With seller shards each of these runs once per shard holding products
+    of the order, all inside one transaction per database.
+    """
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    groups = shards.group_products(quantities, for_write=True)
+    products = {}
+    for alias, product_ids in groups.items():
+        for row in Product.objects.using(alias).filter(pk__in=product_ids).values(
+            "id", "title", "price", "discount", "stock", "seller_id"
+        ):
+            row["database"] = alias
+            products[row["id"]] = row
+    if not products:
+        raise serializers.ValidationError({"items": ["No valid items were provided for this order."]})
+
+    short = [product_id for product_id, row in products.items() if quantities[product_id] > row["stock"]]
+    if short:
+        raise serializers.ValidationError({"items": [f"Not enough stock for products {sorted(short)}."]})
+
+    items = [
+        OrderItem(
+            product_id=product_id,
+            quantity=quantities[product_id],
+            seller_id=row["seller_id"],
+            product_title=row["title"],
+            unit_price=row["price"],
+            discount=row["discount"],
+            line_total=line_total(row["price"], row["discount"], quantities[product_id]),
+        )
+        for product_id, row in products.items()
+    ]
+
+    with shards.atomic(*groups):
+        order = Order.objects.create(
+            user=user,
+            total_items=sum(item.quantity for item in items),
+            total_price=sum((item.line_total for item in items), Decimal("0")),
+        )
+        for item in items:
+            # The id rather than the instance: the order may be on another database
+            item.order_id = order.pk
+            item.order_created_at = order.created_at
+        for alias in groups:
+            lines = [item for item in items if products[item.product_id]["database"] == alias]
+            OrderItem.objects.using(alias).bulk_create(lines)
+            # Take the stock for every line in one UPDATE; the stock__gte guard
+            # makes a concurrent checkout that got there first fail cleanly
+            needed = Case(*[When(pk=line.product_id, then=Value(line.quantity)) for line in lines])
+            updated = Product.objects.using(alias).filter(
+                pk__in=[line.product_id for line in lines], stock__gte=needed
+            ).update(stock=F("stock") - needed, updated_at=timezone.now())
+            if updated != len(lines):
+                raise serializers.ValidationError({"items": ["Stock changed during checkout, please try again."]})
+            # The stock UPDATE bypasses post_save, so clear cached copies and
+            # log the changes here (once this shard has committed too)
+            product_cache.invalidate(*[line.product_id for line in lines], using=alias)
+            product_changes.record([line.product_id for line in lines], using=alias)
+
+        # bulk_create skips post_save, so publish the live sales events here
+        broker = get_broker()
+        for item in items:
+            event = sale_event(order, user, item)
+            shards.on_commit(
+                lambda seller_id=item.seller_id, event=event: broker.publish(seller_id, event),
+                products[item.product_id]["database"],
+            )
+    # The response lists every item with its product and seller: load them
+    # together (and from the shards, where order.items would only look on 'default')
+    shards.prefetch_order_items([order])
+    return order
+
+
+def checkout_cart(cart):
+    """Convert a cart into an order and empty it"""
+    quantities = dict(cart.items.values_list("product_id", "quantity"))
+    if not quantities:
+        raise serializers.ValidationError({"items": ["Your cart is empty."]})
+    with transaction.atomic():
+        order = place_order(cart.user, quantities)
+        cart.items.all().delete()
+    return order
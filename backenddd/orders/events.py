@@ -0,0 +1,189 @@
+# This file implements the publish/subscribe channel for live seller sales events
+import asyncio
+import json
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.core import signing
+from django.utils.module_loading import import_string
+
+# Salt for stream tickets, so no other signed value can be used as one
+TICKET_SALT = 'orders.sales-stream'
+
+
+class BaseBroker:
+    """
+    Interface for a sales event broker.
+
+    publish() is called from synchronous code (signal handlers) and
+    subscribe() returns a Subscription that an async view reads from.
+    Swap the implementation with the SALES_EVENT_BROKER setting.
+    """
+
+    def publish(self, seller_id, event):
+        raise NotImplementedError
+
+    def subscribe(self, seller_id):
+        raise NotImplementedError
+
+
+class Subscription:
+    """One listener's bounded queue, bound to the event loop that reads it"""
+
+    def __init__(self, broker, seller_id, max_pending):
+        self.broker = broker
+        self.seller_id = seller_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_pending)
+
+    def deliver(self, event):
+        # Runs on the subscriber's loop; a slow client loses its oldest event
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        """Wait for the next event, or return None after `timeout` seconds"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker(BaseBroker):
+    """
+    Broker that fans events out to subscribers in the same process.
+
+    This is enough for a single ASGI worker. Deployments with several
+    workers should point SALES_EVENT_BROKER at a broker backed by a shared
+    service with the same publish/subscribe interface.
+    """
+
+    def __init__(self, max_pending=100):
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def publish(self, seller_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(seller_id, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # The subscriber's loop has shut down
+                self.unsubscribe(subscription)
+
+    def subscribe(self, seller_id):
+        subscription = Subscription(self, seller_id, self.max_pending)
+        with self._lock:
+            self._subscribers.setdefault(seller_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            listeners = self._subscribers.get(subscription.seller_id)
+            if listeners is not None:
+                listeners.discard(subscription)
+                if not listeners:
+                    del self._subscribers[subscription.seller_id]
+
+    def subscriber_count(self, seller_id):
+        with self._lock:
+            return len(self._subscribers.get(seller_id, ()))
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Return the process-wide broker configured by SALES_EVENT_BROKER"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                broker_class = import_string(
+                    getattr(settings, 'SALES_EVENT_BROKER', 'orders.events.InProcessBroker')
+                )
+                _broker = broker_class()
+    return _broker
+
+
+def sale_event(order, customer, item):
+    """Build the event payload for one sold OrderItem (same shape as sales-orders)"""
+    return {
+        'order_id': order.id,
+        'customer': customer.username,
+        'created_at': order.created_at.isoformat(),
+        'item': {
+            'id': item.id,
+            'product_id': item.product_id,
+            'product_title': item.product_title,
+            'quantity': item.quantity,
+            'price': float(item.paid_unit_price()),
+            'total': float(item.line_total),
+        },
+    }
+
+
+def format_event(event):
+    """
+    One sale as a server-sent event. The id is the order time, so a client
+    that reconnects with Last-Event-ID gets the sales it missed (missed_sales).
+    """
+    return f"id: {event['created_at']}\nevent: sale\ndata: {json.dumps(event)}\n\n"
+
+
+def missed_sales(seller_id, since):
+    """
+    Sale events of a seller's items ordered at or after `since`, oldest first.
+
+    SALES_STREAM_REPLAY_OVERLAP seconds before `since` are sent again, for
+    checkouts that committed after a later one; the client skips item ids
+    it already has. Returns None when there are more than
+    SALES_STREAM_REPLAY_LIMIT: the client should reload the page instead.
+    """
+    from products import shards
+    from .models import Order, OrderItem
+
+    overlap = timedelta(seconds=getattr(settings, 'SALES_STREAM_REPLAY_OVERLAP', 5))
+    limit = getattr(settings, 'SALES_STREAM_REPLAY_LIMIT', 500)
+    items = list(
+        OrderItem.objects.using(shards.shard_for_seller(seller_id))
+        .filter(seller_id=seller_id, order_created_at__gte=since - overlap)
+        .order_by('order_created_at', 'id')[:limit + 1]
+    )
+    if len(items) > limit:
+        return None
+    # Orders are on 'default', the items may be on a seller shard
+    orders = Order.objects.select_related('user').in_bulk({item.order_id for item in items})
+    return [
+        sale_event(orders[item.order_id], orders[item.order_id].user, item)
+        for item in items
+        if item.order_id in orders
+    ]
+
+
+def stream_ticket(user):
+    """
+    A short-lived signed ticket for opening the sales stream.
+
+    EventSource cannot send an Authorization header, so the stream URL
+    carries this ticket instead of the JWT: it only opens the stream and
+    expires after SALES_STREAM_TICKET_SECONDS, so one found in an access log
+    is no use for long.
+    """
+    return signing.TimestampSigner(salt=TICKET_SALT).sign(str(user.pk))
+
+
+def ticket_user_id(ticket):
+    """The user id in a valid, unexpired stream ticket, or None"""
+    max_age = getattr(settings, 'SALES_STREAM_TICKET_SECONDS', 30)
+    try:
+        return int(signing.TimestampSigner(salt=TICKET_SALT).unsign(ticket, max_age=max_age))
+    except (signing.BadSignature, ValueError):
+        return None
@@ -0,0 +1,187 @@
+# This file makes order-creating endpoints safe to retry. A client sends an
+# Idempotency-Key header; the first request with a key claims a row in the
+# IdempotencyKey table and stores its response there. Retries replay that
+# response, and a duplicate arriving while the first is still running waits
+# for it instead of creating a second order. The response is stored in the
+# same transaction that creates the order, so an order never exists without
+# its stored response, and an unfinished key never has an order behind it.
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from products import shards
+from .models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def fingerprint(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def request_fingerprint(request):
+    """Hash of the parsed request body (key order doesn't matter)"""
+    return fingerprint(json.dumps(request.data, sort_keys=True, cls=JSONEncoder))
+
+
+def claim(user, scope, key, request_hash):
+    """
+    Insert the in-progress row for this key. Returns the new row, or None if
+    the key already exists. The insert commits straight away so concurrent
+    duplicates see it.
+    """
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=user,
+                scope=scope,
+                key=key,
+                request_fingerprint=request_hash,
+                expires_at=timezone.now() + timedelta(seconds=_setting("IDEMPOTENCY_KEY_TTL", 86400)),
+            )
+    except IntegrityError:
+        return None
+
+
+def replay(record):
+    """The stored response, marked so clients can tell it is a replay"""
+    response = Response(json.loads(record.response_body), status=record.response_status)
+    response["Idempotent-Replayed"] = "true"
+    response["ETag"] = f'"{record.response_fingerprint}"'
+    return response
+
+
+def idempotent(request, scope, handler):
+    """
+    Run handler() (which returns a Response) at most once per Idempotency-Key.
+
+    Without the header the handler just runs. A successful (2xx) response is
+    stored for IDEMPOTENCY_KEY_TTL seconds. If the handler fails the claim is
+    released, so a retry runs it again. Reusing a key for a different body
+    gives 422. A duplicate that is still waiting after
+    IDEMPOTENCY_WAIT_SECONDS gives 409 with Retry-After.
+    """
+    key = request.headers.get(HEADER)
+    if key is None:
+        return handler()
+    key = key.strip()
+    if not key or len(key) > 255:
+        return Response(
+            {"detail": f"{HEADER} must be 1 to 255 characters."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    request_hash = request_fingerprint(request)
+    deadline = time.monotonic() + _setting("IDEMPOTENCY_WAIT_SECONDS", 10)
+    delay = 0.05
+    while True:
+        record = claim(request.user, scope, key, request_hash)
+        if record is not None:
+            response = run_and_store(record, handler)
+            if response is not None:
+                return response
+            # Taken over while running (our order was rolled back): look again
+            continue
+
+        record = IdempotencyKey.objects.filter(user=request.user, scope=scope, key=key).first()
+        if record is None:
+            # The first request failed and released the key: try to claim it again
+            continue
+        if record.expires_at <= timezone.now() or is_abandoned(record):
+            # Expired, or its request died without finishing: take the key over
+            IdempotencyKey.objects.filter(pk=record.pk, completed_at=record.completed_at).delete()
+            continue
+        if record.request_fingerprint != request_hash:
+            return Response(
+                {"detail": f"This {HEADER} was already used for a different request."},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        if record.completed_at is not None:
+            return replay(record)
+
+        # The first request is still running: wait for its response
+        if time.monotonic() >= deadline:
+            response = Response(
+                {"detail": "A request with this Idempotency-Key is still in progress."},
+                status=status.HTTP_409_CONFLICT,
+            )
+            response["Retry-After"] = "1"
+            return response
+        time.sleep(delay)
+        delay = min(delay * 2, 0.5)
+
+
+def is_abandoned(record):
+    """
+    An unfinished claim older than IDEMPOTENCY_LOCK_SECONDS (its process
+    died). Taking it over is safe: the order and the stored response commit
+    together, so an unfinished claim has no order, and if its request is
+    still running it finds the claim gone and rolls its order back.
+    """
+    if record.completed_at is not None:
+        return False
+    age = timezone.now() - record.created_at
+    return age > timedelta(seconds=_setting("IDEMPOTENCY_LOCK_SECONDS", 60))
+
+
+class ClaimLost(Exception):
+    """The claim was taken over while the handler ran"""
+
+
+def run_and_store(record, handler):
+    """
+    Run handler() and store a 2xx response in the same transaction as what
+    it writes (on 'default' and every shard, 'default' committing first).
+    Returns None if the claim was taken over meanwhile: everything the
+    handler did is rolled back then.
+    """
+    try:
+        with shards.atomic(*shards.databases()):
+            response = handler()
+            if 200 <= response.status_code < 300:
+                body = json.dumps(response.data, cls=JSONEncoder)
+                stored = IdempotencyKey.objects.filter(pk=record.pk, completed_at=None).update(
+                    response_status=response.status_code,
+                    response_body=body,
+                    response_fingerprint=fingerprint(body),
+                    completed_at=timezone.now(),
+                )
+                if not stored:
+                    raise ClaimLost()
+    except ClaimLost:
+        return None
+    except BaseException:
+        # The transaction rolled back, so nothing was created: free the key
+        IdempotencyKey.objects.filter(pk=record.pk, completed_at=None).delete()
+        raise
+    if not 200 <= response.status_code < 300:
+        IdempotencyKey.objects.filter(pk=record.pk, completed_at=None).delete()
+    return response
+
+
+def purge_expired(chunk_size=1000, log=None):
+    """Delete expired keys in chunks of `chunk_size` rows; returns how many were deleted"""
+    deleted = 0
+    now = timezone.now()
+    while True:
+        ids = list(
+            IdempotencyKey.objects.filter(expires_at__lt=now)
+            .order_by("expires_at")
+            .values_list("id", flat=True)[:chunk_size]
+        )
+        if not ids:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
+        if log:
+            log(f"Deleted {deleted} expired idempotency keys so far")
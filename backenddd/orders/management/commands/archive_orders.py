@@ -0,0 +1,62 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from orders.archive import archive_orders, parse_moment
+from orders.models import Order
+
+
+class Command(BaseCommand):
+    help = "Move orders older than a cutoff into the archive tables, in chunks"
+
+    def add_arguments(self, parser):
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument(
+            "--older-than-days",
+            type=int,
+            help="Archive orders created more than this many days ago",
+        )
+        group.add_argument(
+            "--before",
+            help="Archive orders created before this ISO date or datetime",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Orders moved per transaction (default: 1000)",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report how many orders would be moved",
+        )
+
+    def handle(self, *args, **options):
+        if options["older_than_days"] is not None:
+            if options["older_than_days"] < 1:
+                raise CommandError("--older-than-days must be at least 1")
+            cutoff = timezone.now() - timedelta(days=options["older_than_days"])
+        else:
+            try:
+                cutoff = parse_moment(options["before"], "before")
+            except ValidationError:
+                raise CommandError("--before must be an ISO date (2024-01-31) or datetime")
+
+        if options["dry_run"]:
+            count = Order.objects.filter(created_at__lt=cutoff).count()
+            self.stdout.write(f"{count} orders created before {cutoff.isoformat()} would be archived")
+            return
+
+        run = archive_orders(
+            cutoff,
+            chunk_size=max(1, options["chunk_size"]),
+            log=self.stdout.write,
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Archived {run.orders_archived} orders ({run.items_archived} items) "
+                f"created before {cutoff.isoformat()}"
+            )
+        )
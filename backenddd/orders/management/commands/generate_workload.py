@@ -0,0 +1,466 @@
+import bisect
+import json
+import multiprocessing
+import random
+from urllib.parse import urlencode
+from datetime import datetime, time, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.utils import timezone
+from orders.models import Order, OrderItem, line_total
+from products import changes, shards
+from products.models import Product
+from products.storefront import invalidate_storefront
+from users.models import Profile
+
+CENT = Decimal("0.01")
+PASSWORD = "workload-password"
+
+ADJECTIVES = [
+    "Classic", "Compact", "Deluxe", "Eco", "Ergonomic", "Foldable", "Heavy-duty", "Lightweight",
+    "Modern", "Portable", "Premium", "Rustic", "Smart", "Vintage", "Waterproof", "Wireless",
+]
+NOUNS = {
+    "electronics": ["Headphones", "Speaker", "Charger", "Keyboard", "Mouse", "Webcam", "Monitor"],
+    "home": ["Lamp", "Kettle", "Blender", "Pillow", "Rug", "Vase", "Clock"],
+    "office": ["Desk", "Chair", "Notebook", "Stapler", "Organizer", "Whiteboard"],
+    "outdoors": ["Tent", "Backpack", "Flashlight", "Bottle", "Hammock", "Cooler"],
+    "fashion": ["Jacket", "Sneakers", "Scarf", "Watch", "Sunglasses", "Belt"],
+    "toys": ["Puzzle", "Robot", "Kite", "Blocks", "Drone", "Plush"],
+}
+CATEGORIES = list(NOUNS)
+# Larger categories are picked more often
+CATEGORY_WEIGHTS = [30, 25, 15, 12, 10, 8]
+PLAN_OPTIONS = ["seed", "products", "days", "zipf", "catalog_skew", "customer_skew", "batch_size"]
+BRANDS = ["Acme", "Globex", "Initech", "Umbrella", "Soylent", "Hooli", "Vandelay", "Stark"]
+
+
+def rng_for(seed, *parts):
+    """A random generator that only depends on the seed and the parts, not on which process uses it"""
+    return random.Random(":".join(str(part) for part in (seed, *parts)))
+
+
+def zipf_cum_weights(count, exponent):
+    """Cumulative weights 1/(rank+1)^exponent for ranks 0..count-1"""
+    total = 0.0
+    cum_weights = []
+    for rank in range(count):
+        total += 1.0 / (rank + 1) ** exponent
+        cum_weights.append(total)
+    return cum_weights
+
+
+def zipf_pick(rng, cum_weights):
+    """A rank drawn from zipf_cum_weights()"""
+    return min(bisect.bisect(cum_weights, rng.random() * cum_weights[-1]), len(cum_weights) - 1)
+
+
+def apportion(total, weights):
+    """Split `total` into integer shares proportional to `weights` (largest remainder, at least 1 each)"""
+    scale = total / sum(weights)
+    shares = [max(1, int(weight * scale)) for weight in weights]
+    remainders = sorted(range(len(weights)), key=lambda i: (int(weights[i] * scale) - weights[i] * scale, i))
+    position = 0
+    while sum(shares) < total:
+        shares[remainders[position % len(weights)]] += 1
+        position += 1
+    while sum(shares) > total:
+        largest = max(range(len(shares)), key=lambda i: shares[i])
+        shares[largest] -= 1
+    return shares
+
+
+class Plan:
+    """
+    Everything the worker processes need to agree on, derived from the seed:
+    which seller owns which product number, and the popularity order of
+    products and customers.
+    """
+
+    def __init__(self, options, seller_ids, customer_ids, anchor):
+        self.seed = options["seed"]
+        # Only what the workers use (the command's own options don't pickle)
+        self.options = {name: options[name] for name in PLAN_OPTIONS}
+        self.seller_ids = seller_ids
+        self.customer_ids = customer_ids
+        self.anchor = anchor
+        products = options["products"]
+        # Seller i has a catalog proportional to 1/(i+1)^catalog_skew
+        sizes = apportion(products, [1.0 / (i + 1) ** options["catalog_skew"] for i in range(len(seller_ids))])
+        self.seller_starts = []
+        start = 0
+        for size in sizes:
+            self.seller_starts.append(start)
+            start += size
+        # Product popularity: a shuffled order of product numbers, Zipf over rank
+        self.popular = list(range(products))
+        rng_for(self.seed, "popularity").shuffle(self.popular)
+        self.product_weights = zipf_cum_weights(products, options["zipf"])
+        # Some customers order far more often than others
+        self.active = list(range(len(customer_ids)))
+        rng_for(self.seed, "activity").shuffle(self.active)
+        self.customer_weights = zipf_cum_weights(len(customer_ids), options["customer_skew"])
+        # Sellers with bigger catalogs also look at their dashboard more
+        self.seller_sizes = sizes
+
+    def seller_for(self, number):
+        return self.seller_ids[bisect.bisect(self.seller_starts, number) - 1]
+
+    def popular_product(self, rng):
+        return self.popular[zipf_pick(rng, self.product_weights)]
+
+    def active_customer(self, rng):
+        return self.customer_ids[self.active[zipf_pick(rng, self.customer_weights)]]
+
+    def chunks(self, total):
+        size = self.options["batch_size"]
+        return [(start, min(start + size, total)) for start in range(0, total, size)]
+
+
+def product_title(rng, number):
+    category = rng.choices(CATEGORIES, weights=CATEGORY_WEIGHTS)[0]
+    # The number keeps titles unique and tells workers which product is which
+    return category, f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS[category])} #{number:07d}"
+
+
+def product_number(title):
+    return int(title.rsplit("#", 1)[1])
+
+
+def make_products(plan, start, end):
+    """Insert products start..end-1 (one bulk insert per seller shard)"""
+    products = []
+    for number in range(start, end):
+        # One generator per row: the data doesn't depend on --batch-size or --workers
+        rng = rng_for(plan.seed, "product", number)
+        category, title = product_title(rng, number)
+        # Log-normal prices: many cheap products, a few expensive ones
+        price = Decimal(min(2000.0, rng.lognormvariate(3.3, 0.9))).quantize(CENT, rounding=ROUND_HALF_UP)
+        products.append(Product(
+            seller_id=plan.seller_for(number),
+            title=title,
+            description=f"{title[:title.rindex(' #')]} from the synthetic workload.",
+            price=max(price, Decimal("1.00")),
+            stock=rng.choice([0, 3, 10, 25, 50, 100, 250]),
+            category=category,
+            brand=rng.choice(BRANDS),
+            tags=",".join(rng.sample(["new", "sale", "gift", "eco", "bestseller"], rng.randint(0, 2))),
+            discount=rng.choice([Decimal("0")] * 6 + [Decimal("5"), Decimal("10"), Decimal("20"), Decimal("30")]),
+            image_url=f"https://picsum.photos/seed/workload-{number}/600/600",
+        ))
+    with shards.atomic(*shards.databases()):
+        Product.objects.bulk_create(products)
+        # bulk_create skips post_save, so add the inserts to the change log here
+        changes.record(product.pk for product in products)
+    return len(products)
+
+
+# Products loaded by this process, read once per run (cleared when a run starts)
+_loaded_products = {}
+
+
+def load_products(plan):
+    """{product number: (id, seller id, title, price, discount)} for the workload's products"""
+    key = (plan.seed, tuple(plan.seller_ids))
+    if key not in _loaded_products:
+        rows = shards.catalog(Product.objects.filter(seller_id__in=plan.seller_ids)).values_list(
+            "id", "seller_id", "title", "price", "discount"
+        )
+        _loaded_products.clear()
+        _loaded_products[key] = {product_number(row[2]): row for row in rows.iterator()}
+    return _loaded_products[key]
+
+
+def make_orders(plan, start, end):
+    """Insert orders start..end-1 with their items, dated over the last --days days"""
+    products = load_products(plan)
+    orders = []
+    dates = []
+    baskets = []
+    for number in range(start, end):
+        rng = rng_for(plan.seed, "order", number)
+        dates.append(plan.anchor - timedelta(seconds=rng.random() * plan.options["days"] * 86400))
+        # Mostly one or two products, sometimes a big basket
+        count = 1
+        while count < 8 and rng.random() < 0.45:
+            count += 1
+        basket = {}
+        for _ in range(count):
+            basket[plan.popular_product(rng)] = rng.choices([1, 2, 3], weights=[80, 15, 5])[0]
+        basket = [(products[number], quantity) for number, quantity in basket.items()]
+        orders.append(Order(
+            user_id=plan.active_customer(rng),
+            total_items=sum(quantity for _, quantity in basket),
+            total_price=sum((line_total(row[3], row[4], quantity) for row, quantity in basket), Decimal("0")),
+        ))
+        baskets.append(basket)
+
+    items = []
+    with shards.atomic(*shards.databases()):
+        Order.objects.bulk_create(orders)
+        # created_at is auto_now_add, so the insert stamped "now": put the dates back
+        for order, created_at in zip(orders, dates):
+            order.created_at = created_at
+        Order.objects.bulk_update(orders, ["created_at"])
+        for order, basket in zip(orders, baskets):
+            for (product_id, seller_id, title, price, discount), quantity in basket:
+                items.append(OrderItem(
+                    order_id=order.pk,
+                    order_created_at=order.created_at,
+                    product_id=product_id,
+                    seller_id=seller_id,
+                    product_title=title,
+                    unit_price=price,
+                    discount=discount,
+                    quantity=quantity,
+                    line_total=line_total(price, discount, quantity),
+                ))
+        OrderItem.objects.bulk_create(items)
+    return len(orders), len(items)
+
+
+def run_chunk(job):
+    """Worker entry point: ("products" or "orders", plan, start, end)"""
+    kind, plan, start, end = job
+    try:
+        if kind == "products":
+            return kind, make_products(plan, start, end), 0
+        return (kind, *make_orders(plan, start, end))
+    finally:
+        connections.close_all()
+
+
+# Request trace -----------------------------------------------------------------
+
+def build_trace(plan, products, usernames, count, rate):
+    """
+    `count` requests arriving at `rate` per second on average (Poisson), as
+    dicts for replay_workload. Product pages follow the same Zipf popularity
+    as the orders, and busy customers and big sellers send more requests.
+    """
+    rng = rng_for(plan.seed, "trace")
+    by_rank = [products[number] for number in plan.popular if number in products]
+    popular_titles = [row[2] for row in by_rank[:200]]
+    seller_weights = list(plan.seller_sizes)
+    at = 0.0
+    trace = []
+
+    def product_id():
+        return products[plan.popular_product(rng)][0]
+
+    def visitor():
+        # Anonymous visitors get their own client address (throttling is per address)
+        number = zipf_pick(rng, plan.customer_weights)
+        return f"10.{number >> 16 & 255}.{number >> 8 & 255}.{number & 255}"
+
+    def add(name, method, path, user=None, body=None, headers=None):
+        entry = {"at": round(at, 4), "name": name, "method": method, "path": path}
+        if user is not None:
+            entry["user"] = usernames[user]
+        else:
+            entry["client"] = visitor()
+        if body is not None:
+            entry["json"] = body
+        if headers:
+            entry["headers"] = headers
+        trace.append(entry)
+
+    while len(trace) < count:
+        at += rng.expovariate(rate)
+        kind = rng.choices(
+            ["list", "detail", "related", "storefront", "suggest", "batch",
+             "checkout", "history", "summary", "sales", "seller"],
+            weights=[22, 25, 5, 8, 7, 5, 6, 8, 3, 7, 4],
+        )[0]
+        if kind == "list":
+            ordering = rng.choice(["", "", "price", "-price", "-rating", "-created_at"])
+            query = {"page_size": 24}
+            if ordering:
+                query["ordering"] = ordering
+            if rng.random() < 0.3:
+                query["search"] = rng.choices(CATEGORIES, weights=CATEGORY_WEIGHTS)[0]
+            add("products.list", "GET", f"/api/products/?{urlencode(query)}")
+        elif kind == "detail":
+            add("products.detail", "GET", f"/api/products/{product_id()}/")
+        elif kind == "related":
+            add("products.related", "GET", f"/api/products/{product_id()}/related/")
+        elif kind == "storefront":
+            add("products.storefront", "GET", "/api/products/storefront/")
+        elif kind == "suggest":
+            title = rng.choice(popular_titles)
+            query = urlencode({"q": title[:rng.randint(2, 6)].strip()})
+            add("products.suggest", "GET", f"/api/products/suggest/?{query}")
+        elif kind == "batch":
+            ids = ",".join(str(product_id()) for _ in range(rng.randint(2, 12)))
+            add("products.batch", "GET", f"/api/products/?ids={ids}")
+        elif kind == "checkout":
+            customer = plan.active_customer(rng)
+            lines = {product_id(): rng.choices([1, 2], weights=[85, 15])[0] for _ in range(rng.randint(1, 3))}
+            items = [{"product": product, "quantity": quantity} for product, quantity in lines.items()]
+            add("cart.update", "PUT", "/api/orders/cart/", customer, {"items": items})
+            at += rng.uniform(1, 20)
+            add(
+                "cart.checkout", "POST", "/api/orders/cart/checkout/", customer,
+                headers={"Idempotency-Key": f"workload-{plan.seed}-{len(trace)}"},
+            )
+        elif kind == "history":
+            add("orders.list", "GET", "/api/orders/?limit=20", plan.active_customer(rng))
+        elif kind == "summary":
+            add("orders.summary", "GET", "/api/orders/summary/", plan.active_customer(rng))
+        else:
+            seller = rng.choices(plan.seller_ids, weights=seller_weights)[0]
+            if kind == "sales":
+                path = rng.choice(["/api/products/seller/sales-summary/", "/api/products/seller/sales-orders/"])
+                add("seller.sales", "GET", path, seller)
+            else:
+                add("seller.products", "GET", "/api/products/seller/", seller)
+    return trace[:count]
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate sellers, customers, products and orders with skewed, Zipf-like "
+        "distributions (deterministic by --seed) plus a request trace for replay_workload"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=42, help="Random seed (default: 42)")
+        parser.add_argument("--prefix", default="wl", help="Username prefix of the generated users (default: wl)")
+        parser.add_argument("--sellers", type=int, default=50, help="Sellers (default: 50)")
+        parser.add_argument("--customers", type=int, default=1000, help="Customers (default: 1000)")
+        parser.add_argument("--products", type=int, default=10000, help="Products (default: 10000)")
+        parser.add_argument("--orders", type=int, default=20000, help="Orders (default: 20000)")
+        parser.add_argument("--days", type=int, default=365, help="Orders are spread over this many days (default: 365)")
+        parser.add_argument(
+            "--zipf", type=float, default=1.1,
+            help="Zipf exponent of product popularity (default: 1.1)",
+        )
+        parser.add_argument(
+            "--catalog-skew", type=float, default=1.0,
+            help="Zipf exponent of catalog size per seller (default: 1.0)",
+        )
+        parser.add_argument(
+            "--customer-skew", type=float, default=0.8,
+            help="Zipf exponent of orders per customer (default: 0.8)",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows per bulk insert (default: 1000)")
+        parser.add_argument(
+            "--workers", type=int, default=1,
+            help="Processes inserting products and orders (default: 1; SQLite allows one writer at a time)",
+        )
+        parser.add_argument("--trace", help="Write a replayable request trace (JSON lines) to this file")
+        parser.add_argument("--trace-requests", type=int, default=10000, help="Requests in the trace (default: 10000)")
+        parser.add_argument("--trace-rate", type=float, default=50, help="Average requests per second (default: 50)")
+        parser.add_argument(
+            "--clear", action="store_true",
+            help="Delete the users with --prefix (and everything they own) first",
+        )
+
+    def handle(self, *args, **options):
+        for name in ("sellers", "customers", "products", "batch_size", "workers"):
+            if options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be at least 1")
+        prefix = options["prefix"]
+        existing = User.objects.filter(username__startswith=f"{prefix}-")
+        if options["clear"]:
+            deleted = existing.count()
+            self.clear(existing)
+            self.stdout.write(f"Deleted {deleted} users named {prefix}-*")
+        elif existing.exists():
+            raise CommandError(f"Users named {prefix}-* already exist; use --clear or another --prefix")
+
+        # Products loaded by an earlier run in this process may be gone (--clear
+        # reuses their ids), and the worker processes are forked after this
+        _loaded_products.clear()
+        # Orders are dated back from midnight, so a seed gives the same data all day
+        anchor = timezone.make_aware(datetime.combine(timezone.localdate(), time.min))
+        seller_ids, customer_ids = self.create_users(options)
+        plan = Plan(options, seller_ids, customer_ids, anchor)
+
+        self.run_jobs(plan, "products", options["products"], options["workers"])
+        invalidate_storefront()
+        if options["orders"] > 0:
+            self.run_jobs(plan, "orders", options["orders"], options["workers"])
+
+        if options["trace"]:
+            usernames = dict(User.objects.filter(pk__in=seller_ids + customer_ids).values_list("id", "username"))
+            trace = build_trace(plan, load_products(plan), usernames, options["trace_requests"], options["trace_rate"])
+            with open(options["trace"], "w") as handle:
+                header = {
+                    "workload": {
+                        "seed": options["seed"],
+                        "prefix": prefix,
+                        "password": PASSWORD,
+                        "requests": len(trace),
+                        "seconds": trace[-1]["at"] if trace else 0,
+                    }
+                }
+                handle.write(json.dumps(header) + "\n")
+                for entry in trace:
+                    handle.write(json.dumps(entry) + "\n")
+            self.stdout.write(f"Wrote {len(trace)} requests to {options['trace']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {len(seller_ids)} sellers, {len(customer_ids)} customers, "
+            f"{options['products']} products and {options['orders']} orders (seed {options['seed']})"
+        ))
+
+    def clear(self, users):
+        user_ids = list(users.values_list("id", flat=True))
+        # Rows on the seller shards aren't reached by the cascade from 'default'.
+        # The user delete signal would remove them one user at a time; this is a
+        # few bulk deletes
+        for alias in shards.aliases():
+            OrderItem.objects.using(alias).filter(seller_id__in=user_ids).delete()
+            # (the delete signals clean up 'default' and log the deletes)
+            Product.objects.using(alias).filter(seller_id__in=user_ids).delete()
+        users.delete()
+        invalidate_storefront()
+
+    def create_users(self, options):
+        """Sellers and customers with one shared password hash (logins still verify it)"""
+        prefix = options["prefix"]
+        encoded = make_password(PASSWORD)
+        sellers = [
+            User(username=f"{prefix}-seller-{number:04d}", email=f"{prefix}-seller-{number}@example.com", password=encoded)
+            for number in range(options["sellers"])
+        ]
+        customers = [
+            User(username=f"{prefix}-customer-{number:06d}", password=encoded)
+            for number in range(options["customers"])
+        ]
+        with transaction.atomic():
+            User.objects.bulk_create(sellers + customers, batch_size=options["batch_size"])
+            users = dict(
+                User.objects.filter(username__startswith=f"{prefix}-").values_list("username", "id")
+            )
+            Profile.objects.bulk_create(
+                [Profile(user_id=users[user.username], user_type="seller") for user in sellers]
+                + [Profile(user_id=users[user.username], user_type="customer") for user in customers],
+                batch_size=options["batch_size"],
+            )
+        return [users[user.username] for user in sellers], [users[user.username] for user in customers]
+
+    def run_jobs(self, plan, kind, total, workers):
+        """Run the chunks of one phase, in this process or on a pool of `workers` processes"""
+        jobs = [(kind, plan, start, end) for start, end in plan.chunks(total)]
+        done = rows = 0
+        if workers == 1:
+            results = map(run_chunk, jobs)
+        else:
+            # Each process opens its own connections
+            connections.close_all()
+            pool = multiprocessing.Pool(workers)
+            results = pool.imap_unordered(run_chunk, jobs)
+        try:
+            for _, count, extra in results:
+                done += count
+                rows += extra
+                self.stdout.write(f"Inserted {done} {kind}" + (f" ({rows} items)" if kind == "orders" else "") + " so far")
+        finally:
+            if workers > 1:
+                pool.close()
+                pool.join()
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from orders.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Delete expired Idempotency-Key records in small chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Rows deleted per statement (default: 1000)",
+        )
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+        deleted = purge_expired(options["chunk_size"], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired idempotency keys"))
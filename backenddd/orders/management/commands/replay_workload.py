@@ -0,0 +1,181 @@
+import http.client
+import json
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+from backenddd import loopback
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def read_trace(path):
+    """(header, entries) of a trace written by generate_workload --trace"""
+    try:
+        with open(path) as handle:
+            lines = [json.loads(line) for line in handle if line.strip()]
+    except (OSError, ValueError) as error:
+        raise CommandError(f"Can't read the trace {path}: {error}")
+    if not lines or "workload" not in lines[0]:
+        raise CommandError(f"{path} is not a generate_workload trace")
+    return lines[0]["workload"], lines[1:]
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a generate_workload trace against a running server, keeping its "
+        "arrival times, and report latency percentiles per endpoint. Against a local "
+        "server anonymous visitors connect from their own 127.x.y.z address"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("trace", help="Trace file written by generate_workload --trace")
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="Server to send the requests to")
+        parser.add_argument(
+            "--speed", type=float, default=1.0,
+            help="Replay speed: 2 sends the trace twice as fast, 0 as fast as possible (default: 1)",
+        )
+        parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight at most (default: 16)")
+        parser.add_argument("--limit", type=int, default=None, help="Only replay the first N requests")
+        parser.add_argument("--timeout", type=float, default=30, help="Seconds before a request fails (default: 30)")
+
+    def handle(self, *args, **options):
+        header, entries = read_trace(options["trace"])
+        if options["limit"] is not None:
+            entries = entries[:options["limit"]]
+        if options["concurrency"] < 1:
+            raise CommandError("--concurrency must be at least 1")
+        tokens = self.access_tokens({entry["user"] for entry in entries if "user" in entry})
+        self.stdout.write(
+            f"Replaying {len(entries)} requests (seed {header.get('seed')}) against {options['url']} "
+            f"at {options['speed']}x with {options['concurrency']} clients"
+        )
+        results, seconds = self.replay(entries, tokens, options)
+        self.report(results, seconds)
+
+    def access_tokens(self, usernames):
+        """
+        An access token per user, minted here instead of through the login
+        endpoint: its throttle and password hashing would dominate the replay.
+        """
+        users = User.objects.filter(username__in=usernames)
+        tokens = {user.username: str(RefreshToken.for_user(user).access_token) for user in users}
+        missing = usernames - set(tokens)
+        if missing:
+            raise CommandError(
+                f"{len(missing)} users of the trace don't exist (e.g. {sorted(missing)[0]}); "
+                "run generate_workload with the same options first"
+            )
+        return tokens
+
+    def replay(self, entries, tokens, options):
+        base_url = options["url"].rstrip("/")
+        speed = options["speed"]
+        # One queue per client thread. A user's requests always go to the same
+        # client, so a checkout never overtakes the cart update before it.
+        queues = [queue.Queue(maxsize=4) for _ in range(options["concurrency"])]
+        results = {}
+        lock = threading.Lock()
+        # Anonymous throttling is per connection address: visitors get their own
+        # loopback address when the server is local, else they share this machine's
+        separate = loopback.simulated_clients(base_url)
+        if not separate:
+            self.stderr.write("Anonymous visitors share this machine's address (and its rate limit)")
+        default_opener = loopback.opener_for(None)
+        openers = {}
+
+        def opener_for(client):
+            if not separate:
+                return default_opener
+            if client not in openers:
+                number = int.from_bytes(bytes(int(part) for part in client.split(".")[1:]), "big")
+                openers[client] = loopback.opener_for(loopback.client_address(number))
+            return openers[client]
+
+        def send(entry):
+            body = json.dumps(entry["json"]).encode() if "json" in entry else None
+            request = urllib.request.Request(base_url + entry["path"], data=body, method=entry["method"])
+            request.add_header("Accept", "application/json")
+            if body is not None:
+                request.add_header("Content-Type", "application/json")
+            if "user" in entry:
+                request.add_header("Authorization", f"Bearer {tokens[entry['user']]}")
+                opener = default_opener
+            else:
+                opener = opener_for(entry["client"])
+            for name, value in entry.get("headers", {}).items():
+                request.add_header(name, value)
+            started = time.perf_counter()
+            try:
+                with opener.open(request, timeout=options["timeout"]) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as error:
+                status = error.code
+            except (urllib.error.URLError, http.client.HTTPException, OSError):
+                status = 0
+            return status, (time.perf_counter() - started) * 1000
+
+        def client(work):
+            while True:
+                entry = work.get()
+                if entry is None:
+                    return
+                status, latency = send(entry)
+                with lock:
+                    result = results.setdefault(entry["name"], {"latencies": [], "errors": 0, "statuses": {}})
+                    result["latencies"].append(latency)
+                    result["statuses"][status] = result["statuses"].get(status, 0) + 1
+                    if status == 0 or status >= 400:
+                        result["errors"] += 1
+
+        threads = [threading.Thread(target=client, args=(work,)) for work in queues]
+        for thread in threads:
+            thread.start()
+        started = time.perf_counter()
+        for number, entry in enumerate(entries):
+            if speed > 0:
+                # Keep the trace's arrival times (requests queue up when the server is slower)
+                delay = entry["at"] / speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            if "user" in entry:
+                work = queues[zlib.crc32(entry["user"].encode()) % len(queues)]
+            else:
+                work = queues[number % len(queues)]
+            work.put(entry)
+        for work in queues:
+            work.put(None)
+        for thread in threads:
+            thread.join()
+        return results, time.perf_counter() - started
+
+    def report(self, results, seconds):
+        total = sum(len(result["latencies"]) for result in results.values())
+        self.stdout.write(f"{'endpoint':<20} {'count':>7} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for name in sorted(results):
+            latencies = results[name]["latencies"]
+            self.stdout.write(
+                f"{name:<20} {len(latencies):>7} {results[name]['errors']:>7} "
+                f"{percentile(latencies, 0.5):>8.1f} {percentile(latencies, 0.95):>8.1f} "
+                f"{percentile(latencies, 0.99):>8.1f}"
+            )
+        statuses = {}
+        for result in results.values():
+            for status, count in result["statuses"].items():
+                statuses[status] = statuses.get(status, 0) + count
+        self.stdout.write(
+            f"{total} requests in {seconds:.1f}s ({total / max(seconds, 0.001):.1f}/s); statuses: "
+            + ", ".join(f"{status or 'no response'}: {count}" for status, count in sorted(statuses.items()))
+        )
@@ -0,0 +1,56 @@
+# Generated by Django 6.0.1 on 2026-10-19 15:02
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_cart'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total_items',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='discount',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=5),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='line_total',
+            field=models.DecimalField(decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_title',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='seller',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sold_items', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+        ),
+    ]
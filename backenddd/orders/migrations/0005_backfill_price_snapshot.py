@@ -0,0 +1,78 @@
+# Backfill OrderItem price snapshots and Order totals in chunks.
+# Existing orders get today's product price/discount, which is the best
+# information available for rows written before snapshots existed.
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations
+from django.db.models import Sum
+
+CHUNK_SIZE = 2000
+CENT = Decimal("0.01")
+
+
+def backfill_items(apps, schema_editor):
+    OrderItem = apps.get_model("orders", "OrderItem")
+    # The database being migrated (a seller shard with `migrate --database`)
+    items = OrderItem.objects.using(schema_editor.connection.alias)
+    last_id = 0
+    while True:
+        chunk = list(
+            items.filter(id__gt=last_id, unit_price__isnull=True)
+            .select_related("product")
+            .order_by("id")[:CHUNK_SIZE]
+        )
+        if not chunk:
+            break
+        for item in chunk:
+            product = item.product
+            unit = product.price
+            if product.discount > 0:
+                unit = unit - unit * (product.discount / 100)
+            item.seller_id = product.seller_id
+            item.product_title = product.title
+            item.unit_price = product.price
+            item.discount = product.discount
+            item.line_total = (unit * item.quantity).quantize(CENT, rounding=ROUND_HALF_UP)
+        items.bulk_update(
+            chunk, ["seller", "product_title", "unit_price", "discount", "line_total"]
+        )
+        last_id = chunk[-1].id
+
+
+def backfill_orders(apps, schema_editor):
+    Order = apps.get_model("orders", "Order")
+    OrderItem = apps.get_model("orders", "OrderItem")
+    database = schema_editor.connection.alias
+    orders = Order.objects.using(database)
+    last_id = 0
+    while True:
+        chunk = list(orders.filter(id__gt=last_id).order_by("id")[:CHUNK_SIZE])
+        if not chunk:
+            break
+        totals = {
+            row["order_id"]: row
+            for row in OrderItem.objects.using(database).filter(order__in=chunk)
+            .values("order_id")
+            .annotate(items=Sum("quantity"), price=Sum("line_total"))
+        }
+        for order in chunk:
+            row = totals.get(order.id, {})
+            order.total_items = row.get("items") or 0
+            order.total_price = row.get("price") or Decimal("0")
+        orders.bulk_update(chunk, ["total_items", "total_price"])
+        last_id = chunk[-1].id
+
+
+class Migration(migrations.Migration):
+    # Commit chunk by chunk instead of holding one long transaction
+    atomic = False
+
+    dependencies = [
+        ('orders', '0004_orderitem_price_snapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_items, migrations.RunPython.noop),
+        migrations.RunPython(backfill_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 6.0.1 on 2026-10-19 15:05
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_backfill_price_snapshot'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cutoff', models.DateTimeField()),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('orders_archived', models.PositiveIntegerField(default=0)),
+                ('items_archived', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('total_items', models.PositiveIntegerField(default=0)),
+                ('total_price', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=12)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_orders', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderItem',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('product_id', models.BigIntegerField()),
+                ('order_created_at', models.DateTimeField()),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('product_title', models.CharField(blank=True, default='', max_length=200)),
+                ('product_image_url', models.URLField(blank=True, null=True)),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10, null=True)),
+                ('discount', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=5)),
+                ('line_total', models.DecimalField(decimal_places=2, max_digits=12, null=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='orders.archivedorder')),
+                ('seller', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_sold_items', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['user', '-created_at'], name='archorder_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorderitem',
+            index=models.Index(fields=['seller', '-order_created_at'], name='architem_seller_created_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Copy each order's date onto its items in chunks, so seller reports can
+# sort and filter items without joining the order table.
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+CHUNK_SIZE = 5000
+
+
+def backfill_order_created_at(apps, schema_editor):
+    Order = apps.get_model("orders", "Order")
+    OrderItem = apps.get_model("orders", "OrderItem")
+    database = schema_editor.connection.alias
+    items = OrderItem.objects.using(database)
+    last_id = 0
+    while True:
+        ids = list(
+            items.filter(id__gt=last_id, order_created_at__isnull=True)
+            .order_by("id")
+            .values_list("id", flat=True)[:CHUNK_SIZE]
+        )
+        if not ids:
+            break
+        items.filter(id__in=ids).update(
+            order_created_at=Subquery(
+                Order.objects.using(database).filter(pk=OuterRef("order_id")).values("created_at")[:1]
+            )
+        )
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+    # Commit chunk by chunk instead of holding one long transaction
+    atomic = False
+
+    dependencies = [
+        ('orders', '0008_orderitem_order_created_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_order_created_at, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,24 @@
 # This file defines the database models for orders
 from django.db import models
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
 from django.contrib.auth.models import User
 from products.models import Product
+from products.shards import ShardedQuerySet
+
+CENT = Decimal("0.01")
+
+
+# Price after a percentage discount (same formula as Product.get_discounted_price)
+def discounted_price(price, discount):
+    if discount > 0:
+        price = price - price * (discount / 100)
+    return price.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+# Total for `quantity` units, rounded to cents once at the end
+def line_total(price, discount, quantity):
+    unit = price - price * (discount / 100) if discount > 0 else price
+    return (unit * quantity).quantize(CENT, rounding=ROUND_HALF_UP)
 
 # Model representing a customer order
 class Order(models.Model):
@@ -10,32 +26,192 @@ class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     # Date and time when the order was created (automatically set)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Totals stored at checkout so order history never re-reads products
+    total_items = models.PositiveIntegerField(default=0)
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0"))
+
+    class Meta:
+        # Order history is always read per user, newest first
+        indexes = [
+            models.Index(fields=["user", "-created_at"], name="order_user_created_idx"),
+        ]
 
-    # Calculate the total number of items in this order
-    def total_items(self):
-        total = 0
-        # Loop through all items in this order
-        for item in self.items.all():
-            # Add the quantity of each item to the total
-            total += item.quantity
-        return total
-
-    # Calculate the total price of this order
-    def total_price(self):
-        total = Decimal("0")
-        # Loop through all items in this order
-        for item in self.items.all():
-            # Calculate price for this item (quantity * product price)
-            item_price = item.quantity * item.product.price
-            # Add to total
-            total += item_price
-        return total
+    # Recalculate the stored totals from the order's item snapshots (one query)
+    def recalculate_totals(self):
+        totals = self.items.aggregate(
+            items=models.Sum("quantity"),
+            price=models.Sum("line_total"),
+        )
+        self.total_items = totals["items"] or 0
+        self.total_price = totals["price"] or Decimal("0")
+        self.save(update_fields=["total_items", "total_price"])
 
 # Model representing a single product item within an order
 class OrderItem(models.Model):
-    # Link to the order this item belongs to
-    order = models.ForeignKey(Order, related_name="items", on_delete=models.CASCADE)
+    # Link to the order this item belongs to (items live on their seller's
+    # shard and orders on 'default', so there is no database constraint)
+    order = models.ForeignKey(Order, related_name="items", on_delete=models.CASCADE, db_constraint=False)
     # Link to the product being ordered
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     # How many of this product are in the order (default is 1)
     quantity = models.PositiveIntegerField(default=1)
+    # Snapshots taken at checkout, so later product edits don't change past orders
+    # Seller of the product (lets seller reports skip the product table)
+    seller = models.ForeignKey(User, null=True, on_delete=models.CASCADE, related_name="sold_items", db_constraint=False)
+    # Order date (lets seller reports skip the order table, which may be on another database)
+    order_created_at = models.DateTimeField(null=True, blank=True)
+    # Product title at checkout
+    product_title = models.CharField(max_length=200, blank=True, default="")
+    # Product price before discount at checkout
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+    # Discount percentage at checkout
+    discount = models.DecimalField(max_digits=5, decimal_places=2, default=Decimal("0"))
+    # quantity x discounted unit price
+    line_total = models.DecimalField(max_digits=12, decimal_places=2, null=True)
+    # create() and bulk_create() write to the seller's shard
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Seller sales reports, newest order first
+            models.Index(fields=["seller", "-order_created_at"], name="orderitem_seller_created_idx"),
+        ]
+
+    # Price paid for one unit (after discount), rounded to cents
+    def paid_unit_price(self):
+        return discounted_price(self.unit_price, self.discount)
+
+    # Fill the snapshot from the product when an item is created one by one
+    # (checkout fills it in bulk and skips this)
+    def save(self, *args, **kwargs):
+        if self.unit_price is None:
+            self.seller_id = self.product.seller_id
+            self.product_title = self.product.title
+            self.unit_price = self.product.price
+            self.discount = self.product.discount
+        if self.order_created_at is None:
+            self.order_created_at = self.order.created_at
+        self.line_total = line_total(self.unit_price, self.discount, self.quantity)
+        super().save(*args, **kwargs)
+
+# Model representing a user's server-side shopping cart
+class Cart(models.Model):
+    # Each user has at most one cart
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="cart")
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+# Model representing one product line in a cart
+class CartItem(models.Model):
+    # Link to the cart this line belongs to
+    cart = models.ForeignKey(Cart, related_name="items", on_delete=models.CASCADE)
+    # Link to the product in the cart (may live on a seller shard, so no database constraint)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_constraint=False)
+    # How many of this product are in the cart
+    quantity = models.PositiveIntegerField(default=1)
+    # When the line was first added
+    added_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # A product appears at most once per cart; adding again bumps the quantity
+        constraints = [
+            models.UniqueConstraint(fields=["cart", "product"], name="unique_cart_product"),
+        ]
+
+
+# Archive of old orders, moved out of Order/OrderItem by `manage.py archive_orders`
+# so the hot tables (and their indexes) stay small. Rows keep their original
+# ids and everything needed to show them without joining products.
+class ArchivedOrder(models.Model):
+    # Same id the order had in the Order table
+    id = models.BigIntegerField(primary_key=True)
+    # The customer who placed the order
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="archived_orders")
+    # When the order was placed (copied, not auto-set)
+    created_at = models.DateTimeField()
+    # Totals stored at checkout
+    total_items = models.PositiveIntegerField(default=0)
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0"))
+    # When the order was moved to the archive
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "-created_at"], name="archorder_user_created_idx"),
+        ]
+
+
+# One line of an archived order
+class ArchivedOrderItem(models.Model):
+    # Same id the line had in the OrderItem table
+    id = models.BigIntegerField(primary_key=True)
+    # The archived order this line belongs to
+    order = models.ForeignKey(ArchivedOrder, related_name="items", on_delete=models.CASCADE)
+    # Product id only: the product may be deleted long after the order was archived
+    product_id = models.BigIntegerField()
+    # Seller of the product (for seller sales reports)
+    seller = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, related_name="archived_sold_items")
+    # Copy of the order date so seller reports don't need to join orders
+    order_created_at = models.DateTimeField()
+    # How many were ordered
+    quantity = models.PositiveIntegerField(default=1)
+    # Snapshots copied from the order item (plus the image at archive time)
+    product_title = models.CharField(max_length=200, blank=True, default="")
+    product_image_url = models.URLField(blank=True, null=True)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+    discount = models.DecimalField(max_digits=5, decimal_places=2, default=Decimal("0"))
+    line_total = models.DecimalField(max_digits=12, decimal_places=2, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["seller", "-order_created_at"], name="architem_seller_created_idx"),
+        ]
+
+    # Price paid for one unit (after discount), rounded to cents
+    def paid_unit_price(self):
+        return discounted_price(self.unit_price, self.discount)
+
+
+# One run of `archive_orders`. Orders created before the newest cutoff may be
+# in the archive, so reads only look there when their date range goes back that far.
+class ArchiveRun(models.Model):
+    # Orders created before this moment are moved
+    cutoff = models.DateTimeField()
+    # When the run started and finished (null while it is still running)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # How many rows were moved
+    orders_archived = models.PositiveIntegerField(default=0)
+    items_archived = models.PositiveIntegerField(default=0)
+
+
+# A client-chosen Idempotency-Key sent with an order-creating request. The
+# first request stores its response here; retries with the same key get that
+# response back instead of creating a second order.
+class IdempotencyKey(models.Model):
+    # Keys are only unique per user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="idempotency_keys")
+    # The Idempotency-Key header value
+    key = models.CharField(max_length=255)
+    # Which endpoint the key was used on (e.g. "orders.create")
+    scope = models.CharField(max_length=50)
+    # SHA-256 of the request body, so a key can't be reused for another request
+    request_fingerprint = models.CharField(max_length=64)
+    # Stored response (empty while the first request is still running)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.TextField(blank=True, default="")
+    # SHA-256 of response_body, sent back as the ETag of replays
+    response_fingerprint = models.CharField(max_length=64, blank=True, default="")
+    # Timestamps; rows are purged after expires_at by `manage.py purge_idempotency_keys`
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "scope", "key"], name="unique_idempotency_key"),
+        ]
+        indexes = [
+            models.Index(fields=["expires_at"], name="idempotency_expires_idx"),
+        ]
@@ -1,8 +1,7 @@
 # This file defines how order data is serialized (converted to/from JSON)
 from rest_framework import serializers
-from decimal import Decimal, InvalidOperation
-from .models import Order, OrderItem
-from products.models import Product
+from .models import Order, OrderItem, CartItem, ArchivedOrder, ArchivedOrderItem
+from .checkout import place_order
 from products.serializers import ProductSerializer
 
 # Serializer for each product item in an order
@@ -12,15 +11,15 @@ class OrderItemSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = OrderItem
-        fields = ["product", "quantity"]
+        fields = ["product", "quantity", "unit_price", "discount", "line_total"]
 
 # Serializer for the entire order
 class OrderSerializer(serializers.ModelSerializer):
     # Include all items in this order
     items = OrderItemSerializer(many=True, read_only=True)
-    # Calculate total number of items
+    # Total number of items in the order
     total_items = serializers.SerializerMethodField()
-    # Calculate total price of the order
+    # Total price of the order
     total_price = serializers.SerializerMethodField()
 
     class Meta:
@@ -33,77 +32,94 @@ class OrderSerializer(serializers.ModelSerializer):
         request = self.context.get("request")
         # Get the user who is making the request
         current_user = getattr(request, "user", None)
-        
-        # Create a new order for this user
-        new_order = Order.objects.create(user=current_user)
-
-        # Get the cart items from the request
-        cart_items = self.initial_data.get("items", [])
-        items_created = 0
-        
-        # Loop through each item in the cart
-        for cart_item in cart_items:
+
+        # Collect {product_id: quantity} from the posted cart items.
+        # Only ids and quantities are read: prices always come from the database.
+        quantities = {}
+        for cart_item in self.initial_data.get("items", []):
             # Try to get the product ID from different possible field names
             product_id = cart_item.get("product") or cart_item.get("product_id") or cart_item.get("id")
-            # Get the quantity (default to 1 if not provided)
-            quantity = cart_item.get("quantity", 1)
-            
-            # Skip if no product ID was found
-            # If product id is missing, we'll try to create a local product from payload
-            # when title/price are available
-            
-            # Try to find the product in the database
             try:
-                product = Product.objects.get(pk=product_id)
-            except Product.DoesNotExist:
-                # Attempt to create a minimal local product using payload (supports DummyJSON items)
-                title = cart_item.get("title")
-                price = cart_item.get("price")
-                description = cart_item.get("description") or ""
-                image_url = cart_item.get("image_url") or cart_item.get("thumbnail")
-                stock = cart_item.get("stock", 100)
-
-                if title is None or price is None:
-                    # Cannot create a product without essential fields; skip
-                    continue
-
-                # Convert price to Decimal to match Product.price DecimalField
-                try:
-                    price_decimal = Decimal(str(price))
-                except (InvalidOperation, TypeError):
-                    continue
-
-                # Fallback seller is the current user to satisfy FK
-                product = Product.objects.create(
-                    seller=current_user,
-                    title=title,
-                    description=description,
-                    price=price_decimal,
-                    stock=stock,
-                    image_url=image_url,
-                )
-            
-            # Create an order item linking the order to the product
-            OrderItem.objects.create(
-                order=new_order,
-                product=product,
-                quantity=quantity
-            )
-            items_created += 1
-
-        # If nothing was created (e.g., all products invalid), raise a validation error
-        if items_created == 0:
-            # Clean up empty order if nothing could be added
-            new_order.delete()
-            raise serializers.ValidationError({"items": ["No valid items were provided for this order."]})
-
-        # Return the created order
-        return new_order
-
-    # Calculate the total number of items in the order
+                product_id = int(product_id)
+                quantity = int(cart_item.get("quantity", 1))
+            except (TypeError, ValueError):
+                # Skip items without a usable product id or quantity
+                continue
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+
+        # Validate and create the whole order with a fixed number of queries
+        return place_order(current_user, quantities)
+
+    # Total number of items, stored on the order at checkout
     def get_total_items(self, order_object):
-        return order_object.total_items()
+        return order_object.total_items
 
-    # Calculate the total price of the order
+    # Total price, stored on the order at checkout
     def get_total_price(self, order_object):
-        return order_object.total_price()
+        return order_object.total_price
+
+
+# Serializer for a line of an archived order (same shape as OrderItemSerializer,
+# with the product taken from the snapshot since it may no longer exist)
+class ArchivedOrderItemSerializer(serializers.ModelSerializer):
+    product = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ArchivedOrderItem
+        fields = ["product", "quantity", "unit_price", "discount", "line_total"]
+
+    def get_product(self, item):
+        return {
+            "id": item.product_id,
+            "title": item.product_title,
+            "price": None if item.unit_price is None else str(item.unit_price),
+            "image_url": item.product_image_url,
+        }
+
+
+# Serializer for an archived order (read-only, same fields as OrderSerializer)
+class ArchivedOrderSerializer(serializers.ModelSerializer):
+    items = ArchivedOrderItemSerializer(many=True, read_only=True)
+    total_items = serializers.SerializerMethodField()
+    total_price = serializers.SerializerMethodField()
+    # Lets the client know the order can no longer be changed or removed
+    archived = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ArchivedOrder
+        fields = ["id", "items", "total_items", "total_price", "created_at", "archived"]
+
+    def get_total_items(self, order_object):
+        return order_object.total_items
+
+    def get_total_price(self, order_object):
+        return order_object.total_price
+
+    def get_archived(self, order_object):
+        return True
+
+
+# Serializer for one line of the server-side cart (read from priced_cart_items)
+class CartItemSerializer(serializers.ModelSerializer):
+    # Values below are annotated by the revalidation query, never sent by the client
+    title = serializers.CharField(read_only=True)
+    image_url = serializers.CharField(read_only=True)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    discount = serializers.DecimalField(max_digits=5, decimal_places=2, read_only=True)
+    stock = serializers.IntegerField(read_only=True)
+    unit_price = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    line_total = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    in_stock = serializers.BooleanField(read_only=True)
+
+    class Meta:
+        model = CartItem
+        fields = [
+            "product", "quantity", "title", "image_url", "price", "discount",
+            "stock", "unit_price", "line_total", "in_stock",
+        ]
+
+
+# Serializer for the lines posted when adding to or replacing the cart
+class CartLineSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, default=1)
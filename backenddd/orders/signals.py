@@ -0,0 +1,17 @@
+# This file publishes live sales events when order items are created
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .models import OrderItem
+from .events import get_broker, sale_event
+
+
+@receiver(post_save, sender=OrderItem)
+def publish_sale(sender, instance, created, **kwargs):
+    """Tell the product's seller about a new sale once the checkout commits"""
+    if not created:
+        return
+    order = instance.order
+    event = sale_event(order, order.user, instance)
+    seller_id = instance.seller_id
+    transaction.on_commit(lambda: get_broker().publish(seller_id, event))
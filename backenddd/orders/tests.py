@@ -1,3 +1,625 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.models.signals import pre_delete
+from django.test import AsyncClient, TestCase, override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from backenddd.testing import SellerShardsMixin
+from products import cache as product_cache
+from products import shards
+from products.models import Product
+from . import archive, events, idempotency
+from .models import ArchivedOrder, ArchivedOrderItem, Cart, CartItem, IdempotencyKey, Order, OrderItem
 
 # Create your tests here.
+
+
+class OrderTestCase(TestCase):
+    """A buyer, a seller with two products and an authenticated client"""
+
+    def setUp(self):
+        for alias in ('default', 'throttle'):
+            caches[alias].clear()
+        product_cache.reset_cache()
+        self.buyer = User.objects.create(username='buyer')
+        self.seller = User.objects.create(username='seller')
+        self.lamp = Product.objects.create(
+            seller=self.seller, title='Lamp', description='x', price=Decimal('12.50'), stock=10, category='lamps'
+        )
+        self.desk = Product.objects.create(
+            seller=self.seller, title='Desk', description='x', price=Decimal('99.00'), stock=2, category='desks'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def place_order(self, items, key=None):
+        headers = {} if key is None else {'HTTP_IDEMPOTENCY_KEY': key}
+        return self.client.post('/api/orders/', {'items': items}, format='json', **headers)
+
+
+class IdempotencyTests(OrderTestCase):
+    """Idempotency-Key on POST /api/orders/: one order per key"""
+
+    def test_retry_replays_the_first_response(self):
+        items = [{'product': self.lamp.pk, 'quantity': 2}]
+        first = self.place_order(items, key='abc')
+        second = self.place_order(items, key='abc')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertNotIn('Idempotent-Replayed', first)
+        self.assertEqual(Order.objects.count(), 1)
+        # The response was stored with the order
+        record = IdempotencyKey.objects.get()
+        self.assertIsNotNone(record.completed_at)
+        self.assertEqual(record.response_status, 201)
+
+    def test_same_key_for_another_body_is_refused(self):
+        self.place_order([{'product': self.lamp.pk, 'quantity': 1}], key='abc')
+        response = self.place_order([{'product': self.desk.pk, 'quantity': 1}], key='abc')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_failed_request_frees_the_key(self):
+        response = self.place_order([{'product': self.desk.pk, 'quantity': 5}], key='abc')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.place_order([{'product': self.desk.pk, 'quantity': 1}], key='abc').status_code, 201)
+
+    @override_settings(IDEMPOTENCY_WAIT_SECONDS=0)
+    def test_duplicate_of_a_running_request_gets_409(self):
+        items = [{'product': self.lamp.pk, 'quantity': 1}]
+        IdempotencyKey.objects.create(
+            user=self.buyer, scope='orders.create', key='abc',
+            request_fingerprint=idempotency.fingerprint('{"items": [{"product": %d, "quantity": 1}]}' % self.lamp.pk),
+            expires_at=timezone.now() + timedelta(days=1),
+        )
+        response = self.place_order(items, key='abc')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(Order.objects.exists())
+
+    def test_abandoned_claim_is_taken_over(self):
+        items = [{'product': self.lamp.pk, 'quantity': 1}]
+        record = IdempotencyKey.objects.create(
+            user=self.buyer, scope='orders.create', key='abc', request_fingerprint='0' * 64,
+            expires_at=timezone.now() + timedelta(days=1),
+        )
+        IdempotencyKey.objects.filter(pk=record.pk).update(created_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(self.place_order(items, key='abc').status_code, 201)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_order_is_rolled_back_when_the_claim_was_taken_over(self):
+        record = IdempotencyKey.objects.create(
+            user=self.buyer, scope='orders.create', key='abc', request_fingerprint='0' * 64,
+            expires_at=timezone.now() + timedelta(days=1),
+        )
+
+        def slow_handler():
+            Order.objects.create(user=self.buyer)
+            # Another request decided this one was abandoned
+            IdempotencyKey.objects.filter(pk=record.pk).delete()
+            return Response({'id': 1}, status=status.HTTP_201_CREATED)
+
+        self.assertIsNone(idempotency.run_and_store(record, slow_handler))
+        self.assertFalse(Order.objects.exists())
+
+    def test_purge_deletes_only_expired_keys(self):
+        for number in range(5):
+            IdempotencyKey.objects.create(
+                user=self.buyer, scope='orders.create', key=f'old{number}', request_fingerprint='0' * 64,
+                expires_at=timezone.now() - timedelta(minutes=1),
+            )
+        IdempotencyKey.objects.create(
+            user=self.buyer, scope='orders.create', key='fresh', request_fingerprint='0' * 64,
+            expires_at=timezone.now() + timedelta(days=1),
+        )
+        out = StringIO()
+        call_command('purge_idempotency_keys', chunk_size=2, stdout=out)
+        self.assertIn('Deleted 5 expired idempotency keys', out.getvalue())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['fresh'])
+
+
+class OrderArchiveTests(OrderTestCase):
+    """Order history and seller sales read across the hot and archive tables"""
+
+    def setUp(self):
+        super().setUp()
+        self.start = timezone.now() - timedelta(days=100)
+        # Orders 1-3 share one timestamp, like a burst of checkouts in the same tick
+        self.orders = []
+        for days in (0, 0, 0, 10, 20, 30, 40):
+            response = self.place_order([{'product': self.lamp.pk, 'quantity': 1}])
+            self.assertEqual(response.status_code, 201)
+            order_id = response.json()['id']
+            created_at = self.start + timedelta(days=days)
+            Order.objects.filter(pk=order_id).update(created_at=created_at)
+            for items in shards.each(OrderItem.objects.filter(order_id=order_id)):
+                items.update(order_created_at=created_at)
+            self.orders.append(order_id)
+        self.newest_first = sorted(self.orders, key=lambda order_id: (
+            self.start + timedelta(days=(0, 0, 0, 10, 20, 30, 40)[self.orders.index(order_id)]), order_id,
+        ), reverse=True)
+
+    def follow_pages(self, url, id_key='id', **params):
+        response = self.client.get(url, {'limit': 2, **params})
+        ids = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids.extend(order[id_key] for order in response.json())
+            link = response.get('Link')
+            if not link:
+                return ids
+            response = self.client.get(link[1:link.index('>')])
+
+    def test_pages_keep_orders_placed_at_the_same_moment(self):
+        self.assertEqual(self.follow_pages('/api/orders/'), self.newest_first)
+        self.client.force_authenticate(self.seller)
+        self.assertEqual(self.follow_pages('/api/products/seller/sales-orders/', 'order_id'), self.newest_first)
+
+    def test_history_spans_the_archive(self):
+        self.assertIsNone(archive.archive_state()['cutoff'])
+        run = archive.archive_orders(self.start + timedelta(days=15), chunk_size=2)
+        # Seen straight away, without waiting for a cache to expire
+        self.assertEqual(archive.archive_state()['run_id'], run.id)
+        self.assertEqual((run.orders_archived, run.items_archived), (4, 4))
+        self.assertEqual(Order.objects.count(), 3)
+        self.assertEqual(sorted(ArchivedOrder.objects.values_list('id', flat=True)), sorted(self.newest_first[3:]))
+
+        self.assertEqual(self.follow_pages('/api/orders/'), self.newest_first)
+        summary = self.client.get('/api/orders/summary/').json()
+        self.assertEqual(summary['total_orders'], 7)
+        self.assertEqual(Decimal(str(summary['total_spent'])), self.lamp.price * 7)
+        self.assertEqual(self.client.get(f'/api/orders/{self.newest_first[-1]}/').status_code, 200)
+        self.client.force_authenticate(self.seller)
+        self.assertEqual(self.follow_pages('/api/products/seller/sales-orders/', 'order_id'), self.newest_first)
+
+    def test_sales_read_during_an_archive_run(self):
+        real_select_related = Order.objects.select_related
+        archived = []
+
+        def archive_first(*args):
+            # The archive run lands between the item query and the order query
+            if not archived:
+                archived.append(archive.archive_orders(self.start + timedelta(days=15)))
+            return real_select_related(*args)
+
+        with mock.patch.object(Order.objects, 'select_related', side_effect=archive_first):
+            result = archive.seller_sales_orders(self.seller)
+        self.assertEqual(archived[0].orders_archived, 4)
+        self.assertEqual([order['order_id'] for order in result], self.newest_first)
+
+    def test_failed_chunk_moves_nothing(self):
+        def fail(**kwargs):
+            raise RuntimeError('disk full')
+
+        pre_delete.connect(fail, sender=Order, dispatch_uid='archive-test')
+        self.addCleanup(pre_delete.disconnect, sender=Order, dispatch_uid='archive-test')
+        with self.assertRaises(RuntimeError):
+            archive.archive_orders(self.start + timedelta(days=15))
+        self.assertFalse(ArchivedOrder.objects.exists())
+        self.assertFalse(ArchivedOrderItem.objects.exists())
+        self.assertEqual(Order.objects.count(), 7)
+        self.assertEqual(sum(items.count() for items in shards.each(OrderItem.objects.all())), 7)
+
+
+class ShardedOrderArchiveTests(SellerShardsMixin, OrderArchiveTests):
+    """The same with the order items on a seller shard"""
+
+
+class ConditionalOrderTests(OrderTestCase):
+    """ETag / Last-Modified on the order history and order detail"""
+
+    def setUp(self):
+        super().setUp()
+        self.order_id = self.place_order([{'product': self.lamp.pk, 'quantity': 1}]).json()['id']
+
+    def assert_revalidates(self, url):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('private', first['Cache-Control'])
+        self.assertTrue(first.has_header('Last-Modified'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+
+        # Every order item shows its product as it is now
+        self.lamp.refresh_from_db()
+        self.lamp.title = 'Desk lamp'
+        self.lamp.save()
+        second = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertIn('Desk lamp', second.content.decode())
+
+        # A new order changes the history, not the detail of another order
+        self.place_order([{'product': self.desk.pk, 'quantity': 1}])
+        return self.client.get(url, HTTP_IF_NONE_MATCH=second['ETag']).status_code
+
+    def test_history_revalidates_with_product_edits(self):
+        self.assertEqual(self.assert_revalidates('/api/orders/'), 200)
+
+    def test_detail_revalidates_with_product_edits(self):
+        self.assertEqual(self.assert_revalidates(f'/api/orders/{self.order_id}/'), 304)
+
+    def test_etag_is_private_to_the_user(self):
+        etag = self.client.get('/api/orders/')['ETag']
+        self.client.force_authenticate(self.seller)
+        self.assertEqual(self.client.get('/api/orders/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ShardedConditionalOrderTests(SellerShardsMixin, ConditionalOrderTests):
+    """The same with the order items and products on a seller shard"""
+
+
+class SalesStreamTests(OrderTestCase):
+    """Live seller sales: stream tickets, replay after a reconnect, no gap before the first page"""
+
+    def ticket(self):
+        self.client.force_authenticate(self.seller)
+        response = self.client.post('/api/products/seller/sales-stream-ticket/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['ticket']
+
+    async def read_events(self, response, until):
+        """(event, id, data) of each event until one named `until`"""
+        found = []
+        buffer = ''
+        async for chunk in response.streaming_content:
+            buffer += chunk.decode() if isinstance(chunk, bytes) else chunk
+            while '\n\n' in buffer:
+                block, buffer = buffer.split('\n\n', 1)
+                fields = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+                if 'event' in fields:
+                    found.append((fields['event'], fields.get('id'), fields.get('data')))
+                    if fields['event'] == until:
+                        return found
+        return found
+
+    async def open_stream(self, ticket, headers=None, **params):
+        return await AsyncClient().get(
+            '/api/products/seller/sales-stream/', {'ticket': ticket, **params}, headers=headers
+        )
+
+    async def events_until_ready(self, ticket, headers=None, **params):
+        response = await self.open_stream(ticket, headers, **params)
+        self.assertEqual(response.status_code, 200)
+        received = await self.read_events(response, 'ready')
+        await response.streaming_content.aclose()
+        return received
+
+    def test_jwt_and_expired_tickets_are_refused(self):
+        ticket = self.ticket()
+        access = str(RefreshToken.for_user(self.seller).access_token)
+        self.assertEqual(async_to_sync(self.open_stream)(access).status_code, 401)
+        self.assertEqual(async_to_sync(AsyncClient().get)(
+            '/api/products/seller/sales-stream/', {'token': access}
+        ).status_code, 401)
+        with override_settings(SALES_STREAM_TICKET_SECONDS=-1):
+            self.assertEqual(async_to_sync(self.open_stream)(ticket).status_code, 401)
+        self.assertEqual(events.ticket_user_id(ticket), self.seller.pk)
+        self.assertIsNone(events.ticket_user_id(ticket + 'x'))
+
+    def test_live_sale_after_ready(self):
+        ticket = self.ticket()
+        event = {'order_id': 1, 'created_at': '2026-01-01T00:00:00+00:00', 'item': {'id': 7}}
+
+        async def scenario():
+            response = await self.open_stream(ticket)
+            # Subscribed before "ready": a sale right after it is delivered
+            self.assertEqual(await self.read_events(response, 'ready'), [('ready', None, '{}')])
+            events.get_broker().publish(self.seller.pk, event)
+            received = await self.read_events(response, 'sale')
+            await response.streaming_content.aclose()
+            return received
+
+        self.assertEqual(async_to_sync(scenario)(), [('sale', event['created_at'], json.dumps(event))])
+
+    def test_reconnect_replays_missed_sales(self):
+        ticket = self.ticket()
+        self.client.force_authenticate(self.buyer)
+        seen = self.place_order([{'product': self.lamp.pk, 'quantity': 1}]).json()['id']
+        long_ago = timezone.now() - timedelta(minutes=10)
+        Order.objects.filter(pk=seen).update(created_at=long_ago)
+        for items in shards.each(OrderItem.objects.filter(order_id=seen)):
+            items.update(order_created_at=long_ago)
+        last_event_id = (timezone.now() - timedelta(minutes=1)).isoformat()
+        missed = self.place_order([{'product': self.desk.pk, 'quantity': 1}, {'product': self.lamp.pk, 'quantity': 2}]).json()['id']
+        missed_items = sorted(
+            item.pk for items in shards.each(OrderItem.objects.filter(order_id=missed)) for item in items
+        )
+
+        # The browser sends Last-Event-ID itself; a new EventSource passes ?last_event_id=
+        for params in ({'headers': {'Last-Event-ID': last_event_id}}, {'last_event_id': last_event_id}):
+            with self.subTest(params=list(params)):
+                received = async_to_sync(self.events_until_ready)(ticket, **params)
+                sales = [json.loads(data) for name, _, data in received if name == 'sale']
+                self.assertEqual(sorted(sale['item']['id'] for sale in sales), missed_items)
+                self.assertEqual({sale['order_id'] for sale in sales}, {missed})
+                self.assertEqual(received[-1][0], 'ready')
+
+        # Too many to replay: the client is told to reload instead
+        with override_settings(SALES_STREAM_REPLAY_LIMIT=1):
+            received = async_to_sync(self.events_until_ready)(ticket, last_event_id=last_event_id)
+        self.assertEqual([name for name, _, _ in received], ['reload', 'ready'])
+
+    def test_sales_orders_items_carry_their_id(self):
+        self.place_order([{'product': self.lamp.pk, 'quantity': 1}])
+        self.client.force_authenticate(self.seller)
+        item = self.client.get('/api/products/seller/sales-orders/').json()[0]['items'][0]
+        self.assertTrue(any(items.filter(pk=item['id']).exists() for items in shards.each(OrderItem.objects.all())))
+
+
+class ShardedSalesStreamTests(SellerShardsMixin, SalesStreamTests):
+    """The same with the sold items on a seller shard"""
+
+
+class CartTests(OrderTestCase):
+    """Server-side cart: adding lines and checking out"""
+
+    def add(self, product, quantity):
+        return self.client.post('/api/orders/cart/items/', {'product': product.pk, 'quantity': quantity}, format='json')
+
+    def test_adding_again_increases_the_quantity(self):
+        self.assertEqual(self.add(self.lamp, 1).status_code, 201)
+        cart = self.add(self.lamp, 2).json()
+        self.assertEqual([(line['product'], line['quantity']) for line in cart['items']], [(self.lamp.pk, 3)])
+        self.assertEqual(cart['total_items'], 3)
+
+    def test_line_inserted_by_a_parallel_request(self):
+        cart = Cart.objects.create(user=self.buyer)
+        racing = []
+
+        def insert_first(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            # Another request adds the same line right after this one looked for it
+            if not racing and 'orders_cartitem' in sql and not sql.lstrip().upper().startswith('INSERT'):
+                racing.append(CartItem.objects.create(cart=cart, product=self.lamp, quantity=1))
+            return result
+
+        with connection.execute_wrapper(insert_first):
+            response = self.add(self.lamp, 2)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(racing), 1)
+        self.assertEqual(CartItem.objects.get(cart=cart).quantity, 3)
+
+    def test_checkout_orders_the_cart_and_empties_it(self):
+        self.add(self.lamp, 2)
+        self.add(self.desk, 1)
+        response = self.client.post('/api/orders/cart/checkout/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            sorted((item['product']['id'], item['quantity']) for item in response.json()['items']),
+            sorted([(self.lamp.pk, 2), (self.desk.pk, 1)]),
+        )
+        self.assertEqual(Decimal(str(response.json()['total_price'])), self.lamp.price * 2 + self.desk.price)
+        self.assertFalse(CartItem.objects.exists())
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.stock, 8)
+        # An empty cart can't be checked out
+        self.assertEqual(self.client.post('/api/orders/cart/checkout/').status_code, 400)
+
+    def test_checkout_without_stock_keeps_the_cart(self):
+        self.add(self.desk, 3)
+        self.assertFalse(self.client.get('/api/orders/cart/').json()['all_in_stock'])
+        self.assertEqual(self.client.post('/api/orders/cart/checkout/').status_code, 400)
+        self.assertEqual(CartItem.objects.get().quantity, 3)
+        self.assertFalse(Order.objects.exists())
+        self.desk.refresh_from_db()
+        self.assertEqual(self.desk.stock, 2)
+
+    def test_unknown_product_is_refused(self):
+        response = self.client.post('/api/orders/cart/items/', {'product': 999999, 'quantity': 1}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CartItem.objects.exists())
+
+
+class ShardedCartTests(SellerShardsMixin, CartTests):
+    """The same with the products on a seller shard"""
+
+
+class PriceSnapshotTests(OrderTestCase):
+    """Order items keep the price paid; orders keep their totals"""
+
+    def test_checkout_snapshots_prices_and_totals(self):
+        self.lamp.discount = Decimal('10')
+        self.lamp.save()
+        response = self.place_order([{'product': self.lamp.pk, 'quantity': 3}, {'product': self.desk.pk, 'quantity': 1}])
+        order = Order.objects.get(pk=response.json()['id'])
+        self.assertEqual((order.total_items, order.total_price), (4, Decimal('132.75')))
+        lamp_line = OrderItem.objects.get(product=self.lamp)
+        self.assertEqual(
+            (lamp_line.seller_id, lamp_line.product_title, lamp_line.unit_price, lamp_line.discount),
+            (self.seller.pk, 'Lamp', Decimal('12.50'), Decimal('10.00')),
+        )
+        self.assertEqual(lamp_line.line_total, Decimal('33.75'))
+        self.assertEqual(lamp_line.order_created_at, order.created_at)
+
+    def test_later_price_changes_leave_past_orders_alone(self):
+        order_id = self.place_order([{'product': self.lamp.pk, 'quantity': 2}]).json()['id']
+        self.lamp.price = Decimal('99.99')
+        self.lamp.title = 'Renamed lamp'
+        self.lamp.save()
+
+        detail = self.client.get(f'/api/orders/{order_id}/').json()
+        self.assertEqual(Decimal(str(detail['total_price'])), Decimal('25.00'))
+        self.assertEqual(Decimal(str(self.client.get('/api/orders/summary/').json()['total_spent'])), Decimal('25.00'))
+        self.client.force_authenticate(self.seller)
+        self.assertEqual(self.client.get('/api/products/seller/sales-summary/').json()['total_revenue'], 25.0)
+        item = self.client.get('/api/products/seller/sales-orders/').json()[0]['items'][0]
+        self.assertEqual((item['product_title'], item['price'], item['total']), ('Lamp', 12.5, 25.0))
+
+    def test_item_saved_one_by_one_fills_its_snapshot(self):
+        order = Order.objects.create(user=self.buyer)
+        item = OrderItem.objects.create(order=order, product=self.desk, quantity=2)
+        item.refresh_from_db()
+        self.assertEqual(
+            (item.seller_id, item.unit_price, item.line_total), (self.seller.pk, Decimal('99.00'), Decimal('198.00'))
+        )
+        self.assertEqual(item.order_created_at, order.created_at)
+
+    def test_backfill_migrations(self):
+        self.place_order([{'product': self.lamp.pk, 'quantity': 2}, {'product': self.desk.pk, 'quantity': 1}])
+        order = Order.objects.get()
+        # Rows written before the snapshot columns existed
+        OrderItem.objects.update(
+            seller=None, product_title='', unit_price=None, line_total=None, order_created_at=None
+        )
+        Order.objects.update(total_items=0, total_price=Decimal('0'))
+        prices = import_module('orders.migrations.0005_backfill_price_snapshot')
+        dates = import_module('orders.migrations.0009_backfill_order_created_at')
+        with mock.patch.object(prices, 'CHUNK_SIZE', 1), mock.patch.object(dates, 'CHUNK_SIZE', 1):
+            schema_editor = mock.Mock(connection=connection)
+            prices.backfill_items(django_apps, schema_editor)
+            prices.backfill_orders(django_apps, schema_editor)
+            dates.backfill_order_created_at(django_apps, schema_editor)
+
+        order.refresh_from_db()
+        self.assertEqual((order.total_items, order.total_price), (3, Decimal('124.00')))
+        self.assertEqual(
+            sorted(OrderItem.objects.values_list(
+                'product_title', 'unit_price', 'line_total', 'seller', 'order_created_at'
+            )),
+            [('Desk', Decimal('99.00'), Decimal('99.00'), self.seller.pk, order.created_at),
+             ('Lamp', Decimal('12.50'), Decimal('25.00'), self.seller.pk, order.created_at)],
+        )
+
+
+class ShardedBackfillTests(SellerShardsMixin, OrderTestCase):
+    """migrate --database=<shard> backfills the items on that shard"""
+
+    def test_backfill_items_on_the_migrated_database(self):
+        self.place_order([{'product': self.lamp.pk, 'quantity': 2}])
+        database = shards.shard_for_seller(self.seller.pk)
+        items = OrderItem.objects.using(database)
+        items.update(seller=None, product_title='', unit_price=None, line_total=None)
+        prices = import_module('orders.migrations.0005_backfill_price_snapshot')
+        prices.backfill_items(django_apps, mock.Mock(connection=connections[database]))
+        self.assertEqual(
+            list(items.values_list('product_title', 'unit_price', 'line_total', 'seller')),
+            [('Lamp', Decimal('12.50'), Decimal('25.00'), self.seller.pk)],
+        )
+
+
+class WorkloadTests(TestCase):
+    """generate_workload: skewed but deterministic data, a consistent trace, and --clear"""
+
+    def generate(self, **options):
+        options = {'sellers': 4, 'customers': 10, 'products': 60, 'orders': 40, 'batch_size': 7, **options}
+        call_command('generate_workload', stdout=StringIO(), **options)
+
+    def users(self, prefix='wl'):
+        return dict(User.objects.filter(username__startswith=f'{prefix}-').values_list('id', 'username'))
+
+    def rows(self, queryset):
+        """Every row of a products or order items queryset, from every seller shard"""
+        return [row for each in shards.each(queryset) for row in each]
+
+    def products(self, prefix='wl'):
+        return self.rows(Product.objects.filter(seller_id__in=list(self.users(prefix))))
+
+    def data(self, prefix='wl'):
+        """Everything generated, without the ids and prefix (which differ between runs)"""
+        users = {user_id: username.split('-', 1)[1] for user_id, username in self.users(prefix).items()}
+        products = sorted(
+            (product.title, product.price, product.stock, users[product.seller_id]) for product in self.products(prefix)
+        )
+        orders = dict(Order.objects.filter(user_id__in=users).values_list('id', 'user_id'))
+        items = sorted(
+            (users[orders[item.order_id]], item.product_title, item.quantity, item.line_total)
+            for item in self.rows(OrderItem.objects.filter(order_id__in=list(orders)))
+        )
+        return products, items
+
+    def test_same_seed_same_data(self):
+        self.generate()
+        # Batch size and prefix don't change the data
+        self.generate(prefix='again', batch_size=50)
+        self.assertEqual(self.data('again'), self.data())
+        self.generate(prefix='other', seed=7)
+        self.assertNotEqual(self.data('other')[0], self.data()[0])
+
+    def test_orders_are_consistent_and_skewed(self):
+        self.generate(products=200, orders=300)
+        products = {product.pk: product for product in self.products()}
+        self.assertEqual(len(products), 200)
+        orders = Order.objects.filter(user_id__in=list(self.users()))
+        self.assertEqual(orders.count(), 300)
+        oldest = timezone.now() - timedelta(days=366)
+        sold = Counter()
+        for order in orders:
+            self.assertGreater(order.created_at, oldest)
+            items = self.rows(OrderItem.objects.filter(order_id=order.pk))
+            self.assertEqual(order.total_items, sum(item.quantity for item in items))
+            self.assertEqual(order.total_price, sum(item.line_total for item in items))
+            for item in items:
+                product = products[item.product_id]
+                self.assertEqual(
+                    (item.seller_id, item.product_title, item.unit_price, item.order_created_at),
+                    (product.seller_id, product.title, product.price, order.created_at),
+                )
+                sold[item.product_id] += item.quantity
+        # Zipf popularity: the best seller sells far more than the median product
+        counts = sorted(sold.values(), reverse=True)
+        self.assertGreater(counts[0], 5 * counts[len(counts) // 2])
+        # The first seller has the biggest catalog
+        catalogs = Counter(self.users()[product.seller_id] for product in products.values())
+        self.assertEqual(catalogs.most_common(1)[0][0], 'wl-seller-0000')
+
+    def test_trace(self):
+        handle, path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        self.generate(trace=path, trace_requests=200, trace_rate=20)
+        with open(path) as trace:
+            header, *entries = [json.loads(line) for line in trace]
+        self.assertEqual(header['workload']['requests'], 200)
+        self.assertEqual(len(entries), 200)
+        times = [entry['at'] for entry in entries]
+        self.assertEqual(times, sorted(times))
+        self.assertEqual(header['workload']['seconds'], times[-1])
+        usernames = set(self.users().values())
+        product_ids = {product.pk for product in self.products()}
+        for entry in entries:
+            self.assertTrue(entry['path'].startswith('/api/'))
+            if 'user' in entry:
+                self.assertIn(entry['user'], usernames)
+            for line in entry.get('json', {}).get('items', []):
+                self.assertIn(line['product'], product_ids)
+        # The users log in with the password in the header
+        customer = User.objects.get(username='wl-customer-000000')
+        self.assertTrue(customer.check_password(header['workload']['password']))
+
+    def test_existing_prefix_needs_clear(self):
+        self.generate()
+        with self.assertRaises(CommandError):
+            self.generate()
+        self.generate(clear=True, products=30, orders=10)
+        self.assertEqual(len(self.products()), 30)
+        orders = set(Order.objects.values_list('pk', flat=True))
+        self.assertEqual(len(orders), 10)
+        # No items of the deleted orders are left on any database
+        self.assertEqual({item.order_id for item in self.rows(OrderItem.objects.all())}, orders)
+
+
+class ShardedWorkloadTests(SellerShardsMixin, WorkloadTests):
+    """The same with the products and order items on seller shards"""
@@ -1,7 +1,19 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
-from .views import OrderViewSet
+from .views import OrderViewSet, CartViewSet
 
 router = DefaultRouter()
 router.register("", OrderViewSet, basename="orders")
 
-urlpatterns = router.urls
+# Server-side cart endpoints (listed before the router so "cart" is not read as an order id)
+cart = CartViewSet.as_view({"get": "retrieve", "put": "update"})
+cart_items = CartViewSet.as_view({"post": "add_item"})
+cart_item = CartViewSet.as_view({"delete": "remove_item"})
+cart_checkout = CartViewSet.as_view({"post": "checkout"})
+
+urlpatterns = [
+    path("cart/", cart, name="cart"),
+    path("cart/items/", cart_items, name="cart-items"),
+    path("cart/items/<int:product_id>/", cart_item, name="cart-item"),
+    path("cart/checkout/", cart_checkout, name="cart-checkout"),
+] + router.urls
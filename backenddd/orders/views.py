@@ -1,25 +1,159 @@
 # This file handles order-related API endpoints
-from rest_framework.viewsets import ModelViewSet
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.viewsets import ModelViewSet, ViewSet
 from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.authentication import JWTAuthentication
-from .models import Order, OrderItem
-from .serializers import OrderSerializer
+from products.models import Product
+from products import shards
+from .models import Order, Cart, CartItem, ArchivedOrder
+from .serializers import OrderSerializer, ArchivedOrderSerializer, CartItemSerializer, CartLineSerializer
+from . import archive
+from .idempotency import idempotent
+from .checkout import priced_cart_items, checkout_cart
+from backenddd.conditional import ConditionalGetMixin, queryset_validator
+from backenddd import compiled
+
+def ordered_products_validator(orders):
+    """
+    (last_modified, count) of the live products nested in `orders` (hot orders).
+
+    Order rows never change, but every order item shows its product as it is
+    now, so a product edit has to change the order validators too. Archived
+    orders keep a snapshot of their products and are not included.
+    """
+    if not shards.enabled():
+        return queryset_validator(Product.objects.filter(orderitem__order__in=orders), "updated_at")
+    # Items and their products are on the seller shards, the orders on 'default'
+    order_ids = list(orders.values_list("id", flat=True))
+    newest, count = None, 0
+    if order_ids:
+        for alias in shards.aliases():
+            last, rows = queryset_validator(
+                Product.objects.using(alias).filter(orderitem__order_id__in=order_ids), "updated_at"
+            )
+            count += rows
+            if last is not None and (newest is None or last > newest):
+                newest = last
+    return newest, count
+
 
 # ViewSet for managing orders
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(ConditionalGetMixin, ModelViewSet):
     # Use OrderSerializer to convert orders to/from JSON
     serializer_class = OrderSerializer
     # Only logged-in users can access orders
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
+    # Orders are private to each user; browsers revalidate with ETag on every poll
+    cache_control = {'private': True, 'no_cache': True}
+    # Orders never change after checkout, so creation time is the validator
+    # (the products nested in them can change: see ordered_products_validator)
+    last_modified_field = "created_at"
 
     # This method filters orders to show only the current user's orders
     def get_queryset(self):
         # Get the currently logged-in user
         current_user = self.request.user
-        # Return only orders that belong to this user
-        user_orders = Order.objects.filter(user=current_user)
-        return user_orders
+        # Return only orders that belong to this user, newest first (items and
+        # their products are loaded in two extra queries instead of one per order).
+        # Archived orders live in separate tables, see list() and retrieve().
+        user_orders = Order.objects.filter(user=current_user).order_by(
+            "-created_at", "-id"
+        )
+        if shards.enabled():
+            # Items are on the seller shards: get_object() attaches them
+            return user_orders
+        return user_orders.prefetch_related("items__product__seller")
+
+    def get_object(self):
+        order = super().get_object()
+        if shards.enabled():
+            shards.prefetch_order_items([order])
+        return order
+
+    def get_archive_state(self):
+        """The archive state, read once per request"""
+        if not hasattr(self, "_archive_state"):
+            self._archive_state = archive.archive_state()
+        return self._archive_state
+
+    def get_list_validators(self):
+        """Hot orders of this user, the products in them and the archive state (changes once per archive run)"""
+        hot = Order.objects.filter(user=self.request.user)
+        return [
+            queryset_validator(hot, self.last_modified_field),
+            ordered_products_validator(hot),
+            archive.archive_validator(self.get_archive_state()),
+        ]
+
+    def get_detail_validators(self):
+        """The order and the products in it"""
+        order = self.get_queryset().filter(pk=self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        return [queryset_validator(order, self.last_modified_field), ordered_products_validator(order)]
+
+    def list(self, request, *args, **kwargs):
+        """
+        Newest-first page of the user's orders.
+
+        ?created_after= and ?created_before= (ISO dates) limit the range and
+        ?limit= the page size. Older pages are linked with a Link header.
+        Archived orders are only read when the hot table can't fill the page
+        and the range reaches back past the archive cutoff.
+        """
+        return self.conditional_response(
+            request, self.get_list_validators(), lambda: self._history(request)
+        )
+
+    def _history(self, request):
+        created_after, before, limit = archive.history_range(request)
+        # Hot orders go through the compiled serializer when it is on
+        plan = compiled.read_plan(OrderSerializer)
+        hot, archived = archive.order_history(
+            request.user, created_after, before, limit, compiled=plan, state=self.get_archive_state()
+        )
+        context = self.get_serializer_context()
+        data = (
+            (plan.serialize(hot) if plan is not None else OrderSerializer(hot, many=True, context=context).data)
+            + ArchivedOrderSerializer(archived, many=True, context=context).data
+        )
+        response = Response(data)
+        if len(data) == limit:
+            if archived or plan is None:
+                oldest = (archived or hot)[-1]
+                oldest = oldest.created_at, oldest.id
+            else:
+                oldest = hot[-1]["created_at"], hot[-1]["id"]
+            response["Link"] = f'<{archive.next_page_link(request, *oldest)}>; rel="next"'
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        """One order, looked up in the archive if it is no longer in the hot table"""
+        try:
+            order_id = int(kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except ValueError:
+            raise NotFound()
+        if self.get_queryset().filter(pk=order_id).exists():
+            return super().retrieve(request, *args, **kwargs)
+        archived = ArchivedOrder.objects.filter(user=request.user, pk=order_id).prefetch_related("items").first()
+        if archived is None:
+            raise NotFound()
+        return Response(ArchivedOrderSerializer(archived, context=self.get_serializer_context()).data)
+
+    @action(detail=False, methods=["get"])
+    def summary(self, request):
+        """Number of orders and total spent over the user's whole history"""
+        return Response(archive.order_totals(request.user, self.get_archive_state()))
+
+    def create(self, request, *args, **kwargs):
+        """Place an order; retries with the same Idempotency-Key header get the first response"""
+        return idempotent(request, "orders.create", lambda: super(OrderViewSet, self).create(request, *args, **kwargs))
 
     # This method is called when creating a new order
     def perform_create(self, serializer):
@@ -27,3 +161,92 @@ class OrderViewSet(ModelViewSet):
         current_user = self.request.user
         # Save the order and assign it to the current user
         serializer.save(user=current_user)
+
+
+# ViewSet for the logged-in user's server-side cart
+class CartViewSet(ViewSet):
+    # Only logged-in users have a server-side cart
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get_cart(self):
+        # Create the cart the first time the user touches it
+        cart, created = Cart.objects.get_or_create(user=self.request.user)
+        return cart
+
+    def cart_response(self, cart, status_code=status.HTTP_200_OK):
+        """Return the cart revalidated against current prices and stock (one query)"""
+        lines = list(priced_cart_items(cart))
+        data = CartItemSerializer(lines, many=True).data
+        return Response({
+            "items": data,
+            "total_items": sum(line.quantity for line in lines),
+            "total_price": sum((line.line_total for line in lines), Decimal("0")),
+            "all_in_stock": all(line.in_stock for line in lines),
+        }, status=status_code)
+
+    def validated_lines(self, data):
+        """Check posted lines and return {product_id: quantity} for existing products"""
+        serializer = CartLineSerializer(data=data, many=True)
+        serializer.is_valid(raise_exception=True)
+        quantities = {}
+        for line in serializer.validated_data:
+            quantities[line["product"]] = quantities.get(line["product"], 0) + line["quantity"]
+        # One query to find which of the posted products exist (the id map
+        # on 'default' knows every product when they are spread over shards)
+        if shards.enabled():
+            existing = set(shards.product_sellers(quantities))
+        else:
+            existing = set(Product.objects.filter(pk__in=quantities).values_list("id", flat=True))
+        missing = sorted(set(quantities) - existing)
+        if missing:
+            raise ValidationError({"items": [f"Unknown products {missing}."]})
+        return quantities
+
+    # GET /api/orders/cart/
+    def retrieve(self, request):
+        return self.cart_response(self.get_cart())
+
+    # PUT /api/orders/cart/ with {"items": [{"product": id, "quantity": n}, ...]}
+    def update(self, request):
+        """Replace the whole cart, e.g. when syncing a browser cart"""
+        quantities = self.validated_lines(request.data.get("items", []))
+        cart = self.get_cart()
+        with transaction.atomic():
+            cart.items.all().delete()
+            CartItem.objects.bulk_create(
+                CartItem(cart=cart, product_id=product_id, quantity=quantity)
+                for product_id, quantity in quantities.items()
+            )
+        return self.cart_response(cart)
+
+    # POST /api/orders/cart/items/ with {"product": id, "quantity": n}
+    def add_item(self, request):
+        """Add a product to the cart (or increase its quantity)"""
+        quantities = self.validated_lines([request.data])
+        cart = self.get_cart()
+        with transaction.atomic():
+            for product_id, quantity in quantities.items():
+                # get_or_create() reads the line again if a parallel request
+                # inserted it first (instead of failing on the unique constraint)
+                item, created = CartItem.objects.get_or_create(
+                    cart=cart, product_id=product_id, defaults={"quantity": quantity}
+                )
+                if not created:
+                    # Increment in the database, so parallel adds are all counted
+                    CartItem.objects.filter(pk=item.pk).update(quantity=F("quantity") + quantity)
+        return self.cart_response(cart, status.HTTP_201_CREATED)
+
+    # DELETE /api/orders/cart/items/<product_id>/
+    def remove_item(self, request, product_id):
+        self.get_cart().items.filter(product_id=product_id).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    # POST /api/orders/cart/checkout/
+    def checkout(self, request):
+        """Turn the cart into an order using current database prices (honours Idempotency-Key)"""
+        def place_order():
+            order = checkout_cart(self.get_cart())
+            return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
+
+        return idempotent(request, "orders.checkout", place_order)
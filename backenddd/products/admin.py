@@ -1,8 +1,198 @@
-from django.contrib import admin
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Min
+from django.db.models.functions import Upper
+from django.utils import timezone
+from django.utils.functional import cached_property
+from . import cache as product_cache
+from . import changes
+from . import shards
 from .models import Product
+from .storefront import invalidate_storefront
+
+
+def performance_mode():
+    """PRODUCT_ADMIN_PERFORMANCE_MODE: changelist settings that stay fast on huge catalogs"""
+    return getattr(settings, 'PRODUCT_ADMIN_PERFORMANCE_MODE', True)
+
+
+def estimated_row_count(queryset):
+    """
+    A cheap estimate of the number of rows in the queryset's table: the
+    planner statistics on PostgreSQL and MySQL, the id range elsewhere.
+    With seller shards it is the sum of the shards' estimates.
+    """
+    return sum(_table_estimate(part) for part in shards.each(queryset))
+
+
+def _table_estimate(queryset):
+    model = queryset.model
+    connection = connections[queryset.db]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+            row = cursor.fetchone()
+            if row and row[0] > 0:
+                return row[0]
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() AND table_name = %s',
+                [table],
+            )
+            row = cursor.fetchone()
+            if row and row[0]:
+                return row[0]
+    # Two lookups on the primary key index
+    bounds = model._default_manager.using(queryset.db).aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return 0
+    return bounds['high'] - bounds['low'] + 1
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never runs an unbounded COUNT(*).
+
+    The unfiltered list uses the table estimate. Filtered and searched lists
+    count at most PRODUCT_ADMIN_COUNT_LIMIT rows, so paging stops there.
+    Narrow the filter to reach further.
+    """
+
+    @cached_property
+    def count(self):
+        limit = getattr(settings, 'PRODUCT_ADMIN_COUNT_LIMIT', 10000)
+        queryset = self.object_list.order_by()
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset)
+            if estimate > limit:
+                return estimate
+        # Each database counts at most `limit` rows (one or each seller shard)
+        return min(limit, sum(part[:limit].count() for part in shards.each(queryset)))
+
+
+class PriceRangeFilter(admin.SimpleListFilter):
+    """Fixed price buckets (PRODUCT_ADMIN_PRICE_BUCKETS) read with a range scan on product_price_idx"""
+    title = 'price'
+    parameter_name = 'price_range'
+
+    def buckets(self):
+        edges = getattr(settings, 'PRODUCT_ADMIN_PRICE_BUCKETS', [0, 10, 25, 50, 100, 250, 500, 1000])
+        for low, high in zip(edges, edges[1:] + [None]):
+            if high is None:
+                yield f'{low}-', f'{low} and up', low, None
+            else:
+                yield f'{low}-{high}', f'{low} to {high}', low, high
+
+    def lookups(self, request, model_admin):
+        return [(value, label) for value, label, _, _ in self.buckets()]
+
+    def queryset(self, request, queryset):
+        for value, _, low, high in self.buckets():
+            if value == self.value():
+                queryset = queryset.filter(price__gte=Decimal(low))
+                if high is not None:
+                    queryset = queryset.filter(price__lt=Decimal(high))
+                return queryset
+        return queryset
+
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('id', 'title', 'price')
-    search_fields = ('title', 'description')
-    list_filter = ('price',)
\ No newline at end of file
+    list_display = ('id', 'title', 'price', 'stock', 'seller')
+    # seller is shown in every row: join it instead of one query per row
+    list_select_related = ('seller',)
+    # Search the title by prefix (product_title_upper_idx) or an exact id
+    search_fields = ('title',)
+    # Sellers are picked by id; a dropdown of every user doesn't scale
+    raw_id_fields = ('seller',)
+    actions = ['mark_out_of_stock', 'clear_discount']
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if shards.enabled():
+            # The products are spread over the shards and their sellers are
+            # on 'default': read every shard and prefetch the sellers
+            return shards.catalog(queryset.prefetch_related('seller'))
+        return queryset
+
+    def get_list_select_related(self, request):
+        # A join can't reach the sellers from a shard (see get_queryset)
+        if shards.enabled():
+            return ()
+        return self.list_select_related
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        if shards.enabled():
+            # Django's delete collects related rows on a single database
+            actions.pop('delete_selected', None)
+        return actions
+
+    @property
+    def show_full_result_count(self):
+        # The "x of y" header runs a second COUNT(*) over the whole table
+        return not performance_mode()
+
+    def get_list_filter(self, request):
+        if performance_mode():
+            return (PriceRangeFilter, 'category')
+        return ('price',)
+
+    def get_search_fields(self, request):
+        if performance_mode():
+            return self.search_fields
+        return ('title', 'description')
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        if performance_mode():
+            return EstimatedCountPaginator(queryset, per_page, orphans, allow_empty_first_page)
+        return super().get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
+
+    def get_search_results(self, request, queryset, search_term):
+        if not performance_mode():
+            return super().get_search_results(request, queryset, search_term)
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.isdigit():
+            return queryset.filter(pk=int(term)), False
+        # A range on UPPER(title) can use the expression index; istartswith
+        # then drops the rows a non-C collation sorts into the range
+        prefix = term.upper()
+        queryset = (
+            queryset.alias(title_upper=Upper('title'))
+            .filter(title_upper__gte=prefix, title_upper__lt=prefix + '\U0010ffff')
+            .filter(title__istartswith=term)
+        )
+        return queryset, False
+
+    # Bulk actions ------------------------------------------------------------
+    # Each action is one UPDATE over the selection (or the whole filtered
+    # list with "select all"), so no rows are loaded into Python
+
+    def bulk_update(self, request, queryset, message, **values):
+        updated = 0
+        # With seller shards the selection spans every shard: one UPDATE each
+        with shards.atomic(*shards.databases()):
+            for part in shards.each(queryset.order_by()):
+                # update() skips post_save, so log the changes and drop the
+                # cached copies of the selected products ourselves
+                product_ids = changes.record_queryset(part)
+                updated += part.update(updated_at=timezone.now(), **values)
+                product_cache.invalidate(*product_ids, using=part.db)
+            shards.on_commit(invalidate_storefront, *shards.databases())
+        self.message_user(request, message % updated, messages.SUCCESS)
+
+    @admin.action(description='Mark selected products out of stock')
+    def mark_out_of_stock(self, request, queryset):
+        self.bulk_update(request, queryset, '%d products marked out of stock.', stock=0)
+
+    @admin.action(description='Remove discount from selected products')
+    def clear_discount(self, request, queryset):
+        self.bulk_update(request, queryset, 'Removed the discount from %d products.', discount=0)
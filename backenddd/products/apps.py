@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ProductsConfig(AppConfig):
     name = 'products'
+
+    def ready(self):
+        # Register signal handlers that keep in-memory indexes up to date
+        from . import signals  # noqa: F401
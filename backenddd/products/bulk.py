@@ -0,0 +1,105 @@
+# This file applies seller price and discount changes to many products with
+# one UPDATE. The new value is an F() expression evaluated by the database, so
+# a sale over 50,000 products is a single statement instead of 50,000 saves.
+import re
+from decimal import Decimal
+
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Max, Min
+from django.db.models.functions import Round
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from . import cache as product_cache
+from . import changes
+from . import shards
+from .storefront import invalidate_storefront
+
+# Allowed range of each column after the change, matching the serializer
+# checks and the column sizes (max_digits)
+LIMITS = {
+    'price': (Decimal('0.01'), Decimal('99999999.99')),
+    'discount': (Decimal('0'), Decimal('100')),
+}
+
+
+def filter_products(queryset, category=None, brand=None, tag=None, ids=None):
+    """Narrow a seller's products by the bulk request filters"""
+    if category is not None:
+        queryset = queryset.filter(category__iexact=category)
+    if brand is not None:
+        queryset = queryset.filter(brand__iexact=brand)
+    if tag is not None:
+        # tags is a comma-separated list: match one whole entry
+        queryset = queryset.filter(tags__iregex=rf'(^|,)\s*{re.escape(tag.strip())}\s*(,|$)')
+    if ids is not None:
+        queryset = queryset.filter(pk__in=ids)
+    return queryset
+
+
+def new_value(field, mode, value):
+    """The changed column as a database expression, rounded to cents"""
+    if mode == 'percent':
+        expression = F(field) * (1 + value / 100)
+    else:
+        expression = F(field) + value
+    return ExpressionWrapper(
+        Round(expression, 2),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+def to_cents(value):
+    # Some backends return aggregates of decimals with extra digits
+    return value.quantize(Decimal('0.01')) if value is not None else None
+
+
+def check_range(field, low, high):
+    """Raise a 400 if any new value falls outside the column's allowed range"""
+    minimum, maximum = LIMITS[field]
+    if low is not None and low < minimum:
+        raise ValidationError({'value': [f"This change would set a {field} to {to_cents(low)} (minimum {minimum})."]})
+    if high is not None and high > maximum:
+        raise ValidationError({'value': [f"This change would set a {field} to {to_cents(high)} (maximum {maximum})."]})
+
+
+def apply_bulk_pricing(queryset, field, mode, value, dry_run=False):
+    """
+    Change `field` for every product in `queryset` with a single UPDATE.
+
+    A dry run only aggregates the would-be values. A real run updates first,
+    then checks the stored values in the same transaction and rolls back if
+    any is out of range, so a concurrent edit can't slip past the check.
+    Returns {matched, updated, dry_run, new_min, new_max}.
+    """
+    queryset = queryset.order_by()
+    expression = new_value(field, mode, value)
+    if dry_run:
+        preview = queryset.aggregate(matched=Count('pk'), low=Min(expression), high=Max(expression))
+        check_range(field, preview['low'], preview['high'])
+        return {
+            'matched': preview['matched'],
+            'updated': 0,
+            'dry_run': True,
+            'new_min': to_cents(preview['low']),
+            'new_max': to_cents(preview['high']),
+        }
+
+    # The change log lives on 'default': with seller shards the products don't,
+    # and a rollback must drop both
+    with shards.atomic(queryset.db):
+        # Logged before the UPDATE, which may move rows out of the queryset
+        product_ids = changes.record_queryset(queryset)
+        updated = queryset.update(**{field: expression, 'updated_at': timezone.now()})
+        result = queryset.aggregate(low=Min(field), high=Max(field))
+        check_range(field, result['low'], result['high'])
+        if updated:
+            # update() skips post_save, so drop the cached copies ourselves
+            # (only these: other sellers' products stay cached)
+            product_cache.invalidate(*product_ids, using=queryset.db)
+            shards.on_commit(invalidate_storefront, queryset.db)
+    return {
+        'matched': updated,
+        'updated': updated,
+        'dry_run': False,
+        'new_min': to_cents(result['low']),
+        'new_max': to_cents(result['high']),
+    }
@@ -0,0 +1,391 @@
+# This file caches serialized products so reads by id skip the database.
+#
+# There are two levels: a small LRU dictionary inside each process, in front
+# of the shared Django cache (memcached/Redis in production). Keys contain
+# the product id and a version: PRODUCT_CACHE_VERSION (bump it when the
+# serializer output changes) plus a generation counter that bulk jobs
+# increment to drop every product at once. The generation is a row in the
+# database (ProductCacheGeneration), so a bump from a management command
+# reaches every worker; each process re-reads it every
+# PRODUCT_CACHE_LOCAL_TTL seconds.
+#
+# Each product also has a stamp in the shared cache, replaced by every write
+# (see signals.py and the places that change products with
+# queryset.update()). A loaded product is stored together with the stamp
+# read before the database was, and only served while that stamp is still
+# current: a slow read that saw the row before a write can't cache the old
+# row after the write cleared it. Other processes only notice writes
+# through the shared cache, so their local copies are kept for at most
+# PRODUCT_CACHE_LOCAL_TTL seconds.
+import pickle
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import F
+from . import shards
+
+# The one ProductCacheGeneration row
+GENERATION_ROW = 1
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def shared_cache():
+    return caches[_setting('PRODUCT_CACHE_ALIAS', 'default')]
+
+
+def stamp_key(product_id):
+    return f"product:stamp:{product_id}"
+
+
+def new_stamp():
+    return secrets.token_hex(8)
+
+
+class LocalLRU:
+    """
+    Bounded in-process LRU of {key: (expires_at, data, size)}.
+
+    Size is the pickled size of the entry, used only for the memory metric.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, data, ttl):
+        size = len(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.monotonic() + ttl, data, size)
+            self.bytes += size
+            while len(self.entries) > self.max_entries:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def _remove(self, key):
+        self.bytes -= self.entries.pop(key)[2]
+
+
+class ProductCache:
+    """Read-through product cache with metrics and a stampede guard"""
+
+    def __init__(self):
+        self.local = LocalLRU(_setting('PRODUCT_CACHE_LOCAL_MAX_ENTRIES', 2000))
+        self.counters = {
+            'local_hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+            'loads': 0,
+            'stampede_waits': 0,
+        }
+        self.counters_lock = threading.Lock()
+        # Per-key locks so threads of one process load a product only once
+        self.key_locks = {}
+        self.key_locks_lock = threading.Lock()
+        self.generation = None
+        self.generation_checked_at = 0.0
+
+    # Keys ------------------------------------------------------------------
+
+    def current_generation(self):
+        """The generation counter from the database, re-read at most every local TTL"""
+        from .models import ProductCacheGeneration
+
+        now = time.monotonic()
+        if self.generation is None or now - self.generation_checked_at > _setting('PRODUCT_CACHE_LOCAL_TTL', 5):
+            generation = (
+                ProductCacheGeneration.objects.filter(pk=GENERATION_ROW).values_list('generation', flat=True).first()
+                or 1
+            )
+            if generation != self.generation:
+                # Everything cached under the old generation is unreachable now
+                self.local.clear()
+            self.generation = generation
+            self.generation_checked_at = now
+        return self.generation
+
+    def key(self, product_id):
+        return f"product:v{_setting('PRODUCT_CACHE_VERSION', 1)}:g{self.current_generation()}:{product_id}"
+
+    # Reads -----------------------------------------------------------------
+
+    def count(self, name, amount=1):
+        with self.counters_lock:
+            self.counters[name] += amount
+
+    def get_many(self, product_ids, load_many):
+        """
+        Return {product_id: data} for the ids that exist.
+
+        Local hits are served from memory, then one get_many() asks the
+        shared cache, and whatever is still missing is passed to
+        load_many(ids), whose results are cached at both levels.
+        """
+        found = {}
+        keys = {}
+        for product_id in product_ids:
+            key = self.key(product_id)
+            data = self.local.get(key)
+            if data is not None:
+                found[product_id] = data
+            else:
+                keys[key] = product_id
+        self.count('local_hits', len(found))
+
+        stamps = {}
+        if keys:
+            shared, stamps = self.read_shared(list(keys.values()))
+            found.update(shared)
+
+        misses = [product_id for product_id in product_ids if product_id not in found]
+        if misses:
+            found.update(self.load(misses, stamps, load_many))
+        return found
+
+    def get(self, product_id, load_many):
+        """
+        Return the data for one product (or None), letting only one caller
+        load a missing product at a time.
+
+        Threads of this process wait on a per-key lock; other processes see
+        a short-lived lock key in the shared cache and poll for the value
+        instead of all querying the database for the same hot product.
+        """
+        key = self.key(product_id)
+        data = self.local.get(key)
+        if data is not None:
+            self.count('local_hits')
+            return data
+
+        with self.key_lock(key):
+            # Another thread may have filled the cache while we waited
+            data = self.local.get(key)
+            if data is not None:
+                self.count('local_hits')
+                return data
+            found, stamps = self.read_shared([product_id])
+            if found:
+                return found[product_id]
+
+            shared = shared_cache()
+            lock_key = f"{key}:loading"
+            lock_timeout = _setting('PRODUCT_CACHE_LOCK_TIMEOUT', 5)
+            owns_lock = shared.add(lock_key, 1, lock_timeout)
+            if not owns_lock:
+                # Another process is loading this product: wait for its result
+                self.count('stampede_waits')
+                deadline = time.monotonic() + lock_timeout
+                while time.monotonic() < deadline:
+                    time.sleep(0.01)
+                    found, _ = self.read_shared([product_id], count_hit=False)
+                    if found:
+                        self.count('shared_hits')
+                        return found[product_id]
+                    if shared.get(lock_key) is None:
+                        # The loader finished without caching anything
+                        # (e.g. the product doesn't exist)
+                        break
+            try:
+                return self.load([product_id], stamps, load_many).get(product_id)
+            finally:
+                if owns_lock:
+                    shared.delete(lock_key)
+
+    def read_shared(self, product_ids, count_hit=True):
+        """
+        ({product_id: data} for the shared entries whose stamp is still
+        current, {product_id: current stamp or None}), in one get_many().
+        """
+        keys = {self.key(product_id): product_id for product_id in product_ids}
+        stamp_keys = {stamp_key(product_id): product_id for product_id in product_ids}
+        values = shared_cache().get_many([*keys, *stamp_keys])
+        stamps = {product_id: values.get(key) for key, product_id in stamp_keys.items()}
+        found = {}
+        for key, product_id in keys.items():
+            entry = values.get(key)
+            if entry is not None and stamps[product_id] is not None and entry[0] == stamps[product_id]:
+                found[product_id] = entry[1]
+                self.local.set(key, entry[1], _setting('PRODUCT_CACHE_LOCAL_TTL', 5))
+        if count_hit:
+            self.count('shared_hits', len(found))
+        return found, stamps
+
+    def load(self, product_ids, stamps, load_many):
+        """
+        load_many(product_ids), cached under the stamps read before the
+        database (products without a stamp get one first).
+        """
+        missing = {stamp_key(product_id): product_id for product_id in product_ids if stamps.get(product_id) is None}
+        if missing:
+            shared = shared_cache()
+            for key in missing:
+                shared.add(key, new_stamp(), None)
+            # Another process may have added (or a write replaced) it meanwhile
+            stamps = {**stamps, **{missing[key]: value for key, value in shared.get_many(list(missing)).items()}}
+        self.count('misses', len(product_ids))
+        self.count('loads')
+        loaded = load_many(product_ids)
+        self.store(loaded, stamps)
+        return loaded
+
+    def key_lock(self, key):
+        with self.key_locks_lock:
+            lock = self.key_locks.get(key)
+            if lock is None:
+                lock = self.key_locks[key] = _KeyLock(self, key)
+            lock.users += 1
+        return lock
+
+    # Writes ----------------------------------------------------------------
+
+    def store(self, serialized, stamps):
+        """Cache {product_id: data} at both levels, each under its stamp from `stamps`"""
+        local_ttl = _setting('PRODUCT_CACHE_LOCAL_TTL', 5)
+        entries = {
+            self.key(product_id): (stamps[product_id], data)
+            for product_id, data in serialized.items()
+            if stamps.get(product_id) is not None
+        }
+        if not entries:
+            return
+        shared_cache().set_many(entries, _setting('PRODUCT_CACHE_TIMEOUT', 300))
+        for key, (stamp, data) in entries.items():
+            self.local.set(key, data, local_ttl)
+
+    def delete(self, product_ids):
+        """Replace the products' stamps, so no entry stored before now is served again"""
+        keys = [self.key(product_id) for product_id in product_ids]
+        shared = shared_cache()
+        shared.set_many({stamp_key(product_id): new_stamp() for product_id in product_ids}, None)
+        shared.delete_many(keys)
+        for key in keys:
+            self.local.delete(key)
+
+    def bump_generation(self):
+        from .models import ProductCacheGeneration
+
+        ProductCacheGeneration.objects.get_or_create(pk=GENERATION_ROW)
+        ProductCacheGeneration.objects.filter(pk=GENERATION_ROW).update(generation=F('generation') + 1)
+        self.generation = None
+        self.local.clear()
+
+    # Metrics ---------------------------------------------------------------
+
+    def stats(self):
+        with self.counters_lock:
+            counters = dict(self.counters)
+        lookups = counters['local_hits'] + counters['shared_hits'] + counters['misses']
+        hits = counters['local_hits'] + counters['shared_hits']
+        return {
+            **counters,
+            'lookups': lookups,
+            'hit_rate': round(hits / lookups, 4) if lookups else None,
+            'local_entries': len(self.local.entries),
+            'local_max_entries': self.local.max_entries,
+            'local_bytes': self.local.bytes,
+            'evictions': self.local.evictions,
+            'generation': self.generation,
+        }
+
+
+class _KeyLock:
+    """A per-key lock that removes itself from the table when the last user leaves"""
+
+    def __init__(self, owner, key):
+        self.owner = owner
+        self.key = key
+        self.lock = threading.Lock()
+        self.users = 0
+
+    def __enter__(self):
+        self.lock.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+        with self.owner.key_locks_lock:
+            self.users -= 1
+            if self.users == 0:
+                self.owner.key_locks.pop(self.key, None)
+
+
+_product_cache = None
+_product_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """The process-wide ProductCache"""
+    global _product_cache
+    if _product_cache is None:
+        with _product_cache_lock:
+            if _product_cache is None:
+                _product_cache = ProductCache()
+    return _product_cache
+
+
+def reset_cache():
+    """Forget the process-wide cache object (used by tests)"""
+    global _product_cache
+    _product_cache = None
+
+
+def get_many(product_ids, load_many):
+    return get_cache().get_many(product_ids, load_many)
+
+
+def get(product_id, load_many):
+    return get_cache().get(product_id, load_many)
+
+
+def invalidate(*product_ids, using=DEFAULT_DB_ALIAS):
+    """Forget cached products (after the current transaction on their database `using` commits)"""
+    product_ids = list(product_ids)
+    # Only after commit: a read taking the new stamp before our write is
+    # visible would cache the old row under it
+    shards.on_commit(lambda: get_cache().delete(product_ids), using)
+
+
+def invalidate_all(*databases):
+    """
+    Drop every cached product in every process, e.g. after a bulk import or
+    UPDATE (once 'default' and the written `databases` have committed)
+    """
+    shards.on_commit(lambda: get_cache().bump_generation(), *databases)
+
+
+def stats():
+    return get_cache().stats()
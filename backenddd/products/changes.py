@@ -0,0 +1,190 @@
+# This file keeps the product change log. Every product insert, update and
+# delete adds a ProductChange row; its sequence number is the sync token.
+# A client that remembers the last token it saw asks
+# /api/products/changes/?since=<token> for what happened afterwards, so a
+# sync costs as much as what changed, not as much as the catalog.
+#
+# Writes made with queryset.update() or bulk_create() skip the model signals,
+# so the code doing them calls record() or record_queryset() itself (next to
+# its product cache invalidation). Readers (the changes endpoint and the
+# suggest index in products/suggest.py) only see settled changes: see
+# settled_before().
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Exists, Max, OuterRef
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from . import shards
+from .models import ProductChange, ProductChangeCompaction
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _changes():
+    # The log always lives on 'default', even with seller shards
+    return ProductChange.objects.using(DEFAULT_DB_ALIAS)
+
+
+# Recording -------------------------------------------------------------------
+
+def record(product_ids, op=ProductChange.UPSERT, using=DEFAULT_DB_ALIAS):
+    """
+    Add one change per product id. `using` is the database the products were
+    written to: the check for a late commit waits for it too.
+    """
+    product_ids = list(product_ids)
+    now = timezone.now()
+    _changes().bulk_create(
+        [ProductChange(product_id=product_id, op=op, changed_at=now) for product_id in product_ids],
+        batch_size=1000,
+    )
+    if any(transaction.get_connection(alias).in_atomic_block for alias in {DEFAULT_DB_ALIAS, using}):
+        shards.on_commit(lambda: _record_again_if_late(product_ids, op, now), using)
+
+
+def _record_again_if_late(product_ids, op, recorded_at):
+    """
+    Runs after the transaction that recorded the changes commits (and the
+    one that wrote the products, on a seller shard). If that took long enough for readers to have moved past their sequence numbers
+    (see settled_before()), the changes are added again at the end of the log.
+    """
+    settle = timedelta(seconds=_setting('PRODUCT_CHANGES_SETTLE_SECONDS', 2))
+    # Half the wait as a margin; 0 turns the wait, and this, off
+    if settle and timezone.now() - recorded_at >= settle / 2:
+        record(product_ids, op)
+
+
+def record_queryset(queryset, op=ProductChange.UPSERT, chunk_size=1000):
+    """Add one change per product in `queryset` (read in chunks of ids). Returns the ids."""
+    ids = queryset.order_by('pk').values_list('pk', flat=True)
+    recorded = []
+    while True:
+        chunk = list((ids.filter(pk__gt=recorded[-1]) if recorded else ids)[:chunk_size])
+        if not chunk:
+            return recorded
+        record(chunk, op, using=queryset.db)
+        recorded.extend(chunk)
+
+
+# Tokens ------------------------------------------------------------------------
+
+def encode_token(seq):
+    return str(seq)
+
+
+def decode_token(token):
+    """The sequence number in a ?since= token (ValidationError if it isn't one)"""
+    try:
+        seq = int(token)
+    except (TypeError, ValueError):
+        seq = -1
+    if seq < 0:
+        raise ValidationError({'since': ['Not a valid change token.']})
+    return seq
+
+
+def settled_before():
+    """
+    Changes recorded after this are not handed out yet.
+
+    A sequence number is taken when record() runs, but the change becomes
+    visible when its transaction commits, so a change with a lower number can
+    show up after a higher one was handed out. changed_at is the time record()
+    ran, not the commit time: waiting PRODUCT_CHANGES_SETTLE_SECONDS only
+    covers transactions that commit within that time of recording. Changes
+    of a transaction that commits later are recorded again at the end of the
+    log when it commits (_record_again_if_late), so a reader that moved past
+    them gets them then. The one gap left is a process dying between that
+    commit and the second record. (SQLite lets one writer in at a time, so
+    there numbers always commit in order.)
+    """
+    return timezone.now() - timedelta(seconds=_setting('PRODUCT_CHANGES_SETTLE_SECONDS', 2))
+
+
+def head():
+    """(seq, changed_at) of the newest settled change, (0, None) for an empty log"""
+    row = (
+        _changes().filter(changed_at__lte=settled_before())
+        .order_by('-seq').values_list('seq', 'changed_at').first()
+    )
+    return tuple(row) if row else (0, None)
+
+
+def horizon():
+    """Tokens below this may have missed a delete dropped by compaction"""
+    return ProductChangeCompaction.objects.using(DEFAULT_DB_ALIAS).aggregate(horizon=Max('horizon'))['horizon'] or 0
+
+
+def needs_resync(seq):
+    """True if a client at `seq` can't catch up from the log and must download the catalog"""
+    newest = _changes().aggregate(seq=Max('seq'))['seq'] or 0
+    # A token from before a compaction, or from a log that was since reset
+    return seq < horizon() or seq > max(newest, horizon())
+
+
+def changes_since(seq, limit):
+    """
+    Up to `limit` settled changes after `seq`, as (changes, next seq, has more).
+    A product changed several times in the page is only listed once, at
+    its newest change.
+    """
+    rows = list(
+        _changes().filter(seq__gt=seq, changed_at__lte=settled_before())
+        .order_by('seq').values_list('seq', 'product_id', 'op')[:limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    latest = {}
+    for row in rows:
+        latest[row[1]] = row
+    changes = sorted(latest.values())
+    return changes, (rows[-1][0] if rows else seq), has_more
+
+
+# Compaction --------------------------------------------------------------------
+
+def compact(retention_days=None, chunk_size=1000, log=None):
+    """
+    Shrink the log in chunks of `chunk_size` rows: drop every change that a
+    newer change of the same product supersedes, then the deletes older than
+    `retention_days` (PRODUCT_CHANGES_RETENTION_DAYS). Returns the run.
+    """
+    if retention_days is None:
+        retention_days = _setting('PRODUCT_CHANGES_RETENTION_DAYS', 30)
+    run = ProductChangeCompaction.objects.using(DEFAULT_DB_ALIAS).create(horizon=horizon())
+
+    newer = _changes().filter(product_id=OuterRef('product_id'), seq__gt=OuterRef('seq'))
+    superseded = _changes().filter(Exists(newer))
+    run.superseded_removed = _delete_in_chunks(superseded, chunk_size, log, 'superseded changes')
+    run.save(update_fields=['superseded_removed'])
+
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    old_deletes = _changes().filter(op=ProductChange.DELETE, changed_at__lt=cutoff)
+    newest_delete = old_deletes.aggregate(seq=Max('seq'))['seq']
+    if newest_delete is not None:
+        # Published first, so no client is told it is up to date in between
+        run.horizon = max(run.horizon, newest_delete)
+        run.save(update_fields=['horizon'])
+        run.deletes_removed = _delete_in_chunks(
+            old_deletes.filter(seq__lte=newest_delete), chunk_size, log, 'old deletes'
+        )
+
+    run.finished_at = timezone.now()
+    run.save(update_fields=['deletes_removed', 'finished_at'])
+    return run
+
+
+def _delete_in_chunks(queryset, chunk_size, log, label):
+    deleted = 0
+    while True:
+        seqs = list(queryset.order_by('seq').values_list('seq', flat=True)[:chunk_size])
+        if not seqs:
+            return deleted
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            deleted += _changes().filter(seq__in=seqs).delete()[0]
+        if log:
+            log(f'Removed {deleted} {label} so far')
@@ -2,6 +2,7 @@ import random
 from decimal import Decimal, ROUND_HALF_UP
 from django.core.management.base import BaseCommand
 from products.models import Product
+from products import shards
 
 class Command(BaseCommand):
     help = "Backfill ratings and reviews_count for existing products"
@@ -24,7 +25,8 @@ class Command(BaseCommand):
         seed = options.get("seed", 123)
         random.seed(seed)
 
-        qs = Product.objects.all()
+        # Every seller shard (or 'default'), in id order so --seed gives the same ratings
+        qs = shards.catalog(Product.objects.order_by("id"))
         if not force:
             qs = qs.filter(rating=Decimal("0"))
 
@@ -38,7 +40,9 @@ class Command(BaseCommand):
 
             p.rating = rating_dec
             p.reviews_count = reviews
-            p.save(update_fields=["rating", "reviews_count"])
+            # Keep the running star sum consistent with the seeded average
+            p.rating_sum = round(rating_dec * reviews)
+            p.save(update_fields=["rating", "reviews_count", "rating_sum"])
             updated += 1
 
         self.stdout.write(
@@ -0,0 +1,99 @@
+import gzip
+import random
+import time
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from backenddd import renderers
+from backenddd.middleware import brotli
+from products import shards
+from products.models import Product
+from products.serializers import ProductSerializer
+from orders.models import Order, OrderItem
+from orders.serializers import OrderSerializer
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark serialization, JSON encoding and compressed size for the "
+        "/api/products/ and /api/orders/ payloads (data is rolled back afterwards)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=5000, help="Catalog size (default: 5000)")
+        parser.add_argument("--orders", type=int, default=200, help="Orders for one customer (default: 200)")
+        parser.add_argument("--repeat", type=int, default=3, help="Best-of-N timing runs (default: 3)")
+
+    def handle(self, *args, **options):
+        # The synthetic rows are rolled back on 'default' only: with seller
+        # shards they would be left behind on the shards
+        if shards.enabled():
+            raise CommandError("This benchmark needs a single database: run it with SELLER_SHARDS empty")
+        self.repeat = max(1, options["repeat"])
+        with transaction.atomic():
+            products, orders = self.create_data(options["products"], options["orders"])
+            self.report("/api/products/", lambda: ProductSerializer(products(), many=True).data)
+            self.report("/api/orders/", lambda: OrderSerializer(orders(), many=True).data)
+            # Never keep the synthetic rows
+            transaction.set_rollback(True)
+
+    def create_data(self, product_count, order_count):
+        random.seed(7)
+        seller = User.objects.create(username="bench-seller")
+        customer = User.objects.create(username="bench-customer")
+        Product.objects.bulk_create(
+            Product(
+                seller=seller,
+                title=f"Bench Product {i}",
+                description="A realistic product description used for encoding benchmarks. " * 3,
+                price=Decimal(random.randint(500, 25000)) / 100,
+                stock=random.randint(0, 500),
+                category=random.choice(["phones", "laptops", "groceries", "furniture"]),
+                brand=random.choice(["Acme", "Globex", "Initech"]),
+                tags="sale,new",
+                image_url=f"https://picsum.photos/seed/bench-{i}/600/600",
+            )
+            for i in range(product_count)
+        )
+        product_ids = list(Product.objects.filter(seller=seller).values_list("id", flat=True))
+        new_orders = Order.objects.bulk_create(Order(user=customer) for _ in range(order_count))
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product_id=random.choice(product_ids), quantity=random.randint(1, 4))
+            for order in new_orders
+            for _ in range(random.randint(1, 5))
+        )
+        return (
+            lambda: Product.objects.filter(seller=seller),
+            lambda: Order.objects.filter(user=customer),
+        )
+
+    def best_of(self, func):
+        best = None
+        result = None
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best * 1000, result
+
+    def report(self, endpoint, serialize):
+        serialize_ms, data = self.best_of(serialize)
+        self.stdout.write(f"\n{endpoint}: serialize {serialize_ms:.1f} ms")
+
+        candidates = [("before: JSONRenderer", JSONRenderer())]
+        if renderers.orjson is not None:
+            candidates.append(("after: FastJSONRenderer", renderers.FastJSONRenderer()))
+        else:
+            self.stdout.write("  (orjson not installed: FastJSONRenderer uses the stdlib path)")
+
+        for label, renderer in candidates:
+            encode_ms, body = self.best_of(lambda: renderer.render(data))
+            line = f"  {label:<26} encode {encode_ms:7.1f} ms  raw {len(body):>9} B"
+            gzip_ms, gzipped = self.best_of(lambda: gzip.compress(body, compresslevel=6))
+            line += f"  gzip {len(gzipped):>8} B ({gzip_ms:.1f} ms)"
+            if brotli is not None:
+                br_ms, compressed = self.best_of(lambda: brotli.compress(body, quality=4))
+                line += f"  br {len(compressed):>8} B ({br_ms:.1f} ms)"
+            self.stdout.write(line)
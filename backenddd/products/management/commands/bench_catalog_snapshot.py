@@ -0,0 +1,117 @@
+import itertools
+import random
+import shutil
+import tempfile
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+from products import shards, snapshot
+from products.models import Product
+from products.views import ProductViewSet
+
+WORDS = ["wireless", "cotton", "leather", "steel", "organic", "smart", "portable", "classic",
+         "lamp", "chair", "phone", "case", "shirt", "shoe", "watch", "bottle", "speaker"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare catalog read throughput of the database and snapshot backends "
+        "on synthetic products (data is rolled back afterwards)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=50000, help="Catalog size (default: 50000)")
+        parser.add_argument("--requests", type=int, default=500, help="Requests per scenario (default: 500)")
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        # The synthetic rows are rolled back on 'default' only: with seller
+        # shards they would be left behind on the shards
+        if shards.enabled():
+            raise CommandError("This benchmark needs a single database: run it with SELLER_SHARDS empty")
+        if snapshot.np is None:
+            raise CommandError("NumPy is required for this benchmark")
+        directory = tempfile.mkdtemp(prefix="catalog-bench-")
+        try:
+            with transaction.atomic():
+                product_ids = self.create_products(options["products"], options["seed"])
+                started = time.perf_counter()
+                snapshot.export_snapshot(directory=directory)
+                self.stdout.write(f"export of {len(product_ids)} products: {time.perf_counter() - started:.1f}s")
+                with override_settings(CATALOG_SNAPSHOT_DIR=directory):
+                    self.run_scenarios(product_ids, options["requests"], options["seed"])
+                # Never keep the synthetic rows
+                transaction.set_rollback(True)
+        finally:
+            snapshot.reset_snapshot()
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def create_products(self, count, seed):
+        rng = random.Random(seed)
+        seller = User.objects.create(username="snapshot-bench-seller")
+        Product.objects.bulk_create(
+            (
+                Product(
+                    seller=seller,
+                    title=" ".join(rng.choices(WORDS, k=3)),
+                    description=" ".join(rng.choices(WORDS, k=15)),
+                    price=Decimal(rng.randint(500, 25000)) / 100,
+                    stock=rng.randint(0, 500),
+                    category=rng.choice(["phones", "laptops", "groceries", "furniture"]),
+                    brand=rng.choice(["Acme", "Globex", "Initech"]),
+                    rating=Decimal(rng.randint(0, 500)) / 100,
+                    image_url=f"https://picsum.photos/seed/bench-{number}/600/600",
+                )
+                for number in range(count)
+            ),
+            batch_size=5000,
+        )
+        return list(Product.objects.filter(seller=seller).values_list("id", flat=True))
+
+    def run_scenarios(self, product_ids, requests, seed):
+        factory = APIRequestFactory(HTTP_HOST="localhost")
+        # No rate limiting: we want to measure the view, not the throttle
+        list_view = ProductViewSet.as_view({"get": "list"}, throttle_classes=[])
+        detail_view = ProductViewSet.as_view({"get": "retrieve"}, throttle_classes=[])
+
+        def list_request(params, url="/api/products/"):
+            return lambda: list_view(factory.get(url, params))
+
+        def deep_page():
+            # The URL 20 pages in (each backend has its own cursor format)
+            url = "/api/products/"
+            for _ in range(20):
+                url = list_view(factory.get(url)).data["next"]
+            return list_request({}, url)
+
+        rng = random.Random(seed)
+        retrieve_ids = itertools.cycle([rng.choice(product_ids) for _ in range(requests)])
+
+        scenarios = [
+            ("first page", lambda: list_request({})),
+            ("page 20", deep_page),
+            ("ordering=price", lambda: list_request({"ordering": "price"})),
+            ("search=leather", lambda: list_request({"search": "leather"})),
+            ("search=leather watch", lambda: list_request({"search": "leather watch", "ordering": "-rating"})),
+            ("retrieve", lambda: lambda: detail_view(factory.get("/api/products/x/"), pk=next(retrieve_ids))),
+        ]
+        self.stdout.write(f"{'scenario':<24} {'database':>12} {'snapshot':>12} {'speedup':>8}")
+        for name, make_request in scenarios:
+            rates = []
+            for backend in ("database", "snapshot"):
+                with override_settings(PRODUCT_READ_BACKEND=backend):
+                    send = make_request()
+                    send().render()  # warm up (opens the snapshot, fills caches)
+                    started = time.perf_counter()
+                    for _ in range(requests):
+                        response = send()
+                        response.render()
+                    rates.append(requests / (time.perf_counter() - started))
+            self.stdout.write(
+                f"{name:<24} {rates[0]:>8.0f} r/s {rates[1]:>8.0f} r/s {rates[1] / rates[0]:>7.1f}x"
+            )
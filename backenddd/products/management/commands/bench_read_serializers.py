@@ -0,0 +1,108 @@
+import random
+import time
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from backenddd import compiled
+from backenddd.renderers import FastJSONRenderer
+from products import shards
+from products.models import Product
+from products.serializers import ProductSerializer
+from orders.models import Order, OrderItem
+from orders.serializers import OrderSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Rows per second for the product and order list payloads, DRF serializers "
+        "against the compiled read path, queries included (data is rolled back afterwards)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=5000, help="Catalog size (default: 5000)")
+        parser.add_argument("--orders", type=int, default=200, help="Orders for one customer (default: 200)")
+        parser.add_argument("--repeat", type=int, default=3, help="Best-of-N timing runs (default: 3)")
+
+    def handle(self, *args, **options):
+        # The synthetic rows are rolled back on 'default' only: with seller
+        # shards they would be left behind on the shards
+        if shards.enabled():
+            raise CommandError("This benchmark needs a single database: run it with SELLER_SHARDS empty")
+        self.repeat = max(1, options["repeat"])
+        product_plan = compiled.get_compiled(ProductSerializer)
+        order_plan = compiled.get_compiled(OrderSerializer)
+        if product_plan is None or order_plan is None:
+            raise CommandError("ProductSerializer or OrderSerializer can't be compiled")
+        with transaction.atomic():
+            seller, customer = self.create_data(options["products"], options["orders"])
+            products = Product.objects.filter(seller=seller).order_by("id")
+            orders = Order.objects.filter(user=customer).order_by("-created_at", "-id")
+            self.stdout.write(f"{'payload':<16} {'serializer':<10} {'rows':>7} {'ms':>9} {'rows/s':>10}")
+            self.compare(
+                "products",
+                lambda: ProductSerializer(products.select_related("seller"), many=True).data,
+                lambda: product_plan.serialize_queryset(products),
+            )
+            self.compare(
+                "orders",
+                lambda: OrderSerializer(orders.prefetch_related("items__product__seller"), many=True).data,
+                lambda: order_plan.serialize_queryset(orders),
+            )
+            # Never keep the synthetic rows
+            transaction.set_rollback(True)
+
+    def create_data(self, product_count, order_count):
+        random.seed(7)
+        seller = User.objects.create(username="bench-read-seller")
+        customer = User.objects.create(username="bench-read-customer")
+        Product.objects.bulk_create(
+            Product(
+                seller=seller,
+                title=f"Bench Product {i}",
+                description="A realistic product description used for serializer benchmarks. " * 3,
+                price=Decimal(random.randint(500, 25000)) / 100,
+                stock=random.randint(0, 500),
+                category=random.choice(["phones", "laptops", "groceries", "furniture"]),
+                brand=random.choice(["Acme", "Globex", "Initech"]),
+                tags="sale,new",
+                discount=random.choice([Decimal("0"), Decimal("10"), Decimal("12.5")]),
+                image_url=f"https://picsum.photos/seed/bench-{i}/600/600",
+            )
+            for i in range(product_count)
+        )
+        products = list(Product.objects.filter(seller=seller).values_list("id", "price"))
+        new_orders = Order.objects.bulk_create(Order(user=customer) for _ in range(order_count))
+        OrderItem.objects.bulk_create(
+            OrderItem(
+                order=order, product_id=product_id, seller=seller, quantity=quantity,
+                unit_price=price, line_total=price * quantity,
+            )
+            for order in new_orders
+            for product_id, price in random.sample(products, random.randint(1, 5))
+            for quantity in [random.randint(1, 4)]
+        )
+        return seller, customer
+
+    def best_of(self, func):
+        best = None
+        result = None
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def compare(self, payload, drf, fast):
+        renderer = FastJSONRenderer()
+        drf_seconds, drf_data = self.best_of(drf)
+        fast_seconds, fast_data = self.best_of(fast)
+        if renderer.render(fast_data) != renderer.render(drf_data):
+            raise CommandError(f"The compiled {payload} payload differs from DRF's")
+        for label, seconds in (("drf", drf_seconds), ("compiled", fast_seconds)):
+            self.stdout.write(
+                f"{payload:<16} {label:<10} {len(drf_data):>7} {seconds * 1000:>9.1f} "
+                f"{len(drf_data) / seconds:>10.0f}"
+            )
+        self.stdout.write(f"{payload:<16} speedup {drf_seconds / fast_seconds:.1f}x")
@@ -0,0 +1,97 @@
+import random
+import resource
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from products import related
+
+WORDS = [
+    "wireless", "bluetooth", "cotton", "leather", "steel", "organic", "smart", "portable",
+    "classic", "premium", "mini", "pro", "ultra", "slim", "waterproof", "vintage",
+    "gaming", "kitchen", "garden", "outdoor", "travel", "sport", "kids", "office",
+    "lamp", "chair", "phone", "case", "shirt", "shoe", "watch", "bottle", "speaker",
+    "headphones", "charger", "backpack", "mug", "knife", "blender", "jacket",
+]
+CATEGORIES = ["electronics", "fashion", "home", "sports", "beauty", "toys", "books", "garden"]
+BRANDS = [f"brand{number}" for number in range(200)]
+
+
+def synthetic_rows(count, seed):
+    rng = random.Random(seed)
+    rows = []
+    for product_id in range(1, count + 1):
+        category = rng.choice(CATEGORIES)
+        rows.append({
+            "id": product_id,
+            "updated_at": None,
+            "title": " ".join(rng.choices(WORDS, k=4)),
+            "description": " ".join(rng.choices(WORDS, k=20)),
+            "category": category,
+            "brand": rng.choice(BRANDS),
+            "tags": f"{category} {rng.choice(WORDS)}",
+        })
+    return rows
+
+
+def synthetic_orders(products, orders, seed):
+    rng = random.Random(seed)
+    for order_id in range(orders):
+        for product_id in sorted(rng.sample(range(1, products + 1), rng.randint(1, 4))):
+            yield order_id, product_id
+
+
+def peak_memory_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = "Benchmark related-index build time, memory and lookup latency on synthetic products"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=100000)
+        parser.add_argument("--orders", type=int, default=50000)
+        parser.add_argument("--lookups", type=int, default=100000)
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        if related.np is None:
+            raise CommandError("NumPy is required for this benchmark")
+        count = options["products"]
+        directory = Path(tempfile.mkdtemp(prefix="related-bench-"))
+        try:
+            started = time.perf_counter()
+            rows = synthetic_rows(count, options["seed"])
+            generated = time.perf_counter() - started
+            memory_before = peak_memory_mb()
+
+            builder = related.RelatedIndexBuilder(directory=directory)
+            started = time.perf_counter()
+            # The synthetic catalog has no matching Order rows, so record no watermark
+            builder.latest_order_time = lambda: None
+            builder.build_full(
+                rows=rows,
+                order_lines=synthetic_orders(count, options["orders"], options["seed"]),
+            )
+            build_seconds = time.perf_counter() - started
+
+            size_mb = sum(path.stat().st_size for path in directory.rglob("*") if path.is_file()) / 2**20
+            index = related.RelatedIndex.open(directory)
+            rng = random.Random(options["seed"])
+            lookups = [rng.randint(1, count) for _ in range(options["lookups"])]
+            started = time.perf_counter()
+            for product_id in lookups:
+                index.lookup(product_id, 8)
+            lookup_us = (time.perf_counter() - started) / len(lookups) * 1e6
+
+            self.stdout.write(f"products:          {count}")
+            self.stdout.write(f"generate rows:     {generated:.1f}s")
+            self.stdout.write(f"build (full):      {build_seconds:.1f}s")
+            self.stdout.write(f"peak RSS:          {peak_memory_mb():.0f} MB (rows alone {memory_before:.0f} MB)")
+            self.stdout.write(f"index on disk:     {size_mb:.0f} MB")
+            self.stdout.write(f"lookup:            {lookup_us:.1f} us per product (mmap)")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
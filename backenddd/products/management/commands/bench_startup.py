@@ -0,0 +1,91 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter: boot Django, build the WSGI handler (which loads
+# the middleware) and serve the same request twice, printing the timings as JSON
+FIRST_REQUEST_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+from django.test import Client
+client = Client(HTTP_HOST="localhost")
+ready = time.perf_counter()
+first = client.get(sys.argv[1])
+served = time.perf_counter()
+client.get(sys.argv[1])
+print(json.dumps({
+    "setup": ready - started,
+    "first": served - ready,
+    "second": time.perf_counter() - served,
+    "status": first.status_code,
+}))
+"""
+
+DEFAULT_PROFILES = "backenddd.settings,backenddd.settings_api,backenddd.settings_commands"
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark cold-start time of `manage.py check` and of the first request "
+        "served by a new process, for each settings profile"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--profiles", default=DEFAULT_PROFILES,
+            help=f"Comma-separated settings modules (default: {DEFAULT_PROFILES})",
+        )
+        parser.add_argument(
+            "--path", default="/api/products/storefront/",
+            help="Request served by the first-request benchmark (default: /api/products/storefront/)",
+        )
+        parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement, median reported (default: 5)")
+
+    def handle(self, *args, **options):
+        repeat = max(1, options["repeat"])
+        profiles = [name.strip() for name in options["profiles"].split(",") if name.strip()]
+        self.stdout.write(
+            f"{'settings':<30} {'check':>9} {'process':>9} {'setup':>9} {'1st req':>9} {'2nd req':>9}"
+        )
+        for profile in profiles:
+            env = {**os.environ, "DJANGO_SETTINGS_MODULE": profile}
+            check = statistics.median(self.check_seconds(env) for _ in range(repeat))
+            runs = [self.first_request(env, options["path"]) for _ in range(repeat)]
+            statuses = {run["status"] for run in runs}
+            self.stdout.write(
+                f"{profile:<30} {check * 1000:>7.0f}ms "
+                + " ".join(
+                    f"{statistics.median(run[name] for run in runs) * 1000:>7.0f}ms"
+                    for name in ("process", "setup", "first", "second")
+                )
+            )
+            if statuses != {200}:
+                self.stderr.write(f"  {options['path']} answered {sorted(statuses)} (is the database migrated?)")
+
+    def run(self, command, env):
+        started = time.perf_counter()
+        result = subprocess.run(command, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        elapsed = time.perf_counter() - started
+        if result.returncode != 0:
+            raise CommandError(f"{' '.join(command)} failed:\n{result.stderr[-2000:]}")
+        return elapsed, result.stdout
+
+    def check_seconds(self, env):
+        elapsed, _ = self.run([sys.executable, "manage.py", "check"], env)
+        return elapsed
+
+    def first_request(self, env, path):
+        """Timings of one new process; "process" is the wall time until the first response"""
+        elapsed, output = self.run([sys.executable, "-c", FIRST_REQUEST_SCRIPT, path], env)
+        timings = json.loads(output.strip().splitlines()[-1])
+        # Everything after the first response (the second request, exit) is not startup
+        timings["process"] = elapsed - timings["second"]
+        return timings
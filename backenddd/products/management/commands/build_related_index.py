@@ -0,0 +1,40 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from products import related
+
+
+class Command(BaseCommand):
+    help = "Build or incrementally update the related-products index"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Rebuild from scratch (also refreshes document frequencies and buckets)",
+        )
+        parser.add_argument(
+            "--directory",
+            default=None,
+            help="Index directory (default: RELATED_INDEX_DIR setting)",
+        )
+
+    def handle(self, *args, **options):
+        if related.np is None:
+            raise CommandError("NumPy is required to build the related-products index")
+
+        builder = related.RelatedIndexBuilder(directory=options.get("directory"))
+        if options["full"]:
+            target = builder.build_full()
+        else:
+            # Falls back to a full build when no index exists yet
+            target = builder.build_incremental()
+
+        with open(target / "meta.json") as handle:
+            meta = json.load(handle)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Wrote {meta['kind']} index of {meta['products']} products to {target} "
+                f"in {meta['build_seconds']}s"
+            )
+        )
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from products.suggest import PrefixIndex
+from products.models import Product
+from products import shards
+
+class Command(BaseCommand):
+    help = "Build the autocomplete prefix index and save it as a snapshot file"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output",
+            default=None,
+            help="Snapshot path (default: PRODUCT_SUGGEST_SNAPSHOT setting)",
+        )
+
+    def handle(self, *args, **options):
+        output = options.get("output") or getattr(settings, "PRODUCT_SUGGEST_SNAPSHOT", None)
+        if not output:
+            raise CommandError("No output path given and PRODUCT_SUGGEST_SNAPSHOT is not set")
+
+        index = PrefixIndex()
+        # Every seller shard (or just 'default')
+        index.load_from_database(shards.catalog(Product.objects.all()))
+        index.dump(output)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Wrote {len(index)} suggestion terms to {output}")
+        )
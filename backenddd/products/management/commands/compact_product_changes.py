@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from products import changes
+
+
+class Command(BaseCommand):
+    help = "Drop superseded and old entries from the product change log, in chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--retention-days",
+            type=int,
+            default=None,
+            help="Keep deletes this many days (default: PRODUCT_CHANGES_RETENTION_DAYS)",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Rows deleted per transaction (default: 1000)",
+        )
+
+    def handle(self, *args, **options):
+        if options["retention_days"] is not None and options["retention_days"] < 0:
+            raise CommandError("--retention-days can't be negative")
+        run = changes.compact(
+            retention_days=options["retention_days"],
+            chunk_size=max(1, options["chunk_size"]),
+            log=self.stdout.write,
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Removed {run.superseded_removed} superseded changes and {run.deletes_removed} old deletes "
+                f"(tokens below {run.horizon} must resync)"
+            )
+        )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from products import snapshot
+
+
+class Command(BaseCommand):
+    help = "Export the product catalog into a memory-mappable snapshot for read-only nodes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--directory",
+            default=None,
+            help="Snapshot directory (default: CATALOG_SNAPSHOT_DIR setting)",
+        )
+
+    def handle(self, *args, **options):
+        if snapshot.np is None:
+            raise CommandError("NumPy is required to export the catalog snapshot")
+
+        target = snapshot.export_snapshot(directory=options.get("directory"))
+        size_mb = sum(path.stat().st_size for path in target.iterdir()) / 2**20
+        meta = snapshot.CatalogSnapshot(target).meta
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Wrote snapshot of {meta['products']} products ({size_mb:.1f} MB) to {target} "
+                f"in {meta['export_seconds']}s"
+            )
+        )
@@ -2,7 +2,9 @@ import random
 from decimal import Decimal, ROUND_HALF_UP
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
+from products import changes, shards
 from products.models import Product
+from products.storefront import invalidate_storefront
 
 class Command(BaseCommand):
     help = "Generate synthetic products with unique names, prices, images, and descriptions (default: 100)"
@@ -30,13 +32,18 @@ class Command(BaseCommand):
         # Deterministic randomness for repeatable seeds
         random.seed(42)
 
-        created_count = 0
+        # Avoid duplicate titles (read all the existing ones with one query per database)
+        titles = [f"Sample Product {i:03d}" for i in range(1, count + 1)]
+        existing = {
+            title
+            for queryset in shards.each(Product.objects.filter(title__startswith="Sample Product "))
+            for title in queryset.values_list("title", flat=True)
+        }
+        products = []
         skipped_count = 0
 
-        for i in range(1, count + 1):
-            title = f"Sample Product {i:03d}"
-            # Avoid duplicate titles
-            if Product.objects.filter(title=title).exists():
+        for i, title in enumerate(titles, start=1):
+            if title in existing:
                 skipped_count += 1
                 continue
 
@@ -56,17 +63,28 @@ class Command(BaseCommand):
             # Unique image via Picsum seed (no download required)
             image_url = f"https://picsum.photos/seed/product-{i}/600/600"
 
-            Product.objects.create(
+            rating = Decimal(str(random.uniform(1, 5))).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+            reviews_count = random.randint(0, 500)
+
+            products.append(Product(
                 seller=seller,
                 title=title,
                 description=description,
                 price=price_dec,
                 stock=stock,
                 image_url=image_url,
-                rating=Decimal(str(random.uniform(1, 5))).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP),
-                reviews_count=random.randint(0, 500),
-            )
-            created_count += 1
+                rating=rating,
+                reviews_count=reviews_count,
+                # Running star sum matching the seeded average
+                rating_sum=round(rating * reviews_count),
+            ))
+
+        with shards.atomic(*shards.databases()):
+            Product.objects.bulk_create(products, batch_size=500)
+            # bulk_create skips post_save, so add the inserts to the change log here
+            changes.record(product.pk for product in products)
+        invalidate_storefront()
+        created_count = len(products)
 
         self.stdout.write(
             self.style.SUCCESS(
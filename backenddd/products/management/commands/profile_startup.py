@@ -0,0 +1,94 @@
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# What the child process loads before it is measured
+TARGETS = {
+    # Settings and every app's models, admin and signals (what any command pays)
+    "setup": "import django; django.setup()",
+    # Plus the URLconf and all views (what a worker pays before its first request)
+    "urls": (
+        "import django; django.setup(); "
+        "from django.urls import get_resolver; get_resolver().url_patterns"
+    ),
+}
+
+
+def parse_importtime(output):
+    """[(module, self_us, cumulative_us)] from the stderr of `python -X importtime`"""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            self_us, cumulative_us = int(parts[0]), int(parts[1])
+        except ValueError:
+            # The header line ("self [us] | cumulative | imported package")
+            continue
+        rows.append((parts[2].strip(), self_us, cumulative_us))
+    return rows
+
+
+def group_name(module, depth):
+    return ".".join(module.split(".")[:depth])
+
+
+class Command(BaseCommand):
+    help = (
+        "Report how long process startup spends importing each package "
+        "(python -X importtime in a fresh interpreter, aggregated)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--settings-module",
+            default=os.environ.get("DJANGO_SETTINGS_MODULE", "backenddd.settings"),
+            help="Settings to profile, e.g. backenddd.settings_api (default: the current ones)",
+        )
+        parser.add_argument("--target", choices=sorted(TARGETS), default="urls")
+        parser.add_argument(
+            "--depth", type=int, default=2,
+            help="Dotted name parts to group by: 1 = top-level package, 2 = django.db, ... (default: 2)",
+        )
+        parser.add_argument("--top", type=int, default=25, help="Rows to show (default: 25)")
+
+    def handle(self, *args, **options):
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": options["settings_module"]}
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", TARGETS[options["target"]]],
+            cwd=settings.BASE_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise CommandError(f"Startup failed:\n{result.stderr[-2000:]}")
+        rows = parse_importtime(result.stderr)
+        if not rows:
+            raise CommandError("No import timings found in the output")
+
+        depth = max(1, options["depth"])
+        groups = defaultdict(lambda: [0, 0])
+        for module, self_us, _ in rows:
+            group = groups[group_name(module, depth)]
+            group[0] += self_us
+            group[1] += 1
+        total_us = sum(self_us for _, self_us, _ in rows)
+
+        self.stdout.write(
+            f"{options['settings_module']} ({options['target']}): "
+            f"{len(rows)} modules imported in {total_us / 1000:.1f} ms"
+        )
+        self.stdout.write(f"{'package':<40} {'ms':>8} {'share':>7} {'modules':>8}")
+        ranked = sorted(groups.items(), key=lambda item: item[1][0], reverse=True)
+        for name, (self_us, modules) in ranked[:options["top"]]:
+            self.stdout.write(
+                f"{name:<40} {self_us / 1000:>8.1f} {self_us / total_us:>7.1%} {modules:>8}"
+            )
@@ -0,0 +1,66 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Count
+from products import shards
+from products.models import Product, SellerShard
+
+
+class Command(BaseCommand):
+    help = "Move a seller's products and order items to another seller shard, in batches"
+
+    def add_arguments(self, parser):
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument("--seller", type=int, help="Id of the seller to move (with --to)")
+        group.add_argument(
+            "--bootstrap",
+            action="store_true",
+            help="Move every seller whose products are still on 'default' to its shard",
+        )
+        group.add_argument("--status", action="store_true", help="Show sellers and products per shard")
+        parser.add_argument("--to", help="Shard alias to move the seller to (one of SELLER_SHARDS)")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Rows copied or deleted per transaction (default: 1000)",
+        )
+
+    def handle(self, *args, **options):
+        if not shards.enabled():
+            raise CommandError("SELLER_SHARDS is empty: there is nothing to rebalance")
+        batch_size = max(1, options["batch_size"])
+
+        if options["status"]:
+            self.show_status()
+            return
+
+        if options["bootstrap"]:
+            moved = shards.bootstrap(batch_size=batch_size, log=self.stdout.write)
+            self.stdout.write(self.style.SUCCESS(f"Moved {moved} sellers from '{DEFAULT_DB_ALIAS}' to the shards"))
+            return
+
+        if options["to"] not in shards.aliases():
+            raise CommandError(f"--to must be one of {', '.join(shards.aliases())}")
+        if not User.objects.filter(pk=options["seller"]).exists():
+            raise CommandError(f"There is no user with id {options['seller']}")
+        source = shards.shard_for_seller(options["seller"])
+        products, items = shards.move_seller(
+            options["seller"], options["to"], batch_size=batch_size, log=self.stdout.write
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Moved seller {options['seller']} from {source} to {options['to']} "
+                f"({products} products, {items} order items)"
+            )
+        )
+
+    def show_status(self):
+        sellers = dict(SellerShard.objects.values("shard").annotate(count=Count("pk")).values_list("shard", "count"))
+        locked = list(SellerShard.objects.filter(locked=True).values_list("seller_id", flat=True))
+        self.stdout.write(f"{'database':<16} {'sellers':>8} {'products':>10}")
+        for alias in [DEFAULT_DB_ALIAS, *shards.aliases()]:
+            products = Product.objects.using(alias).count()
+            self.stdout.write(f"{alias:<16} {sellers.get(alias, 0):>8} {products:>10}")
+        if locked:
+            self.stdout.write(f"Being moved (locked): {', '.join(map(str, locked))}")
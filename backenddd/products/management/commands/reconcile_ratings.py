@@ -0,0 +1,79 @@
+from decimal import Decimal, ROUND_HALF_UP
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+from django.utils import timezone
+from products.models import Product, Review
+from products import cache as product_cache
+from products import changes as product_changes
+from products import shards
+
+class Command(BaseCommand):
+    help = "Recompute rating, reviews_count and rating_sum for all products from the Review table"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Products updated per bulk UPDATE (default: 1000)",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options.get("batch_size", 1000))
+
+        # One grouped query gives the true count and star sum per product
+        totals = {
+            row["product_id"]: (row["count"], row["stars"])
+            for row in Review.objects.values("product_id").annotate(
+                count=Count("id"), stars=Sum("rating")
+            )
+        }
+
+        # Reviews and the change log are on 'default', the products may be on seller shards
+        with shards.atomic(*shards.databases()):
+            # Products without any review go back to zero in one UPDATE (per shard)
+            cleared = 0
+            for stale in shards.each(Product.objects.exclude(pk__in=list(totals)).exclude(
+                reviews_count=0, rating_sum=0, rating=0
+            )):
+                # update() and bulk_update() skip post_save, so log the changes ourselves
+                product_changes.record_queryset(stale)
+                cleared += stale.update(
+                    reviews_count=0, rating_sum=0, rating=Decimal("0"), updated_at=timezone.now()
+                )
+
+            corrected = 0
+            product_ids = list(totals)
+            for start in range(0, len(product_ids), batch_size):
+                chunk_ids = product_ids[start:start + batch_size]
+                changed = {}
+                for product in shards.in_bulk(
+                    Product.objects.only("id", "reviews_count", "rating_sum", "rating"), chunk_ids
+                ).values():
+                    count, stars = totals[product.id]
+                    rating = (Decimal(stars) / count).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+                    if (product.reviews_count, product.rating_sum, product.rating) != (count, stars, rating):
+                        product.reviews_count = count
+                        product.rating_sum = stars
+                        product.rating = rating
+                        # bulk_update() skips auto_now, and order ETags read updated_at
+                        product.updated_at = timezone.now()
+                        changed.setdefault(product._state.db, []).append(product)
+                for alias, products in changed.items():
+                    Product.objects.using(alias).bulk_update(
+                        products, ["reviews_count", "rating_sum", "rating", "updated_at"]
+                    )
+                    product_changes.record([product.id for product in products])
+                    corrected += len(products)
+
+            # update() and bulk_update() skip post_save, so drop every cached
+            # product at once rather than one key per corrected row
+            if cleared or corrected:
+                product_cache.invalidate_all(*shards.databases())
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Reconciled {len(totals)} reviewed products "
+                f"({corrected} corrected, {cleared} reset to no reviews)"
+            )
+        )
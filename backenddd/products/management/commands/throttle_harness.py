@@ -0,0 +1,109 @@
+import json
+import multiprocessing
+import time
+import urllib.error
+import urllib.request
+from django.core.management.base import BaseCommand
+from backenddd import loopback
+
+def send(opener, url, payload=None):
+    """Send one request with `opener` (one simulated client); return (status, seconds)"""
+    data = json.dumps(payload).encode() if payload is not None else None
+    request = urllib.request.Request(url, data=data)
+    if data is not None:
+        request.add_header("Content-Type", "application/json")
+    start = time.perf_counter()
+    try:
+        with opener.open(request, timeout=30) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as error:
+        status = error.code
+    except (urllib.error.URLError, OSError):
+        status = 0
+    return status, time.perf_counter() - start
+
+def abuse(base_url, worker, stop_at, with_login, separate, results):
+    """Hammer the catalog (and optionally login) as fast as possible from one address"""
+    counts = {}
+    opener = loopback.opener_for(loopback.client_address(1000 + worker) if separate else None)
+    i = 0
+    while time.time() < stop_at:
+        if with_login and i % 2:
+            status, _ = send(opener, base_url + "/api/users/login/", {"username": f"victim{i}", "password": "guess"})
+        else:
+            status, _ = send(opener, base_url + "/api/products/")
+        counts[status] = counts.get(status, 0) + 1
+        i += 1
+    results.put(counts)
+
+class Command(BaseCommand):
+    help = (
+        "Measure latency of a well-behaved client with and without abusive traffic "
+        "against a running server (start it with runserver/gunicorn first). Against a "
+        "local server each client connects from its own 127.x.y.z address"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of the running API")
+        parser.add_argument("--duration", type=float, default=10, help="Seconds per phase (default: 10)")
+        parser.add_argument("--abusers", type=int, default=8, help="Abusive client processes (default: 8)")
+        parser.add_argument("--interval", type=float, default=0.2, help="Seconds between good-client requests")
+        parser.add_argument("--no-login", action="store_true", help="Abusers only scrape the catalog")
+
+    def handle(self, *args, **options):
+        base_url = options["url"].rstrip("/")
+        duration = options["duration"]
+        # Throttling is per connection address: only a local server can tell the clients apart
+        self.separate = loopback.simulated_clients(base_url)
+        if not self.separate:
+            self.stderr.write(
+                "All clients share this machine's address, so the good client is throttled with the abusers"
+            )
+
+        baseline = self.good_client(base_url, duration, options["interval"])
+        self.report("baseline (no abuse)", baseline)
+
+        results = multiprocessing.Queue()
+        stop_at = time.time() + duration
+        workers = [
+            multiprocessing.Process(target=abuse, args=(base_url, n, stop_at, not options["no_login"], self.separate, results))
+            for n in range(options["abusers"])
+        ]
+        for worker in workers:
+            worker.start()
+        under_abuse = self.good_client(base_url, duration, options["interval"])
+        abusive_counts = {}
+        for _ in workers:
+            for status, count in results.get().items():
+                abusive_counts[status] = abusive_counts.get(status, 0) + count
+        for worker in workers:
+            worker.join()
+
+        self.report(f"under abuse ({options['abusers']} clients)", under_abuse)
+        summary = ", ".join(f"{status}: {count}" for status, count in sorted(abusive_counts.items()))
+        self.stdout.write(f"abusive responses by status: {summary}")
+
+    def good_client(self, base_url, duration, interval):
+        """A polite client browsing the catalog from its own address"""
+        opener = loopback.opener_for(loopback.client_address(1) if self.separate else None)
+        samples = []
+        stop_at = time.time() + duration
+        while time.time() < stop_at:
+            samples.append(send(opener, base_url + "/api/products/"))
+            time.sleep(interval)
+        return samples
+
+    def report(self, label, samples):
+        latencies = sorted(seconds * 1000 for _, seconds in samples)
+        statuses = {}
+        for status, _ in samples:
+            statuses[status] = statuses.get(status, 0) + 1
+        if not latencies:
+            self.stdout.write(f"{label}: no samples")
+            return
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        self.stdout.write(
+            f"{label}: {len(latencies)} requests, p50 {p50:.1f} ms, p99 {p99:.1f} ms, statuses {statuses}"
+        )
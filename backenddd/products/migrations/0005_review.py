@@ -0,0 +1,46 @@
+# Generated by Django 6.0.1 on 2026-10-19 15:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Round
+
+
+def seed_rating_sum(apps, schema_editor):
+    # Keep existing (seeded) ratings: rating_sum ~= rating * reviews_count
+    Product = apps.get_model('products', 'Product')
+    Product.objects.update(rating_sum=Round(F('rating') * F('reviews_count')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_product_additional_images_product_brand_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='Review',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating', models.PositiveSmallIntegerField()),
+                ('comment', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reviews', to='products.product')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reviews', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', '-created_at'], name='review_product_created_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'user'), name='unique_review_per_user')],
+            },
+        ),
+        migrations.RunPython(seed_rating_sum, migrations.RunPython.noop),
+    ]
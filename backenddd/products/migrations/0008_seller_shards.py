@@ -0,0 +1,43 @@
+# Generated by Django 6.0.1 on 2026-10-19 16:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('products', '0007_admin_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SellerShard',
+            fields=[
+                ('seller', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='shard', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('shard', models.CharField(max_length=100)),
+                ('locked', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='seller',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='products', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='review',
+            name='product',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='reviews', to='products.product'),
+        ),
+        migrations.CreateModel(
+            name='ProductKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_keys', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
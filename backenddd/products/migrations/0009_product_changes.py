@@ -0,0 +1,37 @@
+# Generated by Django 6.0.1 on 2026-10-19 15:09
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_seller_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductChangeCompaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('horizon', models.BigIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('superseded_removed', models.PositiveIntegerField(default=0)),
+                ('deletes_removed', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductChange',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('product_id', models.IntegerField()),
+                ('op', models.CharField(choices=[('upsert', 'Inserted or updated'), ('delete', 'Deleted')], default='upsert', max_length=6)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product_id', 'seq'], name='productchange_product_seq_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_product_changes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCacheGeneration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('generation', models.PositiveBigIntegerField(default=1)),
+            ],
+        ),
+    ]
@@ -1,11 +1,19 @@
 # This file defines the database model for products
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, models
+from django.db.models import Case, DecimalField, F, FloatField, Value, When
+from django.db.models.functions import Cast, Upper
 from django.contrib.auth.models import User
+from django.utils import timezone
+from . import cache as product_cache
+from . import shards
 
 # Model representing a product in the store
 class Product(models.Model):
-    # Link to the user who is selling this product
-    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='products')
+    # Link to the user who is selling this product (no database constraint:
+    # with seller shards the product and the user live in different databases)
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='products', db_constraint=False)
+    # create() and bulk_create() write to the seller's shard
+    objects = shards.ShardedQuerySet.as_manager()
     # Product name/title (maximum 200 characters)
     title = models.CharField(max_length=200)
     # Detailed description of the product
@@ -30,10 +38,25 @@ class Product(models.Model):
     rating = models.DecimalField(max_digits=3, decimal_places=2, default=0)
     # Number of reviews
     reviews_count = models.IntegerField(default=0)
+    # Sum of all review stars; rating = rating_sum / reviews_count
+    rating_sum = models.BigIntegerField(default=0)
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Storefront sections and the default list order read these
+            # indexes with a LIMIT instead of sorting the whole catalog
+            models.Index(fields=['-created_at', '-id'], name='product_created_idx'),
+            models.Index(fields=['-rating', '-reviews_count'], name='product_rating_idx'),
+            models.Index(fields=['-reviews_count', '-rating'], name='product_popular_idx'),
+            models.Index(fields=['category', '-rating'], name='product_category_rating_idx'),
+            # Admin price range filter and title prefix search
+            models.Index(fields=['price'], name='product_price_idx'),
+            models.Index(Upper('title'), name='product_title_upper_idx'),
+        ]
+
     # This method returns a string representation of the product
     # Used in Django admin and when printing the product
     def __str__(self):
@@ -45,3 +68,129 @@ class Product(models.Model):
             discount_amount = self.price * (self.discount / 100)
             return self.price - discount_amount
         return self.price
+
+    # Apply a change in review stars/count to one product's rating in O(1).
+    # A single UPDATE adjusts the running sum and count and recomputes the
+    # average from them, so no AVG() over the reviews table is needed.
+    @classmethod
+    def apply_rating_change(cls, product_id, stars_delta, count_delta):
+        new_sum = F('rating_sum') + stars_delta
+        new_count = F('reviews_count') + count_delta
+        from . import changes
+
+        # The product's shard (None: let the router pick, i.e. 'default')
+        database = shards.shard_for_product(product_id, for_write=True) if shards.enabled() else None
+        # update() skips post_save, so drop the cached copy and log the change ourselves
+        product_cache.invalidate(product_id, using=database or DEFAULT_DB_ALIAS)
+        changes.record([product_id], using=database or DEFAULT_DB_ALIAS)
+        return cls.objects.db_manager(database).filter(pk=product_id).update(
+            rating_sum=new_sum,
+            reviews_count=new_count,
+            rating=Case(
+                When(reviews_count__lte=-count_delta, then=Value(0)),
+                default=Cast(new_sum, FloatField()) / new_count,
+                output_field=DecimalField(max_digits=3, decimal_places=2),
+            ),
+            updated_at=timezone.now(),
+        )
+
+
+# Model representing a customer's review of a product
+class Review(models.Model):
+    # The product being reviewed (may live on a seller shard, so no database constraint)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reviews', db_constraint=False)
+    # The user who wrote the review
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reviews')
+    # Star rating from 1 to 5
+    rating = models.PositiveSmallIntegerField()
+    # Optional review text
+    comment = models.TextField(blank=True, default='')
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            # One review per user per product
+            models.UniqueConstraint(fields=['product', 'user'], name='unique_review_per_user'),
+        ]
+        indexes = [
+            # Reviews are listed per product, newest first
+            models.Index(fields=['product', '-created_at'], name='review_product_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} on {self.product} ({self.rating}/5)"
+
+
+# Seller shards (SELLER_SHARDS): which database holds each seller's products
+# and order items. A seller gets a row the first time a shard is needed for
+# them, and `manage.py rebalance_shards` moves them to another one.
+class SellerShard(models.Model):
+    # The seller being placed
+    seller = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='shard')
+    # Database alias, one of SELLER_SHARDS
+    shard = models.CharField(max_length=100)
+    # Set while the seller's rows are being copied to another shard; their
+    # products can be read but not changed or bought until it is cleared
+    locked = models.BooleanField(default=False)
+    # When the seller was placed or last moved
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.seller_id} on {self.shard}"
+
+
+# Product ids for a sharded catalog. Each shard has its own product table, so
+# new ids are handed out from this table on 'default' to keep them unique,
+# and the row tells which seller (and so which shard) owns a product id.
+class ProductKey(models.Model):
+    # The seller who owns the product with this id
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='product_keys')
+
+
+# Product change log: one row per product insert, update or delete, numbered
+# in write order. Clients sync with /api/products/changes/?since=<seq> instead
+# of downloading the whole catalog again (see products/changes.py).
+class ProductChange(models.Model):
+    UPSERT = 'upsert'
+    DELETE = 'delete'
+    OPS = [(UPSERT, 'Inserted or updated'), (DELETE, 'Deleted')]
+
+    # Position in the log; the sync tokens handed to clients are these numbers
+    seq = models.BigAutoField(primary_key=True)
+    # The product that changed (a plain id: the product may be gone or on a seller shard)
+    product_id = models.IntegerField()
+    # What happened to it
+    op = models.CharField(max_length=6, choices=OPS, default=UPSERT)
+    # When the change was recorded
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Compaction looks for newer changes of the same product
+            models.Index(fields=['product_id', 'seq'], name='productchange_product_seq_idx'),
+        ]
+
+
+# One run of `manage.py compact_product_changes`. Compaction drops changes
+# that a newer change of the same product supersedes (clients lose nothing)
+# and deletes older than the retention; the newest dropped delete is the
+# horizon, and clients whose token is older than it must resync in full.
+class ProductChangeCompaction(models.Model):
+    # Clients with a token below this may have missed a delete
+    horizon = models.BigIntegerField(default=0)
+    # When the run started and finished (null while it is still running)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # How many rows were dropped
+    superseded_removed = models.PositiveIntegerField(default=0)
+    deletes_removed = models.PositiveIntegerField(default=0)
+
+
+# The generation counter of the product cache (products/cache.py): bulk jobs
+# bump it to drop every cached product at once. It lives in the database so
+# a bump from a management command or another worker reaches every process,
+# whatever cache backend they use. There is only ever one row.
+class ProductCacheGeneration(models.Model):
+    generation = models.PositiveBigIntegerField(default=1)
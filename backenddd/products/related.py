@@ -0,0 +1,584 @@
+# This file builds and serves the "related products" index.
+#
+# Every product becomes a hashed TF-IDF vector over its title, description,
+# category, brand and tags. Nearest neighbours are found with batched NumPy
+# matrix products inside random-hyperplane buckets (so the work grows with
+# N * bucket size instead of N squared) and re-ranked with co-purchase counts
+# from OrderItem. The result is a fixed-width table of neighbour ids saved as
+# .npy files and opened with mmap, so a request is a binary search in the
+# sorted product ids plus an array lookup.
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from django.conf import settings
+
+# NumPy is optional: without it the related endpoint falls back to a category query
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None
+
+# How much each field counts towards similarity
+FIELD_WEIGHTS = {
+    'title': 3.0,
+    'category': 2.0,
+    'brand': 2.0,
+    'tags': 2.0,
+    'description': 1.0,
+}
+TEXT_FIELDS = tuple(FIELD_WEIGHTS)
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+# Hash space used for document frequencies (much larger than the vector size)
+DF_BUCKETS = 1 << 20
+# Orders with more lines than this are ignored for co-purchase pairs
+MAX_ORDER_LINES = 50
+# Weight of the co-purchase signal relative to text similarity (0..1 each)
+COPURCHASE_WEIGHT = 0.5
+
+
+def index_settings():
+    """Index location and shape from settings (with defaults)"""
+    return {
+        'directory': Path(getattr(settings, 'RELATED_INDEX_DIR', settings.BASE_DIR / 'var' / 'related')),
+        'dims': getattr(settings, 'RELATED_INDEX_DIMS', 128),
+        'neighbours': getattr(settings, 'RELATED_INDEX_NEIGHBOURS', 12),
+        'bucket_size': getattr(settings, 'RELATED_INDEX_BUCKET_SIZE', 512),
+    }
+
+
+# Rows tokenized at a time (bounds the temporary term arrays)
+TOKENIZE_CHUNK = 50000
+
+
+class TokenHashes(dict):
+    """
+    Memo of token -> crc32 for one field.
+
+    The field name is part of the hash so "apple" the brand and "apple" in
+    a description are different features. Catalogs reuse a small
+    vocabulary, so almost every lookup is a dict hit.
+    """
+
+    def __init__(self, field):
+        super().__init__()
+        self.prefix = field + ':'
+
+    def __missing__(self, token):
+        value = self[token] = zlib.crc32((self.prefix + token).encode())
+        return value
+
+
+def hashed_terms(rows, memos=None):
+    """
+    Distinct terms of a chunk of product rows as three parallel arrays:
+    row position, token hash and weight (field weight * (1 + log tf)).
+    """
+    if memos is None:
+        memos = {field: TokenHashes(field) for field in TEXT_FIELDS}
+    all_keys = []
+    all_weights = []
+    for field, weight in FIELD_WEIGHTS.items():
+        lookup = memos[field].__getitem__
+        positions = []
+        hashes = []
+        for position, row in enumerate(rows):
+            tokens = TOKEN_RE.findall((row.get(field) or '').lower())
+            positions.extend([position] * len(tokens))
+            hashes.extend(map(lookup, tokens))
+        if not hashes:
+            continue
+        # One sort counts term frequencies for the whole chunk
+        keys = (np.array(positions, dtype=np.int64) << 32) | np.array(hashes, dtype=np.int64)
+        keys, counts = np.unique(keys, return_counts=True)
+        all_keys.append(keys)
+        all_weights.append(weight * (1.0 + np.log(counts)))
+    if not all_keys:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, np.array([], dtype=np.float64)
+    keys = np.concatenate(all_keys)
+    return keys >> 32, keys & 0xFFFFFFFF, np.concatenate(all_weights)
+
+
+def _chunks(rows):
+    for start in range(0, len(rows), TOKENIZE_CHUNK):
+        yield start, rows[start:start + TOKENIZE_CHUNK]
+
+
+def vectorize(rows, dims, df, doc_count, memos=None):
+    """
+    Turn product rows into L2-normalised float32 vectors of size `dims`.
+
+    Each token hash picks a column and a sign (the "hashing trick"), and is
+    weighted by its field weight, log term frequency and inverse document
+    frequency looked up in `df`.
+    """
+    if memos is None:
+        memos = {field: TokenHashes(field) for field in TEXT_FIELDS}
+    vectors = np.zeros((len(rows), dims), dtype=np.float32)
+    for start, chunk in _chunks(rows):
+        positions, hashes, weights = hashed_terms(chunk, memos)
+        idf = np.log((1 + doc_count) / (1 + df[hashes % DF_BUCKETS])) + 1.0
+        sign = np.where(hashes & 0x80000000, 1.0, -1.0)
+        cells = positions * dims + hashes % dims
+        block = np.bincount(cells, weights=sign * weights * idf, minlength=len(chunk) * dims)
+        vectors[start:start + len(chunk)] = block.reshape(len(chunk), dims)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors /= norms
+    return vectors
+
+
+def document_frequencies(rows, memos=None):
+    """Count, per hashed token, how many products contain it"""
+    if memos is None:
+        memos = {field: TokenHashes(field) for field in TEXT_FIELDS}
+    df = np.zeros(DF_BUCKETS, dtype=np.int32)
+    for _, chunk in _chunks(rows):
+        _, hashes, _ = hashed_terms(chunk, memos)
+        df += np.bincount(hashes % DF_BUCKETS, minlength=DF_BUCKETS).astype(np.int32)
+    return df
+
+
+def bucket_codes(vectors, planes):
+    """Random-hyperplane LSH code for every vector (similar vectors share codes)"""
+    if planes.shape[0] == 0:
+        return np.zeros(len(vectors), dtype=np.int64)
+    bits = (vectors @ planes.T) > 0
+    weights = (1 << np.arange(planes.shape[0], dtype=np.int64))
+    return bits.astype(np.int64) @ weights
+
+
+def top_k_in_bucket(vectors, rows, k, chunk=1024):
+    """
+    Exact cosine top-k among `rows` using batched matrix products.
+
+    Returns (neighbour rows, scores), each shaped (len(rows), k), padded
+    with -1 / -inf when the bucket has fewer than k other members.
+    """
+    members = vectors[rows]
+    size = len(rows)
+    take = min(k, size - 1)
+    result_rows = np.full((size, k), -1, dtype=np.int64)
+    result_scores = np.full((size, k), -np.inf, dtype=np.float32)
+    if take <= 0:
+        return result_rows, result_scores
+    for start in range(0, size, chunk):
+        stop = min(start + chunk, size)
+        scores = members[start:stop] @ members.T
+        # A product is never related to itself
+        scores[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        best = np.argpartition(-scores, take - 1, axis=1)[:, :take]
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        best = np.take_along_axis(best, order, axis=1)
+        result_rows[start:stop, :take] = rows[best]
+        result_scores[start:stop, :take] = np.take_along_axis(best_scores, order, axis=1)
+    return result_rows, result_scores
+
+
+def copurchase_pairs(order_lines):
+    """
+    Count how often two products were bought in the same order.
+
+    `order_lines` is an iterable of (order_id, product_id) sorted by order.
+    Returns {product_id: Counter({other_product_id: count})}.
+    """
+    pairs = defaultdict(Counter)
+
+    def flush(products):
+        if 1 < len(products) <= MAX_ORDER_LINES:
+            for product_id in products:
+                for other_id in products:
+                    if other_id != product_id:
+                        pairs[product_id][other_id] += 1
+
+    current_order = None
+    products = []
+    for order_id, product_id in order_lines:
+        if order_id != current_order:
+            flush(products)
+            current_order = order_id
+            products = []
+        if product_id not in products:
+            products.append(product_id)
+    flush(products)
+    return pairs
+
+
+class RelatedIndexBuilder:
+    """
+    Builds index versions under <directory>/<version>/ and flips the
+    CURRENT pointer file once a version is complete, so readers never see a
+    half-written index.
+    """
+
+    def __init__(self, directory=None, dims=None, neighbours=None, bucket_size=None, seed=13):
+        config = index_settings()
+        self.directory = Path(directory or config['directory'])
+        self.dims = dims or config['dims']
+        self.k = neighbours or config['neighbours']
+        self.bucket_size = bucket_size or config['bucket_size']
+        self.seed = seed
+
+    # Building blocks -------------------------------------------------------
+
+    def planes_for(self, count):
+        """Enough hyperplanes for buckets of about bucket_size products"""
+        bits = max(0, math.ceil(math.log2(max(count, 1) / self.bucket_size)))
+        rng = np.random.default_rng(self.seed)
+        return rng.standard_normal((min(bits, 30), self.dims)).astype(np.float32)
+
+    def neighbours_for(self, vectors, codes, rows_to_update, live):
+        """Content neighbours (as row numbers) for `rows_to_update`"""
+        neighbour_rows = {}
+        neighbour_scores = {}
+        wanted = np.zeros(len(vectors), dtype=bool)
+        wanted[rows_to_update] = True
+        for code in np.unique(codes[rows_to_update]):
+            members = np.flatnonzero((codes == code) & live)
+            if not len(members):
+                continue
+            found_rows, found_scores = top_k_in_bucket(vectors, members, self.k * 2)
+            for position, row in enumerate(members):
+                if wanted[row]:
+                    neighbour_rows[row] = found_rows[position]
+                    neighbour_scores[row] = found_scores[position]
+        return neighbour_rows, neighbour_scores
+
+    def rerank(self, row, ids, vectors, row_of_id, content_rows, content_scores, bought_with):
+        """Blend text similarity with co-purchase counts and keep the best k ids"""
+        scores = {}
+        for other_row, score in zip(content_rows, content_scores):
+            if other_row >= 0 and np.isfinite(score):
+                scores[int(ids[other_row])] = float(score)
+        if bought_with:
+            top_count = max(bought_with.values())
+            for other_id, count in bought_with.most_common(self.k):
+                other_row = row_of_id.get(other_id)
+                if other_row is None:
+                    continue
+                base = scores.get(other_id)
+                if base is None:
+                    base = float(vectors[row] @ vectors[other_row])
+                boost = COPURCHASE_WEIGHT * math.log1p(count) / math.log1p(top_count)
+                scores[other_id] = base + boost
+        best = sorted(scores.items(), key=lambda item: -item[1])[:self.k]
+        result_ids = np.full(self.k, -1, dtype=np.int64)
+        result_scores = np.zeros(self.k, dtype=np.float32)
+        for position, (other_id, score) in enumerate(best):
+            result_ids[position] = other_id
+            result_scores[position] = score
+        return result_ids, result_scores
+
+    # Reading from the database --------------------------------------------
+
+    def product_rows(self, queryset):
+        """The indexed columns of the products in `queryset`, from every seller shard, by id"""
+        from . import shards
+
+        fields = ('id', 'updated_at') + TEXT_FIELDS
+        return list(shards.catalog(queryset).values(*fields).order_by('id').iterator(chunk_size=5000))
+
+    def order_lines(self, since=None, until=None):
+        """(order_id, product_id) of orders placed after `since` and up to `until`"""
+        from orders.models import OrderItem
+        from . import shards
+
+        # The items keep a copy of their order's time, so no join with the
+        # orders (which aren't on the seller shards)
+        lines = shards.catalog(OrderItem.objects.all())
+        if since is not None:
+            lines = lines.filter(order_created_at__gt=since)
+        if until is not None:
+            lines = lines.filter(order_created_at__lte=until)
+        return lines.order_by('order_id').values_list('order_id', 'product_id').iterator(chunk_size=10000)
+
+    # Full and incremental builds ------------------------------------------
+
+    def build_full(self, rows=None, order_lines=None):
+        """Build a complete index from all products (or the given rows)"""
+        from .models import Product
+
+        started = time.time()
+        if rows is None:
+            rows = self.product_rows(Product.objects.all())
+        # Taken before the order lines are read: an order placed meanwhile is
+        # left for the next incremental build instead of being skipped by it
+        orders_watermark = self.latest_order_time()
+        if order_lines is None:
+            order_lines = self.order_lines(until=orders_watermark) if orders_watermark is not None else []
+
+        ids = np.array([row['id'] for row in rows], dtype=np.int64)
+        memos = {field: TokenHashes(field) for field in TEXT_FIELDS}
+        df = document_frequencies(rows, memos)
+        vectors = vectorize(rows, self.dims, df, len(rows), memos)
+        planes = self.planes_for(len(rows))
+        codes = bucket_codes(vectors, planes)
+        live = np.ones(len(rows), dtype=bool)
+        watermark = max((row['updated_at'] for row in rows if row.get('updated_at')), default=None)
+
+        pairs = copurchase_pairs(order_lines)
+        neighbours = np.full((len(rows), self.k), -1, dtype=np.int64)
+        scores = np.zeros((len(rows), self.k), dtype=np.float32)
+        self.fill_neighbours(ids, vectors, codes, live, np.arange(len(rows)), pairs, neighbours, scores)
+
+        return self.write_version(
+            ids, vectors, codes, planes, df, neighbours, scores, pairs,
+            meta={
+                'doc_count': len(rows),
+                'watermark': watermark.isoformat() if watermark else None,
+                'orders_watermark': orders_watermark.isoformat() if orders_watermark else None,
+                'build_seconds': round(time.time() - started, 3),
+                'kind': 'full',
+            },
+        )
+
+    def build_incremental(self):
+        """
+        Update the current index with products changed since the last build.
+
+        Changed products get new vectors with the stored document
+        frequencies, deleted products are dropped, and neighbours are
+        recomputed only for buckets that contain a changed product or a
+        product whose co-purchase counts changed.
+        """
+        from django.utils.dateparse import parse_datetime
+        from .models import Product
+        from . import shards
+
+        current = load_version(self.directory)
+        if current is None:
+            return self.build_full()
+        started = time.time()
+        meta = current['meta']
+        ids = np.array(current['ids'])
+        vectors = np.array(current['vectors'])
+        codes = np.array(current['codes'])
+        planes = np.array(current['planes'])
+        df = np.array(current['df'])
+        neighbours = np.array(current['neighbours'])
+        scores = np.array(current['scores'])
+        pairs = current['pairs']
+        row_of_id = {int(product_id): row for row, product_id in enumerate(ids)}
+
+        live_ids = set(shards.catalog(Product.objects.all()).values_list('id', flat=True))
+        live = np.array([int(product_id) in live_ids for product_id in ids], dtype=bool)
+        deleted_rows = np.flatnonzero(~live & (codes >= 0))
+
+        watermark = parse_datetime(meta['watermark']) if meta.get('watermark') else None
+        changed = Product.objects.all()
+        if watermark is not None:
+            changed = changed.filter(updated_at__gt=watermark)
+        changed_rows = self.product_rows(changed)
+
+        affected_codes = set(codes[deleted_rows].tolist())
+        codes[deleted_rows] = -1
+        updated_rows = []
+        if changed_rows:
+            new_vectors = vectorize(changed_rows, self.dims, df, meta['doc_count'])
+            new_codes = bucket_codes(new_vectors, planes)
+            appended = [row for row in changed_rows if row['id'] not in row_of_id]
+            if appended:
+                extra = len(appended)
+                ids = np.concatenate([ids, np.array([row['id'] for row in appended], dtype=np.int64)])
+                vectors = np.concatenate([vectors, np.zeros((extra, self.dims), dtype=np.float32)])
+                codes = np.concatenate([codes, np.full(extra, -1, dtype=np.int64)])
+                live = np.concatenate([live, np.ones(extra, dtype=bool)])
+                neighbours = np.concatenate([neighbours, np.full((extra, self.k), -1, dtype=np.int64)])
+                scores = np.concatenate([scores, np.zeros((extra, self.k), dtype=np.float32)])
+                for offset, row in enumerate(appended):
+                    row_of_id[row['id']] = len(ids) - extra + offset
+            for position, row in enumerate(changed_rows):
+                index_row = row_of_id[row['id']]
+                if codes[index_row] >= 0:
+                    affected_codes.add(int(codes[index_row]))
+                vectors[index_row] = new_vectors[position]
+                codes[index_row] = new_codes[position]
+                affected_codes.add(int(new_codes[position]))
+                updated_rows.append(index_row)
+            new_watermark = max(row['updated_at'] for row in changed_rows)
+            if watermark is None or new_watermark > watermark:
+                watermark = new_watermark
+
+        orders_since = parse_datetime(meta['orders_watermark']) if meta.get('orders_watermark') else None
+        # Read before the new order lines, like in build_full()
+        orders_watermark = self.latest_order_time()
+        new_pairs = {}
+        if orders_watermark is not None:
+            new_pairs = copurchase_pairs(self.order_lines(since=orders_since, until=orders_watermark))
+        for product_id, counts in new_pairs.items():
+            pairs.setdefault(product_id, Counter()).update(counts)
+            if product_id in row_of_id:
+                updated_rows.append(row_of_id[product_id])
+
+        rows_to_update = np.flatnonzero(np.isin(codes, list(affected_codes)) & live) if affected_codes else np.array([], dtype=np.int64)
+        rows_to_update = np.union1d(rows_to_update, np.array(updated_rows, dtype=np.int64))
+        rows_to_update = rows_to_update[live[rows_to_update]] if len(rows_to_update) else rows_to_update
+        self.fill_neighbours(ids, vectors, codes, live, rows_to_update, pairs, neighbours, scores)
+        neighbours[deleted_rows] = -1
+
+        meta.update({
+            'watermark': watermark.isoformat() if watermark else None,
+            'orders_watermark': orders_watermark.isoformat() if orders_watermark else meta.get('orders_watermark'),
+            'build_seconds': round(time.time() - started, 3),
+            'kind': 'incremental',
+            'updated_rows': int(len(rows_to_update)),
+        })
+        return self.write_version(ids, vectors, codes, planes, df, neighbours, scores, pairs, meta=meta)
+
+    def fill_neighbours(self, ids, vectors, codes, live, rows_to_update, pairs, neighbours, scores):
+        if not len(rows_to_update):
+            return
+        row_of_id = {int(product_id): row for row, product_id in enumerate(ids) if live[row]}
+        content_rows, content_scores = self.neighbours_for(vectors, codes, rows_to_update, live)
+        for row in rows_to_update:
+            row = int(row)
+            found = content_rows.get(row, np.full(self.k * 2, -1, dtype=np.int64))
+            found_scores = content_scores.get(row, np.full(self.k * 2, -np.inf, dtype=np.float32))
+            bought_with = pairs.get(int(ids[row]))
+            if bought_with:
+                neighbours[row], scores[row] = self.rerank(
+                    row, ids, vectors, row_of_id, found, found_scores, bought_with
+                )
+            else:
+                # No co-purchases: the content ranking is already sorted
+                found_ids = np.where(found >= 0, ids[np.maximum(found, 0)], -1)
+                neighbours[row] = found_ids[:self.k]
+                scores[row] = np.where(np.isfinite(found_scores[:self.k]), found_scores[:self.k], 0)
+
+    def latest_order_time(self):
+        """Creation time of the newest order (None without orders)"""
+        from orders.models import Order
+
+        return Order.objects.order_by('-created_at').values_list('created_at', flat=True).first()
+
+    # Writing ---------------------------------------------------------------
+
+    def write_version(self, ids, vectors, codes, planes, df, neighbours, scores, pairs, meta):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        version = time.strftime('%Y%m%d%H%M%S') + f"-{os.getpid()}-{int(time.time() * 1000) % 1000:03d}"
+        target = self.directory / version
+        target.mkdir()
+
+        # Sorted ids and their rows: a lookup is a binary search, and the
+        # files grow with the number of products, not with the largest id
+        # (product ids are sparse when they come from ProductKey)
+        id_rows = np.argsort(ids, kind='stable').astype(np.int64)
+
+        np.save(target / 'ids.npy', ids)
+        np.save(target / 'sorted_ids.npy', ids[id_rows])
+        np.save(target / 'id_rows.npy', id_rows)
+        np.save(target / 'vectors.npy', vectors)
+        np.save(target / 'codes.npy', codes)
+        np.save(target / 'planes.npy', planes)
+        np.save(target / 'df.npy', df)
+        np.save(target / 'neighbours.npy', neighbours)
+        np.save(target / 'scores.npy', scores)
+        with open(target / 'pairs.json', 'w') as handle:
+            json.dump({str(key): dict(value) for key, value in pairs.items()}, handle)
+        meta = dict(meta, dims=self.dims, neighbours=self.k, products=int(len(ids)))
+        with open(target / 'meta.json', 'w') as handle:
+            json.dump(meta, handle)
+
+        # Flip the pointer atomically, then drop all but the previous version
+        pointer = self.directory / 'CURRENT.tmp'
+        pointer.write_text(version)
+        os.replace(pointer, self.directory / 'CURRENT')
+        versions = sorted(path for path in self.directory.iterdir() if path.is_dir())
+        for old in versions[:-2]:
+            shutil.rmtree(old, ignore_errors=True)
+        return target
+
+
+def load_version(directory, mmap=True):
+    """Open the CURRENT index version (memory-mapped) or return None"""
+    directory = Path(directory)
+    pointer = directory / 'CURRENT'
+    if np is None or not pointer.exists():
+        return None
+    target = directory / pointer.read_text().strip()
+    # Versions written before the sorted id files are rebuilt in full
+    if not (target / 'sorted_ids.npy').exists():
+        return None
+    mode = 'r' if mmap else None
+    arrays = {
+        name: np.load(target / f'{name}.npy', mmap_mode=mode)
+        for name in ('ids', 'sorted_ids', 'id_rows', 'vectors', 'codes', 'planes', 'df', 'neighbours', 'scores')
+    }
+    with open(target / 'meta.json') as handle:
+        arrays['meta'] = json.load(handle)
+    with open(target / 'pairs.json') as handle:
+        arrays['pairs'] = {
+            int(key): Counter({int(other): count for other, count in value.items()})
+            for key, value in json.load(handle).items()
+        }
+    arrays['version'] = target.name
+    return arrays
+
+
+class RelatedIndex:
+    """Read side: neighbour ids for a product with a binary search and an array lookup"""
+
+    def __init__(self, sorted_ids, id_rows, neighbours, version):
+        self.sorted_ids = sorted_ids
+        self.id_rows = id_rows
+        self.neighbours = neighbours
+        self.version = version
+
+    @classmethod
+    def open(cls, directory):
+        pointer = Path(directory) / 'CURRENT'
+        if np is None or not pointer.exists():
+            return None
+        target = Path(directory) / pointer.read_text().strip()
+        if not (target / 'sorted_ids.npy').exists():
+            # Written by an older version: serve the fallback until the next build
+            return None
+        return cls(
+            np.load(target / 'sorted_ids.npy', mmap_mode='r'),
+            np.load(target / 'id_rows.npy', mmap_mode='r'),
+            np.load(target / 'neighbours.npy', mmap_mode='r'),
+            target.name,
+        )
+
+    def lookup(self, product_id, limit):
+        position = int(np.searchsorted(self.sorted_ids, product_id))
+        if position >= len(self.sorted_ids) or self.sorted_ids[position] != product_id:
+            return None
+        row = self.id_rows[position]
+        return [int(other) for other in self.neighbours[row][:limit] if other >= 0]
+
+
+_index = None
+_index_checked_at = 0.0
+_index_lock = threading.Lock()
+
+
+def get_related_index():
+    """
+    Return the current RelatedIndex, re-opening it when a new version has
+    been published (checked at most every RELATED_INDEX_RELOAD_SECONDS).
+    """
+    global _index, _index_checked_at
+    now = time.monotonic()
+    interval = getattr(settings, 'RELATED_INDEX_RELOAD_SECONDS', 30)
+    if _index is not None and now - _index_checked_at < interval:
+        return _index
+    with _index_lock:
+        _index_checked_at = now
+        directory = index_settings()['directory']
+        pointer = directory / 'CURRENT'
+        version = pointer.read_text().strip() if pointer.exists() else None
+        if version is None:
+            _index = None
+        elif _index is None or _index.version != version:
+            _index = RelatedIndex.open(directory)
+    return _index
@@ -1,7 +1,8 @@
 # This file defines how product data is serialized (converted to/from JSON)
+from django.conf import settings
 from rest_framework import serializers
-from .models import Product
-from django.contrib.auth.models import User
+from .models import Product, Review
+from . import shards
 
 # Serializer for products (public view)
 class ProductSerializer(serializers.ModelSerializer):
@@ -16,8 +17,8 @@ class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         # Use the Product model
         model = Product
-        # Include all fields from the Product model
-        fields = '__all__'
+        # Include all fields from the Product model except internal counters
+        exclude = ['rating_sum']
         read_only_fields = ['seller', 'rating', 'reviews_count', 'created_at', 'updated_at']
 
 
@@ -66,3 +67,86 @@ class SellerProductSerializer(serializers.ModelSerializer):
             except json.JSONDecodeError:
                 raise serializers.ValidationError("Additional images must be valid JSON array")
         return value
+
+
+# Input for seller bulk price/discount changes (/api/products/seller/bulk-pricing/)
+class BulkPricingSerializer(serializers.Serializer):
+    # Which column to change, and how: "percent" scales it, "absolute" adds to it
+    field = serializers.ChoiceField(choices=['price', 'discount'])
+    mode = serializers.ChoiceField(choices=['percent', 'absolute'])
+    value = serializers.DecimalField(max_digits=10, decimal_places=2)
+    # Filters (combined with AND); at least one, or all=true for the whole shop
+    category = serializers.CharField(required=False)
+    brand = serializers.CharField(required=False)
+    tag = serializers.CharField(required=False)
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    all = serializers.BooleanField(default=False)
+    # Only count the matching products and preview the new values
+    dry_run = serializers.BooleanField(default=False)
+
+    def validate_ids(self, value):
+        limit = getattr(settings, 'SELLER_BULK_MAX_IDS', 5000)
+        if len(value) > limit:
+            raise serializers.ValidationError(f"At most {limit} ids per request")
+        return value
+
+    def validate(self, attrs):
+        """Require a filter, and keep percentage cuts above -100%"""
+        filters = [name for name in ('category', 'brand', 'tag', 'ids') if name in attrs]
+        if not filters and not attrs['all']:
+            raise serializers.ValidationError("Give category, brand, tag or ids, or set all to true")
+        if attrs['mode'] == 'percent' and attrs['value'] <= -100:
+            raise serializers.ValidationError({'value': "A percentage change must be above -100"})
+        return attrs
+
+
+# Query string filters of the public catalog (/api/products/?category=lamps&max_price=20)
+class CatalogFilterSerializer(serializers.Serializer):
+    # Exact values, ignoring case
+    category = serializers.CharField(required=False)
+    brand = serializers.CharField(required=False)
+    # Seller user id
+    seller = serializers.IntegerField(required=False, min_value=1)
+    # Price range, both ends included
+    min_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, min_value=0)
+    max_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, min_value=0)
+    # in_stock=1: only products with stock left
+    in_stock = serializers.BooleanField(required=False)
+
+
+# Serializer for product reviews
+class CatalogProductField(serializers.PrimaryKeyRelatedField):
+    """Product picked by id, looked up on every seller shard when SELLER_SHARDS is set"""
+
+    def get_queryset(self):
+        return shards.catalog(Product.objects.all())
+
+
+class ReviewSerializer(serializers.ModelSerializer):
+    username = serializers.CharField(source='user.username', read_only=True)
+    product = CatalogProductField()
+
+    class Meta:
+        model = Review
+        fields = ['id', 'product', 'username', 'rating', 'comment', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'username', 'created_at', 'updated_at']
+
+    def validate_rating(self, value):
+        """Ensure rating is between 1 and 5 stars"""
+        if value < 1 or value > 5:
+            raise serializers.ValidationError("Rating must be between 1 and 5")
+        return value
+
+    def validate_product(self, value):
+        """A review cannot be moved to another product"""
+        if self.instance is not None and value != self.instance.product:
+            raise serializers.ValidationError("The product of a review cannot be changed")
+        return value
+
+    def validate(self, attrs):
+        """Ensure a user reviews each product at most once"""
+        request = self.context.get('request')
+        if self.instance is None and request is not None:
+            if Review.objects.filter(product=attrs['product'], user=request.user).exists():
+                raise serializers.ValidationError("You have already reviewed this product")
+        return attrs
@@ -0,0 +1,762 @@
+# This file splits the catalog over several databases ("seller shards").
+# Each seller's products and order items live together on one database listed
+# in SELLER_SHARDS; users, orders, carts and reviews stay on 'default'. The
+# shard map (SellerShard) says where each seller lives, and ProductKey hands
+# out product ids that are unique over all shards. With SELLER_SHARDS empty
+# every helper here gives plain 'default' querysets, so nothing changes.
+import functools
+import heapq
+import itertools
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, router, transaction
+from django.db.models import Count, Max, Min, QuerySet, Sum, prefetch_related_objects
+from django.db.models.query import FlatValuesListIterable, ModelIterable, ValuesIterable
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+# Models whose rows live on their seller's shard (app_label.model_name)
+SHARDED_MODELS = {'products.product', 'orders.orderitem'}
+
+CACHE_PREFIX = 'shards:seller:'
+
+
+class SellerMoving(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'This shop is being moved to another server, please try again in a minute.'
+    default_code = 'seller_moving'
+    # Sent as the Retry-After header by DRF's exception handler
+    wait = 10
+
+
+class NoShardChosen(Exception):
+    """A query on products or order items that says nothing about which shard to use"""
+
+
+def aliases():
+    """The shard database aliases (empty when sharding is off)"""
+    return list(getattr(settings, 'SELLER_SHARDS', None) or [])
+
+
+def enabled():
+    return bool(aliases())
+
+
+def databases():
+    """Every database that may hold products: the shards, or just 'default'"""
+    return aliases() or [DEFAULT_DB_ALIAS]
+
+
+def is_sharded(model):
+    return model._meta.label_lower in SHARDED_MODELS
+
+
+# Shard map -------------------------------------------------------------------
+
+def _cache_key(seller_id):
+    return f'{CACHE_PREFIX}{seller_id}'
+
+
+def placement(seller_id, fresh=False):
+    """
+    (shard, locked) for a seller. Sellers without a map entry get one on
+    first use (by seller id modulo the number of shards), so adding a shard
+    later only affects new sellers. fresh=True skips the cache: the cache is
+    per process, so only the map itself shows a lock taken by another one.
+    """
+    from .models import SellerShard
+
+    key = _cache_key(seller_id)
+    cached = None if fresh else cache.get(key)
+    if cached is not None:
+        return cached
+    sellers = SellerShard.objects.using(DEFAULT_DB_ALIAS)
+    row = sellers.filter(pk=seller_id).values_list('shard', 'locked').first()
+    if row is None:
+        shards = aliases()
+        shard = shards[seller_id % len(shards)]
+        try:
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                sellers.create(seller_id=seller_id, shard=shard)
+        except IntegrityError:
+            # Placed by a concurrent request in the meantime
+            pass
+        row = sellers.filter(pk=seller_id).values_list('shard', 'locked').first() or (shard, False)
+    row = tuple(row)
+    cache.set(key, row, getattr(settings, 'SELLER_SHARD_CACHE_SECONDS', 300))
+    return row
+
+
+def placements(seller_ids, fresh=False):
+    """
+    {seller_id: (shard, locked)} for several sellers: from the cache, then
+    one query for the ones it misses (instead of one per seller). fresh as
+    in placement().
+    """
+    from .models import SellerShard
+
+    keys = {seller_id: _cache_key(seller_id) for seller_id in set(seller_ids)}
+    cached = {} if fresh else cache.get_many(keys.values())
+    found = {seller_id: tuple(cached[key]) for seller_id, key in keys.items() if key in cached}
+    missing = [seller_id for seller_id in keys if seller_id not in found]
+    if missing:
+        rows = {
+            seller_id: (shard, locked)
+            for seller_id, shard, locked in SellerShard.objects.using(DEFAULT_DB_ALIAS)
+            .filter(pk__in=missing).values_list('pk', 'shard', 'locked')
+        }
+        cache.set_many(
+            {keys[seller_id]: row for seller_id, row in rows.items()},
+            getattr(settings, 'SELLER_SHARD_CACHE_SECONDS', 300),
+        )
+        found.update(rows)
+        for seller_id in missing:
+            if seller_id not in found:
+                # Not placed yet: placement() creates the map entry
+                found[seller_id] = placement(seller_id, fresh)
+    return found
+
+
+def shard_for_seller(seller_id, for_write=False):
+    """
+    Database alias holding a seller's products and order items. With
+    for_write, raise SellerMoving (503) while the seller is being moved: the
+    placement is then read from the map, never from a cached copy.
+    """
+    if not enabled():
+        return DEFAULT_DB_ALIAS
+    shard, locked = placement(seller_id, fresh=for_write)
+    if for_write and locked:
+        raise SellerMoving()
+    return shard
+
+
+def forget_seller(seller_id):
+    """Drop a seller's cached placement (after the map entry changed)"""
+    cache.delete(_cache_key(seller_id))
+
+
+# Product ids -------------------------------------------------------------------
+
+def allocate_product_ids(seller_id, count):
+    """`count` new product ids, unique over all shards"""
+    from .models import ProductKey
+
+    keys = ProductKey.objects.using(DEFAULT_DB_ALIAS)
+    if count > 1 and connections[DEFAULT_DB_ALIAS].features.can_return_rows_from_bulk_insert:
+        return [key.pk for key in keys.bulk_create([ProductKey(seller_id=seller_id) for _ in range(count)])]
+    return [keys.create(seller_id=seller_id).pk for _ in range(count)]
+
+
+def product_sellers(product_ids):
+    """{product_id: seller_id} for the ids that exist"""
+    from .models import ProductKey
+
+    return dict(
+        ProductKey.objects.using(DEFAULT_DB_ALIAS)
+        .filter(pk__in=list(product_ids))
+        .values_list('id', 'seller_id')
+    )
+
+
+def group_products(product_ids, for_write=False):
+    """
+    {database alias: [product ids]} for the products that exist (all on
+    'default' when sharding is off). for_write as in shard_for_seller().
+    """
+    product_ids = list(product_ids)
+    if not enabled():
+        return {DEFAULT_DB_ALIAS: product_ids} if product_ids else {}
+    sellers = product_sellers(product_ids)
+    placed = placements(sellers.values(), fresh=for_write)
+    groups = {}
+    for product_id, seller_id in sellers.items():
+        shard, locked = placed[seller_id]
+        if for_write and locked:
+            raise SellerMoving()
+        groups.setdefault(shard, []).append(product_id)
+    return groups
+
+
+def shard_for_product(product_id, for_write=False):
+    """Database alias holding a product, or None if the id doesn't exist"""
+    return next(iter(group_products([product_id], for_write)), None)
+
+
+def forget_products(product_ids):
+    """Remove what 'default' keeps about deleted products (the database can't cascade across shards)"""
+    from orders.models import CartItem
+    from .models import ProductKey, Review
+
+    product_ids = list(product_ids)
+    CartItem.objects.using(DEFAULT_DB_ALIAS).filter(product_id__in=product_ids).delete()
+    Review.objects.using(DEFAULT_DB_ALIAS).filter(product_id__in=product_ids).delete()
+    ProductKey.objects.using(DEFAULT_DB_ALIAS).filter(pk__in=product_ids).delete()
+
+
+def delete_user_rows(user_id):
+    """
+    Delete a user's products and the items of their orders from every shard.
+    Deleting the user on 'default' cascades to everything else, but can't
+    reach the shards.
+    """
+    from orders.models import Order, OrderItem
+    from .models import Product
+
+    order_ids = list(Order.objects.using(DEFAULT_DB_ALIAS).filter(user_id=user_id).values_list('pk', flat=True))
+    for alias in aliases():
+        if order_ids:
+            OrderItem.objects.using(alias).filter(order_id__in=order_ids).delete()
+        # Through the model signals, which clean up 'default' and log the deletes
+        # (a seller moved a moment ago may still have rows on the old shard)
+        Product.objects.using(alias).filter(seller_id=user_id).delete()
+
+
+# Queries -------------------------------------------------------------------------
+
+def select_seller(queryset):
+    """Load each product's seller with it: joined on one database, prefetched from 'default' across shards"""
+    if enabled():
+        return queryset.prefetch_related('seller')
+    return queryset.select_related('seller')
+
+
+def each(queryset):
+    """The queryset bound to every database that may hold its rows"""
+    return [queryset.using(alias) for alias in databases()]
+
+
+def catalog(queryset):
+    """A queryset over all sellers: the queryset itself, or a ScatterQuerySet across the shards"""
+    if enabled() and is_sharded(queryset.model):
+        return ScatterQuerySet(queryset)
+    return queryset
+
+
+def in_bulk(queryset, product_ids):
+    """queryset.in_bulk(product_ids), reading each product from its own shard"""
+    if not enabled():
+        return queryset.in_bulk(product_ids)
+    found = {}
+    for alias, ids in group_products(product_ids).items():
+        found.update(queryset.using(alias).in_bulk(ids))
+    return found
+
+
+def prefetch_order_items(orders):
+    """
+    prefetch_related('items__product__seller') for orders whose items may be
+    on any shard (a plain prefetch would only look on 'default'). Returns the
+    orders as a list.
+    """
+    from orders.models import OrderItem
+
+    orders = list(orders)
+    if not enabled():
+        prefetch_related_objects(orders, 'items__product__seller')
+        return orders
+    items = {order.pk: [] for order in orders}
+    if items:
+        for alias in aliases():
+            rows = OrderItem.objects.using(alias).filter(order_id__in=items).select_related('product').order_by('id')
+            for item in rows:
+                items[item.order_id].append(item)
+        # In id order, as if they came from a single database
+        for rows in items.values():
+            rows.sort(key=lambda item: item.pk)
+        prefetch_related_objects([item.product for rows in items.values() for item in rows], 'seller')
+    for order in orders:
+        for item in items[order.pk]:
+            item.order = order
+        # A queryset holding the rows, as prefetch_related leaves it
+        queryset = order.items.all()
+        queryset._result_cache = items[order.pk]
+        queryset._prefetch_done = True
+        order._prefetched_objects_cache = {**getattr(order, '_prefetched_objects_cache', {}), 'items': queryset}
+    return orders
+
+
+@contextmanager
+def atomic(*names):
+    """
+    One transaction on 'default' and on each given database. They commit one
+    after the other on exit, 'default' first: a failure inside the block, or
+    in the commit of 'default' (orders, the idempotency key), rolls back all
+    of them. Only a crash between the commits can't be undone; it leaves an
+    order whose items or stock change are missing, never items and stock
+    taken for an order that doesn't exist.
+    """
+    shard_names = [alias for alias in dict.fromkeys(names) if alias != DEFAULT_DB_ALIAS]
+    with ExitStack() as stack:
+        # Entered last, so it commits first
+        for alias in [*shard_names, DEFAULT_DB_ALIAS]:
+            stack.enter_context(transaction.atomic(using=alias))
+        yield
+
+
+def on_commit(callback, *names):
+    """
+    transaction.on_commit() for a write to 'default' and the given databases:
+    `callback` runs once all of them have committed (right away outside a
+    transaction). In atomic() 'default' commits first, so a hook on it alone
+    would run while the shard still shows the old rows.
+    """
+    step = callback
+    # Wait for each shard in turn, then for 'default'
+    for alias in reversed([*[alias for alias in dict.fromkeys(names) if alias != DEFAULT_DB_ALIAS], DEFAULT_DB_ALIAS]):
+        step = functools.partial(transaction.on_commit, step, using=alias)
+    step()
+
+
+# Moving sellers ------------------------------------------------------------------
+
+def _copy(queryset, target, batch_size, log, label):
+    """Copy the rows of `queryset` to `target` in primary key order, `batch_size` rows per transaction"""
+    copied = 0
+    last_pk = None
+    while True:
+        batch = queryset.order_by('pk')
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        rows = list(batch[:batch_size])
+        if not rows:
+            return copied
+        with transaction.atomic(using=target):
+            # Explicit ids, so order items keep pointing at the same products
+            queryset.model.objects.using(target).bulk_create(rows)
+        copied += len(rows)
+        last_pk = rows[-1].pk
+        if log:
+            log(f'Copied {copied} {label} so far')
+
+
+def _purge(queryset, batch_size):
+    """
+    Delete the rows of `queryset` in batches. No signals and no cascades: the
+    reviews and cart lines of a moved product (on 'default') must stay.
+    """
+    while True:
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return
+        with transaction.atomic(using=queryset.db):
+            queryset.model.objects.using(queryset.db).filter(pk__in=ids)._raw_delete(queryset.db)
+
+
+def move_seller(seller_id, target, source=None, batch_size=1000, log=None, purge=True):
+    """
+    Move a seller's products and their order items to the `target` shard.
+
+    The seller is locked first in the map (writes check the map itself and
+    get SellerMoving, reads go on), then after SELLER_SHARD_MOVE_GRACE
+    seconds (writes already past the check finish) the rows are copied in
+    batches and the map is pointed at the target and unlocked. The old rows
+    are deleted after SELLER_SHARD_PURGE_DELAY seconds, when no process can
+    still read them through a cached placement; purge=False leaves that to
+    purge_moved(). A move that stopped half way can simply be run again.
+    `source` defaults to the seller's current shard ('default' when
+    bootstrapping). Returns (products, order items) copied.
+    """
+    import time
+
+    from orders.models import OrderItem
+    from . import cache as product_cache
+    from .models import Product, SellerShard
+    from .storefront import invalidate_storefront
+
+    if target not in aliases():
+        raise ValueError(f'{target!r} is not one of SELLER_SHARDS {aliases()}')
+    source = source or shard_for_seller(seller_id, for_write=True)
+    if source == target:
+        return 0, 0
+
+    sellers = SellerShard.objects.using(DEFAULT_DB_ALIAS)
+    sellers.update_or_create(seller_id=seller_id, defaults={'shard': source, 'locked': True})
+    forget_seller(seller_id)
+    time.sleep(getattr(settings, 'SELLER_SHARD_MOVE_GRACE', 2))
+
+    products = Product.objects.using(source).filter(seller_id=seller_id)
+    items = OrderItem.objects.using(source).filter(product__seller_id=seller_id)
+    # Leftovers of an earlier move that stopped half way
+    _purge(OrderItem.objects.using(target).filter(product__seller_id=seller_id), batch_size)
+    _purge(Product.objects.using(target).filter(seller_id=seller_id), batch_size)
+    copied = (
+        _copy(products, target, batch_size, log, 'products'),
+        _copy(items, target, batch_size, log, 'order items'),
+    )
+
+    sellers.filter(pk=seller_id).update(shard=target, locked=False)
+    forget_seller(seller_id)
+    product_cache.invalidate(*products.values_list('pk', flat=True))
+    invalidate_storefront()
+    if purge:
+        wait_for_cached_placements(log)
+        purge_moved(seller_id, source, batch_size)
+    return copied
+
+
+def wait_for_cached_placements(log=None):
+    """Sleep until every process has dropped the placements it cached before a move"""
+    import time
+
+    delay = getattr(settings, 'SELLER_SHARD_PURGE_DELAY', None)
+    if delay is None:
+        delay = getattr(settings, 'SELLER_SHARD_CACHE_SECONDS', 300)
+    if delay and log:
+        log(f'Waiting {delay}s for cached seller placements to expire before deleting the old rows')
+    time.sleep(delay)
+
+
+def purge_moved(seller_id, source, batch_size=1000):
+    """Delete what a finished move left of a seller on `source` (refused while it still lives there)"""
+    from orders.models import OrderItem
+    from .models import Product
+
+    if shard_for_seller(seller_id, for_write=True) == source:
+        raise ValueError(f'Seller {seller_id} still lives on {source!r}')
+    _purge(OrderItem.objects.using(source).filter(product__seller_id=seller_id), batch_size)
+    _purge(Product.objects.using(source).filter(seller_id=seller_id), batch_size)
+
+
+def bootstrap(batch_size=1000, log=None):
+    """
+    Move the catalog that is still on 'default' onto the shards: point the
+    map at 'default' for its sellers (so they keep working meanwhile),
+    register the product ids in ProductKey, then move every seller to its
+    shard. Sellers already placed on a shard are skipped. Returns the
+    number of sellers moved.
+    """
+    from django.core.management.color import no_style
+
+    from .models import Product, ProductKey, SellerShard
+
+    on_default = Product.objects.using(DEFAULT_DB_ALIAS)
+    seller_ids = list(on_default.order_by('seller_id').values_list('seller_id', flat=True).distinct())
+    sellers = SellerShard.objects.using(DEFAULT_DB_ALIAS)
+    sellers.bulk_create(
+        [SellerShard(seller_id=seller_id, shard=DEFAULT_DB_ALIAS) for seller_id in seller_ids],
+        ignore_conflicts=True,
+    )
+    placed = dict(sellers.filter(pk__in=seller_ids).values_list('seller_id', 'shard'))
+    moved_ids = []
+    for seller_id in seller_ids:
+        forget_seller(seller_id)
+        if placed[seller_id] != DEFAULT_DB_ALIAS:
+            if log:
+                log(f'Skipped seller {seller_id}: already placed on {placed[seller_id]}')
+            continue
+        ProductKey.objects.using(DEFAULT_DB_ALIAS).bulk_create(
+            [
+                ProductKey(pk=product_id, seller_id=seller_id)
+                for product_id in on_default.filter(seller_id=seller_id).values_list('pk', flat=True)
+            ],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+        names = aliases()
+        move_seller(seller_id, names[seller_id % len(names)], DEFAULT_DB_ALIAS, batch_size, log, purge=False)
+        moved_ids.append(seller_id)
+        if log:
+            log(f'Moved {len(moved_ids)} sellers so far')
+    # One wait for all the moves, then the old rows go
+    if moved_ids:
+        wait_for_cached_placements(log)
+    for seller_id in moved_ids:
+        purge_moved(seller_id, DEFAULT_DB_ALIAS, batch_size)
+    # New ids must start after the registered ones (a no-op on SQLite)
+    connection = connections[DEFAULT_DB_ALIAS]
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [ProductKey]):
+            cursor.execute(sql)
+    return len(moved_ids)
+
+
+class ShardedQuerySet(QuerySet):
+    """
+    QuerySet for the sharded models. create() and bulk_create() write each
+    row to its seller's shard: the plain ones pick one database for the
+    whole call without looking at the rows. With shards on, any other query
+    must say which database to use (NoShardChosen otherwise).
+    """
+
+    def _shard_for(self, obj):
+        return router.db_for_write(self.model, instance=obj)
+
+    @property
+    def db(self):
+        # With seller shards, a query without .using() or a row to go by would
+        # quietly run on 'default', where no products are: refuse it instead
+        if self._db is None and enabled() and self._hints.get('instance') is None:
+            raise NoShardChosen(
+                f'{self.model._meta.label} rows live on the seller shards: query them through '
+                'products.shards (catalog(), each(), in_bulk()) or pick a database with using()'
+            )
+        return super().db
+
+    def create(self, **kwargs):
+        if self._db is not None or not enabled():
+            return super().create(**kwargs)
+        return super(ShardedQuerySet, self.using(self._shard_for(self.model(**kwargs)))).create(**kwargs)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if self._db is not None or not enabled():
+            return super().bulk_create(objs, *args, **kwargs)
+        objs = list(objs)
+        if self.model._meta.label_lower == 'products.product':
+            # pre_save doesn't run for bulk inserts: hand out the ids here
+            new = {}
+            for obj in objs:
+                if obj.pk is None:
+                    new.setdefault(obj.seller_id, []).append(obj)
+            for seller_id, products in new.items():
+                for obj, product_id in zip(products, allocate_product_ids(seller_id, len(products))):
+                    obj.pk = product_id
+        # One map lookup for all the sellers (the router would read it once per row)
+        placed = placements({obj.seller_id for obj in objs if getattr(obj, 'seller_id', None) is not None}, fresh=True)
+        groups = {}
+        for obj in objs:
+            seller_id = getattr(obj, 'seller_id', None)
+            if seller_id is None:
+                alias = self._shard_for(obj)
+            else:
+                alias, locked = placed[seller_id]
+                if locked:
+                    raise SellerMoving()
+            groups.setdefault(alias, []).append(obj)
+        for alias, group in groups.items():
+            super(ShardedQuerySet, self.using(alias)).bulk_create(group, *args, **kwargs)
+        return objs
+
+
+class _Descending:
+    """Sort key wrapper that reverses the order of the wrapped value"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def _unique(rows):
+    seen = set()
+    for row in rows:
+        key = tuple(row.items()) if isinstance(row, dict) else row
+        if key not in seen:
+            seen.add(key)
+            yield row
+
+
+class ScatterQuerySet:
+    """
+    The read-only part of the QuerySet API, answered by every shard.
+
+    Chained calls (filter, order_by, values, ...) return another
+    ScatterQuerySet. Slices ask each shard for at most the slice's end and
+    merge the sorted answers, counts add up, and Max/Min/Count/Sum
+    aggregates are combined. Ties in the ordering are broken by primary
+    key, and rows are compared in Python (text sorts by code point, like
+    SQLite). Sliced values()/values_list() queries must include their
+    ordering fields, and distinct() ones drop rows repeated across shards.
+    """
+    CHAINED = {
+        'all', 'filter', 'exclude', 'order_by', 'distinct', 'select_related', 'prefetch_related',
+        'only', 'defer', 'annotate', 'alias', 'values', 'values_list', 'none',
+    }
+    COMBINE = {Count: sum, Sum: sum, Max: max, Min: min}
+
+    def __init__(self, queryset, databases=None):
+        self.queryset = queryset
+        self.databases = list(databases or aliases())
+        self._result_cache = None
+
+    def __getattr__(self, name):
+        if name not in self.CHAINED:
+            raise AttributeError(name)
+
+        def chained(*args, **kwargs):
+            return ScatterQuerySet(getattr(self.queryset, name)(*args, **kwargs), self.databases)
+        return chained
+
+    def __repr__(self):
+        return f'<ScatterQuerySet {self.databases} {self.queryset.query}>'
+
+    @property
+    def model(self):
+        return self.queryset.model
+
+    @property
+    def query(self):
+        return self.queryset.query
+
+    @property
+    def ordered(self):
+        return self.queryset.ordered
+
+    def using(self, alias):
+        return self.queryset.using(alias)
+
+    def _clone(self):
+        # The admin changelist copies its queryset with this
+        return ScatterQuerySet(self.queryset._clone(), self.databases)
+
+    # Ordering ------------------------------------------------------------------
+
+    def ordering(self):
+        """(order by fields of the query or the model's default, the primary key tie-breaker or None)"""
+        query = self.queryset.query
+        opts = self.model._meta
+        if query.order_by:
+            fields = list(query.order_by)
+        elif query.default_ordering and opts.ordering:
+            fields = list(opts.ordering)
+        else:
+            fields = []
+        for field in fields:
+            if not isinstance(field, str) or field == '?':
+                raise NotImplementedError('ScatterQuerySet only orders by field names')
+        tiebreak = None
+        names = {field.lstrip('-') for field in fields}
+        if not names & {'pk', opts.pk.name, opts.pk.attname}:
+            tiebreak = '-pk' if fields and fields[-1].startswith('-') else 'pk'
+        return fields, tiebreak
+
+    def sort_key(self, fields, tiebreak):
+        """Python sort key for this query's rows (instances, dicts or tuples)"""
+        opts = self.model._meta
+        query = self.queryset.query
+        iterable = self.queryset._iterable_class
+        columns = [*query.extra_select, *query.values_select, *query.annotation_select]
+        local_fields = {field.name: field.attname for field in opts.concrete_fields}
+        getters = []
+        for field in fields + ([tiebreak] if tiebreak else []):
+            name = field.lstrip('-')
+            if name == 'pk':
+                name = opts.pk.name
+            if issubclass(iterable, ModelIterable):
+                if '__' in name:
+                    raise NotImplementedError('ScatterQuerySet orders model rows by their own fields only')
+                getter = lambda row, attname=local_fields.get(name, name): getattr(row, attname)
+            elif name not in columns:
+                if field is tiebreak:
+                    # Rows without the primary key are only merged on the requested fields
+                    continue
+                raise NotImplementedError(f'values() must include the ordering field {name!r}')
+            elif issubclass(iterable, ValuesIterable):
+                getter = lambda row, name=name: row[name]
+            elif issubclass(iterable, FlatValuesListIterable):
+                getter = lambda row: row
+            else:
+                getter = lambda row, position=columns.index(name): row[position]
+            getters.append((getter, field.startswith('-')))
+
+        def key(row):
+            parts = []
+            for getter, descending in getters:
+                value = getter(row)
+                # NULLs first when ascending (as in SQLite)
+                part = (value is not None, value)
+                parts.append(_Descending(part) if descending else part)
+            return tuple(parts)
+        return key
+
+    # Reading ---------------------------------------------------------------------
+
+    def merged(self, limit=None, chunk_size=None):
+        """Iterator over every shard's rows in order (at most `limit` from each)"""
+        fields, tiebreak = self.ordering()
+        streams = []
+        for alias in self.databases:
+            queryset = self.queryset.using(alias).order_by(*fields, *([tiebreak] if tiebreak else []))
+            if limit is not None:
+                queryset = queryset[:limit]
+            streams.append(queryset.iterator(chunk_size=chunk_size) if chunk_size else iter(queryset))
+        if len(streams) == 1:
+            return streams[0]
+        rows = heapq.merge(*streams, key=self.sort_key(fields, tiebreak))
+        if self.queryset.query.distinct and not issubclass(self.queryset._iterable_class, ModelIterable):
+            # Each shard's rows are distinct, but two shards can return the same values
+            rows = _unique(rows)
+        return rows
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            if key < 0:
+                raise ValueError('Negative indexing is not supported.')
+            rows = self[key:key + 1]
+            if not rows:
+                raise IndexError('ScatterQuerySet index out of range')
+            return rows[0]
+        if key.step is not None or (key.start or 0) < 0 or (key.stop is not None and key.stop < 0):
+            raise ValueError('Only positive slices without a step are supported.')
+        if self._result_cache is not None:
+            return self._result_cache[key]
+        return list(itertools.islice(self.merged(key.stop), key.start or 0, key.stop))
+
+    def _fetch_all(self):
+        if self._result_cache is None:
+            self._result_cache = list(self.merged())
+        return self._result_cache
+
+    def __iter__(self):
+        return iter(self._fetch_all())
+
+    def __len__(self):
+        return len(self._fetch_all())
+
+    def __bool__(self):
+        return self.exists()
+
+    def iterator(self, chunk_size=2000):
+        return self.merged(chunk_size=chunk_size)
+
+    def count(self):
+        if self._result_cache is not None:
+            return len(self._result_cache)
+        return sum(self.queryset.using(alias).count() for alias in self.databases)
+
+    def exists(self):
+        if self._result_cache is not None:
+            return bool(self._result_cache)
+        return any(self.queryset.using(alias).exists() for alias in self.databases)
+
+    def first(self):
+        rows = self[0:1]
+        return rows[0] if rows else None
+
+    def get(self, *args, **kwargs):
+        rows = self.filter(*args, **kwargs)[:2]
+        if not rows:
+            raise self.model.DoesNotExist(f'{self.model._meta.object_name} matching query does not exist.')
+        if len(rows) > 1:
+            raise self.model.MultipleObjectsReturned(
+                f'get() returned more than one {self.model._meta.object_name}.'
+            )
+        return rows[0]
+
+    def in_bulk(self, id_list=None):
+        found = {}
+        for alias in self.databases:
+            found.update(self.queryset.using(alias).in_bulk(id_list))
+        return found
+
+    def aggregate(self, **aggregates):
+        """Max, Min, Count and Sum, combined over the shards"""
+        combine = {}
+        for name, expression in aggregates.items():
+            function = self.COMBINE.get(type(expression))
+            if function is None or getattr(expression, 'distinct', False):
+                raise NotImplementedError(f'{expression!r} cannot be combined across shards')
+            combine[name] = function
+        results = [self.queryset.using(alias).aggregate(**aggregates) for alias in self.databases]
+        totals = {}
+        for name, function in combine.items():
+            values = [result[name] for result in results if result[name] is not None]
+            totals[name] = function(values) if values else results[0][name]
+        return totals
@@ -0,0 +1,75 @@
+# This file keeps in-memory product indexes in sync with database writes
+from django.contrib.auth.models import User
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from .models import Product, ProductChange
+from . import changes
+from . import shards
+from . import suggest
+from . import cache as product_cache
+from .storefront import invalidate_storefront
+
+
+@receiver(post_save, sender=Product)
+def update_suggest_index(sender, instance, **kwargs):
+    """Re-index a product's title, brand and category after it is saved"""
+    # Nothing to update until the first lookup has built the index
+    if suggest.index_is_loaded():
+        suggest.get_index().add_product(
+            instance.pk, instance.title, instance.brand, instance.category
+        )
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_suggest_index(sender, instance, **kwargs):
+    """Drop a deleted product from the autocomplete index"""
+    if suggest.index_is_loaded():
+        suggest.get_index().remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def refresh_storefront(sender, instance, **kwargs):
+    """Drop the cached storefront so the next home page view rebuilds it"""
+    invalidate_storefront()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_cache(sender, instance, using, **kwargs):
+    """Forget the cached copy of a product that was written"""
+    product_cache.invalidate(instance.pk, using=using)
+
+
+@receiver(post_save, sender=Product)
+def record_product_saved(sender, instance, using, raw=False, **kwargs):
+    """Add the insert or update to the product change log"""
+    if not raw:
+        changes.record([instance.pk], using=using)
+
+
+@receiver(post_delete, sender=Product)
+def record_product_deleted(sender, instance, using, **kwargs):
+    """Add the delete to the product change log"""
+    changes.record([instance.pk], ProductChange.DELETE, using=using)
+
+
+@receiver(pre_save, sender=Product)
+def allocate_product_id(sender, instance, raw=False, **kwargs):
+    """On seller shards a new product takes its id from ProductKey, so ids stay unique over all shards"""
+    if instance.pk is None and not raw and shards.enabled():
+        instance.pk = shards.allocate_product_ids(instance.seller_id, 1)[0]
+
+
+@receiver(post_delete, sender=Product)
+def forget_sharded_product(sender, instance, **kwargs):
+    """Cart lines, reviews and the id of a product deleted from a shard are on 'default'"""
+    if shards.enabled():
+        shards.forget_products([instance.pk])
+
+
+@receiver(pre_delete, sender=User)
+def delete_sharded_user_rows(sender, instance, **kwargs):
+    """Deleting a user cascades on 'default' only: remove their rows on the seller shards first"""
+    if shards.enabled():
+        shards.delete_user_rows(instance.pk)
@@ -0,0 +1,533 @@
+# This file exports the product catalog into a read-only snapshot that API
+# processes memory-map, so read nodes can serve the public product list and
+# product pages without touching the database.
+#
+# A snapshot is a directory of flat files, one row per product in id order:
+#   - numeric columns as .npy arrays (decimals as hundredths, datetimes as
+#     microseconds since the epoch)
+#   - text columns as one UTF-8 blob per field plus an offsets array, so
+#     row i is blob[offsets[i]:offsets[i + 1]]
+#   - category and brand also as codes into a list of their lowercased
+#     values (in meta.json), so ?category= and ?brand= compare integers
+#   - one row permutation per sortable field, so sorting costs nothing
+# Versions are written next to each other and published by swapping a
+# CURRENT pointer file (the same layout as the related-products index).
+import base64
+import binascii
+import json
+import mmap
+import os
+import shutil
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+# NumPy is optional: without it the API keeps reading from the database
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None
+
+# Integer columns; decimals are stored in hundredths
+INT_COLUMNS = (
+    'id', 'seller_id', 'stock', 'reviews_count',
+    'price', 'discount', 'rating', 'discounted_price',
+    'created_at', 'updated_at',
+)
+DECIMAL_COLUMNS = ('price', 'discount', 'rating', 'discounted_price')
+DATETIME_COLUMNS = ('created_at', 'updated_at')
+TEXT_COLUMNS = (
+    'title', 'description', 'category', 'brand', 'tags',
+    'image_url', 'additional_images', 'seller_username',
+)
+# Fields accepted by ?ordering= (ProductViewSet.ordering_fields)
+SORT_FIELDS = ('price', 'title', 'created_at', 'rating')
+# Text columns filtered by exact (case-insensitive) value
+CODE_COLUMNS = ('category', 'brand')
+# Bumped when the file layout changes; older snapshots are not opened
+FORMAT = 2
+# Rows read from the database at a time while exporting
+EXPORT_CHUNK = 5000
+# Search results kept per snapshot (?search= strings -> row masks)
+SEARCH_CACHE_SIZE = 64
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def snapshot_directory():
+    return Path(getattr(settings, 'CATALOG_SNAPSHOT_DIR', settings.BASE_DIR / 'var' / 'catalog'))
+
+
+def to_micros(value):
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(value):
+    return EPOCH + timedelta(microseconds=int(value))
+
+
+def to_hundredths(value):
+    return int(Decimal(value).scaleb(2))
+
+
+# Export ------------------------------------------------------------------------
+
+def export_snapshot(directory=None, queryset=None):
+    """
+    Write the current catalog as a new snapshot version and publish it.
+
+    Products are streamed in id order in chunks, so memory stays at a few
+    bytes per product plus the titles needed for the title sort order.
+    Returns the path of the new version.
+    """
+    # Imported here so the serializer decides the exported discounted price
+    from .models import Product
+    from .serializers import ProductSerializer
+
+    started = time.perf_counter()
+    directory = Path(directory) if directory else snapshot_directory()
+    directory.mkdir(parents=True, exist_ok=True)
+    version = time.strftime('%Y%m%d%H%M%S') + f"-{os.getpid()}-{int(time.time() * 1000) % 1000:03d}"
+    target = directory / version
+    target.mkdir()
+
+    if queryset is None:
+        queryset = Product.objects.all()
+    discounted_field = ProductSerializer().fields['discounted_price']
+    columns = {name: array('q') for name in INT_COLUMNS}
+    image_url_null = array('b')
+    codes = {name: array('q') for name in CODE_COLUMNS}
+    code_values = {name: {} for name in CODE_COLUMNS}
+    titles = []
+    text_files = {name: open(target / f'{name}.bin', 'wb') for name in TEXT_COLUMNS + ('search',)}
+    text_offsets = {name: array('q', [0]) for name in text_files}
+    try:
+        rows = _export_rows(queryset)
+        texts = {name: [] for name in text_files}
+        for count, row in enumerate(rows, 1):
+            (product_id, seller_id, stock, reviews_count, price, discount, rating,
+             created_at, updated_at, title, description, category, brand,
+             tags, image_url, additional_images, seller_username) = row
+            discounted = Product(price=price, discount=discount).get_discounted_price()
+            for name, value in (
+                ('id', product_id), ('seller_id', seller_id), ('stock', stock),
+                ('reviews_count', reviews_count), ('price', to_hundredths(price)),
+                ('discount', to_hundredths(discount)), ('rating', to_hundredths(rating)),
+                ('discounted_price', to_hundredths(discounted_field.to_representation(discounted))),
+                ('created_at', to_micros(created_at)), ('updated_at', to_micros(updated_at)),
+            ):
+                columns[name].append(value)
+            image_url_null.append(image_url is None)
+            for name, value in (('category', category), ('brand', brand)):
+                codes[name].append(code_values[name].setdefault(value.lower(), len(code_values[name])))
+            titles.append(title)
+            for name, value in (
+                ('title', title), ('description', description), ('category', category),
+                ('brand', brand), ('tags', tags), ('image_url', image_url or ''),
+                ('additional_images', additional_images), ('seller_username', seller_username),
+                # One lowercased blob for ?search=; the separators stop a
+                # term from matching across two fields or two rows
+                ('search', '\x00'.join((title, description, category, brand, tags, '')).lower()),
+            ):
+                texts[name].append(value.encode())
+            if count % EXPORT_CHUNK == 0:
+                _flush_texts(texts, text_files, text_offsets)
+        _flush_texts(texts, text_files, text_offsets)
+    finally:
+        for handle in text_files.values():
+            handle.close()
+
+    ids = np.frombuffer(columns['id'], dtype=np.int64)
+    for name, values in columns.items():
+        np.save(target / f'{name}.npy', np.frombuffer(values, dtype=np.int64))
+    np.save(target / 'image_url_null.npy', np.frombuffer(image_url_null, dtype=np.int8).astype(bool))
+    for name, values in codes.items():
+        np.save(target / f'{name}_code.npy', np.frombuffer(values, dtype=np.int64))
+    for name, offsets in text_offsets.items():
+        np.save(target / f'{name}.offsets.npy', np.frombuffer(offsets, dtype=np.int64))
+
+    # Ascending (value, id) permutations; descending orders read them backwards
+    for field in SORT_FIELDS:
+        if field == 'title':
+            order = sorted(range(len(titles)), key=lambda row: (titles[row], ids[row]))
+            order = np.array(order, dtype=np.int64)
+        else:
+            order = np.lexsort((ids, np.frombuffer(columns[field], dtype=np.int64)))
+        np.save(target / f'order_{field}.npy', order.astype(np.int64))
+
+    updated = np.frombuffer(columns['updated_at'], dtype=np.int64)
+    meta = {
+        'format': FORMAT,
+        'products': len(ids),
+        # Lowercased category and brand values, indexed by their codes
+        'codes': {name: list(values) for name, values in code_values.items()},
+        'exported_at': timezone.now().isoformat(),
+        'last_modified': from_micros(updated.max()).isoformat() if len(updated) else None,
+        'export_seconds': round(time.perf_counter() - started, 2),
+    }
+    with open(target / 'meta.json', 'w') as handle:
+        json.dump(meta, handle)
+
+    # Flip the pointer atomically, then drop all but the previous version
+    pointer = directory / 'CURRENT.tmp'
+    pointer.write_text(version)
+    os.replace(pointer, directory / 'CURRENT')
+    versions = sorted(path for path in directory.iterdir() if path.is_dir())
+    for old in versions[:-2]:
+        shutil.rmtree(old, ignore_errors=True)
+    return target
+
+
+def _export_rows(queryset):
+    """The exported columns of every product in id order, with the seller's username last"""
+    from django.contrib.auth.models import User
+    from . import shards
+
+    fields = (
+        'id', 'seller_id', 'stock', 'reviews_count', 'price', 'discount', 'rating',
+        'created_at', 'updated_at', 'title', 'description', 'category', 'brand',
+        'tags', 'image_url', 'additional_images',
+    )
+    if not shards.enabled():
+        return queryset.order_by('id').values_list(*fields, 'seller__username').iterator(chunk_size=EXPORT_CHUNK)
+    # The sellers are on 'default', not next to their products: no join, one
+    # query for the usernames of all sellers instead
+    catalog = shards.catalog(queryset)
+    seller_ids = set(catalog.order_by('seller_id').values_list('seller_id', flat=True).distinct())
+    usernames = dict(User.objects.filter(pk__in=seller_ids).values_list('id', 'username'))
+    return (
+        (*row, usernames[row[1]])
+        for row in catalog.order_by('id').values_list(*fields).iterator(chunk_size=EXPORT_CHUNK)
+    )
+
+
+def _flush_texts(texts, text_files, text_offsets):
+    for name, values in texts.items():
+        offsets = text_offsets[name]
+        end = offsets[-1]
+        for value in values:
+            end += len(value)
+            offsets.append(end)
+        text_files[name].write(b''.join(values))
+        values.clear()
+
+
+# Cursors -----------------------------------------------------------------------
+
+def encode_cursor(ordering, key, product_id, reverse):
+    """Opaque ?cursor= value: the sort key of the row to continue from"""
+    payload = json.dumps({'o': ordering, 'k': key, 'i': product_id, 'r': int(reverse)})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(value, ordering):
+    """(key, id, reverse) from a ?cursor= value, or None if it is not valid for `ordering`"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(value.encode()))
+        key = payload['k']
+        key_type = str if ordering.lstrip('-') == 'title' else int
+        if payload['o'] != ordering or type(key) is not key_type:
+            return None
+        return key, int(payload['i']), bool(payload['r'])
+    except (binascii.Error, ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+# Reading -----------------------------------------------------------------------
+
+class TextColumn:
+    """One memory-mapped text field: row i is blob[offsets[i]:offsets[i + 1]]"""
+
+    def __init__(self, target, name):
+        self.offsets = np.load(target / f'{name}.offsets.npy', mmap_mode='r')
+        with open(target / f'{name}.bin', 'rb') as handle:
+            size = os.fstat(handle.fileno()).st_size
+            # mmap refuses empty files; an empty catalog has nothing to read anyway
+            self.blob = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.view = memoryview(self.blob)
+
+    def __getitem__(self, row):
+        # Decoding straight from the mapped pages: no intermediate bytes copy
+        return str(self.view[self.offsets[row]:self.offsets[row + 1]], 'utf-8')
+
+    def rows_containing(self, needle, count):
+        """Boolean mask of the rows whose text contains `needle` (bytes)"""
+        mask = np.zeros(count, dtype=bool)
+        position = self.blob.find(needle)
+        while position != -1:
+            row = int(np.searchsorted(self.offsets, position, side='right')) - 1
+            end = int(self.offsets[row + 1])
+            if position + len(needle) <= end:
+                mask[row] = True
+                # One match per row is enough: continue at the next row
+                position = self.blob.find(needle, end)
+            else:
+                # The match runs into the next row: not a match of either
+                position = self.blob.find(needle, position + 1)
+        return mask
+
+
+class CatalogSnapshot:
+    """
+    Read side: products by id, search masks and keyset pages over the
+    memory-mapped files of one snapshot version.
+    """
+
+    def __init__(self, target):
+        # Imported here so the fields format values exactly like the database path
+        from .serializers import ProductSerializer
+
+        self.version = target.name
+        with open(target / 'meta.json') as handle:
+            self.meta = json.load(handle)
+        self.columns = {
+            name: np.load(target / f'{name}.npy', mmap_mode='r')
+            for name in INT_COLUMNS + ('image_url_null',)
+        }
+        self.texts = {name: TextColumn(target, name) for name in TEXT_COLUMNS + ('search',)}
+        self.codes = {name: np.load(target / f'{name}_code.npy', mmap_mode='r') for name in CODE_COLUMNS}
+        self.code_values = {
+            name: {value: code for code, value in enumerate(values)} for name, values in self.meta['codes'].items()
+        }
+        self.orders = {field: np.load(target / f'order_{field}.npy', mmap_mode='r') for field in SORT_FIELDS}
+        self.ids = self.columns['id']
+        self.fields = ProductSerializer().fields
+        self.search_cache = OrderedDict()
+        self.search_cache_lock = threading.Lock()
+        self.last_modified = (
+            datetime.fromisoformat(self.meta['last_modified']) if self.meta['last_modified'] else None
+        )
+
+    @classmethod
+    def open(cls, directory):
+        pointer = Path(directory) / 'CURRENT'
+        if np is None or not pointer.exists():
+            return None
+        target = Path(directory) / pointer.read_text().strip()
+        with open(target / 'meta.json') as handle:
+            if json.load(handle).get('format') != FORMAT:
+                # Written by an older version: read the database until the next export
+                return None
+        return cls(target)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Rows --------------------------------------------------------------------
+
+    def row_of(self, product_id):
+        """Row number of a product id (rows are in id order), or None"""
+        row = int(np.searchsorted(self.ids, product_id))
+        if row < len(self.ids) and self.ids[row] == product_id:
+            return row
+        return None
+
+    def serialize(self, row):
+        """The same dict ProductSerializer returns for this product"""
+        columns, texts, fields = self.columns, self.texts, self.fields
+        value = {}
+        for name in fields:
+            if name == 'seller':
+                value[name] = int(columns['seller_id'][row])
+            elif name in DECIMAL_COLUMNS:
+                value[name] = fields[name].to_representation(Decimal(int(columns[name][row])).scaleb(-2))
+            elif name in DATETIME_COLUMNS:
+                value[name] = fields[name].to_representation(from_micros(columns[name][row]))
+            elif name == 'image_url' and columns['image_url_null'][row]:
+                value[name] = None
+            elif name in texts:
+                value[name] = texts[name][row]
+            else:
+                value[name] = int(columns[name][row])
+        return value
+
+    def get_many(self, product_ids):
+        """{product_id: data} for the ids that are in the snapshot"""
+        found = {}
+        for product_id in product_ids:
+            row = self.row_of(product_id)
+            if row is not None:
+                found[product_id] = self.serialize(row)
+        return found
+
+    # Search ------------------------------------------------------------------
+
+    def search_mask(self, terms):
+        """
+        Rows matching every term in at least one search field (like
+        SearchFilter's icontains), or None for no search. Case is folded
+        for all of Unicode, as PostgreSQL does; SQLite only folds ASCII.
+        """
+        if not terms:
+            return None
+        key = tuple(term.lower() for term in terms)
+        with self.search_cache_lock:
+            if key in self.search_cache:
+                self.search_cache.move_to_end(key)
+                return self.search_cache[key]
+        mask = None
+        for term in key:
+            if '\x00' in term:
+                # The separator itself: in no product's text
+                term_mask = np.zeros(len(self), dtype=bool)
+            else:
+                term_mask = self.texts['search'].rows_containing(term.encode(), len(self))
+            mask = term_mask if mask is None else mask & term_mask
+        with self.search_cache_lock:
+            self.search_cache[key] = mask
+            while len(self.search_cache) > SEARCH_CACHE_SIZE:
+                self.search_cache.popitem(last=False)
+        return mask
+
+    def filter_mask(self, filters):
+        """
+        Rows passing the catalog filters (see products.views.catalog_filters),
+        or None for no filters.
+        """
+        mask = None
+
+        def narrow(rows):
+            nonlocal mask
+            mask = rows if mask is None else mask & rows
+
+        for name in CODE_COLUMNS:
+            if filters.get(name) is not None:
+                code = self.code_values[name].get(filters[name].lower())
+                narrow(self.codes[name] == code if code is not None else np.zeros(len(self), dtype=bool))
+        if filters.get('seller') is not None:
+            narrow(self.columns['seller_id'] == filters['seller'])
+        if filters.get('min_price') is not None:
+            narrow(self.columns['price'] >= to_hundredths(filters['min_price']))
+        if filters.get('max_price') is not None:
+            narrow(self.columns['price'] <= to_hundredths(filters['max_price']))
+        if filters.get('in_stock'):
+            narrow(self.columns['stock'] > 0)
+        return mask
+
+    # Paging ------------------------------------------------------------------
+
+    def sort_key(self, field, row):
+        value = self.texts['title'][row] if field == 'title' else int(self.columns[field][row])
+        return value, int(self.ids[row])
+
+    def locate(self, field, key):
+        """(left, right) bisection of (value, id) in the ascending order of `field`"""
+        order = self.orders[field]
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            if self.sort_key(field, order[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(order) and self.sort_key(field, order[low]) == key:
+            return low, low + 1
+        return low, low
+
+    def page(self, ordering, terms=(), cursor=None, size=24, filters=None):
+        """
+        One keyset page of the catalog in `ordering` (e.g. '-created_at'),
+        narrowed by the search `terms` and the catalog `filters`.
+
+        `cursor` is the decoded (key, id, reverse) of the row to continue
+        from. Returns (rows, next_cursor, previous_cursor) with the cursors
+        already encoded (None when there is no such page). Row orders are
+        read backwards or forwards straight from the mapped permutations.
+        """
+        field = ordering.lstrip('-')
+        descending = ordering.startswith('-')
+        order = self.orders[field]
+        mask = self.search_mask(terms)
+        filtered = self.filter_mask(filters or {})
+        if filtered is not None:
+            mask = filtered if mask is None else mask & filtered
+
+        if cursor is None:
+            reverse = False
+            start = len(order) - 1 if descending else 0
+        else:
+            key, product_id, reverse = cursor
+            left, right = self.locate(field, (key, product_id))
+            # Walking up the ascending order is "forward" for ascending
+            # orderings and "backward" for descending ones
+            start = right if descending == reverse else left - 1
+        step = 1 if descending == reverse else -1
+        if step == 1:
+            sequence = order[start:]
+        else:
+            sequence = order[start::-1] if start >= 0 else order[:0]
+
+        rows = self.collect(sequence, mask, size + 1)
+        has_more = len(rows) > size
+        rows = rows[:size]
+        if reverse:
+            rows.reverse()
+
+        def cursor_at(row, backwards):
+            key, product_id = self.sort_key(field, row)
+            return encode_cursor(ordering, key, product_id, backwards)
+
+        if not reverse:
+            next_cursor = cursor_at(rows[-1], False) if has_more else None
+            previous_cursor = cursor_at(rows[0], True) if cursor is not None and rows else None
+        else:
+            previous_cursor = cursor_at(rows[0], True) if has_more else None
+            next_cursor = cursor_at(rows[-1], False) if rows else None
+        return [self.serialize(row) for row in rows], next_cursor, previous_cursor
+
+    @staticmethod
+    def collect(sequence, mask, count):
+        """The first `count` rows of `sequence` that pass `mask`"""
+        if mask is None:
+            return [int(row) for row in sequence[:count]]
+        rows = []
+        chunk = 1024
+        for start in range(0, len(sequence), chunk):
+            block = sequence[start:start + chunk]
+            rows.extend(int(row) for row in block[mask[block]])
+            if len(rows) >= count:
+                break
+            # Rare terms need long scans; grow the blocks as we go
+            chunk = min(chunk * 2, 65536)
+        return rows[:count]
+
+
+_snapshot = None
+_snapshot_checked_at = 0.0
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot():
+    """
+    Return the current CatalogSnapshot, re-opening it when a new version has
+    been published (checked at most every CATALOG_SNAPSHOT_RELOAD_SECONDS).
+    """
+    global _snapshot, _snapshot_checked_at
+    now = time.monotonic()
+    interval = getattr(settings, 'CATALOG_SNAPSHOT_RELOAD_SECONDS', 30)
+    if _snapshot is not None and now - _snapshot_checked_at < interval:
+        return _snapshot
+    with _snapshot_lock:
+        _snapshot_checked_at = now
+        directory = snapshot_directory()
+        pointer = directory / 'CURRENT'
+        version = pointer.read_text().strip() if pointer.exists() else None
+        if version is None:
+            _snapshot = None
+        elif _snapshot is None or _snapshot.version != version:
+            # Requests already holding the old snapshot finish on its mappings
+            _snapshot = CatalogSnapshot.open(directory)
+    return _snapshot
+
+
+def reset_snapshot():
+    """Forget the open snapshot (used by tests)"""
+    global _snapshot, _snapshot_checked_at
+    _snapshot = None
+    _snapshot_checked_at = 0.0
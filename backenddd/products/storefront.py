@@ -0,0 +1,130 @@
+# This file builds the storefront: the curated product sections shown on the
+# home page. Every section is a LIMIT query served by an index, and the whole
+# payload is cached, so the first screen costs the same for 100 or 1,000,000
+# products.
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Window, prefetch_related_objects
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from .models import Product
+from . import shards
+
+CACHE_KEY = 'products:storefront'
+
+
+def with_sellers(queryset):
+    # The serializer shows seller.username, so join it instead of one query per
+    # product. With seller shards the sellers live on 'default': build_storefront
+    # loads the sellers of every section at once instead of once per shard and section
+    if shards.enabled():
+        return queryset
+    return queryset.select_related('seller')
+
+
+def products():
+    return shards.catalog(with_sellers(Product.objects.all()))
+
+
+def section_size():
+    return getattr(settings, 'STOREFRONT_SECTION_SIZE', 8)
+
+
+def top_categories(limit):
+    """The categories with the most products"""
+    counts = {}
+    # One GROUP BY per database, added up (a single query without seller shards)
+    for queryset in shards.each(Product.objects.exclude(category='')):
+        for category, count in queryset.values('category').annotate(products=Count('id')).values_list(
+            'category', 'products'
+        ):
+            counts[category] = counts.get(category, 0) + count
+    return sorted(counts, key=lambda category: (-counts[category], category))[:limit]
+
+
+def category_sections(categories, size):
+    """Best rated products of each category, in one windowed query (per seller shard)"""
+    ranked = (
+        with_sellers(Product.objects.all()).filter(category__in=categories)
+        .annotate(position=Window(
+            RowNumber(),
+            partition_by=[F('category')],
+            order_by=[F('rating').desc(), F('reviews_count').desc(), F('id').desc()],
+        ))
+        .filter(position__lte=size)
+        .order_by('category', 'position')
+    )
+    by_category = {category: [] for category in categories}
+    for rows in shards.each(ranked):
+        for product in rows:
+            by_category[product.category].append(product)
+    if shards.enabled():
+        # Each shard sent its best `size`: keep the best `size` of those
+        for category, found in by_category.items():
+            found.sort(key=lambda product: (product.rating, product.reviews_count, product.id), reverse=True)
+            del found[size:]
+    return [
+        {'key': f'category:{category}', 'title': category, 'products': by_category[category]}
+        for category in categories
+        if by_category[category]
+    ]
+
+
+def build_storefront():
+    """
+    Run the section queries and return the serialized storefront.
+
+    Featured are the most reviewed products in stock, top rated needs a
+    minimum number of reviews so one 5-star review doesn't win, and each of
+    the largest categories gets its own row.
+    """
+    # Imported here because signals.py imports this module at startup, and
+    # the serializers pull in all of DRF (not needed by management commands)
+    from .serializers import ProductSerializer
+
+    size = section_size()
+    min_reviews = getattr(settings, 'STOREFRONT_MIN_REVIEWS', 3)
+    in_stock = products().filter(stock__gt=0)
+    sections = [
+        {
+            'key': 'featured',
+            'title': 'Featured',
+            'products': list(in_stock.order_by('-reviews_count', '-rating')[:size]),
+        },
+        {
+            'key': 'top_rated',
+            'title': 'Top rated',
+            'products': list(
+                products().filter(reviews_count__gte=min_reviews).order_by('-rating', '-reviews_count')[:size]
+            ),
+        },
+        {
+            'key': 'newest',
+            'title': 'New arrivals',
+            'products': list(products().order_by('-created_at', '-id')[:size]),
+        },
+    ]
+    categories = top_categories(getattr(settings, 'STOREFRONT_CATEGORIES', 6))
+    sections.extend(category_sections(categories, size))
+
+    # No-op without seller shards (already joined)
+    prefetch_related_objects([product for section in sections for product in section['products']], 'seller')
+    for section in sections:
+        section['products'] = ProductSerializer(section['products'], many=True).data
+    return {
+        'generated_at': timezone.now(),
+        'sections': [section for section in sections if section['products']],
+    }
+
+
+def get_storefront():
+    """The cached storefront, rebuilt on a miss (at most every STOREFRONT_CACHE_SECONDS)"""
+    storefront = cache.get(CACHE_KEY)
+    if storefront is None:
+        storefront = build_storefront()
+        cache.set(CACHE_KEY, storefront, getattr(settings, 'STOREFRONT_CACHE_SECONDS', 60))
+    return storefront
+
+
+def invalidate_storefront():
+    cache.delete(CACHE_KEY)
@@ -0,0 +1,305 @@
+# This file keeps an in-memory prefix index used by the search box autocomplete.
+# Each process builds its index once when it starts (warm_up(), called from
+# backenddd/wsgi.py and asgi.py), then keeps it current from the product
+# change log (products/changes.py), which every writer adds to, including
+# queryset.update() and bulk_create() ones and other processes. Like any
+# reader of the log it only sees settled changes (changes.settled_before()).
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DatabaseError
+
+logger = logging.getLogger(__name__)
+
+# The kinds of terms we suggest, in the order they are stored on a product
+SUGGEST_FIELDS = ("title", "brand", "category")
+
+# Hard cap on how many suggestions one request can ask for
+MAX_SUGGESTIONS = 20
+
+
+def normalize(text):
+    """Lower-case and trim a term so lookups are case-insensitive"""
+    return " ".join((text or "").split()).casefold()
+
+
+class PrefixIndex:
+    """
+    Sorted array of normalized terms searched with binary search.
+
+    Each key is "<normalized term>\\x00<kind>" so the same word used as a
+    brand and as a category is suggested once for each. We also remember the
+    indexed terms per product so an update can remove the old values.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Sorted list of keys, searched with bisect
+        self._keys = []
+        # key -> [display text, kind, number of products using it]
+        self._terms = {}
+        # product id -> tuple of (kind, display text) currently indexed
+        self._products = {}
+        # Newest updated_at we have seen, used when loading a snapshot
+        self.watermark = None
+        # Change log position the index is up to date with, and when it was last checked
+        self.seq = 0
+        self.checked_at = 0.0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _add_term(self, kind, text, keep_sorted=True):
+        norm = normalize(text)
+        if not norm:
+            return
+        key = f"{norm}\x00{kind}"
+        entry = self._terms.get(key)
+        if entry is None:
+            self._terms[key] = [text.strip(), kind, 1]
+            if keep_sorted:
+                insort(self._keys, key)
+            else:
+                self._keys.append(key)
+        else:
+            entry[2] += 1
+
+    def _remove_term(self, kind, text):
+        norm = normalize(text)
+        if not norm:
+            return
+        key = f"{norm}\x00{kind}"
+        entry = self._terms.get(key)
+        if entry is None:
+            return
+        entry[2] -= 1
+        if entry[2] <= 0:
+            del self._terms[key]
+            position = bisect_left(self._keys, key)
+            if position < len(self._keys) and self._keys[position] == key:
+                del self._keys[position]
+
+    def _discard(self, product_id):
+        for kind, text in self._products.pop(product_id, ()):
+            self._remove_term(kind, text)
+
+    @staticmethod
+    def _terms_for(title, brand, category):
+        return tuple(
+            (kind, text)
+            for kind, text in zip(SUGGEST_FIELDS, (title, brand, category))
+            if normalize(text)
+        )
+
+    def add_product(self, product_id, title, brand, category):
+        """Index (or re-index) one product"""
+        terms = self._terms_for(title, brand, category)
+        with self._lock:
+            if self._products.get(product_id) == terms:
+                return
+            self._discard(product_id)
+            for kind, text in terms:
+                self._add_term(kind, text)
+            self._products[product_id] = terms
+
+    def add_products(self, rows):
+        """
+        Index many (id, title, brand, category) rows at once.
+
+        New keys are appended and the array is sorted once at the end, which
+        is much faster than inserting one by one when building from scratch.
+        """
+        with self._lock:
+            for product_id, title, brand, category in rows:
+                terms = self._terms_for(title, brand, category)
+                if self._products.get(product_id) == terms:
+                    continue
+                self._discard(product_id)
+                for kind, text in terms:
+                    self._add_term(kind, text, keep_sorted=False)
+                self._products[product_id] = terms
+            self._keys.sort()
+
+    def remove_product(self, product_id):
+        """Drop a deleted product from the index"""
+        with self._lock:
+            self._discard(product_id)
+
+    def remove_products(self, product_ids):
+        with self._lock:
+            for product_id in product_ids:
+                self._discard(product_id)
+
+    def product_ids(self):
+        with self._lock:
+            return list(self._products)
+
+    def search(self, prefix, limit=10):
+        """Return up to `limit` suggestions whose term starts with `prefix`"""
+        norm = normalize(prefix)
+        if not norm:
+            return []
+        limit = max(1, min(limit, MAX_SUGGESTIONS))
+        results = []
+        # Writers sort and shift the array in place: never read it halfway through
+        with self._lock:
+            keys = self._keys
+            position = bisect_left(keys, norm)
+            while position < len(keys) and len(results) < limit:
+                key = keys[position]
+                if not key.startswith(norm):
+                    break
+                entry = self._terms[key]
+                results.append({"text": entry[0], "type": entry[1], "count": entry[2]})
+                position += 1
+        return results
+
+    def dump(self, path):
+        """Write the indexed products to a JSON snapshot file"""
+        with self._lock:
+            rows = [
+                [product_id, dict(terms)]
+                for product_id, terms in self._products.items()
+            ]
+        payload = {
+            "watermark": self.watermark.isoformat() if self.watermark else None,
+            "products": rows,
+        }
+        Path(path).write_text(json.dumps(payload))
+
+    def load(self, path):
+        """Fill the index from a JSON snapshot file written by dump()"""
+        from django.utils.dateparse import parse_datetime
+
+        payload = json.loads(Path(path).read_text())
+        self.add_products(
+            (product_id, terms.get("title", ""), terms.get("brand", ""), terms.get("category", ""))
+            for product_id, terms in payload["products"]
+        )
+        if payload.get("watermark"):
+            self.watermark = parse_datetime(payload["watermark"])
+
+    def load_from_database(self, queryset):
+        """Index every product in `queryset` (only the needed columns are read)"""
+        rows = queryset.values_list("id", "title", "brand", "category", "updated_at")
+
+        def track_watermark():
+            for product_id, title, brand, category, updated_at in rows.iterator(chunk_size=5000):
+                if self.watermark is None or updated_at > self.watermark:
+                    self.watermark = updated_at
+                yield product_id, title, brand, category
+
+        self.add_products(track_watermark())
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def build_index():
+    """Build a fresh index from the snapshot file (if any) plus the database"""
+    from .models import Product
+    from . import changes, shards
+
+    index = PrefixIndex()
+    # Read first: whatever changes while the products are read is replayed by refresh_index()
+    index.seq = changes.head()[0]
+    snapshot = getattr(settings, "PRODUCT_SUGGEST_SNAPSHOT", None)
+    queryset = shards.catalog(Product.objects.all())
+    if snapshot and Path(snapshot).exists():
+        index.load(snapshot)
+        # The snapshot can't know which of its products were deleted since:
+        # keep only the ids that still exist (one id-only query per database)
+        existing = set()
+        for ids in shards.each(Product.objects.values_list("id", flat=True)):
+            existing.update(ids)
+        index.remove_products(product_id for product_id in index.product_ids() if product_id not in existing)
+        # Only products changed after the snapshot was taken need to be read
+        if index.watermark is not None:
+            queryset = queryset.filter(updated_at__gt=index.watermark)
+    index.load_from_database(queryset)
+    index.checked_at = time.monotonic()
+    return index
+
+
+def refresh_index(index, chunk_size=1000):
+    """
+    Apply the change log since index.seq: upserted products are read again,
+    deleted ones removed. Returns the index, or a rebuilt one when the log
+    was compacted past index.seq.
+    """
+    from .models import Product, ProductChange
+    from . import changes, shards
+
+    if changes.needs_resync(index.seq):
+        return build_index()
+    while True:
+        rows, seq, has_more = changes.changes_since(index.seq, chunk_size)
+        upserts = [product_id for _, product_id, op in rows if op == ProductChange.UPSERT]
+        found = []
+        for alias, product_ids in shards.group_products(upserts).items():
+            found.extend(
+                Product.objects.using(alias).filter(pk__in=product_ids).values_list("id", "title", "brand", "category")
+            )
+        index.add_products(found)
+        # Deleted, or upserted and deleted again since
+        present = {row[0] for row in found}
+        index.remove_products(product_id for _, product_id, _ in rows if product_id not in present)
+        index.seq = seq
+        if not has_more:
+            return index
+
+
+def get_index():
+    """
+    Return the process-wide index, building it if warm_up() didn't and
+    bringing it up to date from the change log every
+    PRODUCT_SUGGEST_REFRESH_SECONDS. One thread builds or refreshes at a time.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = build_index()
+    interval = getattr(settings, "PRODUCT_SUGGEST_REFRESH_SECONDS", 5)
+    # Without waiting: while one request refreshes (or rebuilds, after a
+    # compaction), the others keep searching the current index
+    if time.monotonic() - _index.checked_at > interval and _index_lock.acquire(blocking=False):
+        try:
+            if _index is not None and time.monotonic() - _index.checked_at > interval:
+                _index.checked_at = time.monotonic()
+                _index = refresh_index(_index)
+        finally:
+            _index_lock.release()
+    return _index
+
+
+def warm_up():
+    """
+    Build the index before the first /suggest request needs it (web workers
+    call this when they start). Off with PRODUCT_SUGGEST_WARM_UP = False.
+    If the database can't be read yet (e.g. not migrated), the first request
+    builds it instead.
+    """
+    if not getattr(settings, "PRODUCT_SUGGEST_WARM_UP", True):
+        return
+    try:
+        get_index()
+    except DatabaseError:
+        logger.warning("Could not build the suggest index at startup", exc_info=True)
+
+
+def index_is_loaded():
+    return _index is not None
+
+
+def reset_index():
+    """Forget the current index so the next lookup rebuilds it"""
+    global _index
+    with _index_lock:
+        _index = None
@@ -1,3 +1,1633 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError
+from django.db.models import Max
+from django.forms.models import model_to_dict
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from backenddd import compiled, middleware, queries
+from backenddd.middleware import CompressionMiddleware
+from backenddd.renderers import FastJSONRenderer
+from backenddd.testing import SHARDS, SellerShardsMixin
+from orders.models import Order, OrderItem
+from orders.serializers import OrderSerializer
+from . import cache as product_cache
+from . import changes
+from . import related
+from . import shards
+from . import snapshot
+from . import suggest
+from .models import Product, ProductCacheGeneration, ProductChange, ProductKey, Review, SellerShard
+from .serializers import ProductSerializer, ReviewSerializer
+from .views import ProductViewSet, ReviewViewSet
 
 # Create your tests here.
+
+
+class CatalogSnapshotConsistencyTests(TestCase):
+    """The snapshot read backend must answer exactly like the database one"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='catalog-snapshot-test-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        settings_override = override_settings(
+            CATALOG_SNAPSHOT_DIR=self.directory, CATALOG_SNAPSHOT_RELOAD_SECONDS=0
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Many requests per test: don't let the anonymous rate limit get in the way
+        throttles = mock.patch.object(ProductViewSet, 'throttle_classes', [])
+        throttles.start()
+        self.addCleanup(throttles.stop)
+        for alias in ('default', 'throttle'):
+            caches[alias].clear()
+        product_cache.reset_cache()
+        snapshot.reset_snapshot()
+        self.addCleanup(snapshot.reset_snapshot)
+
+        sellers = [User.objects.create(username='alice'), User.objects.create(username='bøb')]
+        words = ['Blue', 'Lamp', 'Chair', 'Acme', 'Café', 'Desk']
+        for number in range(45):
+            Product.objects.create(
+                seller=sellers[number % 2],
+                title=f'{words[number % 6]} {words[(number * 5) % 6]} item {number:02d}',
+                description=f'A {words[(number * 7) % 6].lower()} thing, number {number}',
+                # Distinct prices and ratings so the database order has no ties
+                price=Decimal(1000 + number * 37) / 100,
+                stock=number % 4,
+                category=['lighting', 'furniture', 'office'][number % 3],
+                brand='Acme' if number % 4 == 0 else 'Globex',
+                tags='sale,new' if number % 5 == 0 else '',
+                discount=Decimal(number % 3 * 12.5),
+                image_url=None if number % 6 == 0 else f'https://example.com/{number}.jpg',
+                rating=Decimal(number) / 10,
+                reviews_count=number,
+            )
+        snapshot.export_snapshot()
+
+    def get(self, backend, url, **params):
+        with override_settings(PRODUCT_READ_BACKEND=backend):
+            return self.client.get(url, params)
+
+    def all_pages(self, backend, **params):
+        """Every result of a list query, following the next links"""
+        response = self.get(backend, '/api/products/', page_size=7, **params)
+        results = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            results.extend(page['results'])
+            if not page['next']:
+                return results
+            response = self.get(backend, page['next'])
+
+    def test_list_matches_database(self):
+        for params in [
+            {},
+            {'ordering': 'price'},
+            {'ordering': '-price'},
+            {'ordering': 'title'},
+            {'ordering': '-title'},
+            {'ordering': 'rating'},
+            {'ordering': 'created_at'},
+            {'search': 'blue'},
+            {'search': 'lamp, acme'},
+            {'search': 'Café', 'ordering': '-price'},
+            {'search': 'no such product'},
+            {'category': 'Lighting'},
+            {'brand': 'acme', 'ordering': 'price'},
+            {'min_price': '12.00', 'max_price': '20.36', 'ordering': '-price'},
+            {'in_stock': '1', 'search': 'lamp'},
+            {'seller': User.objects.get(username='alice').pk, 'category': 'office'},
+            {'category': 'no such category'},
+        ]:
+            with self.subTest(**params):
+                expected = self.all_pages('database', **params)
+                self.assertEqual(self.all_pages('snapshot', **params), expected)
+
+    def test_invalid_filter_is_rejected(self):
+        for backend in ('database', 'snapshot'):
+            response = self.get(backend, '/api/products/', min_price='cheap')
+            self.assertEqual(response.status_code, 400)
+
+    def test_search_term_does_not_straddle_two_rows(self):
+        directory = tempfile.mkdtemp(prefix='catalog-text-test-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        target = snapshot.Path(directory)
+        with open(target / 'search.bin', 'wb') as handle:
+            handle.write(b'alpha\x00foo' + b'bar\x00beta')
+        snapshot.np.save(target / 'search.offsets.npy', snapshot.np.array([0, 9, 18], dtype=snapshot.np.int64))
+        column = snapshot.TextColumn(target, 'search')
+        self.assertEqual(list(column.rows_containing(b'foobar', 2)), [False, False])
+        self.assertEqual(list(column.rows_containing(b'bar', 2)), [False, True])
+        self.assertEqual(list(column.rows_containing(b'a', 2)), [True, True])
+
+    def test_previous_links_walk_back(self):
+        first = self.get('snapshot', '/api/products/', page_size=10, ordering='-price').json()
+        self.assertIsNone(first['previous'])
+        second = self.get('snapshot', first['next']).json()
+        back = self.get('snapshot', second['previous']).json()
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(back['previous'])
+
+    def test_retrieve_and_batch_match_byte_for_byte(self):
+        product_ids = list(shards.catalog(Product.objects.order_by('id')).values_list('id', flat=True)[:10])
+        for product_id in product_ids + [999999]:
+            expected = self.get('database', f'/api/products/{product_id}/')
+            actual = self.get('snapshot', f'/api/products/{product_id}/')
+            self.assertEqual(actual.status_code, expected.status_code)
+            self.assertEqual(actual.content, expected.content)
+        ids = ','.join(str(product_id) for product_id in product_ids[::-1] + [999999])
+        self.assertEqual(
+            self.get('snapshot', '/api/products/', ids=ids).content,
+            self.get('database', '/api/products/', ids=ids).content,
+        )
+
+    def test_invalid_cursor(self):
+        response = self.get('snapshot', '/api/products/', cursor='not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+    def test_new_export_is_picked_up(self):
+        product = shards.catalog(Product.objects.order_by('id')).first()
+        Product.objects.using(product._state.db).filter(pk=product.pk).update(price=Decimal('1.23'))
+        response = self.get('snapshot', f'/api/products/{product.pk}/')
+        self.assertNotEqual(json.loads(response.content)['price'], '1.23')
+
+        snapshot.export_snapshot()
+        response = self.get('snapshot', f'/api/products/{product.pk}/')
+        self.assertEqual(json.loads(response.content)['price'], '1.23')
+
+    def test_without_snapshot_reads_the_database(self):
+        shutil.rmtree(self.directory)
+        snapshot.reset_snapshot()
+        self.assertEqual(self.all_pages('snapshot'), self.all_pages('database'))
+
+
+class ShardedCatalogSnapshotConsistencyTests(SellerShardsMixin, CatalogSnapshotConsistencyTests):
+    """The same with the snapshot exported from the seller shards"""
+
+
+class SellerShardTests(SellerShardsMixin, TestCase):
+    """Products and order items spread over three local SQLite shards"""
+
+    def setUp(self):
+        for alias in ('default', 'throttle'):
+            caches[alias].clear()
+        product_cache.reset_cache()
+        self.client = APIClient()
+        self.buyer = User.objects.create(username='buyer')
+        self.sellers = [User.objects.create(username=f'seller{number}') for number in range(4)]
+        self.products = []
+        for number in range(30):
+            self.products.append(Product.objects.create(
+                seller=self.sellers[number % 4],
+                title=f'Item {number:02d}',
+                description='Sharded',
+                # Distinct prices so every ordering is total
+                price=Decimal(500 + number * 7) / 100,
+                stock=10,
+                category=['lamps', 'desks'][number % 2],
+            ))
+
+    def shard_of(self, seller):
+        return shards.shard_for_seller(seller.pk)
+
+    def all_pages(self, **params):
+        response = self.client.get('/api/products/', {'page_size': 4, **params})
+        ids = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            ids.extend(product['id'] for product in page['results'])
+            if not page['next']:
+                return ids
+            response = self.client.get(page['next'])
+
+    def test_products_live_on_their_sellers_shard(self):
+        self.assertFalse(Product.objects.using('default').exists())
+        self.assertGreater(len({self.shard_of(seller) for seller in self.sellers}), 1)
+        for product in self.products:
+            self.assertEqual(product._state.db, self.shard_of(product.seller))
+            self.assertTrue(Product.objects.using(self.shard_of(product.seller)).filter(pk=product.pk).exists())
+        ids = [product.pk for product in self.products]
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(ProductKey.objects.count(), len(ids))
+
+    def test_scatter_list_matches_a_sorted_merge(self):
+        by_price = sorted(self.products, key=lambda product: product.price)
+        newest = sorted(self.products, key=lambda product: (product.created_at, product.pk), reverse=True)
+        self.assertEqual(self.all_pages(), [product.pk for product in newest])
+        self.assertEqual(self.all_pages(ordering='price'), [product.pk for product in by_price])
+        self.assertEqual(self.all_pages(ordering='-price'), [product.pk for product in reversed(by_price)])
+        lamps = [product.pk for product in by_price if product.category == 'lamps']
+        self.assertEqual(self.all_pages(search='lamps', ordering='price'), lamps)
+
+        response = self.client.get(f'/api/products/{self.products[5].pk}/')
+        self.assertEqual(response.json()['seller_username'], self.products[5].seller.username)
+        ids = ','.join(str(product.pk) for product in self.products[:6])
+        found = self.client.get('/api/products/', {'ids': ids}).json()
+        self.assertEqual([product['id'] for product in found['results']], [p.pk for p in self.products[:6]])
+
+    def test_checkout_across_shards(self):
+        first, second = self.products[0], self.products[1]
+        self.assertNotEqual(first._state.db, second._state.db)
+        self.client.force_authenticate(self.buyer)
+        self.client.put('/api/orders/cart/', {'items': [
+            {'product': first.pk, 'quantity': 2}, {'product': second.pk, 'quantity': 1},
+        ]}, format='json')
+        cart = self.client.get('/api/orders/cart/').json()
+        self.assertEqual(cart['total_items'], 3)
+        self.assertEqual(Decimal(str(cart['total_price'])), first.price * 2 + second.price)
+
+        response = self.client.post('/api/orders/cart/checkout/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['items']), 2)
+        order = Order.objects.get()
+        for product, quantity in ((first, 2), (second, 1)):
+            item = OrderItem.objects.using(product._state.db).get(order_id=order.pk)
+            self.assertEqual(item.quantity, quantity)
+            self.assertEqual(item.order_created_at, order.created_at)
+            product.refresh_from_db()
+            self.assertEqual(product.stock, 10 - quantity)
+
+        history = self.client.get('/api/orders/').json()
+        self.assertEqual(len(history[0]['items']), 2)
+        detail = self.client.get(f'/api/orders/{order.pk}/').json()
+        self.assertEqual(sorted(item['product']['id'] for item in detail['items']), [first.pk, second.pk])
+
+        self.client.force_authenticate(first.seller)
+        summary = self.client.get('/api/products/seller/sales-summary/').json()
+        self.assertEqual(summary['total_orders'], 1)
+        self.assertEqual(summary['total_items_sold'], 2)
+        sales = self.client.get('/api/products/seller/sales-orders/').json()
+        self.assertEqual(sales[0]['customer'], 'buyer')
+
+    def test_rebalance_moves_products_and_order_items(self):
+        seller = self.sellers[1]
+        product = self.products[1]
+        self.client.force_authenticate(self.buyer)
+        self.client.post('/api/orders/', {'items': [{'product': product.pk, 'quantity': 1}]}, format='json')
+        source = self.shard_of(seller)
+        target = next(alias for alias in SHARDS if alias != source)
+
+        call_command('rebalance_shards', seller=seller.pk, to=target, batch_size=2, stdout=StringIO())
+
+        self.assertEqual(self.shard_of(seller), target)
+        self.assertFalse(Product.objects.using(source).filter(seller=seller).exists())
+        self.assertFalse(OrderItem.objects.using(source).filter(seller=seller).exists())
+        self.assertEqual(Product.objects.using(target).filter(seller=seller).count(), 8)
+        self.assertEqual(OrderItem.objects.using(target).get(seller=seller).product_id, product.pk)
+        response = self.client.get(f'/api/products/{product.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.all_pages()), 30)
+
+    def test_locked_seller_cannot_write(self):
+        seller = self.sellers[0]
+        seller.shard.locked = True
+        seller.shard.save()
+        shards.forget_seller(seller.pk)
+        self.client.force_authenticate(seller)
+        response = self.client.post('/api/products/seller/', {
+            'title': 'New', 'description': 'x', 'price': '1.00', 'stock': 1,
+        })
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.client.get('/api/products/seller/').status_code, 200)
+
+    def test_writes_read_the_lock_from_the_map(self):
+        # Another process locked the seller: this one still has the unlocked placement cached
+        seller = self.sellers[2]
+        product = Product.objects.using(self.shard_of(seller)).filter(seller=seller).first()
+        SellerShard.objects.filter(pk=seller.pk).update(locked=True)
+        self.assertFalse(shards.placement(seller.pk)[1])
+        product.stock = 3
+        with self.assertRaises(shards.SellerMoving):
+            product.save()
+        self.client.force_authenticate(self.buyer)
+        response = self.client.post('/api/orders/', {'items': [{'product': product.pk, 'quantity': 1}]}, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(Order.objects.exists())
+
+    def test_atomic_commits_default_first(self):
+        real_atomic = shards.transaction.atomic
+        commits = []
+
+        @contextmanager
+        def recording_atomic(using):
+            with real_atomic(using=using):
+                yield
+                commits.append(using)
+
+        with mock.patch.object(shards.transaction, 'atomic', recording_atomic):
+            with shards.atomic('shard_1', 'default', 'shard_0'):
+                pass
+        self.assertEqual(commits[0], 'default')
+        self.assertEqual(sorted(commits), ['default', 'shard_0', 'shard_1'])
+
+    def test_commit_hooks_wait_for_the_shard(self):
+        product = self.products[0]
+        alias = self.shard_of(product.seller)
+        # The plain captures: one database each, nothing run
+        with TestCase.captureOnCommitCallbacks(using=alias) as on_shard, \
+                TestCase.captureOnCommitCallbacks() as on_default:
+            product.stock = 3
+            product.save()
+        # The cache and change log hooks only reach 'default' once the shard has committed
+        self.assertEqual(on_default, [])
+        self.assertTrue(on_shard)
+        with mock.patch.object(product_cache.get_cache(), 'delete') as delete:
+            with TestCase.captureOnCommitCallbacks(execute=True) as on_default:
+                for callback in on_shard:
+                    callback()
+        self.assertTrue(on_default)
+        delete.assert_called_once_with([product.pk])
+
+    def test_purge_refuses_the_sellers_current_shard(self):
+        seller = self.sellers[3]
+        source = self.shard_of(seller)
+        with self.assertRaises(ValueError):
+            shards.purge_moved(seller.pk, source)
+        self.assertEqual(Product.objects.using(source).filter(seller=seller).count(), 7)
+
+    def test_bootstrap_moves_the_catalog_off_default(self):
+        veteran = User.objects.create(username='veteran')
+        with override_settings(SELLER_SHARDS=[]):
+            legacy = Product.objects.create(
+                seller=veteran, title='Legacy', description='x', price=Decimal('3.00'), stock=1, id=1000
+            )
+        self.assertEqual(legacy._state.db, 'default')
+
+        call_command('rebalance_shards', bootstrap=True, stdout=StringIO())
+
+        self.assertFalse(Product.objects.using('default').exists())
+        self.assertEqual(shards.shard_for_product(legacy.pk), self.shard_of(veteran))
+        newer = Product.objects.create(seller=veteran, title='Newer', description='x', price=1, stock=1)
+        self.assertGreater(newer.pk, legacy.pk)
+
+
+@override_settings(PRODUCT_CHANGES_SETTLE_SECONDS=0)
+class ProductChangeFeedTests(TestCase):
+    """/api/products/changes/ replays inserts, updates and deletes after a token"""
+
+    def setUp(self):
+        for alias in ('default', 'throttle'):
+            caches[alias].clear()
+        product_cache.reset_cache()
+        throttles = mock.patch.object(ProductViewSet, 'throttle_classes', [])
+        throttles.start()
+        self.addCleanup(throttles.stop)
+        self.seller = User.objects.create(username='seller')
+
+    def create(self, title):
+        return Product.objects.create(seller=self.seller, title=title, description='x', price=1, stock=1)
+
+    def sync(self, token, **params):
+        response = self.client.get('/api/products/changes/', {'since': token, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_only_changes_after_the_token(self):
+        start = self.client.get('/api/products/changes/').json()
+        self.assertTrue(start['resync'])
+        kept, dropped = self.create('Kept'), self.create('Dropped')
+        kept.title = 'Kept, renamed'
+        kept.save()
+        dropped_id = dropped.pk
+        dropped.delete()
+
+        page = self.sync(start['next'])
+        self.assertEqual(
+            [(change['op'], change['id']) for change in page['changes']],
+            [('upsert', kept.pk), ('delete', dropped_id)],
+        )
+        self.assertEqual(page['changes'][0]['product']['title'], 'Kept, renamed')
+        self.assertEqual(self.sync(page['next'])['changes'], [])
+
+    def test_pages_and_update_without_signals(self):
+        products = [self.create(f'Item {number}') for number in range(5)]
+        token = self.client.get('/api/products/changes/').json()['next']
+        Product.apply_rating_change(products[2].pk, 5, 1)
+        Product.apply_rating_change(products[4].pk, 3, 1)
+        first = self.sync(token, limit=1)
+        self.assertTrue(first['has_more'])
+        second = self.sync(first['next'], limit=1)
+        self.assertFalse(second['has_more'])
+        self.assertEqual([first['changes'][0]['id'], second['changes'][0]['id']], [products[2].pk, products[4].pk])
+        self.assertEqual(second['changes'][0]['product']['rating'], '3.00')
+
+    def test_compaction_and_resync(self):
+        product = self.create('Gone')
+        token = self.client.get('/api/products/changes/').json()['next']
+        product.delete()
+        self.create('Other')
+        ProductChange.objects.update(changed_at=ProductChange.objects.first().changed_at - timedelta(days=60))
+        call_command('compact_product_changes', retention_days=30, stdout=StringIO())
+
+        self.assertFalse(ProductChange.objects.filter(op=ProductChange.DELETE).exists())
+        response = self.client.get('/api/products/changes/', {'since': token})
+        self.assertEqual(response.status_code, 410)
+        self.assertTrue(response.json()['resync'])
+        self.assertEqual(self.sync(response.json()['next'])['changes'], [])
+        self.assertEqual(self.client.get('/api/products/changes/', {'since': 'x'}).status_code, 400)
+
+    @override_settings(PRODUCT_CHANGES_SETTLE_SECONDS=2)
+    def test_changes_committed_late_are_recorded_again(self):
+        with self.captureOnCommitCallbacks() as slow_commit:
+            changes.record([101])
+        with self.captureOnCommitCallbacks() as fast_commit:
+            changes.record([102])
+        # The fast transaction commits straight away: nothing to repeat
+        for callback in fast_commit:
+            callback()
+        self.assertEqual(ProductChange.objects.count(), 2)
+
+        later = timezone.now() + timedelta(seconds=5)
+        with mock.patch.object(changes.timezone, 'now', return_value=later):
+            # A reader moved past both changes before the slow one committed
+            seq, _ = changes.head()
+            for callback in slow_commit:
+                callback()
+        with mock.patch.object(changes.timezone, 'now', return_value=later + timedelta(seconds=5)):
+            rows, _, _ = changes.changes_since(seq, 10)
+        self.assertEqual([(product_id, op) for _, product_id, op in rows], [(101, ProductChange.UPSERT)])
+
+
+class CompiledSerializerTests(TestCase):
+    """The compiled read path must render exactly the bytes DRF renders"""
+
+    def setUp(self):
+        for alias in ('default', 'throttle'):
+            caches[alias].clear()
+        product_cache.reset_cache()
+        throttles = mock.patch.object(ProductViewSet, 'throttle_classes', [])
+        throttles.start()
+        self.addCleanup(throttles.stop)
+        self.client = APIClient()
+        sellers = [User.objects.create(username='alice'), User.objects.create(username='bøb')]
+        self.products = []
+        for number in range(20):
+            self.products.append(Product.objects.create(
+                seller=sellers[number % 2],
+                title=f'Lamp {number:02d}',
+                description='Compiled',
+                price=Decimal(1000 + number * 37) / 100,
+                stock=number % 4,
+                category=['lighting', 'office'][number % 2],
+                # 12.5% off gives discounted prices with more than two decimals
+                discount=Decimal(number % 3 * 12.5),
+                image_url=None if number % 5 == 0 else f'https://example.com/{number}.jpg',
+                rating=Decimal(number) / 10,
+            ))
+        self.buyer = User.objects.create(username='buyer')
+        for number in range(6):
+            order = Order.objects.create(user=self.buyer, total_items=number + 1, total_price=Decimal('12.50') * number)
+            for product in self.products[number:number + 1 + number % 3]:
+                OrderItem.objects.create(
+                    order=order, product=product, seller_id=product.seller_id, quantity=number + 1,
+                    unit_price=product.price, discount=product.discount, line_total=product.price,
+                )
+
+    def get_both(self, url, **params):
+        """(compiled, DRF) responses for the same request"""
+        responses = []
+        for enabled in (True, False):
+            caches['default'].clear()
+            product_cache.reset_cache()
+            with override_settings(COMPILED_SERIALIZERS=enabled):
+                responses.append(self.client.get(url, params))
+        return responses
+
+    def test_serializers_compile(self):
+        self.assertIsNotNone(compiled.get_compiled(ProductSerializer))
+        self.assertIsNotNone(compiled.get_compiled(OrderSerializer))
+
+    def test_product_list_pages_match(self):
+        for params in [{}, {'ordering': 'price'}, {'ordering': '-rating'}, {'search': 'office'}]:
+            with self.subTest(**params):
+                url, query = '/api/products/', {'page_size': 6, **params}
+                while url:
+                    compiled, drf = self.get_both(url, **query)
+                    self.assertEqual(compiled.status_code, 200)
+                    self.assertEqual(compiled.content, drf.content)
+                    url, query = compiled.json()['next'], {}
+
+    def test_product_pages_and_batch_match(self):
+        for product in self.products[:6]:
+            compiled, drf = self.get_both(f'/api/products/{product.pk}/')
+            self.assertEqual(compiled.content, drf.content)
+        ids = ','.join(str(product.pk) for product in self.products[::-3])
+        compiled, drf = self.get_both('/api/products/', ids=ids)
+        self.assertEqual(compiled.content, drf.content)
+
+    def test_order_history_matches(self):
+        self.client.force_authenticate(self.buyer)
+        for params in [{}, {'limit': 4}]:
+            compiled, drf = self.get_both('/api/orders/', **params)
+            self.assertEqual(compiled.status_code, 200)
+            self.assertEqual(compiled.content, drf.content)
+            self.assertEqual(compiled.get('Link'), drf.get('Link'))
+
+
+class ShardedCompiledSerializerTests(SellerShardsMixin, CompiledSerializerTests):
+    """The same, with products and order items spread over the seller shards"""
+
+
+class RequestProfilingTests(TestCase):
+    """Staff requests with X-Profile or ?_profile are sampled and stored"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='profiles-test-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        settings_override = override_settings(PROFILING_DIR=self.directory, PROFILING_KEEP=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        throttles = mock.patch.object(ProductViewSet, 'throttle_classes', [])
+        throttles.start()
+        self.addCleanup(throttles.stop)
+        caches['default'].clear()
+        product_cache.reset_cache()
+        seller = User.objects.create(username='alice')
+        for number in range(5):
+            Product.objects.create(seller=seller, title=f'Lamp {number}', price=Decimal('9.99'), stock=3)
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.client = APIClient()
+
+    def login(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+
+    def test_staff_request_is_profiled(self):
+        self.login(self.admin)
+        response = self.client.get('/api/products/', {'_profile': 1})
+        self.assertEqual(response.status_code, 200)
+        profile_id = response['X-Profile-Id']
+
+        summary = self.client.get(f'/api/profiles/{profile_id}/').json()
+        self.assertEqual(summary['user'], 'admin')
+        self.assertEqual(summary['status'], 200)
+        self.assertGreater(summary['sql_count'], 0)
+        self.assertTrue(all(query['origin'] for query in summary['sql']))
+        self.assertIn('products_product', ' '.join(query['sql'] for query in summary['sql']))
+
+        listed = self.client.get('/api/profiles/').json()
+        self.assertEqual([profile['id'] for profile in listed], [profile_id])
+        self.assertNotIn('sql', listed[0])
+        download = self.client.get(f'/api/profiles/{profile_id}/flamegraph/')
+        self.assertEqual(download.status_code, 200)
+        for line in b''.join(download.streaming_content).decode().splitlines():
+            stack, count = line.rsplit(' ', 1)
+            self.assertTrue(stack and int(count) > 0)
+
+    def test_header_and_retention(self):
+        self.login(self.admin)
+        ids = [self.client.get('/api/products/', HTTP_X_PROFILE='1')['X-Profile-Id'] for _ in range(3)]
+        listed = [profile['id'] for profile in self.client.get('/api/profiles/').json()]
+        self.assertEqual(sorted(listed), sorted(ids)[1:])
+
+    def test_other_users_are_not_profiled(self):
+        self.assertNotIn('X-Profile-Id', self.client.get('/api/products/', {'_profile': 1}))
+        self.login(User.objects.create(username='bob'))
+        self.assertNotIn('X-Profile-Id', self.client.get('/api/products/', HTTP_X_PROFILE='1'))
+        self.assertEqual(self.client.get('/api/profiles/').status_code, 403)
+        self.login(self.admin)
+        self.assertNotIn('X-Profile-Id', self.client.get('/api/products/'))
+        self.assertEqual(self.client.get('/api/profiles/').json(), [])
+        self.assertEqual(self.client.get('/api/profiles/..%2Fsecrets/flamegraph/').status_code, 404)
+
+
+class QueryBudgetTests(TestCase):
+    """The viewsets run a fixed number of queries, and never one query per row"""
+
+    # Times one query shape may run on a database in a request
+    repeats = 1
+
+    # (user, method, url, data, queries allowed)
+    def endpoints(self):
+        product = self.products[0]
+        lines = [{'product': product.pk, 'quantity': 1} for product in self.products[:4]]
+        return [
+            (None, 'get', '/api/products/', None, 2),
+            (None, 'get', f'/api/products/{product.pk}/', None, 1),
+            (None, 'get', '/api/products/', {'ids': ','.join(str(product.pk) for product in self.products)}, 1),
+            (None, 'get', '/api/products/reviews/', {'product': product.pk}, 1),
+            # One of them is the ETag of the products nested in the orders
+            (self.buyer, 'get', '/api/orders/', None, 7),
+            (self.buyer, 'get', f'/api/orders/{self.order.pk}/', None, 7),
+            (self.buyer, 'put', '/api/orders/cart/', {'items': lines}, 10),
+            (self.buyer, 'get', '/api/orders/cart/', None, 5),
+            (self.buyer, 'post', '/api/orders/cart/checkout/', None, 16),
+            (self.buyer, 'post', '/api/orders/', {'items': lines}, 10),
+            (self.seller, 'get', '/api/products/seller/', None, 2),
+            (self.seller, 'get', '/api/products/seller/sales-orders/', None, 6),
+            (self.seller, 'get', '/api/products/seller/sales-summary/', None, 5),
+        ]
+
+    def setUp(self):
+        throttles = mock.patch.object(ProductViewSet, 'throttle_classes', [])
+        throttles.start()
+        self.addCleanup(throttles.stop)
+        self.client = APIClient()
+        # More sellers than shards, so per-seller loops show up in ShardedQueryBudgetTests
+        sellers = [User.objects.create(username=f'seller{number}') for number in range(5)]
+        self.seller = sellers[0]
+        self.products = [
+            Product.objects.create(seller=sellers[number % 5], title=f'Lamp {number}', price=Decimal('9.50'), stock=50)
+            for number in range(15)
+        ]
+        self.buyer = User.objects.create(username='buyer')
+        for number in range(5):
+            self.order = Order.objects.create(user=self.buyer, total_items=3, total_price=Decimal('28.50'))
+            for product in self.products[number:number + 3]:
+                OrderItem.objects.create(
+                    order=self.order, product=product, seller_id=product.seller_id, quantity=1,
+                    unit_price=product.price, line_total=product.price,
+                )
+
+    def test_endpoint_budgets(self):
+        for enabled in (True, False):
+            for user, method, url, data, total in self.endpoints():
+                with self.subTest(compiled=enabled, method=method, url=url):
+                    for alias in ('default', 'throttle'):
+                        caches[alias].clear()
+                    product_cache.reset_cache()
+                    # The cache generation is read from the database every few seconds, not per request
+                    product_cache.get_cache().current_generation()
+                    self.client.force_authenticate(user)
+                    budget = queries.query_budget(
+                        total=None if shards.enabled() else total, repeats=self.repeats, label=f'{method} {url}'
+                    )
+                    with override_settings(COMPILED_SERIALIZERS=enabled), budget:
+                        response = getattr(self.client, method)(url, data, format='json')
+                    self.assertLess(response.status_code, 300)
+
+    def test_loops_are_reported_with_their_call_site(self):
+        with self.assertRaises(queries.QueryBudgetExceeded) as caught:
+            with queries.query_budget(repeats=1):
+                for product in self.products[:3]:
+                    Product.objects.using(shards.databases()[0]).filter(pk=product.pk).exists()
+        message = str(caught.exception)
+        self.assertIn('3x on ', message)
+        self.assertIn('SELECT ? AS "a" FROM "products_product" WHERE "products_product"."id" = ? LIMIT ?', message)
+        self.assertIn('products/tests.py', message)
+        self.assertIn('in test_loops_are_reported_with_their_call_site', message)
+        # IN lists and bulk inserts of any length have one shape
+        self.assertEqual(
+            queries.fingerprint("SELECT * FROM t WHERE a IN (%s, %s, %s) AND b = 'x' LIMIT 21"),
+            queries.fingerprint("SELECT * FROM t WHERE a IN (%s)  AND b = 'it''s' LIMIT 5"),
+        )
+        self.assertEqual(
+            queries.fingerprint('INSERT INTO "t" ("a", "b") VALUES (%s, %s), (%s, %s)'),
+            'INSERT INTO "t" ("a", "b") VALUES (...)',
+        )
+
+    def import_dummy_products(self):
+        call_command('import_dummy_products', count=150, stdout=StringIO())
+        call_command('import_dummy_products', count=400, stdout=StringIO())
+        imported = Product.objects.filter(title__startswith='Sample Product ')
+        self.assertEqual(sum(queryset.count() for queryset in shards.each(imported)), 400)
+
+    @queries.query_budget(total=30)
+    def test_import_dummy_products_does_not_query_per_product(self):
+        self.import_dummy_products()
+
+
+class ShardedQueryBudgetTests(SellerShardsMixin, QueryBudgetTests):
+    """The same with seller shards: scatter reads run once per shard, still never once per row"""
+    repeats = len(SHARDS)
+
+    @queries.query_budget(total=50)
+    def test_import_dummy_products_does_not_query_per_product(self):
+        self.import_dummy_products()
+
+
+class ProductCacheTests(TestCase):
+    """The two-level product cache: one load per miss, never a stale row after a write"""
+
+    def setUp(self):
+        for alias in ('default', 'throttle'):
+            caches[alias].clear()
+        product_cache.reset_cache()
+        # Read the generation now, so the threads below don't query the database
+        product_cache.get_cache().current_generation()
+        self.loads = []
+
+    def loader(self, data, delay=0):
+        def load_many(product_ids):
+            self.loads.append(list(product_ids))
+            time.sleep(delay)
+            return {product_id: data for product_id in product_ids}
+        return load_many
+
+    def test_concurrent_misses_load_once(self):
+        load_many = self.loader({'title': 'Lamp'}, delay=0.05)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(product_cache.get(7, load_many))) for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [{'title': 'Lamp'}] * 10)
+        self.assertEqual(self.loads, [[7]])
+
+    def test_read_from_before_a_write_is_not_served(self):
+        def slow_load(product_ids):
+            # The row is read, then a write commits and clears the product
+            self.loads.append(list(product_ids))
+            product_cache.get_cache().delete(product_ids)
+            return {product_id: {'price': 'old'} for product_id in product_ids}
+
+        self.assertEqual(product_cache.get_many([7], slow_load), {7: {'price': 'old'}})
+        # Another process (an empty local level) must not get the old row from the shared level
+        product_cache.reset_cache()
+        self.assertEqual(product_cache.get(7, self.loader({'price': 'new'})), {'price': 'new'})
+        self.assertEqual(product_cache.get_many([7], self.loader({'price': 'newer'})), {7: {'price': 'new'}})
+        self.assertEqual(len(self.loads), 2)
+
+    @override_settings(PRODUCT_CACHE_LOCAL_TTL=0)
+    def test_invalidate_all_reaches_other_processes(self):
+        product_cache.get(7, self.loader({'price': 'old'}))
+        worker = product_cache.ProductCache()
+        self.assertEqual(worker.get(7, self.loader({'price': 'unused'})), {'price': 'old'})
+        # A management command in its own process, with its own local-memory cache
+        command_cache = mock.patch.object(product_cache, 'shared_cache', lambda: caches['throttle'])
+        with command_cache, self.captureOnCommitCallbacks(execute=True):
+            product_cache.invalidate_all()
+        self.assertEqual(ProductCacheGeneration.objects.get().generation, 2)
+        self.assertEqual(worker.get(7, self.loader({'price': 'new'})), {'price': 'new'})
+
+    def test_save_clears_the_cached_product(self):
+        product = Product.objects.create(
+            seller=User.objects.create(username='alice'), title='Lamp', price=Decimal('5.00'), stock=1
+        )
+        client = APIClient()
+        with mock.patch.object(ProductViewSet, 'throttle_classes', []):
+            self.assertEqual(client.get(f'/api/products/{product.pk}/').json()['price'], '5.00')
+            product.price = Decimal('6.00')
+            with self.captureOnCommitCallbacks(execute=True):
+                product.save()
+            self.assertEqual(client.get(f'/api/products/{product.pk}/').json()['price'], '6.00')
+
+
+@override_settings(PRODUCT_CHANGES_SETTLE_SECONDS=0, PRODUCT_SUGGEST_REFRESH_SECONDS=0)
+class SuggestIndexTests(TestCase):
+    """/api/products/suggest/ follows every kind of product write"""
+
+    def setUp(self):
+        for alias in ('default', 'throttle'):
+            caches[alias].clear()
+        throttles = mock.patch.object(ProductViewSet, 'throttle_classes', [])
+        throttles.start()
+        self.addCleanup(throttles.stop)
+        suggest.reset_index()
+        self.addCleanup(suggest.reset_index)
+        self.client = APIClient()
+        self.seller = User.objects.create(username='alice')
+        self.lamp = Product.objects.create(
+            seller=self.seller, title='Lamp Deluxe', price=Decimal('5.00'), stock=1, brand='Lumo', category='lighting'
+        )
+        self.desk = Product.objects.create(
+            seller=self.seller, title='Desk', price=Decimal('50.00'), stock=1, brand='Lumo', category='office'
+        )
+
+    def suggestions(self, query):
+        response = self.client.get('/api/products/suggest/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [(item['text'], item['type'], item['count']) for item in response.json()]
+
+    def test_prefixes(self):
+        self.assertEqual(self.suggestions('l'), [('Lamp Deluxe', 'title', 1), ('lighting', 'category', 1), ('Lumo', 'brand', 2)])
+        self.assertEqual(self.suggestions('  DES'), [('Desk', 'title', 1)])
+        self.assertEqual(self.suggestions(''), [])
+
+    def test_warm_up_builds_before_the_first_request(self):
+        with override_settings(PRODUCT_SUGGEST_WARM_UP=False):
+            suggest.warm_up()
+        self.assertFalse(suggest.index_is_loaded())
+        suggest.warm_up()
+        self.assertTrue(suggest.index_is_loaded())
+        with mock.patch.object(suggest, 'build_index', side_effect=AssertionError('built in the request')):
+            self.assertEqual(self.suggestions('des'), [('Desk', 'title', 1)])
+
+    def test_warm_up_leaves_a_missing_table_to_the_first_request(self):
+        with mock.patch.object(suggest, 'build_index', side_effect=DatabaseError('no such table')), \
+                self.assertLogs('products.suggest', 'WARNING'):
+            suggest.warm_up()
+        self.assertFalse(suggest.index_is_loaded())
+        self.assertEqual(self.suggestions('des'), [('Desk', 'title', 1)])
+
+    def test_one_request_refreshes_at_a_time(self):
+        suggest.warm_up()
+        index = suggest.get_index()
+        index.checked_at = 0.0
+        # Another request holds the lock: this one searches the current index
+        with suggest._index_lock, mock.patch.object(suggest, 'refresh_index', side_effect=AssertionError('waited')):
+            self.assertIs(suggest.get_index(), index)
+
+    def test_update_and_bulk_create_reach_the_index(self):
+        self.suggestions('l')
+        # Writers that skip the model signals record their changes in the log
+        Product.objects.filter(pk=self.lamp.pk).update(title='Sofa')
+        changes.record([self.lamp.pk])
+        created = Product.objects.bulk_create([
+            Product(seller=self.seller, title='Stool', price=Decimal('9.00'), stock=1, category='seating')
+        ])
+        changes.record(product.pk for product in created)
+        self.assertEqual(self.suggestions('s'), [('seating', 'category', 1), ('Sofa', 'title', 1), ('Stool', 'title', 1)])
+        self.assertEqual(self.suggestions('lamp'), [])
+        self.desk.delete()
+        self.assertEqual(self.suggestions('lumo'), [('Lumo', 'brand', 1)])
+
+    def test_snapshot_load_drops_deleted_products(self):
+        directory = tempfile.mkdtemp(prefix='suggest-test-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = f'{directory}/suggest.json'
+        call_command('build_suggest_index', output=path, stdout=StringIO())
+        Product.objects.filter(pk=self.desk.pk).delete()
+        with override_settings(PRODUCT_SUGGEST_SNAPSHOT=path):
+            self.assertEqual(self.suggestions('desk'), [])
+            self.assertEqual(self.suggestions('lamp'), [('Lamp Deluxe', 'title', 1)])
+
+
+class ProductBatchTests(TestCase):
+    """?ids= and POST /batch/ return products in the requested order"""
+
+    def setUp(self):
+        for alias in ('default', 'throttle'):
+            caches[alias].clear()
+        product_cache.reset_cache()
+        throttles = mock.patch.object(ProductViewSet, 'throttle_classes', [])
+        throttles.start()
+        self.addCleanup(throttles.stop)
+        self.client = APIClient()
+        seller = User.objects.create(username='alice')
+        self.ids = [
+            Product.objects.create(seller=seller, title=f'Lamp {number}', price=Decimal('5.00'), stock=1).pk
+            for number in range(4)
+        ]
+
+    def batch(self, ids):
+        return self.client.post('/api/products/batch/', {'ids': ids}, format='json')
+
+    def test_order_duplicates_and_missing(self):
+        first, second, third, _ = self.ids
+        missing = max(self.ids) + 100
+        for response in (
+            self.client.get('/api/products/', {'ids': f'{third},{first},{missing},{third}, ,{second}'}),
+            self.batch([third, str(first), missing, third, '', second]),
+        ):
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([product['id'] for product in response.json()['results']], [third, first, second])
+            self.assertEqual(response.json()['missing'], [missing])
+
+    def test_bad_ids(self):
+        self.assertEqual(self.client.get('/api/products/', {'ids': '1,lamp'}).status_code, 400)
+        self.assertEqual(self.batch([1, None]).status_code, 400)
+        self.assertEqual(self.batch({'id': 1}).status_code, 400)
+
+    @override_settings(PRODUCT_BATCH_MAX_IDS=3)
+    def test_limit(self):
+        # Duplicates don't count towards the limit
+        self.assertEqual(self.batch([self.ids[0]] * 50 + self.ids[1:3]).status_code, 200)
+        response = self.batch(self.ids)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('At most 3', response.json()['ids'][0])
+        self.assertEqual(self.batch(list(range(100000))).status_code, 400)
+        # The limit is checked while reading: a huge request stops at the 4th id
+        ids = iter(range(100000))
+        with self.assertRaises(ValidationError):
+            ProductViewSet().parse_ids(ids)
+        self.assertEqual(next(ids), 4)
+
+
+class ReviewRatingTests(TestCase):
+    """Reviews keep the product's rating with O(1) updates (Product.apply_rating_change)"""
+
+    def setUp(self):
+        for alias in ('default', 'throttle'):
+            caches[alias].clear()
+        product_cache.reset_cache()
+        self.seller = User.objects.create(username='seller')
+        self.lamp = Product.objects.create(seller=self.seller, title='Lamp', price=Decimal('5.00'), stock=1)
+        self.users = [User.objects.create(username=f'reviewer{number}') for number in range(3)]
+        self.client = APIClient()
+
+    def review(self, user, rating):
+        self.client.force_authenticate(user)
+        return self.client.post('/api/products/reviews/', {'product': self.lamp.pk, 'rating': rating}, format='json')
+
+    def assert_rating(self, count, stars, rating):
+        product = Product.objects.using(self.lamp._state.db).get(pk=self.lamp.pk)
+        self.assertEqual((product.reviews_count, product.rating_sum, product.rating), (count, stars, Decimal(rating)))
+
+    def test_create_update_delete(self):
+        for user, rating in zip(self.users, (5, 4, 2)):
+            self.assertEqual(self.review(user, rating).status_code, 201)
+        self.assert_rating(3, 11, '3.67')
+
+        review = Review.objects.get(user=self.users[2])
+        response = self.client.patch(f'/api/products/reviews/{review.pk}/', {'rating': 5}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assert_rating(3, 14, '4.67')
+        self.assertEqual(self.client.delete(f'/api/products/reviews/{review.pk}/').status_code, 204)
+        self.assert_rating(2, 9, '4.50')
+
+        for user in self.users[:2]:
+            self.client.force_authenticate(user)
+            self.client.delete(f'/api/products/reviews/{Review.objects.get(user=user).pk}/')
+        self.assert_rating(0, 0, '0')
+
+    def test_rating_is_updated_without_reading_the_reviews(self):
+        self.review(self.users[0], 4)
+        with queries.QueryLog() as log:
+            self.assertEqual(self.review(self.users[1], 2).status_code, 201)
+        shapes = [shape for _, shape in log.shapes]
+        self.assertFalse([shape for shape in shapes if 'AVG(' in shape.upper()])
+        self.assertFalse([shape for shape in shapes if 'products_review' in shape and 'COUNT(' in shape.upper()])
+        self.assert_rating(2, 6, '3.00')
+
+    def test_edit_uses_the_stars_in_the_database(self):
+        self.review(self.users[0], 5)
+        review = Review.objects.get()
+        real_get_object = ReviewViewSet.get_object
+
+        def stale_get_object(view):
+            # Loaded before a parallel edit changed the stars from 2 to 5
+            instance = real_get_object(view)
+            instance.rating = 2
+            return instance
+
+        with mock.patch.object(ReviewViewSet, 'get_object', stale_get_object):
+            self.client.patch(f'/api/products/reviews/{review.pk}/', {'rating': 3}, format='json')
+        self.assert_rating(1, 3, '3.00')
+
+    def test_parallel_duplicate_review_is_a_400(self):
+        self.review(self.users[0], 5)
+        # Both requests passed the "already reviewed" check before either saved
+        with mock.patch.object(ReviewSerializer, 'validate', lambda serializer, attrs: attrs):
+            response = self.review(self.users[0], 1)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('already reviewed', response.json()['non_field_errors'][0])
+        self.assert_rating(1, 5, '5.00')
+
+
+class ShardedReviewRatingTests(SellerShardsMixin, ReviewRatingTests):
+    """The same with the product on a seller shard"""
+
+
+class RelatedIndexTests(TestCase):
+    """Offline related-products index: sparse product ids and the order watermark"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='related-index-test-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.seller = User.objects.create(username='seller')
+        self.buyer = User.objects.create(username='buyer')
+        # Ids far apart, like ids handed out by ProductKey across shards
+        self.lamp, self.shade, self.desk = (
+            Product.objects.create(pk=pk, seller=self.seller, title=title, category=category, price=Decimal('5.00'), stock=1)
+            for pk, title, category in (
+                (3, 'Blue desk lamp', 'lamps'), (4_000_000_000, 'Blue lamp shade', 'lamps'), (9, 'Oak desk', 'desks'),
+            )
+        )
+
+    def buy(self, *products):
+        order = Order.objects.create(user=self.buyer)
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, seller=self.seller, quantity=1)
+        return order
+
+    def builder(self):
+        return related.RelatedIndexBuilder(directory=self.directory, neighbours=2, bucket_size=4)
+
+    def test_sparse_ids_keep_the_index_small(self):
+        self.builder().build_full()
+        index = related.RelatedIndex.open(self.directory)
+        self.assertEqual(len(index.sorted_ids), 3)
+        self.assertEqual(index.lookup(self.shade.pk, 2)[0], self.lamp.pk)
+        self.assertEqual(index.lookup(self.lamp.pk, 2)[0], self.shade.pk)
+        for missing in (0, 5, 4_000_000_001, -1):
+            self.assertIsNone(index.lookup(missing, 2))
+        # Unsorted ids (products appended by an incremental build) are found too
+        Product.objects.create(pk=7, seller=self.seller, title='Blue lamp', category='lamps', price=Decimal('1'), stock=1)
+        self.builder().build_incremental()
+        index = related.RelatedIndex.open(self.directory)
+        self.assertEqual(list(index.sorted_ids), sorted(index.sorted_ids))
+        self.assertIsNotNone(index.lookup(7, 2))
+
+    def test_order_placed_during_a_build_is_counted_once(self):
+        self.buy(self.lamp, self.desk)
+        builder = self.builder()
+        read_lines = builder.order_lines
+
+        def order_lines(**kwargs):
+            lines = list(read_lines(**kwargs))
+            # Another checkout commits while the build is reading orders
+            self.buy(self.lamp, self.desk)
+            return iter(lines)
+
+        with mock.patch.object(builder, 'order_lines', order_lines):
+            builder.build_full()
+        self.assertEqual(related.load_version(self.directory)['pairs'][self.lamp.pk][self.desk.pk], 1)
+        self.builder().build_incremental()
+        self.assertEqual(related.load_version(self.directory)['pairs'][self.lamp.pk][self.desk.pk], 2)
+        self.builder().build_incremental()
+        self.assertEqual(related.load_version(self.directory)['pairs'][self.lamp.pk][self.desk.pk], 2)
+
+
+class CompressionTests(TestCase):
+    """CompressionMiddleware: brotli or gzip, with random padding against BREACH"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.body = json.dumps([{'id': number, 'title': f'Lamp {number}', 'price': '5.00'} for number in range(100)])
+
+    def compress(self, accept, response=None):
+        request = self.factory.get('/', HTTP_ACCEPT_ENCODING=accept)
+        if response is None:
+            response = HttpResponse(self.body, content_type='application/json')
+            response['ETag'] = '"abc"'
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_encodings_round_trip(self):
+        decoders = {'gzip': gzip.decompress}
+        if middleware.brotli is not None:
+            decoders['br'] = middleware.brotli.decompress
+        for accept, encoding in (('gzip, deflate, br', 'br' if 'br' in decoders else 'gzip'), ('gzip', 'gzip')):
+            with self.subTest(accept=accept):
+                response = self.compress(accept)
+                self.assertEqual(response['Content-Encoding'], encoding)
+                self.assertEqual(decoders[encoding](response.content).decode(), self.body)
+                self.assertEqual(response['Content-Length'], str(len(response.content)))
+                self.assertEqual(response['ETag'], 'W/"abc"')
+                self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertFalse(self.compress('identity').has_header('Content-Encoding'))
+
+    def test_length_is_padded_at_random(self):
+        encodings = ['gzip'] + (['br'] if middleware.brotli is not None else [])
+        for encoding in encodings:
+            with self.subTest(encoding=encoding):
+                self.assertGreater(len({len(self.compress(encoding).content) for _ in range(20)}), 1)
+                with override_settings(COMPRESSION_MAX_RANDOM_BYTES=0):
+                    self.assertEqual(len({len(self.compress(encoding).content) for _ in range(5)}), 1)
+
+    def test_streams_are_compressed_and_padded(self):
+        encodings = {'gzip': gzip.decompress}
+        if middleware.brotli is not None:
+            encodings['br'] = middleware.brotli.decompress
+        for encoding, decompress in encodings.items():
+            with self.subTest(encoding=encoding):
+                lengths = set()
+                for _ in range(10):
+                    response = self.compress(encoding, StreamingHttpResponse(iter([self.body[:500], self.body[500:]])))
+                    self.assertFalse(response.has_header('Content-Length'))
+                    content = b''.join(response.streaming_content)
+                    self.assertEqual(decompress(content).decode(), self.body)
+                    lengths.add(len(content))
+                self.assertGreater(len(lengths), 1)
+
+    def test_small_bodies_and_event_streams_are_left_alone(self):
+        small = self.compress('gzip', HttpResponse('{}', content_type='application/json'))
+        self.assertEqual(small.content, b'{}')
+        events = StreamingHttpResponse(iter(['data: x\n\n']), content_type='text/event-stream')
+        self.assertFalse(self.compress('gzip', events).has_header('Content-Encoding'))
+
+
+class FastJSONRendererTests(TestCase):
+    """FastJSONRenderer (orjson) writes the same bytes as DRF's JSONRenderer"""
+
+    def test_same_output_as_drf(self):
+        data = {
+            'price': Decimal('12.50'),
+            'title': gettext_lazy('Lamp'),
+            'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            'created_at': datetime(2026, 1, 2, 3, 4, 5, 678901, tzinfo=dt_timezone.utc),
+            'local': datetime(2026, 1, 2, 3, 4, 5),
+            'text': 'Café \u2028 line \u2029 end "quoted"',
+            1: [None, True, 1.5, {'nested': []}],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    def test_indented_requests_use_drf(self):
+        data = {'a': [1, 2]}
+        context = {'indent': 2}
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json', context),
+            JSONRenderer().render(data, 'application/json', context),
+        )
+
+    def test_api_responses_use_it(self):
+        seller = User.objects.create(username='seller')
+        Product.objects.create(seller=seller, title='Lamp', price=Decimal('5.00'), stock=1)
+        with mock.patch.object(ProductViewSet, 'throttle_classes', []):
+            response = self.client.get('/api/products/')
+        self.assertIsInstance(response.accepted_renderer, FastJSONRenderer)
+        self.assertEqual(response.json()['results'][0]['title'], 'Lamp')
+
+
+@override_settings(STOREFRONT_SECTION_SIZE=2, STOREFRONT_CATEGORIES=2, STOREFRONT_MIN_REVIEWS=3)
+class StorefrontTests(TestCase):
+    """The home page sections come from a few bounded queries and a cached payload"""
+
+    def setUp(self):
+        for alias in ('default', 'throttle'):
+            caches[alias].clear()
+        product_cache.reset_cache()
+        throttles = mock.patch.object(ProductViewSet, 'throttle_classes', [])
+        throttles.start()
+        self.addCleanup(throttles.stop)
+        self.client = APIClient()
+        sellers = [User.objects.create(username=f'seller{number}') for number in range(4)]
+        self.products = {}
+        # title: (category, stock, rating, reviews)
+        for number, (title, values) in enumerate({
+            'Popular lamp': ('lamps', 5, '4.0', 40),
+            'Sold out lamp': ('lamps', 0, '4.5', 90),
+            'Loved lamp': ('lamps', 3, '5.0', 1),
+            'Good desk': ('desks', 2, '4.8', 10),
+            'Plain desk': ('desks', 2, '3.0', 5),
+            'Old desk': ('desks', 2, '2.0', 2),
+            'Lone rug': ('rugs', 1, '4.9', 30),
+        }.items()):
+            category, stock, rating, reviews = values
+            self.products[title] = Product.objects.create(
+                seller=sellers[number % 4], title=title, price=Decimal('10.00'), stock=stock,
+                category=category, rating=Decimal(rating), reviews_count=reviews,
+            )
+
+    def sections(self):
+        response = self.client.get('/api/products/storefront/')
+        self.assertEqual(response.status_code, 200)
+        return {
+            section['key']: [product['title'] for product in section['products']]
+            for section in response.json()['sections']
+        }
+
+    def test_sections(self):
+        self.assertEqual(self.sections(), {
+            # Most reviewed in stock: the sold out lamp is left out
+            'featured': ['Popular lamp', 'Lone rug'],
+            # The 5-star lamp has a single review
+            'top_rated': ['Lone rug', 'Good desk'],
+            'newest': ['Lone rug', 'Old desk'],
+            # The two largest categories, best rated first
+            'category:desks': ['Good desk', 'Plain desk'],
+            'category:lamps': ['Loved lamp', 'Sold out lamp'],
+        })
+
+    def test_bounded_queries_then_cached(self):
+        for number in range(20):
+            Product.objects.create(
+                seller=self.products['Lone rug'].seller, title=f'Extra {number}', price=Decimal('1.00'),
+                stock=1, category=f'extra{number % 3}',
+            )
+        caches['default'].clear()
+        # Featured, top rated, newest, category counts and category rows on each
+        # database, plus one query for the sellers with seller shards
+        budget = queries.query_budget(total=5 * len(shards.databases()) + shards.enabled(), repeats=len(shards.databases()))
+        with budget:
+            first = self.client.get('/api/products/storefront/')
+        self.assertEqual(len(first.json()['sections']), 5)
+        with queries.query_budget(total=0):
+            again = self.client.get('/api/products/storefront/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+    def test_product_changes_rebuild_it(self):
+        self.assertEqual(self.sections()['newest'], ['Lone rug', 'Old desk'])
+        product = self.products['Old desk']
+        product.title = 'Renamed desk'
+        product.save()
+        self.assertEqual(self.sections()['newest'], ['Lone rug', 'Renamed desk'])
+        self.products['Lone rug'].delete()
+        self.assertEqual(self.sections()['newest'], ['Renamed desk', 'Plain desk'])
+
+    def test_public_list_pages_are_bounded(self):
+        for number in range(100):
+            Product.objects.create(
+                seller=self.products['Lone rug'].seller, title=f'Bulk {number}', price=Decimal('1.00'), stock=1
+            )
+        page = self.client.get('/api/products/').json()
+        self.assertEqual(len(page['results']), 24)
+        self.assertIsNotNone(page['next'])
+        page = self.client.get('/api/products/', {'page_size': 1000}).json()
+        self.assertEqual(len(page['results']), 100)
+        self.assertEqual(len(self.client.get(page['next']).json()['results']), 7)
+
+
+class ShardedStorefrontTests(SellerShardsMixin, StorefrontTests):
+    """The same sections merged from the seller shards"""
+
+
+class LeanSettingsTests(SimpleTestCase):
+    """The lean settings profiles boot, answer API requests and leave the admin out"""
+
+    # Run in a fresh interpreter: prints what got installed and imported
+    SCRIPT = """
+import json, sys
+import django
+django.setup()
+from django.conf import settings
+from django.test import Client
+import products.views
+client = Client(HTTP_HOST='localhost')
+print(json.dumps({
+    'admin': 'django.contrib.admin' in settings.INSTALLED_APPS,
+    'sessions': 'django.contrib.sessions.middleware.SessionMiddleware' in settings.MIDDLEWARE,
+    'cors': 'corsheaders' in settings.INSTALLED_APPS,
+    'numpy': 'numpy' in sys.modules,
+    'admin_page': client.get('/admin/').status_code,
+    'login': client.post('/api/users/login/', {}, content_type='application/json').status_code,
+}))
+"""
+
+    def run_python(self, settings_module, *args):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings_module}
+        result = subprocess.run(
+            [sys.executable, *args], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, timeout=120,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout
+
+    def test_profiles(self):
+        expected = {
+            'backenddd.settings': {'admin': True, 'sessions': True, 'cors': True, 'admin_page': 302},
+            'backenddd.settings_api': {'admin': False, 'sessions': False, 'cors': True, 'admin_page': 404},
+            'backenddd.settings_commands': {'admin': False, 'sessions': False, 'cors': False, 'admin_page': 404},
+        }
+        for settings_module, values in expected.items():
+            with self.subTest(settings_module):
+                found = json.loads(self.run_python(settings_module, '-c', self.SCRIPT).splitlines()[-1])
+                # The related index loads NumPy only when it is used
+                self.assertEqual(found, {**values, 'numpy': False, 'login': 400})
+                self.assertIn('no issues', self.run_python(settings_module, 'manage.py', 'check'))
+
+    def test_manage_picks_the_lean_profile_for_data_commands(self):
+        sys.path.insert(0, str(settings.BASE_DIR))
+        self.addCleanup(sys.path.remove, str(settings.BASE_DIR))
+        manage = import_module('manage')
+        for argv, chosen in [
+            (['manage.py', 'backfill_ratings'], 'backenddd.settings_commands'),
+            (['manage.py', 'runserver'], 'backenddd.settings'),
+            (['manage.py', 'test'], 'backenddd.settings_test'),
+            (['manage.py'], 'backenddd.settings'),
+        ]:
+            with self.subTest(argv=argv), mock.patch.dict(os.environ), mock.patch.object(sys, 'argv', argv), \
+                    mock.patch('django.core.management.execute_from_command_line') as execute:
+                os.environ.pop('DJANGO_SETTINGS_MODULE', None)
+                manage.main()
+                execute.assert_called_once_with(argv)
+                self.assertEqual(os.environ['DJANGO_SETTINGS_MODULE'], chosen)
+        # A settings module given by the user always wins
+        with mock.patch.dict(os.environ, {'DJANGO_SETTINGS_MODULE': 'backenddd.settings'}), \
+                mock.patch.object(sys, 'argv', ['manage.py', 'backfill_ratings']), \
+                mock.patch('django.core.management.execute_from_command_line'):
+            manage.main()
+            self.assertEqual(os.environ['DJANGO_SETTINGS_MODULE'], 'backenddd.settings')
+
+
+@override_settings(PRODUCT_ADMIN_COUNT_LIMIT=5, PRODUCT_ADMIN_PRICE_BUCKETS=[0, 10, 25])
+class ProductAdminTests(TestCase):
+    """The product changelist never counts the whole table, and bulk actions are one UPDATE"""
+    url = '/admin/products/product/'
+
+    def setUp(self):
+        for alias in ('default', 'throttle'):
+            caches[alias].clear()
+        product_cache.reset_cache()
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.force_login(self.admin)
+        # Two sellers (on two shards in the sharded tests), each with both categories
+        sellers = [User.objects.create(username='seller'), User.objects.create(username='other seller')]
+        self.products = [
+            Product.objects.create(
+                seller=sellers[number // 6], title=f'{["Lamp", "Desk"][number % 2]} {number:02d}', price=Decimal(number * 3),
+                stock=5, discount=Decimal('10.00'), category=['lamps', 'desks'][number % 2],
+            )
+            for number in range(12)
+        ]
+
+    def changelist(self, **params):
+        with queries.QueryLog(max_recorded=100) as log:
+            response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        counts = [query['sql'] for query in log.queries if 'COUNT(' in query['sql']]
+        # Every count is bounded by a LIMIT, or is the id range estimate
+        for sql in counts:
+            self.assertIn('LIMIT', sql)
+        return response.context['cl']
+
+    def titles(self, changelist):
+        return sorted(product.title for product in changelist.result_list)
+
+    def test_unfiltered_count_is_the_id_range(self):
+        changelist = self.changelist()
+        self.assertEqual(changelist.paginator.count, 12)
+        self.assertFalse(changelist.show_full_result_count)
+        # Newest first, over both sellers
+        self.assertEqual(
+            [product.pk for product in changelist.result_list],
+            [product.pk for product in reversed(self.products)][:changelist.list_per_page],
+        )
+        category_filter = next(spec for spec in changelist.filter_specs if spec.title == 'category')
+        self.assertEqual(list(category_filter.lookup_choices), ['desks', 'lamps'])
+
+    def test_change_page(self):
+        product = self.products[7]
+        url = f'{self.url}{product.pk}/change/'
+        self.assertEqual(self.client.get(url).status_code, 200)
+        data = {name: value for name, value in model_to_dict(product).items() if value is not None}
+        response = self.client.post(url, {**data, 'title': 'Renamed', 'description': 'A lamp'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(shards.in_bulk(Product.objects.all(), [product.pk])[product.pk].title, 'Renamed')
+
+    def test_filtered_count_stops_at_the_limit(self):
+        self.assertEqual(self.changelist(category='lamps').paginator.count, 5)
+        self.assertEqual(self.changelist(price_range='0-10').paginator.count, 4)
+
+    def test_price_buckets(self):
+        self.assertEqual(self.titles(self.changelist(price_range='0-10')), ['Desk 01', 'Desk 03', 'Lamp 00', 'Lamp 02'])
+        self.assertEqual(self.titles(self.changelist(price_range='25-')), ['Desk 09', 'Desk 11', 'Lamp 10'])
+
+    def test_search_by_title_prefix_or_id(self):
+        self.assertEqual(self.titles(self.changelist(q='desk 1')), ['Desk 11'])
+        self.assertEqual(self.titles(self.changelist(q='amp')), [])
+        self.assertEqual(self.titles(self.changelist(q=str(self.products[4].pk))), ['Lamp 04'])
+
+    def test_bulk_actions(self):
+        lamps = [product.pk for product in self.products if product.category == 'lamps']
+        api = APIClient()
+        detail = f'/api/products/{lamps[0]}/'
+        with mock.patch.object(ProductViewSet, 'throttle_classes', []):
+            self.assertEqual(api.get(detail).json()['stock'], 5)
+        cache = product_cache.get_cache()
+        with self.captureOnCommitCallbacks(execute=True), mock.patch.object(cache, 'bump_generation') as bump:
+            response = self.client.post(self.url, {'action': 'mark_out_of_stock', '_selected_action': lamps})
+        self.assertEqual(response.status_code, 302)
+        # Only the selected products leave the cache
+        bump.assert_not_called()
+        self.assertEqual(set(shards.catalog(Product.objects.filter(stock=0)).values_list('pk', flat=True)), set(lamps))
+        # The change feed and the product cache see the UPDATE
+        self.assertEqual(
+            set(ProductChange.objects.filter(product_id__in=lamps).values_list('product_id', flat=True)), set(lamps)
+        )
+        with mock.patch.object(ProductViewSet, 'throttle_classes', []):
+            self.assertEqual(api.get(detail).json()['stock'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, {'action': 'clear_discount', 'select_across': 1, '_selected_action': lamps[:1]})
+        self.assertFalse(shards.catalog(Product.objects.exclude(discount=0)).exists())
+
+    @override_settings(PRODUCT_ADMIN_PERFORMANCE_MODE=False)
+    def test_without_performance_mode(self):
+        response = self.client.get(self.url, {'q': 'amp'})
+        self.assertEqual(response.context['cl'].result_count, 6)
+        self.assertEqual(response.context['cl'].paginator.count, 6)
+
+
+class ShardedProductAdminTests(SellerShardsMixin, ProductAdminTests):
+    """The same changelist, read from every seller shard"""
+
+
+class BulkPricingTests(TestCase):
+    """Seller bulk price changes: one UPDATE, a preview that writes nothing, all or nothing"""
+    url = '/api/products/seller/bulk-pricing/'
+
+    def setUp(self):
+        for alias in ('default', 'throttle'):
+            caches[alias].clear()
+        product_cache.reset_cache()
+        self.seller = User.objects.create(username='seller')
+        self.other = User.objects.create(username='other')
+        self.client = APIClient()
+        self.client.force_authenticate(self.seller)
+        self.products = {
+            title: Product.objects.create(
+                seller=self.seller, title=title, price=Decimal(price), stock=3, category=category, tags=tags,
+            )
+            for title, price, category, tags in [
+                ('Lamp', '9.99', 'lamps', 'sale, new'),
+                ('Big lamp', '20.00', 'Lamps', 'wholesale'),
+                ('Desk', '120.00', 'desks', 'sale'),
+            ]
+        }
+        self.others_lamp = Product.objects.create(
+            seller=self.other, title='Their lamp', price=Decimal('50.00'), stock=3, category='lamps',
+        )
+        # Only changes logged by the test count, not the creates above
+        self.last_change = ProductChange.objects.aggregate(last=Max('pk'))['last']
+
+    def new_changes(self):
+        return set(ProductChange.objects.filter(pk__gt=self.last_change).values_list('product_id', flat=True))
+
+    def prices(self):
+        return {
+            product.title: product.price
+            for queryset in shards.each(Product.objects.all())
+            for product in queryset
+        }
+
+    def post(self, **data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(self.url, data, format='json')
+
+    def test_dry_run_changes_nothing(self):
+        before = self.prices()
+        response = self.post(field='price', mode='percent', value='-15', category='lamps', dry_run=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(), {'matched': 2, 'updated': 0, 'dry_run': True, 'new_min': '8.49', 'new_max': '17.00'}
+        )
+        self.assertEqual(self.prices(), before)
+        self.assertEqual(self.new_changes(), set())
+
+    def test_update_only_touches_the_sellers_matches(self):
+        lamp = self.products['Lamp']
+        with mock.patch.object(ProductViewSet, 'throttle_classes', []):
+            self.assertEqual(self.client.get(f'/api/products/{lamp.pk}/').json()['price'], '9.99')
+        cache = product_cache.get_cache()
+        with queries.query_budget(repeats=1), mock.patch.object(cache, 'bump_generation') as bump, \
+                mock.patch.object(cache, 'delete', wraps=cache.delete) as delete:
+            response = self.post(field='price', mode='percent', value='-15', category='lamps')
+        self.assertEqual(response.json()['updated'], 2)
+        # Only the changed products leave the cache, not every product
+        bump.assert_not_called()
+        delete.assert_called_once_with(sorted([lamp.pk, self.products['Big lamp'].pk]))
+        self.assertEqual(self.prices(), {
+            'Lamp': Decimal('8.49'), 'Big lamp': Decimal('17.00'), 'Desk': Decimal('120.00'),
+            'Their lamp': Decimal('50.00'),
+        })
+        # The cached copy and the change feed see the UPDATE
+        with mock.patch.object(ProductViewSet, 'throttle_classes', []):
+            self.assertEqual(self.client.get(f'/api/products/{lamp.pk}/').json()['price'], '8.49')
+        self.assertEqual(
+            self.new_changes(), {lamp.pk, self.products['Big lamp'].pk},
+        )
+
+    def test_tag_matches_whole_entries(self):
+        response = self.post(field='discount', mode='absolute', value='25', tag='sale')
+        self.assertEqual(response.json()['updated'], 2)
+        discounted = {
+            product.title for queryset in shards.each(Product.objects.filter(discount=25)) for product in queryset
+        }
+        self.assertEqual(discounted, {'Lamp', 'Desk'})
+
+    def test_out_of_range_rolls_back(self):
+        before = self.prices()
+        for data in [
+            {'mode': 'absolute', 'value': '-10', 'ids': [self.products['Lamp'].pk, self.products['Desk'].pk]},
+            {'mode': 'absolute', 'value': '-10', 'all': True, 'dry_run': True},
+        ]:
+            with self.subTest(**data):
+                response = self.post(field='price', **data)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('minimum 0.01', response.json()['value'][0])
+        self.assertEqual(self.prices(), before)
+        self.assertEqual(self.new_changes(), set())
+
+    def test_invalid_requests(self):
+        for data in [
+            {'field': 'price', 'mode': 'percent', 'value': '10'},
+            {'field': 'price', 'mode': 'percent', 'value': '-100', 'all': True},
+            {'field': 'stock', 'mode': 'absolute', 'value': '1', 'all': True},
+        ]:
+            with self.subTest(**data):
+                self.assertEqual(self.post(**data).status_code, 400)
+
+
+class ShardedBulkPricingTests(SellerShardsMixin, BulkPricingTests):
+    """The same on the seller's shard"""
+
+
+class OfflineJobsTests(TestCase):
+    """Commands and builders that read the whole catalog see every seller's products"""
+
+    def setUp(self):
+        for alias in ('default', 'throttle'):
+            caches[alias].clear()
+        product_cache.reset_cache()
+        self.directory = tempfile.mkdtemp(prefix='offline-jobs-test-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.buyer = User.objects.create(username='buyer')
+        # More sellers than shards, so the products are spread out
+        self.sellers = [User.objects.create(username=f'seller{number}') for number in range(4)]
+        self.products = [
+            Product.objects.create(
+                seller=self.sellers[number % 4], title=f'{["Blue", "Red"][number % 2]} lamp {number}',
+                category='lamps', price=Decimal('5.00'), stock=1,
+            )
+            for number in range(8)
+        ]
+
+    def fresh(self, product):
+        return shards.in_bulk(Product.objects.all(), [product.pk])[product.pk]
+
+    def buy(self, *products):
+        order = Order.objects.create(user=self.buyer)
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, seller_id=product.seller_id, quantity=1)
+        return order
+
+    def test_reconcile_ratings(self):
+        first, second, third = self.products[:3]
+        for number, stars in enumerate((5, 4)):
+            Review.objects.create(product=first, user=self.sellers[number], rating=stars)
+        Review.objects.create(product=second, user=self.buyer, rating=2)
+        # third claims reviews it doesn't have
+        Product.objects.using(third._state.db).filter(pk=third.pk).update(reviews_count=3, rating_sum=9, rating=3)
+        call_command('reconcile_ratings', batch_size=1, stdout=StringIO())
+        self.assertEqual(
+            [(product.reviews_count, product.rating_sum, product.rating) for product in map(self.fresh, (first, second, third))],
+            [(2, 9, Decimal('4.50')), (1, 2, Decimal('2.00')), (0, 0, Decimal('0.00'))],
+        )
+
+    def test_backfill_ratings(self):
+        call_command('backfill_ratings', stdout=StringIO())
+        ratings = [self.fresh(product).rating for product in self.products]
+        self.assertTrue(all(Decimal(1) <= rating <= Decimal(5) for rating in ratings))
+        # Same seed, same ratings
+        call_command('backfill_ratings', force=True, stdout=StringIO())
+        self.assertEqual([self.fresh(product).rating for product in self.products], ratings)
+
+    def test_build_suggest_index(self):
+        path = f'{self.directory}/suggest.json'
+        call_command('build_suggest_index', output=path, stdout=StringIO())
+        index = suggest.PrefixIndex()
+        index.load(path)
+        self.assertEqual(sorted(index.product_ids()), sorted(product.pk for product in self.products))
+
+    def test_related_index(self):
+        lamp, other = self.products[0], self.products[1]
+        self.assertNotEqual(lamp.seller_id, other.seller_id)
+        self.buy(lamp, other)
+        builder = related.RelatedIndexBuilder(directory=self.directory, neighbours=2, bucket_size=4)
+        builder.build_full()
+        self.assertEqual(related.load_version(self.directory)['pairs'][lamp.pk][other.pk], 1)
+        self.buy(lamp, other)
+        builder.build_incremental()
+        self.assertEqual(related.load_version(self.directory)['pairs'][lamp.pk][other.pk], 2)
+        self.assertEqual(len(related.RelatedIndex.open(self.directory).sorted_ids), 8)
+
+    def test_deleting_users_reaches_every_database(self):
+        lamp = self.products[0]
+        order = self.buy(lamp, self.products[1])
+        Review.objects.create(product=lamp, user=self.buyer, rating=4)
+        self.buyer.delete()
+        self.assertFalse(Order.objects.filter(pk=order.pk).exists())
+        self.assertFalse(any(queryset.exists() for queryset in shards.each(OrderItem.objects.filter(order_id=order.pk))))
+
+        self.buyer = User.objects.create(username='second buyer')
+        self.buy(lamp)
+        Review.objects.create(product=lamp, user=self.sellers[1], rating=4)
+        self.sellers[0].delete()
+        self.assertEqual(
+            sum(queryset.count() for queryset in shards.each(Product.objects.all())), len(self.products) - 2
+        )
+        self.assertFalse(any(queryset.exists() for queryset in shards.each(OrderItem.objects.filter(product=lamp.pk))))
+        self.assertFalse(Review.objects.filter(product_id=lamp.pk).exists())
+        self.assertFalse(ProductKey.objects.filter(pk=lamp.pk).exists())
+
+
+class ShardedOfflineJobsTests(SellerShardsMixin, OfflineJobsTests):
+    """The same with seller shards, and a loud error where a job can't handle them"""
+
+    def test_queries_must_pick_a_database(self):
+        with self.assertRaises(shards.NoShardChosen):
+            Product.objects.count()
+        with self.assertRaises(shards.NoShardChosen):
+            OrderItem.objects.filter(seller=self.sellers[0]).update(quantity=2)
+        # A row to go by is enough
+        self.assertEqual(self.sellers[0].products.count(), 2)
+
+    def test_benchmarks_refuse_before_writing(self):
+        users = User.objects.count()
+        for command in ('bench_api_encoding', 'bench_catalog_snapshot', 'bench_read_serializers'):
+            with self.subTest(command), self.assertRaises(CommandError):
+                call_command(command, products=1, stdout=StringIO())
+        self.assertEqual(User.objects.count(), users)
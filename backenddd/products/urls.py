@@ -1,6 +1,6 @@
 from rest_framework.routers import DefaultRouter
 from django.urls import path, include
-from .views import ProductViewSet, SellerProductViewSet
+from .views import ProductViewSet, SellerProductViewSet, ReviewViewSet, seller_sales_stream, product_cache_stats
 
 router = DefaultRouter()
 router.register('', ProductViewSet, basename='product')
@@ -9,7 +9,14 @@ router.register('', ProductViewSet, basename='product')
 seller_router = DefaultRouter()
 seller_router.register('', SellerProductViewSet, basename='seller-product')
 
+# Router for product reviews (/api/products/reviews/?product=<id>)
+review_router = DefaultRouter()
+review_router.register('', ReviewViewSet, basename='review')
+
 urlpatterns = [
+    path('seller/sales-stream/', seller_sales_stream),
     path('seller/', include(seller_router.urls)),
+    path('reviews/', include(review_router.urls)),
+    path('cache-stats/', product_cache_stats),
     path('', include(router.urls)),
 ]
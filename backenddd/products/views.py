@@ -1,120 +1,579 @@
 # This file handles product-related API endpoints
 from rest_framework.viewsets import ModelViewSet
-from rest_framework.permissions import AllowAny, IsAuthenticated
-from rest_framework.filters import SearchFilter, OrderingFilter
-from rest_framework.decorators import action
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework.pagination import CursorPagination
+from rest_framework.filters import BaseFilterBackend, SearchFilter, OrderingFilter
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.decorators import action, api_view, authentication_classes, permission_classes
 from rest_framework.response import Response
+from rest_framework import status
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework_simplejwt.authentication import JWTAuthentication
-from django.db.models import Sum, Count, Q
-from .models import Product
-from .serializers import ProductSerializer, SellerProductSerializer
-from orders.models import Order, OrderItem
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+from django.db import IntegrityError, transaction
+from .models import Product, ProductChange, Review
+from .serializers import (
+    ProductSerializer, SellerProductSerializer, ReviewSerializer, BulkPricingSerializer, CatalogFilterSerializer,
+)
+from .bulk import apply_bulk_pricing, filter_products
+from . import changes as change_log
+from . import shards
+from . import suggest as suggest_index
+from .storefront import get_storefront
+from . import cache as product_cache
+from backenddd.conditional import ConditionalGetMixin, queryset_validator
+from backenddd import compiled
+
+# Cursor pagination for the public catalog: each page is an indexed LIMIT
+# query, so infinite scroll stays fast no matter how deep the user goes
+class ProductPagination(CursorPagination):
+    ordering = ('-created_at', '-id')
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+def catalog_filters(request):
+    """The catalog filters given in the query string, validated (400 if one is invalid)"""
+    serializer = CatalogFilterSerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data
+
+
+# ?category=, ?brand=, ?seller=, ?min_price=, ?max_price= and ?in_stock=
+# for the public catalog (the snapshot backend applies the same ones)
+class CatalogFilter(BaseFilterBackend):
+    def filter_queryset(self, request, queryset, view):
+        filters = catalog_filters(request)
+        queryset = filter_products(queryset, category=filters.get('category'), brand=filters.get('brand'))
+        if filters.get('seller') is not None:
+            queryset = queryset.filter(seller_id=filters['seller'])
+        if filters.get('min_price') is not None:
+            queryset = queryset.filter(price__gte=filters['min_price'])
+        if filters.get('max_price') is not None:
+            queryset = queryset.filter(price__lte=filters['max_price'])
+        if filters.get('in_stock'):
+            queryset = queryset.filter(stock__gt=0)
+        return queryset
+
 
 # ViewSet for managing products (public view)
-class ProductViewSet(ModelViewSet):
-    # Get all products from the database
-    queryset = Product.objects.all()
+class ProductViewSet(ConditionalGetMixin, compiled.CompiledListMixin, ModelViewSet):
+    # Get all products from the database (with the seller for seller_username)
+    queryset = Product.objects.select_related('seller')
     # Use ProductSerializer to convert products to/from JSON
     serializer_class = ProductSerializer
     # Allow anyone to view products (no login required)
     permission_classes = [AllowAny]
     # No authentication required to view products
     authentication_classes = []
-    # Enable search and ordering features
-    filter_backends = [SearchFilter, OrderingFilter]
+    # Enable filter, search and ordering features
+    filter_backends = [CatalogFilter, SearchFilter, OrderingFilter]
     # Fields that can be searched
     search_fields = ["title", "description", "category", "brand", "tags"]
     # Fields that can be used for sorting
     ordering_fields = ["price", "title", "created_at", "rating"]
+    # Catalog data is the same for everyone, so shared caches may store it
+    cache_control = {'public': True, 'max_age': 30}
+    # Never return the whole catalog in one response
+    pagination_class = ProductPagination
+
+    def get_queryset(self):
+        """Every seller's products: gathered from all shards when SELLER_SHARDS is set"""
+        if shards.enabled():
+            return shards.catalog(shards.select_seller(Product.objects.all()))
+        return super().get_queryset()
+
+    def get_snapshot(self):
+        """The catalog snapshot when PRODUCT_READ_BACKEND = 'snapshot' and one is published"""
+        if getattr(settings, 'PRODUCT_READ_BACKEND', 'database') != 'snapshot':
+            return None
+        # Imported here so database-backed processes never load NumPy
+        from . import snapshot as catalog_snapshot
+
+        return catalog_snapshot.get_snapshot()
+
+    def list(self, request, *args, **kwargs):
+        """List products, or fetch several at once with ?ids=1,2,3"""
+        ids = request.query_params.get('ids')
+        if ids is not None:
+            return self.batch_response(self.parse_ids(ids.split(',')))
+        snapshot = self.get_snapshot()
+        if snapshot is not None:
+            return self.conditional_response(
+                request,
+                [(snapshot.last_modified, len(snapshot))],
+                lambda: self.snapshot_list(request, snapshot),
+            )
+        return super().list(request, *args, **kwargs)
+
+    def snapshot_list(self, request, snapshot):
+        """
+        The same filters, search, ordering and cursor pages as the database
+        path, read from the memory-mapped snapshot. Ties in ?ordering= are
+        broken by id.
+        """
+        from . import snapshot as catalog_snapshot
+
+        filters = catalog_filters(request)
+        terms = SearchFilter().get_search_terms(request)
+        ordering = (OrderingFilter().get_ordering(request, None, self) or ['-created_at'])[0]
+        paginator = self.paginator
+        cursor = request.query_params.get(paginator.cursor_query_param)
+        if cursor is not None:
+            cursor = catalog_snapshot.decode_cursor(cursor, ordering)
+            if cursor is None:
+                raise NotFound(paginator.invalid_cursor_message)
+        results, next_cursor, previous_cursor = snapshot.page(
+            ordering, terms, cursor, paginator.get_page_size(request), filters
+        )
+        url = request.build_absolute_uri()
+
+        def link(value):
+            return replace_query_param(url, paginator.cursor_query_param, value) if value else None
+
+        return Response({
+            'next': link(next_cursor),
+            'previous': link(previous_cursor),
+            'results': results,
+        })
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """Fetch several products at once: POST {"ids": [1, 2, 3]}"""
+        ids = request.data.get('ids')
+        if not isinstance(ids, list):
+            raise ValidationError({'ids': ['Expected a list of product ids.']})
+        return self.batch_response(self.parse_ids(ids))
+
+    def parse_ids(self, raw_ids):
+        """Turn the requested ids into a list of unique ints, keeping their order"""
+        limit = settings.PRODUCT_BATCH_MAX_IDS
+        # A dict keeps the first position of each id and finds duplicates in O(1)
+        product_ids = {}
+        for raw_id in raw_ids:
+            if isinstance(raw_id, str) and not raw_id.strip():
+                continue
+            try:
+                product_id = int(raw_id)
+            except (TypeError, ValueError):
+                raise ValidationError({'ids': [f'"{raw_id}" is not a valid product id.']})
+            product_ids[product_id] = None
+            # Stop reading as soon as the request is too big
+            if len(product_ids) > limit:
+                raise ValidationError({'ids': [f'At most {limit} ids per request.']})
+        return list(product_ids)
+
+    def batch_response(self, product_ids):
+        """
+        Serialized products in the requested order plus the ids that don't exist.
+
+        Cached products come from the product cache; the rest are read with
+        a single in_bulk query and cached for the next request.
+        """
+        snapshot = self.get_snapshot()
+        if snapshot is not None:
+            products = snapshot.get_many(product_ids)
+        else:
+            products = product_cache.get_many(product_ids, self.load_serialized)
+        return Response({
+            'results': [products[product_id] for product_id in product_ids if product_id in products],
+            'missing': [product_id for product_id in product_ids if product_id not in products],
+        })
+
+    def load_serialized(self, product_ids):
+        """Serialize products by id with one query per shard (the product cache's loader)"""
+        plan = self.get_compiled_serializer()
+        if plan is not None:
+            rows = []
+            for alias, ids in shards.group_products(product_ids).items():
+                rows.extend(plan.values(Product.objects.using(alias).filter(pk__in=ids)))
+            return {row[plan.pk]: data for row, data in zip(rows, plan.serialize(rows))}
+        found = shards.in_bulk(shards.select_seller(Product.objects.all()), product_ids)
+        serialized = self.get_serializer(list(found.values()), many=True).data
+        return {product_id: dict(data) for product_id, data in zip(found, serialized)}
+
+    def retrieve(self, request, *args, **kwargs):
+        """One product, served from the product cache when possible"""
+        try:
+            product_id = int(kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except ValueError:
+            raise NotFound()
+        snapshot = self.get_snapshot()
+        if snapshot is not None:
+            data = snapshot.get_many([product_id]).get(product_id)
+        else:
+            data = product_cache.get(product_id, self.load_serialized)
+        if data is None:
+            raise NotFound()
+        # The cached copy carries its own validator, so a 304 needs no query
+        updated_at = parse_datetime(data['updated_at']) if data.get('updated_at') else None
+        return self.conditional_response(request, [(updated_at, 1)], lambda: Response(data))
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """
+        Product changes after ?since=<token>, oldest first (?limit= per page).
+        Upserts carry the current product, deletes only the id. Without a
+        token, or with one the log can no longer serve (410 Gone), the client
+        must download the catalog again and continue from the returned token.
+        """
+        seq, changed_at = change_log.head()
+        since = request.query_params.get('since')
+        if since is None:
+            return Response(self.resync_payload(seq))
+        since = change_log.decode_token(since)
+        if change_log.needs_resync(since):
+            return Response(
+                {'detail': 'This token is too old, download the catalog again.', **self.resync_payload(seq)},
+                status=status.HTTP_410_GONE,
+            )
+        try:
+            limit = int(request.query_params.get('limit', settings.PRODUCT_CHANGES_PAGE_SIZE))
+        except ValueError:
+            limit = settings.PRODUCT_CHANGES_PAGE_SIZE
+        limit = max(1, min(limit, settings.PRODUCT_CHANGES_MAX_PAGE_SIZE))
+        return self.conditional_response(
+            request, [(changed_at, seq)], lambda: self.changes_page(since, limit)
+        )
+
+    def resync_payload(self, seq):
+        return {'resync': True, 'changes': [], 'next': change_log.encode_token(seq), 'has_more': False}
+
+    def changes_page(self, since, limit):
+        rows, next_seq, has_more = change_log.changes_since(since, limit)
+        upserts = [product_id for _, product_id, op in rows if op == ProductChange.UPSERT]
+        # Current data, from the product cache where possible
+        products = product_cache.get_many(upserts, self.load_serialized)
+        results = []
+        for seq, product_id, op in rows:
+            product = products.get(product_id) if op == ProductChange.UPSERT else None
+            results.append({
+                'seq': seq,
+                # Deleted since: its delete comes later in the log
+                'op': ProductChange.UPSERT if product is not None else ProductChange.DELETE,
+                'id': product_id,
+                'product': product,
+            })
+        return Response({
+            'resync': False,
+            'changes': results,
+            'next': change_log.encode_token(next_seq),
+            'has_more': has_more,
+        })
+
+    @action(detail=False, methods=['get'])
+    def storefront(self, request):
+        """Curated home page sections (featured, top rated, newest, per category) in one response"""
+        storefront = get_storefront()
+        return self.conditional_response(
+            request,
+            [(storefront['generated_at'], len(storefront['sections']))],
+            lambda: Response(storefront),
+        )
+
+    @action(detail=False, methods=['get'])
+    def suggest(self, request):
+        """Autocomplete titles, brands and categories from the in-memory prefix index"""
+        query = request.query_params.get('q', '')
+        try:
+            limit = int(request.query_params.get('limit', settings.PRODUCT_SUGGEST_LIMIT))
+        except ValueError:
+            limit = settings.PRODUCT_SUGGEST_LIMIT
+        # Once the index is built, typing only reads the change log every few seconds
+        results = suggest_index.get_index().search(query, limit=limit)
+        return Response(results)
+
+    @action(detail=True, methods=['get'])
+    def related(self, request, pk=None):
+        """Products similar to this one, read from the offline related-products index"""
+        product = self.get_object()
+        try:
+            limit = int(request.query_params.get('limit', settings.RELATED_PRODUCTS_LIMIT))
+        except ValueError:
+            limit = settings.RELATED_PRODUCTS_LIMIT
+        limit = max(1, min(limit, settings.RELATED_INDEX_NEIGHBOURS))
+
+        # Imported here so only processes serving this endpoint load NumPy
+        from . import related as related_index
+
+        index = related_index.get_related_index()
+        related_ids = index.lookup(product.pk, limit) if index is not None else None
+        if related_ids is None:
+            # No index yet (or product added after the last build):
+            # fall back to the best rated products of the same category
+            related = list(
+                shards.catalog(shards.select_seller(Product.objects.all()))
+                .filter(category=product.category)
+                .exclude(pk=product.pk)
+                .order_by('-rating', '-id')[:limit]
+            )
+        else:
+            # One query for all neighbours, returned in similarity order
+            found = shards.in_bulk(shards.select_seller(Product.objects.all()), related_ids)
+            related = [found[related_id] for related_id in related_ids if related_id in found]
+        serializer = self.get_serializer(related, many=True)
+        return Response(serializer.data)
 
 
 # ViewSet for seller product management
-class SellerProductViewSet(ModelViewSet):
+class SellerProductViewSet(ConditionalGetMixin, ModelViewSet):
     serializer_class = SellerProductSerializer
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
     filter_backends = [SearchFilter, OrderingFilter]
     search_fields = ["title", "description", "category", "brand"]
     ordering_fields = ["price", "title", "created_at", "stock"]
+    # Seller data is per-user and must always be revalidated
+    cache_control = {'private': True, 'no_cache': True}
     
     def get_queryset(self):
-        """Return only products belonging to the current seller"""
-        return Product.objects.filter(seller=self.request.user).order_by('-created_at')
+        """Return only products belonging to the current seller (read from the seller's shard)"""
+        # Writes are refused with a 503 while the seller is being moved
+        for_write = self.request.method not in ('GET', 'HEAD', 'OPTIONS')
+        shard = shards.shard_for_seller(self.request.user.id, for_write=for_write)
+        return Product.objects.using(shard).filter(seller=self.request.user).order_by('-created_at')
+
+    def get_archive_state(self):
+        """The order archive state, read once per request"""
+        from orders import archive as order_archive
+
+        if not hasattr(self, '_archive_state'):
+            self._archive_state = order_archive.archive_state()
+        return self._archive_state
+
+    def get_sales_validators(self):
+        """Validators for the sales endpoints: the seller's order items, product prices and the archive"""
+        from orders.models import OrderItem
+        from orders import archive as order_archive
+
+        seller = self.request.user
+        shard = shards.shard_for_seller(seller.id)
+        return [
+            queryset_validator(OrderItem.objects.using(shard).filter(seller=seller), 'order_created_at'),
+            queryset_validator(Product.objects.using(shard).filter(seller=seller), 'updated_at'),
+            order_archive.archive_validator(self.get_archive_state()),
+        ]
     
     def perform_create(self, serializer):
         """Automatically set the seller to the current user when creating a product"""
+        shards.shard_for_seller(self.request.user.id, for_write=True)
         serializer.save(seller=self.request.user)
     
     def perform_update(self, serializer):
         """Ensure seller cannot be changed during update"""
         serializer.save(seller=self.request.user)
     
+    @action(detail=False, methods=['post'], url_path='bulk-pricing')
+    def bulk_pricing(self, request):
+        """
+        Change price or discount of many products at once, e.g.
+        {"field": "price", "mode": "percent", "value": "-20", "category": "shoes", "dry_run": true}
+        """
+        serializer = BulkPricingSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        options = serializer.validated_data
+        products = filter_products(
+            self.get_queryset(),
+            category=options.get('category'),
+            brand=options.get('brand'),
+            tag=options.get('tag'),
+            ids=options.get('ids'),
+        )
+        result = apply_bulk_pricing(
+            products, options['field'], options['mode'], options['value'], dry_run=options['dry_run']
+        )
+        # Decimals as strings, like the product payloads
+        for name in ('new_min', 'new_max'):
+            if result[name] is not None:
+                result[name] = str(result[name])
+        return Response(result)
+
     @action(detail=False, methods=['get'], url_path='sales-summary')
     def sales_summary(self, request):
         """Get sales summary for the seller"""
+        return self.conditional_response(
+            request, self.get_sales_validators(), lambda: self._sales_summary(request)
+        )
+
+    def _sales_summary(self, request):
         seller = request.user
         
-        # Get all order items containing seller's products
-        seller_order_items = OrderItem.objects.filter(
-            product__seller=seller
-        ).select_related('order', 'product')
-        
-        # Calculate statistics
-        total_orders = seller_order_items.values('order').distinct().count()
-        total_items_sold = seller_order_items.aggregate(
-            total=Sum('quantity')
-        )['total'] or 0
-        
-        total_revenue = sum(
-            item.quantity * item.product.price 
-            for item in seller_order_items
-        )
+        # All statistics come from the order item snapshots (no join to
+        # products, so later price changes don't rewrite history): one
+        # aggregate over recent sales plus a cached one over archived sales
+        from orders import archive as order_archive
+
+        totals = order_archive.seller_totals(seller, self.get_archive_state())
         
         # Get product count
-        total_products = Product.objects.filter(seller=seller).count()
+        total_products = Product.objects.using(shards.shard_for_seller(seller.id)).filter(seller=seller).count()
         
         return Response({
             'total_products': total_products,
-            'total_orders': total_orders,
-            'total_items_sold': total_items_sold,
-            'total_revenue': float(total_revenue),
+            'total_orders': totals['total_orders'],
+            'total_items_sold': totals['total_items_sold'],
+            'total_revenue': float(totals['total_revenue']),
         })
     
     @action(detail=False, methods=['get'], url_path='sales-orders')
     def sales_orders(self, request):
         """Get all orders containing seller's products"""
-        seller = request.user
-        
-        # Get all order items containing seller's products
-        seller_order_items = OrderItem.objects.filter(
-            product__seller=seller
-        ).select_related('order', 'product', 'order__user').order_by('-order__created_at')
-        
-        # Group by order
-        orders_data = {}
-        for item in seller_order_items:
-            order_id = item.order.id
-            if order_id not in orders_data:
-                orders_data[order_id] = {
-                    'order_id': order_id,
-                    'customer': item.order.user.username,
-                    'created_at': item.order.created_at,
-                    'items': [],
-                    'total': 0
-                }
-            
-            item_total = float(item.quantity * item.product.price)
-            orders_data[order_id]['items'].append({
-                'product_id': item.product.id,
-                'product_title': item.product.title,
-                'quantity': item.quantity,
-                'price': float(item.product.price),
-                'total': item_total
-            })
-            orders_data[order_id]['total'] += item_total
-        
-        # Convert to list and sort by date
-        orders_list = list(orders_data.values())
-        orders_list.sort(key=lambda x: x['created_at'], reverse=True)
-        
-        return Response(orders_list)
+        return self.conditional_response(
+            request, self.get_sales_validators(), lambda: self._sales_orders(request)
+        )
+
+    def _sales_orders(self, request):
+        # Newest orders first, one page at a time (?limit=, ?created_after=,
+        # ?created_before=); archived sales are only read for older pages
+        from orders import archive as order_archive
+
+        created_after, before, limit = order_archive.history_range(request)
+        orders_data = order_archive.seller_sales_orders(
+            request.user, created_after, before, limit, state=self.get_archive_state()
+        )
+        response = Response(orders_data)
+        if len(orders_data) == limit:
+            oldest = orders_data[-1]
+            response['Link'] = f'<{order_archive.next_page_link(request, oldest["created_at"], oldest["order_id"])}>; rel="next"'
+        return response
+
+    @action(detail=False, methods=['post'], url_path='sales-stream-ticket')
+    def sales_stream_ticket(self, request):
+        """A short-lived ticket for opening the live sales stream (see seller_sales_stream)"""
+        from orders.events import stream_ticket
+
+        return Response({
+            'ticket': stream_ticket(request.user),
+            'expires_in': getattr(settings, 'SALES_STREAM_TICKET_SECONDS', 30),
+        })
+
+
+# Newest-first cursor pagination, served from the (product, -created_at) index
+class ReviewPagination(CursorPagination):
+    ordering = ('-created_at', '-id')
+    page_size = 20
+
+
+# ViewSet for product reviews
+class ReviewViewSet(ModelViewSet):
+    serializer_class = ReviewSerializer
+    authentication_classes = [JWTAuthentication]
+    # Anyone can read reviews; writing one requires login
+    permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = ReviewPagination
+
+    def get_queryset(self):
+        """Reviews of ?product=<id>; users may only change their own reviews"""
+        queryset = Review.objects.select_related('user')
+        product_id = self.request.query_params.get('product')
+        if product_id is not None:
+            queryset = queryset.filter(product_id=product_id)
+        if self.action not in ('list', 'retrieve'):
+            queryset = queryset.filter(user=self.request.user)
+        return queryset
+
+    def perform_create(self, serializer):
+        """Save the review and add its stars to the product rating in one transaction"""
+        try:
+            with transaction.atomic():
+                review = serializer.save(user=self.request.user)
+                Product.apply_rating_change(review.product_id, review.rating, 1)
+        except IntegrityError:
+            # A parallel request saved this user's review first (the serializer
+            # check passed for both): a 400 like the check, not a 500
+            raise ValidationError({'non_field_errors': ['You have already reviewed this product']})
+
+    def perform_update(self, serializer):
+        """Apply only the change in stars to the product rating"""
+        with transaction.atomic():
+            # Read the stars under a row lock, so a parallel edit of the same
+            # review can't slip in between this read and the save
+            old_rating = Review.objects.select_for_update().values_list('rating', flat=True).get(
+                pk=serializer.instance.pk
+            )
+            review = serializer.save()
+            if review.rating != old_rating:
+                Product.apply_rating_change(review.product_id, review.rating - old_rating, 0)
+
+    def perform_destroy(self, instance):
+        """Remove the review's stars from the product rating"""
+        with transaction.atomic():
+            # The stars as they are now; a parallel delete leaves nothing to remove
+            old_rating = (
+                Review.objects.select_for_update().filter(pk=instance.pk).values_list('rating', flat=True).first()
+            )
+            if old_rating is None:
+                return
+            Product.apply_rating_change(instance.product_id, -old_rating, -1)
+            instance.delete()
+
+
+# Product cache metrics for operators
+@api_view(['GET'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAdminUser])
+def product_cache_stats(request):
+    """Hit rate, evictions and memory use of this process's product cache"""
+    return Response(product_cache.stats())
+
+
+# Live sales feed for the seller dashboard (server-sent events, ASGI only)
+async def seller_sales_stream(request):
+    """
+    Stream new sales of the seller's products as server-sent events.
+
+    EventSource cannot send an Authorization header, so the stream is opened
+    with ?ticket= from POST seller/sales-stream-ticket/ (short-lived, unlike
+    the JWT). The stream subscribes first, then replays the sales after the
+    Last-Event-ID header (or ?last_event_id= on a manual reconnect), or sends
+    a "reload" event if too many were missed, and then a "ready" event: a
+    client that loads its first page after "ready" misses nothing. A comment
+    line is sent every SALES_STREAM_HEARTBEAT seconds to keep proxies from
+    closing the stream.
+    """
+    from django.contrib.auth.models import User
+    from orders.events import format_event, get_broker, missed_sales, ticket_user_id
+
+    seller_id = ticket_user_id(request.GET.get('ticket', ''))
+    if seller_id is None or not await User.objects.filter(pk=seller_id, is_active=True).aexists():
+        return JsonResponse({'detail': 'Invalid or expired stream ticket'}, status=401)
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        since = parse_datetime(last_event_id) if last_event_id else None
+    except ValueError:
+        since = None
+    heartbeat = getattr(settings, 'SALES_STREAM_HEARTBEAT', 15)
+
+    async def event_stream():
+        subscription = get_broker().subscribe(seller_id)
+        try:
+            # Tell the browser how quickly to reconnect if the stream drops
+            yield 'retry: 1000\n\n'
+            # Sales from before the subscription (live ones sent twice are
+            # skipped by the client, which knows their item ids)
+            if since is not None:
+                missed = await sync_to_async(missed_sales)(seller_id, since)
+                if missed is None:
+                    yield 'event: reload\ndata: {}\n\n'
+                else:
+                    for event in missed:
+                        yield format_event(event)
+            yield 'event: ready\ndata: {}\n\n'
+            while True:
+                event = await subscription.get(timeout=heartbeat)
+                if event is None:
+                    yield ': keep-alive\n\n'
+                else:
+                    yield format_event(event)
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,63 @@
+# This file holds password hashers whose cost comes from settings.
+# Django's hashers read the cost from class attributes; these read it from
+# AUTH_* settings instead, so it can be tuned per deployment. Every hasher
+# keeps Django's algorithm name, which means existing hashes still verify.
+# Django rehashes a password on the next successful login when its cost or
+# algorithm differs from the preferred hasher (the first in PASSWORD_HASHERS).
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    Argon2PasswordHasher,
+    PBKDF2PasswordHasher,
+    ScryptPasswordHasher,
+)
+
+
+def _setting(name, default):
+    value = getattr(settings, name, None)
+    return default if value is None else value
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """PBKDF2-SHA256 with AUTH_PBKDF2_ITERATIONS rounds (None: Django's default)"""
+
+    @property
+    def iterations(self):
+        return _setting("AUTH_PBKDF2_ITERATIONS", PBKDF2PasswordHasher.iterations)
+
+
+class TunedScryptPasswordHasher(ScryptPasswordHasher):
+    """scrypt with AUTH_SCRYPT_WORK_FACTOR (N), AUTH_SCRYPT_BLOCK_SIZE (r) and AUTH_SCRYPT_PARALLELISM (p)"""
+
+    @property
+    def work_factor(self):
+        return _setting("AUTH_SCRYPT_WORK_FACTOR", ScryptPasswordHasher.work_factor)
+
+    @property
+    def block_size(self):
+        return _setting("AUTH_SCRYPT_BLOCK_SIZE", ScryptPasswordHasher.block_size)
+
+    @property
+    def parallelism(self):
+        return _setting("AUTH_SCRYPT_PARALLELISM", ScryptPasswordHasher.parallelism)
+
+    @property
+    def maxmem(self):
+        # scrypt needs about 128 * N * r bytes; OpenSSL refuses more than
+        # 32 MiB unless told otherwise, so allow twice the configured need
+        return max(2 * 128 * self.work_factor * self.block_size, 32 * 1024 * 1024)
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    """argon2id with AUTH_ARGON2_TIME_COST, AUTH_ARGON2_MEMORY_COST (KiB) and AUTH_ARGON2_PARALLELISM (needs argon2-cffi)"""
+
+    @property
+    def time_cost(self):
+        return _setting("AUTH_ARGON2_TIME_COST", Argon2PasswordHasher.time_cost)
+
+    @property
+    def memory_cost(self):
+        return _setting("AUTH_ARGON2_MEMORY_COST", Argon2PasswordHasher.memory_cost)
+
+    @property
+    def parallelism(self):
+        return _setting("AUTH_ARGON2_PARALLELISM", Argon2PasswordHasher.parallelism)
@@ -0,0 +1,126 @@
+# This file runs password hashing on a small dedicated pool of workers.
+# Hashing a password is deliberately slow (tens of milliseconds of CPU). If
+# every request thread could hash, a burst of logins would take all the CPU
+# from catalog requests served by the same process. Instead at most
+# AUTH_HASHING_WORKERS hashes run at once. Up to AUTH_HASHING_QUEUE more
+# wait for a worker, and beyond that logins get a quick 503.
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth import authenticate, get_user_model
+from django.contrib.auth.hashers import make_password, verify_password
+from django.contrib.auth.signals import user_login_failed
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many sign-ins at the moment, please try again shortly.'
+    default_code = 'auth_busy'
+    # Sent as the Retry-After header by DRF's exception handler
+    wait = 1
+
+
+_lock = threading.Lock()
+_pool = None
+_slots = None
+_config = None
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def pool_config():
+    """(workers, kind, queue) from settings; workers=0 means hash on the request thread"""
+    return (
+        _setting('AUTH_HASHING_WORKERS', 2),
+        _setting('AUTH_HASHING_POOL', 'thread'),
+        _setting('AUTH_HASHING_QUEUE', 32),
+    )
+
+
+def _init_process():
+    # Worker processes started with spawn/forkserver need Django set up to read settings
+    django.setup()
+
+
+def get_pool():
+    """The shared executor and its slot semaphore, rebuilt if the settings changed"""
+    global _pool, _slots, _config
+    config = pool_config()
+    with _lock:
+        if config != _config:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            workers, kind, queue = config
+            if kind == 'process':
+                _pool = ProcessPoolExecutor(workers, initializer=_init_process)
+            else:
+                _pool = ThreadPoolExecutor(workers, thread_name_prefix='auth-hashing')
+            _slots = threading.BoundedSemaphore(workers + queue)
+            _config = config
+        return _pool, _slots
+
+
+def reset_pool():
+    """Shut the pool down (the next hash starts a new one)"""
+    global _pool, _slots, _config
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+        _pool = _slots = _config = None
+
+
+def run(function, *args):
+    """Call function(*args) on the hashing pool and wait for the result"""
+    if not pool_config()[0]:
+        return function(*args)
+    pool, slots = get_pool()
+    if not slots.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        future = pool.submit(function, *args)
+    except BaseException:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+    return future.result()
+
+
+def hash_password(password):
+    """make_password() on the pool"""
+    return run(make_password, password)
+
+
+def authenticate_user(request, username, password):
+    """
+    Same result as authenticate() with the default ModelBackend, but with
+    the password check and any rehash run on the hashing pool. Database
+    reads and writes stay on the request thread.
+
+    With AUTH_HASHING_WORKERS = 0 this is plain authenticate(), which also
+    keeps any custom AUTHENTICATION_BACKENDS working.
+    """
+    if not pool_config()[0]:
+        return authenticate(request, username=username, password=password)
+    User = get_user_model()
+    try:
+        user = User._default_manager.get_by_natural_key(username)
+    except User.DoesNotExist:
+        user = None
+    # With no user, check against an unusable password: verify_password
+    # still hashes once, so unknown usernames take as long as wrong passwords
+    encoded = user.password if user else make_password(None)
+    is_correct, must_update = run(verify_password, password, encoded)
+    if not is_correct or not user.is_active:
+        user_login_failed.send(sender=__name__, credentials={'username': username}, request=request)
+        return None
+    if must_update:
+        # Cost or algorithm changed since this password was stored: upgrade it now
+        user.password = hash_password(password)
+        user.save(update_fields=['password'])
+    return user
@@ -0,0 +1,151 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+from products.models import Product
+from products.views import ProductViewSet
+from users import hashing
+from users.models import Profile
+from users.views import LoginView
+
+PREFIX = "auth-bench-"
+PASSWORD = "bench-password-123"
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure login throughput and catalog latency during a login storm, "
+        "with hashing on the request threads and on the hashing pool"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=5, help="Length of each scenario (default: 5)")
+        parser.add_argument("--login-threads", type=int, default=8, help="Concurrent login clients (default: 8)")
+        parser.add_argument("--catalog-threads", type=int, default=2, help="Concurrent catalog clients (default: 2)")
+        parser.add_argument("--workers", type=int, default=None, help="Hashing pool size (default: AUTH_HASHING_WORKERS)")
+        parser.add_argument(
+            "--hasher", choices=sorted(settings.AUTH_HASHER_CLASSES), default=None,
+            help="Preferred hasher for this run (default: AUTH_PASSWORD_HASHER)",
+        )
+
+    def handle(self, *args, **options):
+        hasher = options["hasher"] or settings.AUTH_PASSWORD_HASHER
+        workers = options["workers"] or settings.AUTH_HASHING_WORKERS or 2
+        hashers = [settings.AUTH_HASHER_CLASSES[hasher]] + [
+            path for path in settings.PASSWORD_HASHERS if path != settings.AUTH_HASHER_CLASSES[hasher]
+        ]
+        if User.objects.filter(username__startswith=PREFIX).exists():
+            raise CommandError(f"Users named {PREFIX}* already exist; remove them first")
+
+        # The threads use their own connections, so the data must be committed
+        # (it is deleted again at the end)
+        with override_settings(PASSWORD_HASHERS=hashers):
+            try:
+                self.usernames = self.create_data(options["login_threads"])
+                self.run_scenarios(options, workers, hasher)
+            finally:
+                hashing.reset_pool()
+                User.objects.filter(username__startswith=PREFIX).delete()
+
+    def create_data(self, count):
+        # One hash shared by every bench user: logins still verify it each time
+        encoded = make_password(PASSWORD)
+        users = User.objects.bulk_create(
+            User(username=f"{PREFIX}{number}", password=encoded) for number in range(count)
+        )
+        Profile.objects.bulk_create(Profile(user=user) for user in users)
+        Product.objects.bulk_create(
+            Product(
+                seller=users[0],
+                title=f"Bench product {number}",
+                description="Catalog traffic during the login storm",
+                price=Decimal(number % 90 + 10),
+                stock=10,
+                category="bench",
+            )
+            for number in range(200)
+        )
+        return [user.username for user in users]
+
+    def run_scenarios(self, options, workers, hasher):
+        self.stdout.write(
+            f"hasher={hasher} login threads={options['login_threads']} "
+            f"catalog threads={options['catalog_threads']} {options['seconds']:.0f}s per scenario"
+        )
+        self.stdout.write(f"{'scenario':<22} {'logins/s':>9} {'503s':>6} {'catalog r/s':>12} {'p50 ms':>8} {'p99 ms':>8}")
+        scenarios = [
+            ("no logins", 0, 0),
+            ("request-thread hashing", options["login_threads"], 0),
+            (f"pool of {workers}", options["login_threads"], workers),
+        ]
+        for name, login_threads, pool_workers in scenarios:
+            with override_settings(AUTH_HASHING_WORKERS=pool_workers):
+                result = self.run_storm(login_threads, options["catalog_threads"], options["seconds"])
+            self.stdout.write(
+                f"{name:<22} {result['logins'] / options['seconds']:>9.1f} {result['busy']:>6} "
+                f"{len(result['latencies']) / options['seconds']:>12.1f} "
+                f"{percentile(result['latencies'], 0.5):>8.1f} {percentile(result['latencies'], 0.99):>8.1f}"
+            )
+
+    def run_storm(self, login_threads, catalog_threads, seconds):
+        factory = APIRequestFactory(HTTP_HOST="localhost")
+        # No rate limiting: we want to measure hashing, not the throttle
+        login_view = LoginView.as_view(throttle_classes=[])
+        list_view = ProductViewSet.as_view({"get": "list"}, throttle_classes=[])
+        result = {"logins": 0, "busy": 0, "latencies": []}
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        def login_client(username):
+            try:
+                while not stop.is_set():
+                    request = factory.post(
+                        "/api/users/login/", {"username": username, "password": PASSWORD}, format="json"
+                    )
+                    response = login_view(request)
+                    with lock:
+                        if response.status_code == 200:
+                            result["logins"] += 1
+                        elif response.status_code == 503:
+                            result["busy"] += 1
+                        else:
+                            raise RuntimeError(f"login failed: {response.status_code} {response.data}")
+            finally:
+                connection.close()
+
+        def catalog_client():
+            latencies = []
+            try:
+                while not stop.is_set():
+                    started = time.perf_counter()
+                    list_view(factory.get("/api/products/")).render()
+                    latencies.append((time.perf_counter() - started) * 1000)
+            finally:
+                connection.close()
+                with lock:
+                    result["latencies"].extend(latencies)
+
+        threads = [threading.Thread(target=login_client, args=(self.usernames[n],)) for n in range(login_threads)]
+        threads += [threading.Thread(target=catalog_client) for _ in range(catalog_threads)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        hashing.reset_pool()
+        return result
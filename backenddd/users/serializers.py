@@ -2,6 +2,7 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
 from .models import Profile
+from .hashing import hash_password
 
 # Serializer for user registration
 class RegisterSerializer(serializers.ModelSerializer):
@@ -23,11 +24,12 @@ class RegisterSerializer(serializers.ModelSerializer):
         password = validated_data['password']
         user_type = validated_data.pop('user_type', 'customer')
         
-        # Create a new user with hashed password
-        new_user = User.objects.create_user(
-            username=username,
-            email=email,
-            password=password
+        # Create a new user with hashed password (hashed on the hashing pool,
+        # otherwise the same as User.objects.create_user)
+        new_user = User.objects.create(
+            username=User.normalize_username(username),
+            email=User.objects.normalize_email(email),
+            password=hash_password(password)
         )
         
         # Create or update profile with user type
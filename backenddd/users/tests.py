@@ -1,3 +1,166 @@
-from django.test import TestCase
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import RequestFactory, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from backenddd.throttling import AnonBucketThrottle, TokenBucketThrottle
+from . import hashing
+
+
+class BucketThrottle(TokenBucketThrottle):
+    """3 requests per minute for every request, with a clock the tests move"""
+    rate = '3/min'
+    now = 1000.0
+
+    def timer(self):
+        return BucketThrottle.now
+
+    def get_cache_key(self, request, view):
+        return 'throttle_test_bucket'
+
+
+class ThrottleTests(TestCase):
+    def setUp(self):
+        caches['throttle'].clear()
+        BucketThrottle.now = 1000.0
+        self.request = RequestFactory().get('/')
+
+    def allowed(self):
+        return BucketThrottle().allow_request(self.request, None)
+
+    def test_burst_then_refill(self):
+        self.assertEqual([self.allowed() for _ in range(4)], [True, True, True, False])
+        throttle = BucketThrottle()
+        self.assertFalse(throttle.allow_request(self.request, None))
+        self.assertAlmostEqual(throttle.wait(), 20)
+        BucketThrottle.now += 20
+        self.assertEqual([self.allowed() for _ in range(2)], [True, False])
+        # A long idle period refills the bucket, but never beyond 3 tokens
+        BucketThrottle.now += 3600
+        self.assertEqual([self.allowed() for _ in range(4)], [True, True, True, False])
+
+    def test_concurrent_requests_keep_their_tokens(self):
+        # Request B runs completely between request A's token and its anchor read
+        BucketThrottle.now += 3600
+        cache = BucketThrottle.cache
+        real_get = cache.get
+        interleaved = []
+
+        def get(key, *args):
+            if key.endswith(':anchor') and not interleaved:
+                interleaved.append(None)
+                interleaved[0] = self.allowed()
+            return real_get(key, *args)
+
+        with mock.patch.object(cache, 'get', side_effect=get):
+            self.assertTrue(self.allowed())
+        self.assertEqual(interleaved, [True])
+        # A and B took two of the three tokens
+        self.assertEqual([self.allowed() for _ in range(2)], [True, False])
+
+    def test_forwarded_for_does_not_pick_a_new_bucket(self):
+        client = APIClient()
+        statuses = [
+            client.post(
+                '/api/users/login/', {'username': 'victim', 'password': f'guess{number}'},
+                format='json', HTTP_X_FORWARDED_FOR=f'10.0.0.{number}',
+            ).status_code
+            for number in range(12)
+        ]
+        # 'auth' allows 10 per minute per connection address, whatever the header says
+        self.assertNotIn(429, statuses[:10])
+        self.assertEqual(statuses[10:], [429, 429])
+        # Another address has its own bucket
+        other = client.post('/api/users/login/', {'username': 'victim', 'password': 'x'}, REMOTE_ADDR='10.9.9.9')
+        self.assertNotEqual(other.status_code, 429)
+
+    def test_anonymous_ident_is_the_connection_address(self):
+        request = RequestFactory().get('/', HTTP_X_FORWARDED_FOR='1.2.3.4', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(AnonBucketThrottle().get_ident(request), '10.0.0.1')
+
+
+# Cheap costs, so the tests don't spend seconds hashing
+@override_settings(
+    AUTH_HASHING_WORKERS=1, AUTH_HASHING_QUEUE=0, AUTH_PBKDF2_ITERATIONS=1000,
+    AUTH_SCRYPT_WORK_FACTOR=2 ** 4, AUTH_SCRYPT_BLOCK_SIZE=1,
+)
+class HashingPoolTests(TestCase):
+    """Login and registration hash on the bounded pool, and old hashes are upgraded at login"""
+
+    def setUp(self):
+        caches['throttle'].clear()
+        hashing.reset_pool()
+        self.addCleanup(hashing.reset_pool)
+        self.client = APIClient()
+        self.user = User.objects.create_user('buyer', password='secret-pass')
+
+    def login(self, password='secret-pass', username='buyer'):
+        return self.client.post('/api/users/login/', {'username': username, 'password': password}, format='json')
+
+    def test_login(self):
+        self.assertEqual(self.user.password.split('$')[:2], ['pbkdf2_sha256', '1000'])
+        response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['username'], 'buyer')
+        self.assertEqual(self.login('wrong').status_code, 401)
+        self.assertEqual(self.login(username='nobody').status_code, 401)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.login().status_code, 401)
+
+    def test_register_hashes_on_the_pool(self):
+        with mock.patch.object(hashing, 'run', wraps=hashing.run) as run:
+            response = self.client.post(
+                '/api/users/register/', {'username': 'new', 'email': 'new@example.com', 'password': 'another-pass'},
+                format='json',
+            )
+        self.assertEqual(response.status_code, 201)
+        run.assert_called_once()
+        self.assertTrue(User.objects.get(username='new').check_password('another-pass'))
+
+    def test_changed_cost_or_algorithm_is_rehashed_at_login(self):
+        with override_settings(AUTH_PBKDF2_ITERATIONS=1200):
+            self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.password.split('$')[:2], ['pbkdf2_sha256', '1200'])
+
+        scrypt_first = ['users.hashers.TunedScryptPasswordHasher', *settings.PASSWORD_HASHERS]
+        with override_settings(PASSWORD_HASHERS=scrypt_first):
+            self.assertEqual(self.login().status_code, 200)
+            self.user.refresh_from_db()
+            self.assertEqual(self.user.password.split('$')[:2], ['scrypt', '16'])
+            # Same cost: nothing to upgrade on the next login
+            stored = self.user.password
+            self.assertEqual(self.login().status_code, 200)
+            self.user.refresh_from_db()
+            self.assertEqual(self.user.password, stored)
+
+    def test_full_queue_is_a_quick_503(self):
+        started, release = threading.Event(), threading.Event()
+
+        def hold_the_worker():
+            started.set()
+            release.wait(10)
+
+        holder = threading.Thread(target=hashing.run, args=(hold_the_worker,))
+        holder.start()
+        self.addCleanup(holder.join)
+        self.addCleanup(release.set)
+        self.assertTrue(started.wait(10))
+        response = self.login()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        release.set()
+        holder.join()
+        self.assertEqual(self.login().status_code, 200)
+
+    @override_settings(AUTH_HASHING_WORKERS=0)
+    def test_without_pool_uses_authenticate(self):
+        with mock.patch.object(hashing, 'authenticate', wraps=hashing.authenticate) as authenticate:
+            self.assertEqual(self.login().status_code, 200)
+        authenticate.assert_called_once()
+        self.assertIsNone(hashing._pool)
@@ -7,6 +7,8 @@ from django.contrib.auth.models import User
 from rest_framework_simplejwt.tokens import RefreshToken
 from .serializers import RegisterSerializer
 from .models import Profile
+from .hashing import authenticate_user
+from backenddd.throttling import AuthBucketThrottle
 
 # This view allows users to create a new account
 class RegisterView(generics.CreateAPIView):
@@ -14,10 +16,15 @@ class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
     # Use the RegisterSerializer to validate and create users
     serializer_class = RegisterSerializer
+    # Password hashing is expensive, so registration has its own stricter budget
+    throttle_classes = [AuthBucketThrottle]
 
 
 # Custom login view that includes user_type
 class LoginView(APIView):
+    # Stricter per-IP budget against credential stuffing
+    throttle_classes = [AuthBucketThrottle]
+
     def post(self, request):
         username = request.data.get('username')
         password = request.data.get('password')
@@ -28,9 +35,8 @@ class LoginView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Try to authenticate user
-        from django.contrib.auth import authenticate
-        user = authenticate(username=username, password=password)
+        # Try to authenticate user (the password hash is checked on the hashing pool)
+        user = authenticate_user(request, username, password)
         
         if user is None:
             return Response(
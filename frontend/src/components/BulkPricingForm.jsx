@@ -0,0 +1,161 @@
+// This component changes the price or discount of many products at once
+// (one request and one database UPDATE, however many products match)
+import { useState } from "react";
+import API from "../services/api";
+import { toast } from "../lib/toast.jsx";
+import "../styles/ProductForm.css";
+
+export default function BulkPricingForm({ onApplied, onCancel }) {
+  const [formData, setFormData] = useState({
+    field: "price",
+    mode: "percent",
+    value: "",
+    category: "",
+    brand: "",
+    tag: "",
+  });
+  // Result of the last dry run, shown before the change is applied
+  const [preview, setPreview] = useState(null);
+  const [submitting, setSubmitting] = useState(false);
+
+  const handleChange = (e) => {
+    const { name, value } = e.target;
+    setFormData((prev) => ({ ...prev, [name]: value }));
+    // Any change makes the old preview out of date
+    setPreview(null);
+  };
+
+  // Build the request body; empty filters are left out, no filters means all products
+  const buildRequest = (dryRun) => {
+    const body = {
+      field: formData.field,
+      mode: formData.mode,
+      value: formData.value,
+      dry_run: dryRun,
+    };
+    ["category", "brand", "tag"].forEach((name) => {
+      if (formData[name].trim()) {
+        body[name] = formData[name].trim();
+      }
+    });
+    if (!body.category && !body.brand && !body.tag) {
+      body.all = true;
+    }
+    return body;
+  };
+
+  const showError = (err) => {
+    const data = err.response?.data;
+    let errorMsg = "Bulk update failed";
+    if (data && typeof data === "object") {
+      errorMsg = Object.values(data).flat().join("; ");
+    }
+    toast.error(errorMsg);
+  };
+
+  const handlePreview = async (e) => {
+    e.preventDefault();
+    setSubmitting(true);
+    try {
+      const response = await API.post("/products/seller/bulk-pricing/", buildRequest(true));
+      setPreview(response.data);
+    } catch (err) {
+      showError(err);
+    } finally {
+      setSubmitting(false);
+    }
+  };
+
+  const handleApply = async () => {
+    setSubmitting(true);
+    try {
+      const response = await API.post("/products/seller/bulk-pricing/", buildRequest(false));
+      toast.success(`Updated ${response.data.updated} products`);
+      setPreview(null);
+      onApplied();
+    } catch (err) {
+      showError(err);
+    } finally {
+      setSubmitting(false);
+    }
+  };
+
+  return (
+    <form className="product-form" onSubmit={handlePreview}>
+      <div className="form-grid">
+        <div className="form-group">
+          <label htmlFor="bulk-field">Change</label>
+          <select id="bulk-field" name="field" value={formData.field} onChange={handleChange}>
+            <option value="price">Price</option>
+            <option value="discount">Discount (%)</option>
+          </select>
+        </div>
+
+        <div className="form-group">
+          <label htmlFor="bulk-mode">By</label>
+          <select id="bulk-mode" name="mode" value={formData.mode} onChange={handleChange}>
+            <option value="percent">Percent of current value</option>
+            <option value="absolute">Fixed amount</option>
+          </select>
+        </div>
+
+        <div className="form-group">
+          <label htmlFor="bulk-value">
+            Amount<span className="required">*</span>
+          </label>
+          <input
+            id="bulk-value"
+            type="number"
+            step="0.01"
+            name="value"
+            value={formData.value}
+            onChange={handleChange}
+            placeholder="-20"
+            required
+          />
+          <small>Use a negative number to lower the value</small>
+        </div>
+
+        <div className="form-group">
+          <label htmlFor="bulk-category">Category</label>
+          <input id="bulk-category" name="category" value={formData.category} onChange={handleChange} />
+        </div>
+
+        <div className="form-group">
+          <label htmlFor="bulk-brand">Brand</label>
+          <input id="bulk-brand" name="brand" value={formData.brand} onChange={handleChange} />
+        </div>
+
+        <div className="form-group">
+          <label htmlFor="bulk-tag">Tag</label>
+          <input id="bulk-tag" name="tag" value={formData.tag} onChange={handleChange} />
+          <small>Leave all filters empty to change every product</small>
+        </div>
+      </div>
+
+      {preview && (
+        <p className="bulk-preview">
+          {preview.matched} products match.
+          {preview.matched > 0 && ` New ${formData.field} values range from ${preview.new_min} to ${preview.new_max}.`}
+        </p>
+      )}
+
+      <div className="form-actions">
+        <button type="button" className="btn-cancel" onClick={onCancel} disabled={submitting}>
+          Cancel
+        </button>
+        <button type="submit" className="btn-cancel" disabled={submitting || formData.value === ""}>
+          Preview
+        </button>
+        <button
+          type="button"
+          className="btn-submit"
+          onClick={handleApply}
+          disabled={submitting || !preview || preview.matched === 0}
+        >
+          Apply to {preview ? preview.matched : "..."} products
+        </button>
+      </div>
+    </form>
+  );
+}
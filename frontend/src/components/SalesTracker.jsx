@@ -1,9 +1,12 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { useNavigate } from "react-router-dom";
 import API from "../services/api";
 import { toast } from "../lib/toast.jsx";
 import "../styles/SalesTracker.css";
 
+// How often to reload the dashboard while the live stream is unavailable (ms)
+const POLL_INTERVAL = 30000;
+
 export default function SalesTracker() {
   const navigate = useNavigate();
   const [summary, setSummary] = useState(null);
@@ -11,14 +14,21 @@ export default function SalesTracker() {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [expandedOrder, setExpandedOrder] = useState(null);
-
-  useEffect(() => {
-    fetchSalesData();
-  }, []);
+  // Order ids already counted in the summary (used by live updates)
+  const knownOrderIds = useRef(new Set());
+  // Item ids already shown (a reconnecting stream may send a sale twice)
+  const knownItemIds = useRef(new Set());
+  // Live sales that arrive while the data is loading, applied once it is in
+  const pendingSales = useRef(null);
+  // True once the first load finished (later reloads don't show the spinner)
+  const loadedOnce = useRef(false);
 
   const fetchSalesData = async () => {
+    pendingSales.current = pendingSales.current || [];
     try {
-      setLoading(true);
+      if (!loadedOnce.current) {
+        setLoading(true);
+      }
       setError(null);
 
       // Fetch both summary and orders in parallel
@@ -29,6 +39,11 @@ export default function SalesTracker() {
 
       setSummary(summaryResponse.data);
       setOrders(ordersResponse.data);
+      knownOrderIds.current = new Set(ordersResponse.data.map((order) => order.order_id));
+      knownItemIds.current = new Set(
+        ordersResponse.data.flatMap((order) => order.items.map((item) => item.id))
+      );
+      loadedOnce.current = true;
     } catch (err) {
       console.error("Error fetching sales data:", err);
       const errorMsg = err.response?.data?.detail || "Failed to load sales data";
@@ -44,9 +59,155 @@ export default function SalesTracker() {
       setError(errorMsg);
     } finally {
       setLoading(false);
+      // Apply the sales that came in meanwhile (ones already loaded are skipped)
+      const pending = pendingSales.current || [];
+      pendingSales.current = null;
+      pending.forEach(applySale);
     }
   };
 
+  // Listen for live sales so the dashboard updates without polling.
+  // The stream is opened with a short-lived ticket (never the login token,
+  // which would end up in server logs). The first page is loaded once the
+  // stream says "ready", so no sale falls between the two; after a drop the
+  // stream replays what was missed since the last event id. Without a
+  // stream the dashboard reloads every POLL_INTERVAL instead.
+  useEffect(() => {
+    let source = null;
+    let pollTimer = null;
+    let lastEventId = null;
+    let stopped = false;
+
+    const stopPolling = () => {
+      clearInterval(pollTimer);
+      pollTimer = null;
+    };
+
+    const startPolling = () => {
+      if (pollTimer || stopped) {
+        return;
+      }
+      fetchSalesData();
+      pollTimer = setInterval(() => {
+        fetchSalesData();
+        connect();
+      }, POLL_INTERVAL);
+    };
+
+    const connect = async () => {
+      if (stopped || source || typeof EventSource === "undefined") {
+        return;
+      }
+      let ticket;
+      try {
+        const response = await API.post("/products/seller/sales-stream-ticket/");
+        ticket = response.data.ticket;
+      } catch (err) {
+        startPolling();
+        return;
+      }
+      if (stopped || source) {
+        return;
+      }
+
+      const params = new URLSearchParams({ ticket });
+      if (lastEventId) {
+        params.set("last_event_id", lastEventId);
+      }
+      const stream = new EventSource(`${API.defaults.baseURL}products/seller/sales-stream/?${params}`);
+      source = stream;
+      let ready = false;
+
+      stream.addEventListener("sale", (message) => {
+        lastEventId = message.lastEventId || lastEventId;
+        applySale(JSON.parse(message.data));
+      });
+
+      // Too many sales were missed to replay them: load the page again
+      stream.addEventListener("reload", () => {
+        lastEventId = null;
+      });
+
+      stream.addEventListener("ready", () => {
+        ready = true;
+        stopPolling();
+        // Nothing to replay from: load the page now that we are subscribed
+        if (!lastEventId) {
+          fetchSalesData();
+        }
+      });
+
+      stream.onerror = () => {
+        // The browser retries a dropped stream by itself, but not one that
+        // was refused (e.g. its ticket expired): get a new ticket
+        if (stream.readyState !== EventSource.CLOSED) {
+          return;
+        }
+        source = null;
+        if (ready) {
+          connect();
+        } else {
+          startPolling();
+        }
+      };
+    };
+
+    if (typeof EventSource === "undefined") {
+      startPolling();
+    } else {
+      connect();
+    }
+
+    // Close the stream when the component is removed
+    return () => {
+      stopped = true;
+      stopPolling();
+      if (source) {
+        source.close();
+      }
+    };
+  }, []);
+
+  // Merge one live sale event into the summary and order list
+  const applySale = (sale) => {
+    if (pendingSales.current) {
+      pendingSales.current.push(sale);
+      return;
+    }
+    if (knownItemIds.current.has(sale.item.id)) {
+      return;
+    }
+    knownItemIds.current.add(sale.item.id);
+    const isNewOrder = !knownOrderIds.current.has(sale.order_id);
+    knownOrderIds.current.add(sale.order_id);
+
+    setSummary((previousSummary) => ({
+      ...previousSummary,
+      total_orders: (previousSummary?.total_orders || 0) + (isNewOrder ? 1 : 0),
+      total_items_sold: (previousSummary?.total_items_sold || 0) + sale.item.quantity,
+      total_revenue: (previousSummary?.total_revenue || 0) + sale.item.total,
+    }));
+
+    setOrders((previousOrders) => {
+      if (previousOrders.some((order) => order.order_id === sale.order_id)) {
+        return previousOrders.map((order) =>
+          order.order_id === sale.order_id
+            ? { ...order, items: [...order.items, sale.item], total: order.total + sale.item.total }
+            : order
+        );
+      }
+
+      const newOrder = {
+        order_id: sale.order_id,
+        customer: sale.customer,
+        created_at: sale.created_at,
+        items: [sale.item],
+        total: sale.item.total,
+      };
+      return [newOrder, ...previousOrders];
+    });
+  };
+
   const toggleOrderExpand = (orderId) => {
     setExpandedOrder(expandedOrder === orderId ? null : orderId);
   };
@@ -155,7 +316,7 @@ export default function SalesTracker() {
                       </thead>
                       <tbody>
                         {order.items.map((item) => (
-                          <tr key={item.product_id}>
+                          <tr key={item.id}>
                             <td className="product-name">{item.product_title}</td>
                             <td>${item.price.toFixed(2)}</td>
                             <td>×{item.quantity}</td>
@@ -1,6 +1,6 @@
 // This component displays the shopping cart
 import { useState, useEffect } from "react";
-import API from "../services/api";
+import API, { fetchProductsByIds, postWithIdempotency } from "../services/api";
 import { toast } from "../lib/toast.jsx";
 import "./Cart.css";
 
@@ -16,6 +16,30 @@ export default function Cart() {
     if (savedCart) {
       const cartArray = JSON.parse(savedCart);
       setCart(cartArray);
+
+      // Refresh titles, prices and images for every item with one request,
+      // and drop products that no longer exist
+      fetchProductsByIds(cartArray.map((item) => item.id))
+        .then(({ results }) => {
+          const latest = new Map(results.map((product) => [product.id, product]));
+          const refreshedCart = cartArray
+            .filter((item) => latest.has(item.id))
+            .map((item) => {
+              const product = latest.get(item.id);
+              return {
+                ...item,
+                title: product.title,
+                price: Number(product.price),
+                image_url: product.image_url || item.image_url,
+              };
+            });
+          setCart(refreshedCart);
+          localStorage.setItem("cart", JSON.stringify(refreshedCart));
+        })
+        .catch((error) => {
+          // Keep showing the saved cart if the refresh fails
+          console.error("Error refreshing cart products:", error);
+        });
     } else {
       // If no cart exists, use empty array
       setCart([]);
@@ -62,8 +86,13 @@ export default function Cart() {
     }
 
     try {
-      // Send cart items to backend to create an order
-      await API.post("orders/", { items: cart });
+      // Sync the browser cart to the server-side cart (only ids and quantities are sent)
+      await API.put("orders/cart/", {
+        items: cart.map((item) => ({ product: item.id, quantity: item.quantity })),
+      });
+      // Convert the server cart into an order using current database prices
+      // (retried with the same key, so a lost response can't create two orders)
+      await postWithIdempotency("orders/cart/checkout/");
       
       // Show success message
       toast.success("Order placed successfully!");
@@ -1,40 +1,31 @@
-// This component displays the home page with product listings
+// This component displays the home page with curated product sections
 import { useEffect, useState } from "react";
-import API from "../services/api";
+import { fetchStorefront, useInfiniteProducts } from "../services/api";
 import ProductCard from "../components/ProductCard";
 import "../styles/Home.css";
 
 export default function Home() {
-  // State to store the list of products
-  const [products, setProducts] = useState([]);
-  // State to store the search term
+  // State to store the storefront sections (featured, top rated, ...)
+  const [sections, setSections] = useState([]);
+  // State to store the text typed in the search box
   const [search, setSearch] = useState("");
+  // The search that was submitted (empty means show the storefront)
+  const [query, setQuery] = useState("");
+
+  // Search results are only fetched once the user has searched for something
+  const results = useInfiniteProducts({ search: query, enabled: query !== "" });
 
   // This runs when the component first loads
   useEffect(() => {
-    // Fetch all products from the backend
-    API.get("products/")
-      .then((response) => {
-        // Try different ways the data might be structured
-        let productList = [];
-        
-        if (response.data && response.data.results) {
-          // If data is paginated, get results array
-          productList = response.data.results;
-        } else if (response.data && response.data.products) {
-          // If data has a products property
-          productList = response.data.products;
-        } else if (Array.isArray(response.data)) {
-          // If data is directly an array
-          productList = response.data;
-        }
-        
-        // Update the products state
-        setProducts(productList);
+    // One small request for the whole first screen instead of the full catalog
+    fetchStorefront()
+      .then((storefrontSections) => {
+        // Update the sections state
+        setSections(storefrontSections);
       })
       .catch((error) => {
         // Log error to console if fetch fails
-        console.error("Error fetching products:", error);
+        console.error("Error fetching storefront:", error);
       });
   }, []);
 
@@ -42,33 +33,9 @@ export default function Home() {
   const handleSearch = (event) => {
     // Prevent the page from refreshing
     event.preventDefault();
-    
-    // Don't search if search term is empty
-    if (!search.trim()) {
-      return;
-    }
-    
-    // Search for products using the search term
-    API.get(`products/?search=${encodeURIComponent(search)}`)
-      .then((response) => {
-        // Try different ways the data might be structured
-        let productList = [];
-        
-        if (response.data && response.data.results) {
-          productList = response.data.results;
-        } else if (response.data && response.data.products) {
-          productList = response.data.products;
-        } else if (Array.isArray(response.data)) {
-          productList = response.data;
-        }
-        
-        // Update the products state with search results
-        setProducts(productList);
-      })
-      .catch((error) => {
-        // Log error to console if search fails
-        console.error("Error searching products:", error);
-      });
+
+    // An empty search goes back to the storefront
+    setQuery(search.trim());
   };
 
   return (
@@ -86,15 +53,33 @@ export default function Home() {
         </button>
       </form>
 
-      <div className="products-grid">
-        {products.length === 0 ? (
-          <p>No products found.</p>
-        ) : (
-          products.map((product) => (
-            <ProductCard key={product.id} product={product} />
-          ))
-        )}
-      </div>
+      {query ? (
+        <>
+          <div className="products-grid">
+            {results.products.length === 0 && !results.loading ? (
+              <p>No products found.</p>
+            ) : (
+              results.products.map((product) => (
+                <ProductCard key={product.id} product={product} />
+              ))
+            )}
+          </div>
+          {/* When this comes into view the next page of results is fetched */}
+          {results.hasMore && <div ref={results.sentinelRef} className="scroll-sentinel" />}
+          {results.loading && <p>Loading...</p>}
+        </>
+      ) : (
+        sections.map((section) => (
+          <section key={section.key} className="storefront-section">
+            <h2 className="storefront-title">{section.title}</h2>
+            <div className="products-grid">
+              {section.products.map((product) => (
+                <ProductCard key={product.id} product={product} />
+              ))}
+            </div>
+          </section>
+        ))
+      )}
     </div>
   );
 }
@@ -1,20 +1,29 @@
 // This component displays user's order history
 import { useEffect, useState } from "react";
-import API from "../services/api";
+import API, { postWithIdempotency } from "../services/api";
 import { toast } from "../lib/toast.jsx";
 import "./Orders.css";
 
 export default function Orders() {
   // State to store the list of orders
   const [orders, setOrders] = useState([]);
+  // URL of the next (older) page of orders, if there is one
+  const [nextPage, setNextPage] = useState(null);
 
-  // This function fetches orders from the backend
-  const fetchOrders = async () => {
+  // Read the "next" URL from the Link header the backend sends with each page
+  const nextPageFrom = (response) => {
+    const match = /<([^>]+)>;\s*rel="next"/.exec(response.headers.link || "");
+    return match ? match[1] : null;
+  };
+
+  // This function fetches orders from the backend (newest first, one page at a time)
+  const fetchOrders = async (url = "orders/") => {
     try {
-      // Get orders from the backend
-      const response = await API.get("orders/");
-      // Update the orders state
-      setOrders(response.data);
+      // Get a page of orders from the backend
+      const response = await API.get(url);
+      // Add older pages after the ones already shown
+      setOrders((previousOrders) => (url === "orders/" ? response.data : [...previousOrders, ...response.data]));
+      setNextPage(nextPageFrom(response));
     } catch (error) {
       // Log error to console
       console.error("Error fetching orders:", error);
@@ -103,7 +112,8 @@ export default function Orders() {
     
     try {
       // Send cart items to backend to create an order
-      await API.post("orders/", { items: cartItems });
+      // (retried with the same key, so a lost response can't create two orders)
+      await postWithIdempotency("orders/", { items: cartItems });
       // Show success message
       toast.success("Order placed!");
       // Clear the cart from local storage
@@ -162,12 +172,15 @@ export default function Orders() {
         <div key={order.id} className="order-card">
           <div className="order-header">
             <h3>Order #{idx + 1}</h3>
-            <button 
-              className="button-danger" 
-              onClick={() => removeOrder(order.id)}
-            >
-              Remove Order
-            </button>
+            {/* Archived orders are kept for history and can't be removed */}
+            {!order.archived && (
+              <button 
+                className="button-danger" 
+                onClick={() => removeOrder(order.id)}
+              >
+                Remove Order
+              </button>
+            )}
           </div>
           <div className="order-meta">
             <p>Total items: {order.total_items}</p>
@@ -189,6 +202,12 @@ export default function Orders() {
           </ul>
         </div>
       ))}
+
+      {nextPage && (
+        <button className="button-secondary" onClick={() => fetchOrders(nextPage)}>
+          Load older orders
+        </button>
+      )}
     </div>
   );
 }
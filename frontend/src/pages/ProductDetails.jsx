@@ -2,6 +2,7 @@
 import { useParams } from "react-router-dom";
 import { useEffect, useState } from "react";
 import API from "../services/api";
+import ProductCard from "../components/ProductCard";
 import { toast } from "../lib/toast.jsx";
 import "../styles/ProductDetails.css";
 
@@ -13,6 +14,8 @@ export default function ProductDetails() {
   const [product, setProduct] = useState(null);
   // State to store any error message
   const [error, setError] = useState(null);
+  // State to store similar products
+  const [related, setRelated] = useState([]);
 
   // This runs when the component loads or when the product ID changes
   useEffect(() => {
@@ -31,6 +34,12 @@ export default function ProductDetails() {
         // Set error message
         setError("Product not found.");
       });
+
+    // Fetch similar products (precomputed on the server, so this is cheap)
+    setRelated([]);
+    API.get(`products/${id}/related/`)
+      .then((response) => setRelated(response.data))
+      .catch((error) => console.error("Error fetching related products:", error));
   }, [id]);
 
   // This function runs when user clicks "Add to Cart"
@@ -124,6 +133,18 @@ export default function ProductDetails() {
           Add to Cart
         </button>
       </div>
+
+      {/* Related products */}
+      {related.length > 0 && (
+        <div className="related-products">
+          <h3>You may also like</h3>
+          <div className="products-grid">
+            {related.map((item) => (
+              <ProductCard key={item.id} product={item} />
+            ))}
+          </div>
+        </div>
+      )}
     </div>
   );
 }
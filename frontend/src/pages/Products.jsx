@@ -1,43 +1,19 @@
 // This component displays all products with search functionality
-import { useEffect, useState } from "react";
-import API from "../services/api";
+import { useState } from "react";
+import { useInfiniteProducts } from "../services/api";
 import ProductCard from "../components/ProductCard";
 import { toast } from "../lib/toast.jsx";
 import "./Products.css";
 
 export default function Products() {
-  // State to store the list of products
-  const [products, setProducts] = useState([]);
-  // State to store the search term
+  // State to store the text typed in the search box
   const [search, setSearch] = useState("");
+  // The search that was submitted (empty means all products)
+  const [query, setQuery] = useState("");
+
+  // Products are loaded one page at a time as the user scrolls
+  const { products, loading, hasMore, sentinelRef } = useInfiniteProducts({ search: query });
 
-  // This runs when the component first loads
-  useEffect(() => {
-    // Fetch all products from the backend
-    API.get("products/")
-      .then((response) => {
-        // Try different ways the data might be structured
-        let productList = [];
-        
-        if (response.data && response.data.results) {
-          // If data is paginated, get results array
-          productList = response.data.results;
-        } else if (response.data && response.data.products) {
-          // If data has a products property
-          productList = response.data.products;
-        } else if (Array.isArray(response.data)) {
-          // If data is directly an array
-          productList = response.data;
-        }
-        
-        // Update the products state
-        setProducts(productList);
-      })
-      .catch((error) => {
-        // Log error to console if fetch fails
-        console.error("Error fetching products:", error);
-      });
-  }, []);
   const addToCart = (product) => {
     try {
       const raw = localStorage.getItem("cart");
@@ -67,32 +43,8 @@ export default function Products() {
     // Prevent the page from refreshing
     event.preventDefault();
     
-    // Don't search if search term is empty
-    if (!search.trim()) {
-      return;
-    }
-    
-    // Search for products using the search term
-    API.get(`products/?search=${encodeURIComponent(search)}`)
-      .then((response) => {
-        // Try different ways the data might be structured
-        let productList = [];
-        
-        if (response.data && response.data.results) {
-          productList = response.data.results;
-        } else if (response.data && response.data.products) {
-          productList = response.data.products;
-        } else if (Array.isArray(response.data)) {
-          productList = response.data;
-        }
-        
-        // Update the products state with search results
-        setProducts(productList);
-      })
-      .catch((error) => {
-        // Log error to console if search fails
-        console.error("Error searching products:", error);
-      });
+    // Start again from the first page of matching products
+    setQuery(search.trim());
   };
 
   return (
@@ -111,7 +63,7 @@ export default function Products() {
       </form>
 
       <div className="products-grid">
-        {products.length === 0 ? (
+        {products.length === 0 && !loading ? (
           <p className="products-empty">No products found.</p>
         ) : (
           products.map((product) => (
@@ -119,6 +71,10 @@ export default function Products() {
           ))
         )}
       </div>
+
+      {/* When this comes into view the next page is fetched */}
+      {hasMore && <div ref={sentinelRef} className="scroll-sentinel" />}
+      {loading && <p className="products-loading">Loading...</p>}
     </div>
   );
 }
@@ -7,6 +7,7 @@ import "./Profile.css";
 export default function Profile() {
   const navigate = useNavigate();
   const [orders, setOrders] = useState([]);
+  const [summary, setSummary] = useState(null);
   const [loading, setLoading] = useState(true);
   const accessToken = localStorage.getItem("access_token");
   const username = localStorage.getItem("username");
@@ -16,9 +17,11 @@ export default function Profile() {
       setLoading(false);
       return;
     }
-    API.get("orders/")
-      .then((res) => {
-        setOrders(res.data || []);
+    // Only the latest orders are shown here; totals come from the summary endpoint
+    Promise.all([API.get("orders/?limit=6"), API.get("orders/summary/")])
+      .then(([ordersRes, summaryRes]) => {
+        setOrders(ordersRes.data || []);
+        setSummary(summaryRes.data);
         setLoading(false);
       })
       .catch((err) => {
@@ -51,8 +54,8 @@ export default function Profile() {
 
   const cart = JSON.parse(localStorage.getItem("cart")) || [];
   const cartTotal = cart.reduce((sum, item) => sum + (item.price || 0) * (item.quantity || 1), 0);
-  const totalOrders = orders.length;
-  const totalSpent = orders.reduce((sum, order) => sum + parseFloat(order.total_price || 0), 0);
+  const totalOrders = summary?.total_orders ?? orders.length;
+  const totalSpent = Number(summary?.total_spent ?? 0);
 
   const formatDate = (dateString) => {
     if (!dateString) return "N/A";
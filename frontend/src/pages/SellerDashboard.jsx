@@ -2,6 +2,7 @@ import { useState, useEffect } from "react";
 import { useNavigate } from "react-router-dom";
 import API from "../services/api";
 import ProductForm from "../components/ProductForm";
+import BulkPricingForm from "../components/BulkPricingForm";
 import SalesTracker from "../components/SalesTracker";
 import "../styles/SellerDashboard.css";
 import { toast } from "../lib/toast.jsx";
@@ -13,6 +14,8 @@ export default function SellerDashboard() {
   const [error, setError] = useState(null);
   const [showAddForm, setShowAddForm] = useState(false);
   const [editingProduct, setEditingProduct] = useState(null);
+  // Whether the bulk price/discount form is open
+  const [showBulkForm, setShowBulkForm] = useState(false);
   const [activeTab, setActiveTab] = useState("products"); // 'products' or 'sales'
 
   // Check authentication on mount
@@ -217,9 +220,33 @@ export default function SellerDashboard() {
             </div>
           )}
 
+          {/* Bulk price/discount change (e.g. for a sale) */}
+          {showBulkForm && (
+            <div className="form-container">
+              <div className="form-header">
+                <h2>Bulk Price Change</h2>
+                <button className="close-button" onClick={() => setShowBulkForm(false)}>
+                  ×
+                </button>
+              </div>
+              <BulkPricingForm
+                onApplied={() => {
+                  setShowBulkForm(false);
+                  fetchProducts();
+                }}
+                onCancel={() => setShowBulkForm(false)}
+              />
+            </div>
+          )}
+
           {/* Add New Product Button */}
           {!showAddForm && !editingProduct && (
             <div className="action-bar">
+              {!showBulkForm && (
+                <button className="btn-secondary" onClick={() => setShowBulkForm(true)}>
+                  Bulk Price Change
+                </button>
+              )}
               <button className="btn-primary" onClick={handleAddNewClick}>
                 + Add New Product
               </button>
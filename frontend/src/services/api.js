@@ -1,5 +1,6 @@
 // This file sets up the API client for making requests to the backend
 import axios from "axios";
+import { useCallback, useEffect, useRef, useState } from "react";
 
 // Create an axios instance with the base URL of the backend API
 const API = axios.create({
@@ -22,5 +23,140 @@ API.interceptors.request.use((request) => {
   return request;
 });
 
+// A unique Idempotency-Key (crypto.randomUUID needs a secure context, so fall back)
+function newIdempotencyKey() {
+  if (window.crypto && window.crypto.randomUUID) {
+    return window.crypto.randomUUID();
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}-${Math.random().toString(36).slice(2)}`;
+}
+
+// Worth retrying: no answer at all, a server error, or "still in progress"
+function isRetryable(error) {
+  const status = error.response ? error.response.status : null;
+  return status === null || status === 409 || status >= 500;
+}
+
+// POST that creates something (an order) and is safe to retry.
+// Every attempt sends the same Idempotency-Key, so the server runs the
+// request at most once and answers retries with the first response.
+export async function postWithIdempotency(url, data, { attempts = 3, timeout = 15000 } = {}) {
+  const headers = { "Idempotency-Key": newIdempotencyKey() };
+  for (let attempt = 1; ; attempt++) {
+    try {
+      return await API.post(url, data, { headers, timeout });
+    } catch (error) {
+      if (attempt >= attempts || !isRetryable(error)) {
+        throw error;
+      }
+      // Back off a little longer each time (0.5s, 1s, ...), or as long as the server asks
+      const retryAfter = Number(error.response && error.response.headers["retry-after"]);
+      const delay = retryAfter > 0 ? retryAfter * 1000 : 500 * 2 ** (attempt - 1);
+      await new Promise((resolve) => setTimeout(resolve, delay));
+    }
+  }
+}
+
+// Fetch one page of the product list.
+// `next` is the URL the previous page returned; leave it empty for the first page
+export async function fetchProductsPage({ next = null, search = "", pageSize = 24 } = {}) {
+  const params = { page_size: pageSize };
+  if (search) {
+    params.search = search;
+  }
+  const response = next ? await API.get(next) : await API.get("products/", { params });
+  return { results: response.data.results || [], next: response.data.next };
+}
+
+// Fetch several products in one request.
+// Returns { results, missing }: products in the order asked for, and ids that no longer exist
+export async function fetchProductsByIds(ids) {
+  if (ids.length === 0) {
+    return { results: [], missing: [] };
+  }
+  const response = await API.post("products/batch/", { ids });
+  return response.data;
+}
+
+// Fetch the curated home page sections (one small, cached response)
+export async function fetchStorefront() {
+  const response = await API.get("products/storefront/");
+  return response.data.sections || [];
+}
+
+// React hook for infinite scrolling through products.
+// Attach `sentinelRef` to an element below the list: when it scrolls into
+// view the next page is loaded. Changing `search` starts again from page one.
+export function useInfiniteProducts({ search = "", pageSize = 24, enabled = true } = {}) {
+  const [products, setProducts] = useState([]);
+  const [loading, setLoading] = useState(false);
+  const [hasMore, setHasMore] = useState(true);
+  // Mutable paging state, replaced on every new search so answers to an
+  // old search can be recognised and ignored
+  const state = useRef({ next: null, loading: false, done: false });
+  const observer = useRef(null);
+
+  const loadPage = useCallback(
+    async (first) => {
+      const current = state.current;
+      if (!enabled || current.loading || (!first && (current.done || !current.next))) {
+        return;
+      }
+      current.loading = true;
+      setLoading(true);
+      try {
+        const page = await fetchProductsPage({ next: first ? null : current.next, search, pageSize });
+        if (current !== state.current) {
+          return;
+        }
+        current.next = page.next;
+        current.done = !page.next;
+        setHasMore(Boolean(page.next));
+        setProducts((previous) => (first ? page.results : [...previous, ...page.results]));
+      } catch (error) {
+        console.error("Error fetching products:", error);
+      } finally {
+        if (current === state.current) {
+          current.loading = false;
+          setLoading(false);
+        }
+      }
+    },
+    [search, pageSize, enabled]
+  );
+
+  // Start over whenever the search (or page size) changes
+  useEffect(() => {
+    state.current = { next: null, loading: false, done: false };
+    setProducts([]);
+    setHasMore(true);
+    loadPage(true);
+  }, [loadPage]);
+
+  // Load the next page when the sentinel element comes close to the viewport
+  const sentinelRef = useCallback(
+    (node) => {
+      if (observer.current) {
+        observer.current.disconnect();
+      }
+      if (!node) {
+        return;
+      }
+      observer.current = new IntersectionObserver(
+        (entries) => {
+          if (entries[0].isIntersecting) {
+            loadPage(false);
+          }
+        },
+        { rootMargin: "400px" }
+      );
+      observer.current.observe(node);
+    },
+    [loadPage]
+  );
+
+  return { products, loading, hasMore, loadMore: () => loadPage(false), sentinelRef };
+}
+
 // Export the API client so other components can use it
 export default API;